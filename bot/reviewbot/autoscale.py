@@ -0,0 +1,312 @@
+"""Queue-aware autoscaling of worker processes.
+
+When ``autoscale_by_queue_depth`` is enabled and the worker is started with
+``--autoscale``, the number of worker processes is based on the number of
+tasks waiting in each tool's queues and how long that tool's tasks usually
+take, rather than just the number of tasks the worker has received.
+
+Tools can be given weights, representing how much memory each of their
+processes needs relative to other tools, and the worker can be given a
+memory budget that the processes must fit within.
+
+Version Added:
+    5.0
+"""
+
+from __future__ import annotations
+
+import math
+import multiprocessing
+from time import monotonic
+
+from celery.worker import state
+from celery.worker.autoscale import Autoscaler
+from kombu.exceptions import ChannelError
+
+from reviewbot.config import config
+from reviewbot.utils.log import get_logger
+
+
+logger = get_logger(__name__)
+
+
+#: The number of seconds between checks of the queue depths on the broker.
+#:
+#: Version Added:
+#:     5.0
+QUEUE_DEPTH_CHECK_INTERVAL = 10
+
+#: The weight given to each new task duration in the average.
+#:
+#: Version Added:
+#:     5.0
+DURATION_SMOOTHING = 0.2
+
+
+_task_durations = {}
+
+
+def setup_task_durations(tool_ids):
+    """Set up storage for the average task durations of tools.
+
+    This must be called before the worker processes are started, so that
+    they all share the storage.
+
+    Args:
+        tool_ids (list of str):
+            The IDs of the tools the worker can run.
+    """
+    _task_durations.clear()
+
+    for tool_id in tool_ids:
+        _task_durations[tool_id] = multiprocessing.Value('d', 0.0)
+
+
+def record_task_duration(routing_key, duration):
+    """Record the duration of a task.
+
+    Args:
+        routing_key (str):
+            The routing key (queue name) of the task.
+
+        duration (float):
+            The number of seconds the task took.
+    """
+    average = _task_durations.get(routing_key.partition('.')[0])
+
+    if average is not None:
+        with average.get_lock():
+            if average.value > 0:
+                average.value += DURATION_SMOOTHING * (duration -
+                                                       average.value)
+            else:
+                average.value = duration
+
+
+def get_task_duration(tool_id):
+    """Return the average duration of a tool's tasks.
+
+    Args:
+        tool_id (str):
+            The ID of the tool.
+
+    Returns:
+        float:
+        The average number of seconds a task takes, or ``None`` if no tasks
+        have completed.
+    """
+    average = _task_durations.get(tool_id)
+
+    if average is None or average.value <= 0:
+        return None
+
+    return average.value
+
+
+class ReviewBotAutoscaler(Autoscaler):
+    """An autoscaler based on the depth of tool queues.
+
+    This falls back on Celery's standard behavior unless
+    ``autoscale_by_queue_depth`` is enabled.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Initialize the autoscaler.
+
+        Args:
+            *args (tuple):
+                Positional arguments for the parent class.
+
+            **kwargs (dict):
+                Keyword arguments for the parent class.
+        """
+        super().__init__(*args, **kwargs)
+
+        self._queue_depths = {}
+        self._queue_depths_checked = None
+        self._last_desired = None
+
+    def _maybe_scale(self, req=None):
+        """Grow or shrink the pool if needed.
+
+        Args:
+            req (celery.worker.request.Request, optional):
+                The request that triggered the check, if any.
+
+        Returns:
+            bool:
+            ``True`` if the pool was scaled.
+        """
+        if not config['autoscale_by_queue_depth']:
+            return super()._maybe_scale(req)
+
+        desired = self.get_desired_processes()
+        procs = self.processes
+
+        if desired > procs:
+            self.scale_up(desired - procs)
+            return True
+        elif desired < procs:
+            self.scale_down(procs - desired)
+            return True
+
+        return False
+
+    def get_desired_processes(self):
+        """Return the number of processes the worker should have.
+
+        Each tool is given a process for every task it's running, plus
+        enough processes for the waiting tasks to be started within
+        ``autoscale_target_wait`` seconds, based on how long its tasks
+        usually take. Processes are then limited by
+        ``autoscale_memory_budget`` and the minimum and maximum concurrency.
+
+        Returns:
+            int:
+            The number of processes.
+        """
+        tools = {}
+
+        for queue_name, depth in self._get_queue_depths().items():
+            tool_id = queue_name.partition('.')[0]
+            tools.setdefault(tool_id, [0, 0])[0] += depth
+
+        active_requests = state.active_requests
+
+        for request in list(state.reserved_requests):
+            routing_key = (request.delivery_info or {}).get('routing_key')
+
+            if routing_key:
+                tool_info = tools.setdefault(routing_key.partition('.')[0],
+                                             [0, 0])
+
+                if request in active_requests:
+                    tool_info[1] += 1
+                else:
+                    tool_info[0] += 1
+
+        target_wait = config['autoscale_target_wait']
+        weights = config['autoscale_tool_weights']
+        process_memory = config['autoscale_process_memory']
+        memory_budget = config['autoscale_memory_budget']
+
+        # Processes that are running tasks are always counted.
+        memory_used = 0
+        desired = 0
+        extra = {}
+        details = []
+
+        for tool_id, (pending, running) in sorted(tools.items()):
+            duration = get_task_duration(tool_id)
+
+            if pending and duration and target_wait:
+                wanted = min(pending,
+                             math.ceil(pending * duration / target_wait))
+            else:
+                wanted = pending
+
+            desired += running
+            memory_used += running * weights.get(tool_id, 1) * process_memory
+
+            if wanted:
+                extra[tool_id] = wanted
+
+            if pending or running:
+                details.append(
+                    '%s: %d waiting, %d running, %s average'
+                    % (tool_id, pending, running,
+                       '%.1fs' % duration if duration else 'unknown'))
+
+        # Waiting tasks share the rest of the budget in turn, so that a
+        # busy tool doesn't prevent others from getting processes.
+        while extra and desired < self.max_concurrency:
+            for tool_id in list(extra):
+                if desired >= self.max_concurrency:
+                    break
+
+                memory = weights.get(tool_id, 1) * process_memory
+
+                if (memory_budget is not None and
+                    memory_used + memory > memory_budget):
+                    del extra[tool_id]
+                    continue
+
+                memory_used += memory
+                desired += 1
+                extra[tool_id] -= 1
+
+                if extra[tool_id] <= 0:
+                    del extra[tool_id]
+
+        desired = max(min(desired, self.max_concurrency),
+                      self.min_concurrency)
+
+        if desired != self._last_desired:
+            logger.info('Autoscaler wants %d processes (currently %d, '
+                        'memory estimate %d MB): %s',
+                        desired, self.processes, memory_used,
+                        '; '.join(details) or 'no tasks')
+            self._last_desired = desired
+
+        return desired
+
+    def _get_queue_depths(self):
+        """Return the number of tasks waiting in each consumed queue.
+
+        The depths are fetched from the broker at most every
+        :py:data:`QUEUE_DEPTH_CHECK_INTERVAL` seconds.
+
+        Returns:
+            dict:
+            A mapping of queue names to the number of waiting tasks.
+        """
+        now = monotonic()
+
+        if (self._queue_depths_checked is not None and
+            now - self._queue_depths_checked < QUEUE_DEPTH_CHECK_INTERVAL):
+            return self._queue_depths
+
+        self._queue_depths_checked = now
+        depths = {}
+
+        try:
+            with self.worker.app.connection_for_read() as conn:
+                channel = conn.default_channel
+
+                for queue_name in self._get_queue_names():
+                    try:
+                        result = channel.queue_declare(queue=queue_name,
+                                                       passive=True)
+                    except ChannelError as e:
+                        logger.debug('Unable to check the depth of queue '
+                                     '%s: %s',
+                                     queue_name, e)
+                        break
+
+                    depths[queue_name] = result.message_count
+        except Exception as e:
+            logger.error('Unable to check queue depths for autoscaling: %s',
+                         e)
+            return self._queue_depths
+
+        self._queue_depths = depths
+
+        return depths
+
+    def _get_queue_names(self):
+        """Return the names of the tool queues being consumed.
+
+        Returns:
+            list of str:
+            The queue names.
+        """
+        try:
+            queues = self.worker.consumer.task_consumer.queues
+        except AttributeError:
+            queues = self.worker.app.amqp.queues.values()
+
+        return sorted(
+            queue.name
+            for queue in queues
+            if queue.name != 'celery'
+        )
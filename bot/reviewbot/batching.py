@@ -0,0 +1,269 @@
+"""Batching of small tasks.
+
+When ``run_tool_batch_size`` is configured, a worker running a task will
+take additional pending tasks for the same queue directly from the broker
+and run them in the same process, sharing the Review Board API client and
+tool instances between them. This reduces the fixed cost of each review for
+cheap tools that see many small reviews.
+
+Tasks taken this way are only acknowledged once they've run. If the worker
+stops partway through a batch, the broker delivers the rest again.
+
+Version Added:
+    5.0
+"""
+
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from celery.utils.time import maybe_iso8601, maybe_make_aware
+from celery.worker import state as worker_state
+from kombu import Exchange, Queue
+
+from reviewbot.config import config
+from reviewbot.utils.log import get_logger
+
+
+logger = get_logger(__name__)
+
+
+#: The number of seconds to wait between checks for new tasks.
+#:
+#: Version Added:
+#:     5.0
+POLL_INTERVAL = 0.05
+
+
+def get_batch_size():
+    """Return the maximum number of tasks to run in a batch.
+
+    Returns:
+        int:
+        The maximum number of tasks, including the task that started the
+        batch. A value of 1 means batching is disabled.
+    """
+    return max(config['run_tool_batch_size'] or 1, 1)
+
+
+class QueuedTask(object):
+    """A task taken from a queue to run in a batch.
+
+    The task must be acknowledged with :py:meth:`ack` once it has run.
+
+    Version Added:
+        5.0
+    """
+
+    def __init__(self, message, task_id, kwargs):
+        """Initialize the task.
+
+        Args:
+            message (kombu.message.Message):
+                The message the task was received in.
+
+            task_id (str):
+                The ID of the task.
+
+            kwargs (dict):
+                The keyword arguments for the task.
+        """
+        self.message = message
+        self.task_id = task_id
+        self.kwargs = kwargs
+
+    def ack(self):
+        """Acknowledge the task, removing it from the queue."""
+        if not self.message.acknowledged:
+            self.message.ack()
+
+    def requeue(self):
+        """Return the task to the queue, if it hasn't been acknowledged."""
+        if not self.message.acknowledged:
+            self.message.requeue()
+
+
+@contextmanager
+def take_queued_tasks(app, queue_name, task_name, max_count, window,
+                      channel=None):
+    """Take pending tasks from a queue.
+
+    The tasks won't be delivered to any other worker while they're held.
+    Each task must be acknowledged once it has run. Any that haven't been
+    are returned to the queue when the context exits, or by the broker if
+    the worker stops first.
+
+    Messages for other tasks, or tasks scheduled to run later, are returned
+    to the queue. Tasks that have been revoked or have expired are
+    discarded, as Celery would do.
+
+    Args:
+        app (celery.Celery):
+            The Celery application.
+
+        queue_name (str):
+            The name of the queue to take tasks from. This is also the name
+            of the queue's exchange and routing key.
+
+        task_name (str):
+            The name of the task to take.
+
+        max_count (int):
+            The maximum number of tasks to take.
+
+        window (float):
+            The maximum number of seconds to wait for tasks to arrive.
+
+        channel (kombu.transport.virtual.Channel, optional):
+            An open channel to take the tasks from. This must stay open
+            until the context exits. If not provided, a connection will be
+            opened for the duration of the context.
+
+    Context:
+        list of QueuedTask:
+        The tasks taken.
+    """
+    if channel is None and max_count > 0:
+        try:
+            conn = app.connection_for_read()
+            channel = conn.default_channel
+        except Exception as e:
+            logger.error('Unable to fetch pending tasks from queue %s: %s',
+                         queue_name, e)
+            conn = None
+    else:
+        conn = None
+
+    queued_tasks = []
+
+    try:
+        if channel is not None and max_count > 0:
+            queued_tasks += _fetch_queued_tasks(queue_name=queue_name,
+                                                task_name=task_name,
+                                                max_count=max_count,
+                                                window=window,
+                                                channel=channel)
+
+        yield queued_tasks
+    finally:
+        try:
+            for queued_task in queued_tasks:
+                queued_task.requeue()
+        except Exception as e:
+            logger.error('Unable to return pending tasks to queue %s: %s',
+                         queue_name, e)
+
+        if conn is not None:
+            conn.release()
+
+
+def _fetch_queued_tasks(queue_name, task_name, max_count, window, channel):
+    """Take pending tasks from a queue using an open channel.
+
+    Args:
+        queue_name (str):
+            The name of the queue to take tasks from.
+
+        task_name (str):
+            The name of the task to take.
+
+        max_count (int):
+            The maximum number of tasks to take.
+
+        window (float):
+            The maximum number of seconds to wait for tasks to arrive.
+
+        channel (kombu.transport.virtual.Channel):
+            The channel to take the tasks from.
+
+    Returns:
+        list of QueuedTask:
+        The tasks taken.
+    """
+    results = []
+    deadline = time.monotonic() + window
+
+    try:
+        queue = Queue(queue_name,
+                      Exchange(queue_name, type='direct'),
+                      routing_key=queue_name)(channel)
+
+        while len(results) < max_count:
+            message = queue.get(no_ack=False)
+
+            if message is None:
+                if time.monotonic() >= deadline:
+                    break
+
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            headers = message.headers or {}
+
+            if headers.get('task') != task_name or headers.get('eta'):
+                message.requeue()
+                break
+
+            try:
+                body = message.decode()
+
+                if isinstance(body, dict):
+                    # Celery task message protocol 1.
+                    task_id = body.get('id')
+                    task_kwargs = body['kwargs']
+                    expires = body.get('expires')
+                else:
+                    # Celery task message protocol 2.
+                    task_id = headers.get('id')
+                    task_kwargs = body[1]
+                    expires = headers.get('expires')
+            except Exception as e:
+                logger.error('Unable to decode a task from queue %s: %s',
+                             queue_name, e)
+                message.ack()
+                continue
+
+            if task_id in worker_state.revoked:
+                logger.info('Discarding revoked task %s from queue %s',
+                            task_id, queue_name)
+                message.ack()
+                continue
+
+            if _is_expired(expires):
+                logger.info('Discarding expired task %s from queue %s',
+                            task_id, queue_name)
+                message.ack()
+                continue
+
+            results.append(QueuedTask(message=message,
+                                      task_id=task_id,
+                                      kwargs=task_kwargs))
+    except Exception as e:
+        logger.error('Unable to fetch pending tasks from queue %s: %s',
+                     queue_name, e)
+
+    return results
+
+
+def _is_expired(expires):
+    """Return whether a task has expired.
+
+    Args:
+        expires (str or datetime.datetime):
+            The expiration time from the task message, if any.
+
+    Returns:
+        bool:
+        ``True`` if the task has expired.
+    """
+    if not expires:
+        return False
+
+    try:
+        expires = maybe_make_aware(maybe_iso8601(expires))
+    except Exception:
+        return False
+
+    return expires < datetime.now(timezone.utc)
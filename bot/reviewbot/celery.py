@@ -2,9 +2,13 @@
 
 from __future__ import annotations
 
+import multiprocessing
 import os
 import sys
 import textwrap
+import threading
+import time
+from functools import partial
 
 from celery import (Celery,
                     VERSION as CELERY_VERSION,
@@ -13,12 +17,23 @@ from celery import (Celery,
                     maybe_patch_concurrency)
 from celery.bin.worker import detach as detach_process
 from celery.platforms import maybe_drop_privileges
-from celery.signals import celeryd_after_setup, celeryd_init
+from celery.signals import (celeryd_after_setup,
+                            celeryd_init,
+                            worker_process_shutdown,
+                            worker_ready)
+from celery.worker import state as worker_state
 from kombu import Exchange, Queue
 
 from reviewbot import VERSION
+from reviewbot.autoscale import get_task_duration, setup_task_durations
 from reviewbot.config import config, get_config_file_path, load_config
-from reviewbot.repositories import repositories, init_repositories
+from reviewbot.repositories import (init_repositories,
+                                    maintain_repositories,
+                                    refresh_repositories,
+                                    repositories)
+from reviewbot.sharding import (fetch_worker_repositories,
+                                get_owned_repositories,
+                                is_sharding_enabled)
 from reviewbot.tools.base.registry import (get_tool_classes,
                                            load_tool_classes)
 from reviewbot.utils.log import get_root_logger
@@ -27,10 +42,202 @@ from reviewbot.utils.log import get_root_logger
 celery = None
 logger = get_root_logger()
 
+#: The suffix for queues receiving tasks for large changes.
+#:
+#: Version Added:
+#:     5.0
+LARGE_QUEUE_SUFFIX = '.large'
+
+#: The number of seconds before a deferred task for a large change is retried.
+#:
+#: Version Added:
+#:     5.0
+LARGE_TASK_RETRY_DELAY = 5
+
+#: The number of seconds before a task deferred by a tool's concurrency limit
+#: is retried.
+#:
+#: Tools with limits tend to run for longer, and the worker stops consuming
+#: from the tool's queues while they're busy, so these wait longer than tasks
+#: for large changes.
+#:
+#: Version Added:
+#:     5.0
+TOOL_TASK_RETRY_DELAY = 15
+
+#: The number of seconds between checks on whether tools are busy.
+#:
+#: Version Added:
+#:     5.0
+TOOL_SLOT_CHECK_INTERVAL = 1
+
+#: The name of the queue that workers send heartbeats to.
+#:
+#: Version Added:
+#:     5.0
+HEARTBEAT_QUEUE = 'reviewbot.heartbeats'
+
+#: The base queue names for tools requiring full repository access.
+#:
+#: A queue will be consumed for each of these and each configured
+#: repository.
+#:
+#: Version Added:
+#:     5.0
+repository_queue_prefixes = []
+
+#: The names of repositories that this worker is consuming queues for.
+#:
+#: When repositories are sharded across workers, this may be a subset of the
+#: configured repositories.
+#:
+#: Version Added:
+#:     5.0
+consumed_repository_names = set()
+
+#: Whether this worker consumes from queues for large changes.
+#:
+#: This is disabled when all of a worker's slots are reserved for small
+#: changes.
+#:
+#: Version Added:
+#:     5.0
+consume_large_queues = True
+
+#: The versions of the tools available on this worker, keyed by tool ID.
+#:
+#: Version Added:
+#:     5.0
+available_tools = {}
+
+_large_task_slots = None
+_tool_slots = {}
+_paused_tool_queues = {}
+_needs_repository_refresh = False
+
 
 _manual_url = 'https://www.reviewboard.org/docs/reviewbot/%s.%s/' % VERSION[:2]
 
 
+class TaskSlots(object):
+    """A set of slots for running tasks, shared between worker processes.
+
+    Each slot records the ID of the process holding it. Slots held by a
+    process that exited without releasing them, such as a process killed for
+    exceeding a time limit or running out of memory, are reclaimed the next
+    time slots are acquired or counted.
+
+    Version Added:
+        5.0
+    """
+
+    def __init__(self, count):
+        """Initialize the slots.
+
+        This must be called before the worker processes are started, so that
+        they all share the slots.
+
+        Args:
+            count (int):
+                The number of slots.
+        """
+        self.count = count
+        self._pids = multiprocessing.Array('i', count)
+
+    def acquire(self):
+        """Acquire a slot for the current process.
+
+        Returns:
+            bool:
+            ``True`` if a slot was acquired.
+        """
+        with self._pids.get_lock():
+            self._reclaim()
+
+            for i, pid in enumerate(self._pids):
+                if pid == 0:
+                    self._pids[i] = os.getpid()
+
+                    return True
+
+        return False
+
+    def release(self, pid=None, release_all=False):
+        """Release slots held by a process.
+
+        Args:
+            pid (int, optional):
+                The ID of the process holding the slots. This defaults to
+                the current process.
+
+            release_all (bool, optional):
+                Whether to release all slots held by the process, rather
+                than just one.
+        """
+        if pid is None:
+            pid = os.getpid()
+
+        with self._pids.get_lock():
+            for i, slot_pid in enumerate(self._pids):
+                if slot_pid == pid:
+                    self._pids[i] = 0
+
+                    if not release_all:
+                        break
+
+    def get_in_use(self):
+        """Return the number of slots in use.
+
+        Returns:
+            int:
+            The number of slots held by running processes.
+        """
+        with self._pids.get_lock():
+            self._reclaim()
+
+            return sum(
+                1
+                for pid in self._pids
+                if pid != 0
+            )
+
+    def _reclaim(self):
+        """Reclaim slots held by processes that are no longer running.
+
+        The lock must be held when calling this.
+        """
+        for i, pid in enumerate(self._pids):
+            if pid != 0 and not _is_process_running(pid):
+                logger.warning('Reclaiming task slot held by process %d, '
+                               'which is no longer running',
+                               pid)
+                self._pids[i] = 0
+
+
+def _is_process_running(pid):
+    """Return whether a process is running.
+
+    Version Added:
+        5.0
+
+    Args:
+        pid (int):
+            The ID of the process.
+
+    Returns:
+        bool:
+        ``True`` if the process is running.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
 class ReviewBotCelery(Celery):
     """A Celery specialization for Review Bot.
 
@@ -50,6 +257,17 @@ class ReviewBotCelery(Celery):
 def create_queues(hostname):
     """Create the celery queues.
 
+    Version Changed:
+        5.0:
+        When sharding is enabled, queues are only created for the
+        repositories this worker is responsible for. Queues for large
+        changes are also created, unless all slots are reserved for small
+        changes.
+
+    Args:
+        hostname (str):
+            The hostname of the worker.
+
     Returns:
         list of kombu.Queue:
         The queues that this worker will listen to.
@@ -63,6 +281,17 @@ def create_queues(hostname):
     missing_dep_tools = []
     working_dir_tools = []
 
+    repository_queue_prefixes[:] = []
+    consumed_repository_names.clear()
+    available_tools.clear()
+
+    if is_sharding_enabled() and repositories:
+        consumed_repository_names.update(get_owned_repositories(
+            hostname,
+            fetch_worker_repositories(celery, hostname, set(repositories))))
+    else:
+        consumed_repository_names.update(repositories)
+
     # Detect the installed tools and select the corresponding queues to
     # consume from.
     for tool_class in get_tool_classes():
@@ -72,25 +301,30 @@ def create_queues(hostname):
 
         if tool.check_dependencies():
             found_tools.append(tool_id)
+            available_tools[tool_id] = tool_class.version
 
             if tool.working_directory_required:
                 # Set up a queue for each configured repository. This way only
                 # workers which have the relevant repository configured will
                 # pick up applicable tasks.
                 working_dir_tools.append(tool_id)
-
-                for repo_name in repositories:
-                    repo_queue_name = '%s.%s' % (queue_name, repo_name)
-
-                    queues.append(Queue(
-                        repo_queue_name,
-                        Exchange(repo_queue_name, type='direct'),
-                        routing_key=repo_queue_name))
+                repository_queue_prefixes.append(queue_name)
+
+                for repo_name in sorted(consumed_repository_names):
+                    queues += [
+                        Queue(_queue_name,
+                              Exchange(_queue_name, type='direct'),
+                              routing_key=_queue_name)
+                        for _queue_name in get_queue_names(
+                            '%s.%s' % (queue_name, repo_name))
+                    ]
             else:
-                queues.append(Queue(
-                    queue_name,
-                    Exchange(queue_name, type='direct'),
-                    routing_key=queue_name))
+                queues += [
+                    Queue(_queue_name,
+                          Exchange(_queue_name, type='direct'),
+                          routing_key=_queue_name)
+                    for _queue_name in get_queue_names(queue_name)
+                ]
         else:
             missing_dep_tools.append(tool_id)
 
@@ -187,6 +421,17 @@ def create_queues(hostname):
                 for _repository in repositories
             ]
 
+            if is_sharding_enabled():
+                s += [
+                    '',
+                    'Repositories are sharded across workers. This worker '
+                    'is responsible for:',
+                    '',
+                ] + [
+                    '  * %s' % _repository
+                    for _repository in sorted(consumed_repository_names)
+                ]
+
         s += [
             '',
             'See %sconfiguration/#worker-configuration-repositories for '
@@ -200,6 +445,485 @@ def create_queues(hostname):
     return queues
 
 
+def add_repository_queues(hostname, repository_names):
+    """Start consuming from queues for newly-added repositories.
+
+    Version Added:
+        5.0
+
+    Args:
+        hostname (str):
+            The hostname of the worker that should consume from the queues.
+
+        repository_names (list of str):
+            The names of the new repositories.
+    """
+    if is_sharding_enabled():
+        # The new repositories may belong to other workers.
+        rebalance_repository_queues(hostname)
+        return
+
+    _add_repository_consumers(hostname, repository_names)
+
+
+def rebalance_repository_queues(hostname):
+    """Update the repository queues consumed by a sharded worker.
+
+    This will determine which repositories this worker is responsible for,
+    based on the workers currently online, and start or stop consuming from
+    repository queues accordingly.
+
+    Version Added:
+        5.0
+
+    Args:
+        hostname (str):
+            The hostname of this worker.
+    """
+    owned = get_owned_repositories(
+        hostname,
+        fetch_worker_repositories(celery, hostname, set(repositories)))
+    added = owned - consumed_repository_names
+    removed = consumed_repository_names - owned
+
+    if added:
+        _add_repository_consumers(hostname, sorted(added))
+
+    for repo_name in sorted(removed):
+        for queue_name in repository_queue_prefixes:
+            for repo_queue_name in get_queue_names('%s.%s'
+                                                   % (queue_name, repo_name)):
+                logger.info('No longer consuming from queue %s',
+                            repo_queue_name)
+                celery.control.cancel_consumer(repo_queue_name,
+                                               destination=[hostname])
+
+        consumed_repository_names.discard(repo_name)
+
+
+def _add_repository_consumers(hostname, repository_names):
+    """Start consuming from the queues for repositories.
+
+    Version Added:
+        5.0
+
+    Args:
+        hostname (str):
+            The hostname of the worker that should consume from the queues.
+
+        repository_names (list of str):
+            The names of the repositories.
+    """
+    for queue_name in repository_queue_prefixes:
+        for repo_name in repository_names:
+            for repo_queue_name in get_queue_names('%s.%s'
+                                                   % (queue_name, repo_name)):
+                logger.info('Consuming from new queue %s', repo_queue_name)
+                celery.control.add_consumer(repo_queue_name,
+                                            exchange=repo_queue_name,
+                                            exchange_type='direct',
+                                            routing_key=repo_queue_name,
+                                            destination=[hostname])
+
+    consumed_repository_names.update(repository_names)
+
+
+def get_queue_names(queue_name):
+    """Return the names of the queues to consume for a base queue name.
+
+    Version Added:
+        5.0
+
+    Args:
+        queue_name (str):
+            The base name of the queue.
+
+    Returns:
+        list of str:
+        The base queue name, followed by the queue for large changes if
+        this worker consumes from them.
+    """
+    queue_names = [queue_name]
+
+    if consume_large_queues:
+        queue_names.append('%s%s' % (queue_name, LARGE_QUEUE_SUFFIX))
+
+    return queue_names
+
+
+def setup_large_task_slots(concurrency):
+    """Set up the slots available for tasks for large changes.
+
+    The ``reserved_small_task_slots`` configuration determines how many of
+    the worker's processes are kept free for tasks for small changes. The
+    remaining processes may run tasks for large changes.
+
+    Version Added:
+        5.0
+
+    Args:
+        concurrency (int):
+            The number of concurrent processes for the worker.
+
+    Returns:
+        int:
+        The number of slots available for tasks for large changes, or
+        ``None`` if there is no limit.
+    """
+    global _large_task_slots, consume_large_queues
+
+    reserved = config['reserved_small_task_slots'] or 0
+
+    if reserved <= 0:
+        _large_task_slots = None
+        consume_large_queues = True
+
+        return None
+
+    large_slot_count = max(concurrency - reserved, 0)
+    consume_large_queues = large_slot_count > 0
+
+    if consume_large_queues:
+        # This is created before the worker processes are started, so that
+        # they all share it.
+        _large_task_slots = TaskSlots(large_slot_count)
+    else:
+        _large_task_slots = None
+
+    return large_slot_count
+
+
+def is_large_task_queue(queue_name):
+    """Return whether a queue receives tasks for large changes.
+
+    Version Added:
+        5.0
+
+    Args:
+        queue_name (str):
+            The name of the queue or routing key.
+
+    Returns:
+        bool:
+        ``True`` if the queue receives tasks for large changes.
+    """
+    return queue_name.endswith(LARGE_QUEUE_SUFFIX)
+
+
+def setup_tool_slots():
+    """Set up the per-tool limits on concurrent tasks.
+
+    The ``tool_concurrency`` configuration maps tool IDs to the maximum
+    number of tasks for that tool that the worker will run at once.
+
+    Version Added:
+        5.0
+
+    Returns:
+        dict:
+        A mapping of tool IDs to their limits.
+    """
+    _tool_slots.clear()
+    _paused_tool_queues.clear()
+
+    for tool_id, limit in config['tool_concurrency'].items():
+        if limit and limit > 0:
+            # This is created before the worker processes are started, so
+            # that they all share it.
+            _tool_slots[tool_id] = TaskSlots(limit)
+
+    return {
+        tool_id: slots.count
+        for tool_id, slots in _tool_slots.items()
+    }
+
+
+def acquire_task_slot(queue_name):
+    """Acquire a slot to run a task from a queue.
+
+    Tasks for small changes can always run. Tasks for large changes need one
+    of the slots not reserved for small changes.
+
+    Slots are held by the current process. If it exits without releasing
+    them, they're reclaimed (see :py:class:`TaskSlots`).
+
+    If the tool has a limit in ``tool_concurrency``, the task also needs one
+    of the tool's slots. While all of these are taken, the worker stops
+    consuming from the tool's queues, so that other workers can pick up the
+    tool's tasks. See :py:func:`update_tool_queue_consumption`.
+
+    Version Added:
+        5.0
+
+    Args:
+        queue_name (str):
+            The name of the queue or routing key for the task.
+
+    Returns:
+        bool:
+        ``True`` if the task can run. If so, :py:func:`release_task_slot`
+        must be called once the task completes.
+    """
+    is_large = (_large_task_slots is not None and
+                is_large_task_queue(queue_name))
+
+    if is_large and not _large_task_slots.acquire():
+        return False
+
+    tool_slots = _tool_slots.get(queue_name.partition('.')[0])
+
+    if tool_slots is not None and not tool_slots.acquire():
+        if is_large:
+            _large_task_slots.release()
+
+        return False
+
+    return True
+
+
+def get_task_retry_delay(queue_name):
+    """Return how long to wait before retrying a task that couldn't run.
+
+    This is used when :py:func:`acquire_task_slot` fails. Tasks waiting on
+    the tool's ``tool_concurrency`` limit wait for
+    :py:data:`TOOL_TASK_RETRY_DELAY`. Tasks waiting on a slot for large
+    changes wait for :py:data:`LARGE_TASK_RETRY_DELAY`.
+
+    Version Added:
+        5.0
+
+    Args:
+        queue_name (str):
+            The name of the queue or routing key for the task.
+
+    Returns:
+        int:
+        The number of seconds to wait before retrying the task.
+    """
+    tool_slots = _tool_slots.get(queue_name.partition('.')[0])
+
+    if (tool_slots is not None and
+        tool_slots.get_in_use() >= tool_slots.count):
+        return TOOL_TASK_RETRY_DELAY
+
+    return LARGE_TASK_RETRY_DELAY
+
+
+def release_task_slot(queue_name):
+    """Release a slot acquired for a task.
+
+    Version Added:
+        5.0
+
+    Args:
+        queue_name (str):
+            The name of the queue or routing key for the task.
+    """
+    if _large_task_slots is not None and is_large_task_queue(queue_name):
+        _large_task_slots.release()
+
+    tool_slots = _tool_slots.get(queue_name.partition('.')[0])
+
+    if tool_slots is not None:
+        tool_slots.release()
+
+
+@worker_process_shutdown.connect
+def release_process_task_slots(pid, **kwargs):
+    """Release all task slots held by a worker process that's shutting down.
+
+    Version Added:
+        5.0
+
+    Args:
+        pid (int):
+            The ID of the worker process.
+
+        **kwargs (dict):
+            Additional keyword arguments passed by the signal.
+    """
+    if _large_task_slots is not None:
+        _large_task_slots.release(pid, release_all=True)
+
+    for tool_slots in _tool_slots.values():
+        tool_slots.release(pid, release_all=True)
+
+
+def update_tool_queue_consumption(consumer):
+    """Pause or resume consuming from the queues of busy tools.
+
+    For each tool with a limit in ``tool_concurrency``, the worker stops
+    consuming from the tool's queues while all of its slots are in use, and
+    resumes once one is free. This checks the queues the consumer is
+    currently consuming from, so queues added after a tool was paused are
+    paused as well. Queues for repositories this worker no longer handles
+    aren't resumed.
+
+    This must be called in the main worker process, which owns the
+    consumer. The changes are made by the consumer's event loop.
+
+    Version Added:
+        5.0
+
+    Args:
+        consumer (celery.worker.consumer.Consumer):
+            The worker's consumer.
+    """
+    for tool_id, tool_slots in _tool_slots.items():
+        paused_queue_names = _paused_tool_queues.setdefault(tool_id, set())
+
+        if tool_slots.get_in_use() >= tool_slots.count:
+            prefix = '%s.' % tool_id
+
+            for queue in list(consumer.task_consumer.queues):
+                queue_name = queue.name
+
+                if (queue_name.startswith(prefix) and
+                    queue_name not in paused_queue_names):
+                    logger.debug('All slots for %s are in use. Pausing '
+                                 'consumption from queue %s',
+                                 tool_id, queue_name)
+                    paused_queue_names.add(queue_name)
+                    consumer.call_soon(consumer.cancel_task_queue,
+                                       queue_name)
+        elif paused_queue_names:
+            for queue_name in sorted(paused_queue_names):
+                if _is_queue_wanted(queue_name):
+                    logger.debug('Resuming consumption from queue %s',
+                                 queue_name)
+                    consumer.call_soon(consumer.add_task_queue,
+                                       queue_name,
+                                       exchange=queue_name,
+                                       exchange_type='direct',
+                                       routing_key=queue_name)
+
+            paused_queue_names.clear()
+
+
+def _is_queue_wanted(queue_name):
+    """Return whether this worker should consume from a tool's queue.
+
+    Queues for repositories are only wanted if this worker still handles
+    the repository.
+
+    Version Added:
+        5.0
+
+    Args:
+        queue_name (str):
+            The name of the queue.
+
+    Returns:
+        bool:
+        ``True`` if the worker should consume from the queue.
+    """
+    for prefix in repository_queue_prefixes:
+        if queue_name.startswith('%s.' % prefix):
+            return any(
+                queue_name in get_queue_names('%s.%s' % (prefix, repo_name))
+                for repo_name in consumed_repository_names
+            )
+
+    return consume_large_queues or not is_large_task_queue(queue_name)
+
+
+def get_heartbeat(hostname, pool_size):
+    """Return a heartbeat describing this worker's current state.
+
+    Version Added:
+        5.0
+
+    Args:
+        hostname (str):
+            The hostname of the worker.
+
+        pool_size (int):
+            The number of processes in the worker's pool.
+
+    Returns:
+        dict:
+        A dictionary with the following keys:
+
+        ``hostname`` (:py:class:`str`):
+            The hostname of the worker.
+
+        ``timestamp`` (:py:class:`float`):
+            The time the heartbeat was created, in seconds since the epoch.
+
+        ``interval`` (:py:class:`int`):
+            The number of seconds until the next heartbeat.
+
+        ``tools`` (:py:class:`dict`):
+            The versions of the available tools, keyed by tool ID.
+
+        ``repositories`` (:py:class:`list` of :py:class:`str`):
+            The names of the repositories this worker runs tasks for.
+
+        ``in_flight`` (:py:class:`int`):
+            The number of tasks currently running.
+
+        ``pool_size`` (:py:class:`int`):
+            The number of processes in the worker's pool.
+
+        ``task_durations`` (:py:class:`dict`):
+            The average number of seconds recent tasks took, keyed by
+            tool ID. Tools without any completed tasks are not included.
+    """
+    task_durations = {}
+
+    for tool_id in available_tools:
+        duration = get_task_duration(tool_id)
+
+        if duration is not None:
+            task_durations[tool_id] = duration
+
+    return {
+        'hostname': hostname,
+        'timestamp': time.time(),
+        'interval': config['heartbeat_interval'],
+        'tools': dict(available_tools),
+        'repositories': sorted(consumed_repository_names),
+        'in_flight': len(worker_state.active_requests),
+        'pool_size': pool_size,
+        'task_durations': task_durations,
+    }
+
+
+def send_heartbeat(app, hostname, pool_size):
+    """Send a heartbeat to the Review Board server.
+
+    The heartbeat is published to :py:data:`HEARTBEAT_QUEUE`, where the
+    extension picks it up. It expires if it hasn't been picked up within a
+    few heartbeat intervals.
+
+    Version Added:
+        5.0
+
+    Args:
+        app (celery.app.base.Celery):
+            The Celery instance.
+
+        hostname (str):
+            The hostname of the worker.
+
+        pool_size (int):
+            The number of processes in the worker's pool.
+    """
+    exchange = Exchange(HEARTBEAT_QUEUE, type='direct', durable=False)
+    queue = Queue(HEARTBEAT_QUEUE, exchange,
+                  routing_key=HEARTBEAT_QUEUE,
+                  durable=False)
+    heartbeat = get_heartbeat(hostname, pool_size)
+
+    with app.producer_or_acquire() as producer:
+        producer.publish(heartbeat,
+                         exchange=exchange,
+                         routing_key=HEARTBEAT_QUEUE,
+                         declare=[queue],
+                         serializer='json',
+                         expiration=3 * heartbeat['interval'])
+
+
 def setup_cookies():
     """Set up cookie storage for API communication.
 
@@ -314,17 +1038,222 @@ def setup_reviewbot(instance, conf, **kwargs):
         logger.error(e)
         sys.exit(1)
 
+    global _needs_repository_refresh
+
     load_tool_classes()
-    init_repositories()
+    setup_task_durations([
+        tool_class.tool_id
+        for tool_class in get_tool_classes()
+    ])
+    _needs_repository_refresh = init_repositories()
 
     if CELERY_VERSION >= (5, 0):
         conf.accept_content = ['json']
     else:
         conf.CELERY_ACCEPT_CONTENT = ['json']
 
+    concurrency = instance.concurrency or os.cpu_count() or 1
+    large_slot_count = setup_large_task_slots(concurrency)
+
+    if large_slot_count is not None:
+        logger.info('%d of %d worker slots may run tasks for large changes',
+                    large_slot_count, concurrency)
+
+    for tool_id, limit in sorted(setup_tool_slots().items()):
+        logger.info('At most %d tasks for %s will run at once',
+                    limit, tool_id)
+
     instance.app.amqp.queues = create_queues(hostname=instance.hostname)
 
 
+@worker_ready.connect
+def start_repository_refresh(sender, **kwargs):
+    """Refresh cached repositories once the worker has started.
+
+    If repositories were loaded from the cache at startup, this will fetch
+    the latest list from the Review Board servers in a background thread.
+    The worker will start consuming from queues for any new repositories.
+
+    Version Added:
+        5.0
+
+    Args:
+        sender (celery.worker.consumer.Consumer):
+            The worker's consumer.
+
+        **kwargs (dict, unused):
+            Additional keyword arguments passed to the signal.
+    """
+    global _needs_repository_refresh
+
+    if not _needs_repository_refresh:
+        return
+
+    _needs_repository_refresh = False
+
+    def _refresh():
+        try:
+            refresh_repositories(on_repositories_added=partial(
+                add_repository_queues,
+                sender.hostname))
+        except Exception as e:
+            logger.exception('Unexpected error refreshing repositories: %s',
+                             e)
+
+    threading.Thread(target=_refresh,
+                     name='reviewbot-repository-refresh',
+                     daemon=True).start()
+
+
+@worker_ready.connect
+def start_repository_rebalancing(sender, **kwargs):
+    """Periodically rebalance sharded repositories across workers.
+
+    If sharding is enabled, this will check for workers that have joined or
+    left at the configured ``repository_shard_rebalance_interval``, in a
+    background thread.
+
+    Version Added:
+        5.0
+
+    Args:
+        sender (celery.worker.consumer.Consumer):
+            The worker's consumer.
+
+        **kwargs (dict, unused):
+            Additional keyword arguments passed to the signal.
+    """
+    if not is_sharding_enabled():
+        return
+
+    interval = config['repository_shard_rebalance_interval']
+
+    def _rebalance():
+        while True:
+            time.sleep(interval)
+
+            try:
+                rebalance_repository_queues(sender.hostname)
+            except Exception as e:
+                logger.exception('Unexpected error rebalancing repository '
+                                 'queues: %s',
+                                 e)
+
+    threading.Thread(target=_rebalance,
+                     name='reviewbot-repository-rebalance',
+                     daemon=True).start()
+
+
+@worker_ready.connect
+def start_repository_maintenance(sender, **kwargs):
+    """Periodically perform maintenance on local repository storage.
+
+    If ``repository_maintenance_interval`` is set, this will perform
+    maintenance (see :py:func:`reviewbot.repositories.maintain_repositories`)
+    at that interval in a background thread, rather than in a worker process
+    that could be running tasks.
+
+    Version Added:
+        5.0
+
+    Args:
+        sender (celery.worker.consumer.Consumer):
+            The worker's consumer.
+
+        **kwargs (dict, unused):
+            Additional keyword arguments passed to the signal.
+    """
+    interval = config['repository_maintenance_interval']
+
+    if interval is None:
+        return
+
+    def _maintain():
+        while True:
+            # This never raises exceptions, and checks whether maintenance
+            # is due across all workers on this host.
+            maintain_repositories()
+            time.sleep(interval)
+
+    threading.Thread(target=_maintain,
+                     name='reviewbot-repository-maintenance',
+                     daemon=True).start()
+
+
+@worker_ready.connect
+def start_tool_queue_monitor(sender, **kwargs):
+    """Periodically pause or resume consuming from busy tools' queues.
+
+    If any tools have a limit in ``tool_concurrency``, this will check
+    whether their slots are in use every :py:data:`TOOL_SLOT_CHECK_INTERVAL`
+    seconds, in a background thread.
+
+    Version Added:
+        5.0
+
+    Args:
+        sender (celery.worker.consumer.Consumer):
+            The worker's consumer.
+
+        **kwargs (dict, unused):
+            Additional keyword arguments passed to the signal.
+    """
+    if not _tool_slots:
+        return
+
+    def _monitor():
+        while True:
+            time.sleep(TOOL_SLOT_CHECK_INTERVAL)
+
+            try:
+                update_tool_queue_consumption(sender)
+            except Exception as e:
+                logger.exception('Unexpected error updating tool queue '
+                                 'consumption: %s',
+                                 e)
+
+    threading.Thread(target=_monitor,
+                     name='reviewbot-tool-queue-monitor',
+                     daemon=True).start()
+
+
+@worker_ready.connect
+def start_heartbeats(sender, **kwargs):
+    """Periodically send heartbeats to the Review Board server.
+
+    Heartbeats are sent at the configured ``heartbeat_interval``, in a
+    background thread.
+
+    Version Added:
+        5.0
+
+    Args:
+        sender (celery.worker.consumer.Consumer):
+            The worker's consumer.
+
+        **kwargs (dict, unused):
+            Additional keyword arguments passed to the signal.
+    """
+    interval = config['heartbeat_interval']
+
+    if not interval:
+        return
+
+    def _send_heartbeats():
+        while True:
+            try:
+                send_heartbeat(sender.app, sender.hostname,
+                               sender.pool.num_processes)
+            except Exception as e:
+                logger.error('Unable to send heartbeat: %s', e)
+
+            time.sleep(interval)
+
+    threading.Thread(target=_send_heartbeats,
+                     name='reviewbot-heartbeat',
+                     daemon=True).start()
+
+
 def get_celery():
     """Return a Celery instance.
 
@@ -359,6 +1288,10 @@ def start_worker(broker, hostname, loglevel, logfile, detach, pidfile, uid,
     Version Added:
         3.0
 
+    Version Changed:
+        5.0:
+        Auto-scaling uses :py:class:`reviewbot.autoscale.ReviewBotAutoscaler`.
+
     Args:
         broker (str):
             The broker URI.
@@ -397,7 +1330,9 @@ def start_worker(broker, hostname, loglevel, logfile, detach, pidfile, uid,
 
         autoscale (str):
             The autoscale settings, in the form of
-            ``max_concurrency,min_concurrency``.
+            ``max_concurrency,min_concurrency``. If
+            ``autoscale_by_queue_depth`` is configured, scaling will be based
+            on the depth of the tool queues.
 
     Returns:
         int:
@@ -468,6 +1403,7 @@ def start_worker(broker, hostname, loglevel, logfile, detach, pidfile, uid,
             concurrency=concurrency,
             pool_cls=pool_cls,
             autoscale=autoscale,
+            autoscaler_cls='reviewbot.autoscale:ReviewBotAutoscaler',
             quiet=True)
 
         if CELERY_VERSION >= (5, 0):
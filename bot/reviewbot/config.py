@@ -24,13 +24,29 @@ _appdirs = AppDirs(appname='reviewbot',
 #: Version Added:
 #:     3.0
 DEFAULT_CONFIG = {
+    'autoscale_by_queue_depth': False,
+    'autoscale_memory_budget': None,
+    'autoscale_process_memory': 256,
+    'autoscale_target_wait': 60,
+    'autoscale_tool_weights': {},
     'cookie_dir': _appdirs.user_cache_dir,
     'exe_paths': {},
+    'heartbeat_interval': 30,
     'java_classpaths': {},
+    'max_files_per_task': {},
     'reviewboard_servers_config_path': None,
     'reviewboard_servers': [],
+    'repositories_cache_path': None,
     'repositories_config_path': None,
     'repositories': [],
+    'repository_maintenance_interval': None,
+    'repository_storage_quota': None,
+    'repository_shard_rebalance_interval': 60,
+    'repository_shard_replicas': None,
+    'reserved_small_task_slots': 0,
+    'run_tool_batch_size': 1,
+    'run_tool_batch_window': 0,
+    'tool_concurrency': {},
 }
 
 #: Deprecated configuration keys.
@@ -227,6 +243,12 @@ def load_config():
         cookie_dir = DEFAULT_CONFIG['cookie_dir']
         new_config['cookie_dir'] = cookie_dir
 
+    # Store repositories discovered from Review Board servers alongside
+    # cookies, unless otherwise configured.
+    if new_config['repositories_cache_path'] is None:
+        new_config['repositories_cache_path'] = os.path.join(
+            cookie_dir, 'reviewbot-repositories.json')
+
     # Set the full cookie path, for convenience. This setting cannot be
     # customized.
     new_config['cookie_path'] = os.path.join(cookie_dir,
@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import copy
 import json
 import os
 from enum import Enum
@@ -11,14 +12,17 @@ from typing import (Any, Final, Literal, Optional, TypedDict, TYPE_CHECKING,
 
 from rbtools.api.errors import APIError
 
-from reviewbot.utils.filesystem import (ensure_dirs_exist,
+from reviewbot.config import config
+from reviewbot.utils.filesystem import (chdir,
+                                        ensure_dirs_exist,
                                         make_tempdir,
                                         make_tempfile,
                                         normalize_platform_path)
 from reviewbot.utils.log import get_logger
+from reviewbot.utils.process import execute, is_exe_in_path
 
 if TYPE_CHECKING:
-    from collections.abc import Iterator
+    from collections.abc import Collection, Iterator
     from rbtools.api.resource import (
         FileDiffItemResource,
         ItemResource,
@@ -460,6 +464,12 @@ class File:
                                    'to "%s" for FileDiff ID=%s',
                                    source_file, dest_file, self.id)
 
+            if os.path.lexists(dest_file):
+                # Replace the file rather than writing to it in place. The
+                # checkout may hard-link files from a shared snapshot, which
+                # must never be modified.
+                os.unlink(dest_file)
+
             with open(dest_file, 'wb') as fp:
                 fp.write(self.patched_file_contents or b'')
 
@@ -866,9 +876,14 @@ class Review:
         review_request_id: int,
         diff_revision: int,
         settings: dict[str, Any],
+        filediff_ids: Optional[Collection[int]] = None,
     ) -> None:
         """Initialize the review.
 
+        Version Changed:
+            5.0:
+            Added the ``filediff_ids`` argument.
+
         Args:
             api_root (rbtools.api.resource.RootResource):
                 The API root.
@@ -883,6 +898,10 @@ class Review:
             settings (dict):
                 The settings provided by the extension when triggering the
                 task.
+
+            filediff_ids (set of int, optional):
+                The IDs of the FileDiffs to review. If provided, data is
+                only fetched for these files.
         """
         self.body_top = ''
         self.body_bottom = ''
@@ -908,11 +927,52 @@ class Review:
                     filediff.extra_data.get('is_symlink', False)):
                     continue
 
+                if (filediff_ids is not None and
+                    int(filediff.id) not in filediff_ids):
+                    continue
+
                 files.append(File(review=self,
                                   api_filediff=filediff))
 
         self.files = files
 
+    def copy(
+        self,
+        settings: dict[str, Any],
+    ) -> Review:
+        """Return a new, empty review of the same diff.
+
+        The new review shares the files, along with any patched files and
+        patch contents already fetched, but has its own settings and
+        comments. This allows several tools to review a diff without
+        fetching it more than once.
+
+        Version Added:
+            5.0
+
+        Args:
+            settings (dict):
+                The settings provided by the extension for the new review.
+
+        Returns:
+            Review:
+            The new review.
+        """
+        review = copy.copy(self)
+        review.body_top = ''
+        review.body_bottom = ''
+        review.settings = settings
+        review.comments = []
+        review.general_comments = []
+        review.files = []
+
+        for f in self.files:
+            review_file = copy.copy(f)
+            review_file.review = review
+            review.files.append(review_file)
+
+        return review
+
     def general_comment(
         self,
         text: str,
@@ -1011,6 +1071,83 @@ class Review:
         patch_contents = self.patch_contents
 
         if patch_contents:
+            if isinstance(patch_contents, str):
+                patch_contents = patch_contents.encode('utf-8')
+
             return make_tempfile(patch_contents, '.diff')
         else:
             return None
+
+    def apply_patch(
+        self,
+        root_target_dir: str,
+    ) -> bool:
+        """Apply the patch for the entire diff to the filesystem.
+
+        This fetches the patch in a single request and applies it using
+        :command:`git apply`, or :command:`patch` if :command:`git` is not
+        available. Unlike :py:meth:`File.apply_patch`, this doesn't need to
+        fetch the patched contents of each file.
+
+        Nothing will be written if the patch doesn't apply cleanly, in which
+        case callers should fall back on :py:meth:`File.apply_patch`.
+
+        Version Added:
+            5.0
+
+        Args:
+            root_target_dir (str):
+                The root directory for the project.
+
+        Returns:
+            bool:
+            ``True`` if the patch was applied. ``False`` if it could not be
+            fetched or applied.
+        """
+        try:
+            patch_path = self.get_patch_file_path()
+        except APIError as e:
+            logger.warning('Unable to fetch the patch for review request '
+                           '%s, diff revision %s: %s',
+                           self.review_request_id, self.diff_revision, e)
+            return False
+
+        if not patch_path:
+            return False
+
+        exe_paths = config['exe_paths']
+        git = exe_paths.get('git', 'git')
+        patch = exe_paths.get('patch', 'patch')
+
+        # The cache records missing executables as None, so these must be
+        # checked before use.
+        if git and is_exe_in_path(git, cache=exe_paths):
+            # git apply is atomic. It won't touch the tree if any hunk fails.
+            commands = [
+                [git, 'apply', '--whitespace=nowarn', patch_path],
+            ]
+        elif patch and is_exe_in_path(patch, cache=exe_paths):
+            commands = [
+                [patch, '-p1', '--dry-run', '--force', '-i', patch_path],
+                [patch, '-p1', '--force', '-i', patch_path],
+            ]
+        else:
+            logger.debug('Neither git nor patch are available to apply the '
+                         'patch for review request %s, diff revision %s',
+                         self.review_request_id, self.diff_revision)
+            return False
+
+        try:
+            with chdir(root_target_dir):
+                for command in commands:
+                    execute(command)
+        except Exception as e:
+            logger.warning('Unable to apply the patch for review request %s, '
+                           'diff revision %s: %s',
+                           self.review_request_id, self.diff_revision, e)
+            return False
+
+        for f in self.files:
+            f.patched_file_path = f.dest_file
+
+        return True
@@ -6,14 +6,24 @@ Version Added:
 
 from __future__ import annotations
 
+import os
+
 import kgb
 
+from reviewbot.config import config
 from reviewbot.testing import TestCase
+from reviewbot.utils.filesystem import cleanup_tempfiles, make_tempdir
+from reviewbot.utils.process import execute
 
 
 class ReviewTests(kgb.SpyAgency, TestCase):
     """Unit tests for reviewbot.processing.review.Review."""
 
+    def tearDown(self) -> None:
+        super().tearDown()
+
+        cleanup_tempfiles()
+
     def test_init_load_filediffs(self) -> None:
         """Testing Review.__init__ with loading FileDiffs"""
         self.spy_on(self.api_root.get_files, op=kgb.SpyOpReturn([
@@ -81,3 +91,168 @@ class ReviewTests(kgb.SpyAgency, TestCase):
         self.assertEqual(files[2].source_file, 'test3.txt')
         self.assertEqual(files[3].source_file, 'test4.txt')
         self.assertEqual(files[4].source_file, 'test5.txt')
+
+    def test_copy(self) -> None:
+        """Testing Review.copy"""
+        self.spy_on(self.api_root.get_files, op=kgb.SpyOpReturn([
+            self.create_filediff_resource(
+                filediff_id=1,
+                review_request_id=1,
+                source_file='test1.txt',
+                dest_file='test1.txt'),
+        ]))
+
+        review = self.create_review()
+        review.files[0].patched_file_path = '/path/to/test1.txt'
+        review.general_comment('Bad thing!')
+
+        new_review = review.copy(settings={
+            'comment_unmodified': True,
+            'open_issues': False,
+        })
+
+        self.assertIsNot(new_review, review)
+        self.assertEqual(new_review.review_request_id,
+                         review.review_request_id)
+        self.assertEqual(new_review.diff_revision, review.diff_revision)
+        self.assertEqual(new_review.comments, [])
+        self.assertEqual(new_review.general_comments, [])
+        self.assertTrue(new_review.settings['comment_unmodified'])
+
+        self.assertEqual(len(new_review.files), 1)
+
+        new_file = new_review.files[0]
+        self.assertIsNot(new_file, review.files[0])
+        self.assertIs(new_file.review, new_review)
+        self.assertEqual(new_file.id, 1)
+        self.assertEqual(new_file.patched_file_path, '/path/to/test1.txt')
+
+        # Comments should only be made on the new review.
+        new_file.comment('Bad line!', first_line=1)
+
+        self.assertEqual(len(new_review.comments), 1)
+        self.assertEqual(review.comments, [])
+
+    def test_apply_patch_with_git(self) -> None:
+        """Testing Review.apply_patch with git"""
+        self.spy_on(execute, op=kgb.SpyOpReturn(''))
+
+        review = self._create_review_with_patch()
+        workdir = make_tempdir()
+
+        with self.override_config({'exe_paths': {'git': '/bin/true'}}):
+            self.assertTrue(review.apply_patch(workdir))
+
+        self.assertSpyCallCount(execute, 1)
+
+        patch_path = execute.last_call.args[0][-1]
+        self.assertSpyCalledWith(
+            execute,
+            ['/bin/true', 'apply', '--whitespace=nowarn', patch_path])
+
+        with open(patch_path, 'rb') as fp:
+            self.assertEqual(fp.read(), review.patch)
+
+        self.assertEqual(
+            [f.get_patched_file_path() for f in review.files],
+            ['test1.txt', 'docs/test2.txt'])
+
+    def test_apply_patch_with_patch(self) -> None:
+        """Testing Review.apply_patch with patch"""
+        self.spy_on(execute, op=kgb.SpyOpReturn(''))
+
+        review = self._create_review_with_patch()
+        workdir = make_tempdir()
+
+        with self.override_config({'exe_paths': {'patch': '/bin/true'}}):
+            self.assertTrue(review.apply_patch(workdir))
+
+        self.assertSpyCallCount(execute, 2)
+
+        patch_path = execute.last_call.args[0][-1]
+        self.assertSpyCalledWith(
+            execute.calls[0],
+            ['/bin/true', '-p1', '--dry-run', '--force', '-i', patch_path])
+        self.assertSpyCalledWith(
+            execute.calls[1],
+            ['/bin/true', '-p1', '--force', '-i', patch_path])
+
+    def test_apply_patch_with_failure(self) -> None:
+        """Testing Review.apply_patch with the patch failing to apply"""
+        self.spy_on(execute, op=kgb.SpyOpRaise(Exception('Oh no.')))
+
+        review = self._create_review_with_patch()
+        workdir = make_tempdir()
+
+        with self.override_config({'exe_paths': {'git': '/bin/true'}}):
+            self.assertFalse(review.apply_patch(workdir))
+
+        self.assertSpyCallCount(execute, 1)
+        self.assertIsNone(review.files[0].patched_file_path)
+
+    def test_apply_patch_without_tools(self) -> None:
+        """Testing Review.apply_patch without git or patch installed"""
+        self.spy_on(execute)
+
+        review = self._create_review_with_patch()
+        workdir = make_tempdir()
+
+        self.assertFalse(review.apply_patch(workdir))
+        self.assertSpyNotCalled(execute)
+
+    def test_apply_patch_without_tools_twice(self) -> None:
+        """Testing Review.apply_patch without git or patch installed, with
+        the lookups cached between reviews
+        """
+        self.spy_on(execute)
+
+        workdir = make_tempdir()
+        old_path = os.environ['PATH']
+
+        try:
+            os.environ['PATH'] = make_tempdir()
+
+            with self.override_config({'exe_paths': {}}):
+                self.assertFalse(
+                    self._create_review_with_patch().apply_patch(workdir))
+
+                # The missing executables are cached as None, which must not
+                # be used as their paths.
+                self.assertEqual(config['exe_paths'],
+                                 {'git': None, 'patch': None})
+                self.assertFalse(
+                    self._create_review_with_patch().apply_patch(workdir))
+        finally:
+            os.environ['PATH'] = old_path
+
+        self.assertSpyNotCalled(execute)
+
+    def _create_review_with_patch(self):
+        """Return a review with files and patch contents.
+
+        Returns:
+            reviewbot.processing.review.Review:
+            The new review.
+        """
+        review = self.create_review()
+        self.create_review_file(review,
+                                filediff_id=1,
+                                source_file='test1.txt',
+                                dest_file='test1.txt')
+        self.create_review_file(review,
+                                filediff_id=2,
+                                source_file='test2.txt',
+                                dest_file='docs/test2.txt',
+                                status='moved')
+
+        review.patch = (
+            b'diff --git a/test1.txt b/test1.txt\n'
+            b'index abc123..def456 100644\n'
+            b'--- a/test1.txt\n'
+            b'+++ b/test1.txt\n'
+            b'@@ -1 +1 @@\n'
+            b'-test\n'
+            b'+test!\n'
+        )
+
+        return review
@@ -2,14 +2,31 @@
 
 from __future__ import annotations
 
+import json
 import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 from uuid import uuid4
 
+try:
+    import fcntl
+except ImportError:
+    # This is unavailable on Windows.
+    fcntl = None
+
 import appdirs
 
 from reviewbot.config import config
 from reviewbot.utils.api import get_api_root
-from reviewbot.utils.filesystem import make_tempdir
+from reviewbot.utils.filesystem import (SNAPSHOT_METHODS,
+                                        add_cleanup_callback,
+                                        get_disk_usage,
+                                        make_tempdir,
+                                        make_tempdir_snapshot)
 from reviewbot.utils.log import get_logger
 from reviewbot.utils.process import execute
 
@@ -20,11 +37,48 @@ logger = get_logger(__name__)
 repositories = {}
 repository_backends = []
 
+_configured_repository_names = set()
+
+
+#: Apply a diff by fetching the patched contents of each file.
+#:
+#: Version Added:
+#:     5.0
+PATCH_STRATEGY_FILES = 'files'
+
+#: Apply a diff by fetching the whole patch once and applying it locally.
+#:
+#: Files will be fetched individually if the patch fails to apply.
+#:
+#: Version Added:
+#:     5.0
+PATCH_STRATEGY_DIFF = 'diff'
+
+#: The maximum number of concurrent requests used to discover repositories.
+#:
+#: Version Added:
+#:     5.0
+MAX_DISCOVERY_THREADS = 8
+
+#: The number of seconds after use before local storage can be evicted.
+#:
+#: This keeps storage from being removed while a task may still be using it.
+#:
+#: Version Added:
+#:     5.0
+EVICTION_GRACE_PERIOD = 60 * 60
+
 
 class BaseRepository(object):
     """A repository.
 
     Attributes:
+        checkout_snapshots (str):
+            The method used to create copy-on-write views of shared
+            snapshots when checking out commits, or ``None`` if each checkout
+            is extracted separately. See
+            :py:data:`reviewbot.utils.filesystem.SNAPSHOT_METHODS`.
+
         clone_path (str):
             The clone path of the repository. This may be the ``path`` or
             ``mirror_path`` of the repository in the API.
@@ -32,8 +86,17 @@ class BaseRepository(object):
         name (str):
             The name of the repository.
 
+        patch_strategy (str):
+            How diffs are applied to checkouts of this repository. This is
+            one of :py:data:`PATCH_STRATEGY_FILES` or
+            :py:data:`PATCH_STRATEGY_DIFF`.
+
         repo_path (str):
             The local path where the clone/checkout is or will be stored.
+
+        snapshots_path (str):
+            The local path where snapshots of checked out commits are
+            stored.
     """
 
     #: A tuple of known repository configuration types this supports.
@@ -54,9 +117,28 @@ class BaseRepository(object):
     #:     str
     tool_name = None
 
-    def __init__(self, name, clone_path):
+    #: Additional repository configuration keys supported by this backend.
+    #:
+    #: Any of these keys found in a configured repository entry will be
+    #: passed to the constructor as keyword arguments.
+    #:
+    #: Version Added:
+    #:     5.0
+    #:
+    #: Type:
+    #:     tuple of str
+    config_keys = ('patch_strategy', 'checkout_snapshots')
+
+    def __init__(self, name, clone_path,
+                 patch_strategy=PATCH_STRATEGY_FILES,
+                 checkout_snapshots=None):
         """Initialize the repository.
 
+        Version Changed:
+            5.0:
+            Added the ``patch_strategy`` and ``checkout_snapshots``
+            arguments.
+
         Args:
             name (str):
                 The name of the repository.
@@ -64,31 +146,372 @@ class BaseRepository(object):
             clone_path (str):
                 The clone path of the repository.
 
-            repo_path (str):
+            patch_strategy (str, optional):
+                How diffs are applied to checkouts of this repository.
+
+            checkout_snapshots (str, optional):
+                The method used to create copy-on-write views of a shared
+                snapshot of each commit when checking out the full tree.
+
+                If ``None``, each checkout will be extracted separately.
+
+        Raises:
+            ValueError:
+                The patch strategy or snapshot method is not supported.
         """
+        if patch_strategy not in (PATCH_STRATEGY_FILES, PATCH_STRATEGY_DIFF):
+            raise ValueError('Unknown patch strategy "%s"' % patch_strategy)
+
+        if (checkout_snapshots is not None and
+            checkout_snapshots not in SNAPSHOT_METHODS):
+            raise ValueError('Unknown checkout snapshot method "%s"'
+                             % checkout_snapshots)
+
         self.name = name
         self.clone_path = clone_path
+        self.patch_strategy = patch_strategy
+        self.checkout_snapshots = checkout_snapshots
+
+        data_dir = appdirs.site_data_dir('reviewbot')
+        self.repo_path = os.path.join(data_dir, 'repositories', name)
+        self.snapshots_path = os.path.join(data_dir, 'snapshots', name)
 
-        self.repo_path = os.path.join(appdirs.site_data_dir('reviewbot'),
-                                      'repositories', name)
+        self._storage_lock_fd = None
+
+    @property
+    def storage_paths(self):
+        """The local paths used to store data for this repository.
+
+        Version Added:
+            5.0
+
+        Type:
+            list of str
+        """
+        return [self.repo_path, self.snapshots_path]
+
+    def get_last_used(self):
+        """Return when the repository was last synced for a review.
+
+        Version Added:
+            5.0
+
+        Returns:
+            float:
+            The timestamp of the last use, or ``None`` if the repository
+            has not been cloned.
+        """
+        try:
+            return os.stat(self.repo_path).st_mtime
+        except OSError:
+            return None
 
     def sync(self):
         """Sync the latest state of the repository."""
         raise NotImplementedError
 
-    def checkout(self, commit_id):
+    def maintain(self):
+        """Optimize the local clone of the repository.
+
+        This is called periodically by :py:func:`maintain_repositories`.
+
+        Version Added:
+            5.0
+        """
+        pass
+
+    def verify(self):
+        """Return whether the local clone of the repository is healthy.
+
+        This is called periodically by :py:func:`maintain_repositories`,
+        while no tasks are using the repository.
+
+        Version Added:
+            5.0
+
+        Returns:
+            bool:
+            ``False`` if the clone is definitely corrupt and should be cloned
+            again. ``True`` otherwise, including if it couldn't be checked.
+        """
+        return True
+
+    def mark_for_reclone(self):
+        """Mark the local clone of the repository to be cloned again.
+
+        The existing storage will be removed the next time the repository is
+        synced while no other tasks are using it.
+
+        Version Added:
+            5.0
+        """
+        logger.warning('Repository %s will be cloned again when next used',
+                       self.name)
+
+        with open(self._reclone_marker_path, 'w'):
+            pass
+
+    def lock_storage(self):
+        """Lock the local storage for use by the current task.
+
+        This takes a shared lock on the repository's storage, held until
+        :py:func:`~reviewbot.utils.filesystem.cleanup_tempfiles` is called.
+        Maintenance won't verify or remove the storage while it's held.
+
+        If the repository was marked to be cloned again, and no other task
+        is using it, the existing storage is removed first.
+
+        This does nothing if the lock is already held, or if locking is
+        unsupported on this platform.
+
+        Version Added:
+            5.0
+        """
+        if fcntl is None or self._storage_lock_fd is not None:
+            return
+
+        os.makedirs(os.path.dirname(self.repo_path), exist_ok=True)
+        lock_fd = os.open(self._storage_lock_path, os.O_RDWR | os.O_CREAT)
+
+        try:
+            if os.path.exists(self._reclone_marker_path):
+                try:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    logger.warning('Repository %s needs to be cloned again, '
+                                   'but is in use by another task',
+                                   self.name)
+                else:
+                    self.remove_storage()
+                    os.unlink(self._reclone_marker_path)
+
+            fcntl.flock(lock_fd, fcntl.LOCK_SH)
+        except Exception:
+            os.close(lock_fd)
+            raise
+
+        self._storage_lock_fd = lock_fd
+        add_cleanup_callback(self._unlock_storage)
+
+    @contextmanager
+    def lock_storage_exclusive(self):
+        """Lock the local storage for maintenance.
+
+        This takes an exclusive lock on the repository's storage, without
+        waiting for tasks using it.
+
+        Version Added:
+            5.0
+
+        Context:
+            bool:
+            ``True`` if the lock was acquired, or ``False`` if the storage is
+            in use. Locking always succeeds if unsupported on this platform.
+        """
+        if fcntl is None:
+            yield True
+            return
+
+        os.makedirs(os.path.dirname(self.repo_path), exist_ok=True)
+        lock_fd = os.open(self._storage_lock_path, os.O_RDWR | os.O_CREAT)
+
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+            else:
+                yield True
+        finally:
+            os.close(lock_fd)
+
+    @property
+    def _storage_lock_path(self):
+        """The path to the lock file for the repository's storage.
+
+        Version Added:
+            5.0
+
+        Type:
+            str
+        """
+        return '%s.lock' % self.repo_path
+
+    @property
+    def _reclone_marker_path(self):
+        """The path to the file marking the repository to be cloned again.
+
+        Version Added:
+            5.0
+
+        Type:
+            str
+        """
+        return '%s.reclone' % self.repo_path
+
+    def _unlock_storage(self):
+        """Release the lock taken by :py:meth:`lock_storage`.
+
+        Version Added:
+            5.0
+        """
+        if self._storage_lock_fd is not None:
+            os.close(self._storage_lock_fd)
+            self._storage_lock_fd = None
+
+    def remove_storage(self):
+        """Remove all locally stored data for the repository.
+
+        The repository will be cloned again the next time it's synced.
+
+        Version Added:
+            5.0
+        """
+        for path in self.storage_paths:
+            if os.path.exists(path):
+                logger.info('Removing %s for repository %s', path, self.name)
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _mark_used(self):
+        """Record that the repository is being used for a review.
+
+        Version Added:
+            5.0
+        """
+        os.utime(self.repo_path)
+
+    def checkout(self, commit_id, paths=None):
         """Check out the given commit.
 
+        Version Changed:
+            5.0:
+            Added the ``paths`` argument.
+
         Args:
             commit_id (str):
                 The ID of the commit to check out.
 
+            paths (set of str, optional):
+                A set of directories, relative to the root of the repository,
+                to limit the checkout to. Files directly within the root of
+                the repository will always be checked out.
+
+                If ``None``, the full tree will be checked out.
+
         Returns:
             str:
             The name of a directory with the given checkout.
         """
         raise NotImplementedError
 
+    def export(self, commit_id, target_dir):
+        """Write the files of the given commit to a directory.
+
+        Unlike :py:meth:`checkout`, this will not include any version control
+        metadata.
+
+        Version Added:
+            5.0
+
+        Args:
+            commit_id (str):
+                The ID of the commit to export.
+
+            target_dir (str):
+                The existing, empty directory to write to.
+        """
+        raise NotImplementedError
+
+    def get_file_paths(self, commit_id):
+        """Return the paths of all files in the given commit.
+
+        This reads from the local clone without checking anything out. The
+        repository must have been synced first.
+
+        Version Added:
+            5.0
+
+        Args:
+            commit_id (str):
+                The ID of the commit to list.
+
+        Returns:
+            list of str:
+            The paths of the files, relative to the root of the repository.
+        """
+        raise NotImplementedError
+
+    def get_snapshot(self, commit_id):
+        """Return a shared snapshot of the given commit.
+
+        The snapshot will be exported the first time it's requested, and
+        then reused by any later checkouts of the same commit. It must not
+        be modified.
+
+        Version Added:
+            5.0
+
+        Args:
+            commit_id (str):
+                The ID of the commit.
+
+        Returns:
+            str:
+            The path to the snapshot.
+        """
+        snapshot_path = os.path.join(self.snapshots_path, commit_id)
+
+        if os.path.isdir(snapshot_path):
+            # Record the last use of the snapshot, so that stale snapshots
+            # can be found and removed.
+            os.utime(snapshot_path)
+        else:
+            if not os.path.exists(self.snapshots_path):
+                os.makedirs(self.snapshots_path)
+
+            # Export to a staging directory and move it into place once
+            # complete, so that a partial snapshot is never used, even if
+            # another worker is exporting the same commit.
+            staging_path = tempfile.mkdtemp(prefix='.staging-',
+                                            dir=self.snapshots_path)
+
+            try:
+                logger.info('Creating snapshot for commit ID %s in %s',
+                            commit_id, snapshot_path)
+                self.export(commit_id, staging_path)
+                os.rename(staging_path, snapshot_path)
+            except Exception:
+                shutil.rmtree(staging_path, ignore_errors=True)
+
+                if not os.path.isdir(snapshot_path):
+                    raise
+
+        return snapshot_path
+
+    def _checkout_snapshot(self, commit_id):
+        """Check out the given commit from a shared snapshot.
+
+        Version Added:
+            5.0
+
+        Args:
+            commit_id (str):
+                The ID of the commit to check out.
+
+        Returns:
+            str:
+            The name of a directory with the given checkout.
+        """
+        snapshot_path = self.get_snapshot(commit_id)
+        workdir = make_tempdir_snapshot(snapshot_path,
+                                        method=self.checkout_snapshots)
+
+        logger.info('Created working tree for commit ID %s in %s from '
+                    'snapshot %s',
+                    commit_id, workdir, snapshot_path)
+
+        return workdir
+
     def __eq__(self, other):
         """Return whether this repository is equal to another.
 
@@ -120,39 +543,191 @@ class BaseRepository(object):
 
 
 class GitRepository(BaseRepository):
-    """A git repository."""
+    """A git repository.
+
+    Attributes:
+        clone_filter (str):
+            An optional object filter used for a partial clone of the
+            repository (for example, ``blob:none``).
+
+        shallow_since (str):
+            An optional date limiting how far back history will be cloned.
+    """
 
     repo_types = ('git',)
     tool_name = 'Git'
+    config_keys = BaseRepository.config_keys + ('clone_filter',
+                                                'shallow_since')
+
+    def __init__(self, name, clone_path, clone_filter=None,
+                 shallow_since=None, **kwargs):
+        """Initialize the repository.
+
+        Version Changed:
+            5.0:
+            Added the ``clone_filter`` and ``shallow_since`` arguments.
+
+        Args:
+            name (str):
+                The name of the repository.
+
+            clone_path (str):
+                The clone path of the repository.
+
+            clone_filter (str, optional):
+                An object filter for a partial clone of the repository
+                (for example, ``blob:none``). Objects excluded by the filter
+                will be fetched on demand when checking out a commit.
+
+            shallow_since (str, optional):
+                A date (in any format understood by :command:`git`) limiting
+                how far back history will be cloned.
+
+            **kwargs (dict):
+                Additional keyword arguments for the parent class.
+        """
+        super(GitRepository, self).__init__(name=name,
+                                            clone_path=clone_path,
+                                            **kwargs)
+
+        self.clone_filter = clone_filter
+        self.shallow_since = shallow_since
 
     def sync(self):
         """Sync the latest state of the repository."""
+        self.lock_storage()
+
         if not os.path.exists(self.repo_path):
             os.makedirs(self.repo_path)
 
+            clone_args = []
+
+            if self.clone_filter:
+                clone_args.append('--filter=%s' % self.clone_filter)
+
+            if self.shallow_since:
+                clone_args.append('--shallow-since=%s' % self.shallow_since)
+
             logger.info('Cloning repository %s to %s',
                         self.clone_path, self.repo_path)
-            execute(['git', 'clone', '--bare', self.clone_path,
-                     self.repo_path])
+            execute(['git', 'clone', '--bare'] + clone_args +
+                    [self.clone_path, self.repo_path])
         else:
             logger.info('Fetching into existing repository %s',
                         self.repo_path)
             execute(['git', '--git-dir=%s' % self.repo_path, 'fetch',
                      'origin', '+refs/heads/*:refs/heads/*'])
 
-    def checkout(self, commit_id):
+            if self.clone_filter:
+                # Partial clones are checked out as worktrees of the mirror.
+                # Clear out the bookkeeping for any that have since been
+                # removed.
+                execute(['git', '--git-dir=%s' % self.repo_path, 'worktree',
+                         'prune'])
+
+        self._mark_used()
+
+    def maintain(self):
+        """Optimize the local clone of the repository.
+
+        This will pack loose objects and consolidate packs when needed, and
+        write the commit-graph and multi-pack-index files used to speed up
+        fetches and history traversal.
+
+        Version Added:
+            5.0
+        """
+        git_args = ['git', '--git-dir=%s' % self.repo_path]
+
+        execute(git_args + ['gc', '--auto'])
+        execute(git_args + ['commit-graph', 'write', '--reachable'])
+        execute(git_args + ['multi-pack-index', 'write'])
+
+    def verify(self):
+        """Return whether the local clone of the repository is healthy.
+
+        Version Added:
+            5.0
+
+        Returns:
+            bool:
+            ``False`` if the clone is definitely corrupt and should be cloned
+            again. ``True`` otherwise, including if it couldn't be checked.
+        """
+        # git fsck exits with a code between 1 and 127 when it finds
+        # problems, and 128 if it couldn't run at all.
+        try:
+            output = execute(
+                ['git', '--git-dir=%s' % self.repo_path, 'fsck',
+                 '--connectivity-only', '--no-dangling', '--no-progress'],
+                extra_ignore_errors=tuple(range(1, 128)),
+                none_on_ignored_error=True)
+        except Exception as e:
+            logger.warning('Unable to verify repository %s: %s',
+                           self.name, e)
+            return True
+
+        if output is None:
+            logger.error('Repository %s failed verification', self.name)
+            return False
+
+        return True
+
+    def checkout(self, commit_id, paths=None):
         """Check out the given commit.
 
+        Version Changed:
+            5.0:
+            Added the ``paths`` argument.
+
         Args:
             commit_id (str):
                 The ID of the commit to check out.
 
+            paths (set of str, optional):
+                A set of directories, relative to the root of the repository,
+                to limit the checkout to. This will use a cone-mode sparse
+                checkout.
+
+                If ``None``, the full tree will be checked out.
+
         Returns:
             str:
             The name of a directory with the given checkout.
         """
+        self.lock_storage()
+
+        if self.checkout_snapshots and paths is None:
+            return self._checkout_snapshot(commit_id)
+
         workdir = make_tempdir()
+
+        if self.clone_filter:
+            # A local clone of a partial clone would be missing the filtered
+            # objects. Instead, check out a worktree of the mirror, which
+            # will fetch only the objects needed for this commit from the
+            # promisor remote.
+            logger.info('Creating worktree for commit ID %s in %s',
+                        commit_id, workdir)
+            worktree_args = ['--detach']
+
+            if paths is not None:
+                worktree_args.append('--no-checkout')
+
+            execute(['git', '--git-dir=%s' % self.repo_path, 'worktree',
+                     'add'] + worktree_args + [workdir, commit_id])
+
+            if paths is not None:
+                self._set_sparse_checkout_paths(workdir, paths)
+                execute(['git', '-C', workdir, 'reset', '--hard'])
+
+            return workdir
+
         branchname = 'br-%s-%s' % (commit_id, uuid4())
+        clone_args = []
+
+        if paths is not None:
+            clone_args.append('--sparse')
 
         logger.info('Creating temporary branch for clone in repo %s',
                     self.repo_path)
@@ -163,24 +738,147 @@ class GitRepository(BaseRepository):
             logger.info('Creating working tree for commit ID %s in %s', commit_id,
                         workdir)
             execute(['git', 'clone', '--local', '--no-hardlinks', '--depth', '1',
-                     '--branch', branchname, self.repo_path, workdir])
+                     '--branch', branchname] + clone_args +
+                    [self.repo_path, workdir])
         finally:
             logger.info('Removing temporary branch for clone in repo %s',
                         self.repo_path)
             execute(['git', '--git-dir=%s' % self.repo_path, 'branch', '-d',
                      branchname])
 
+        if paths is not None:
+            self._set_sparse_checkout_paths(workdir, paths)
+
         return workdir
 
+    def export(self, commit_id, target_dir):
+        """Write the files of the given commit to a directory.
+
+        Version Added:
+            5.0
+
+        Args:
+            commit_id (str):
+                The ID of the commit to export.
+
+            target_dir (str):
+                The existing, empty directory to write to.
+        """
+        # Use a private index, so that the shared repository is never
+        # modified.
+        env = {
+            'GIT_INDEX_FILE': os.path.join(make_tempdir(), 'index'),
+        }
+        git_args = [
+            'git',
+            '--git-dir=%s' % self.repo_path,
+            '--work-tree=%s' % target_dir,
+        ]
+
+        execute(git_args + ['read-tree', commit_id], env=env)
+        execute(git_args + ['checkout-index', '--all'], env=env)
+
+    def get_file_paths(self, commit_id):
+        """Return the paths of all files in the given commit.
+
+        Version Added:
+            5.0
+
+        Args:
+            commit_id (str):
+                The ID of the commit to list.
+
+        Returns:
+            list of str:
+            The paths of the files, relative to the root of the repository.
+        """
+        # This only reads trees, so it works with partial clones without
+        # fetching any blobs.
+        output = execute(['git', '--git-dir=%s' % self.repo_path, 'ls-tree',
+                          '-r', '-z', '--name-only', commit_id])
+
+        return [path for path in output.split('\0') if path]
+
+    def _set_sparse_checkout_paths(self, workdir, paths):
+        """Limit a working tree to a set of directories.
+
+        Version Added:
+            5.0
+
+        Args:
+            workdir (str):
+                The working tree to update.
+
+            paths (set of str):
+                The directories to check out.
+        """
+        logger.info('Limiting working tree %s to paths: %s',
+                    workdir, ', '.join(sorted(paths)))
+        execute(['git', '-C', workdir, 'sparse-checkout', 'set', '--cone'] +
+                sorted(paths))
+
 
 class HgRepository(BaseRepository):
-    """A Mercurial repository."""
+    """A Mercurial repository.
+
+    Attributes:
+        checkout_pool_size (int):
+            The number of persistent working copies to keep for checkouts, or
+            ``None`` if each checkout is archived separately.
+
+        pool_path (str):
+            The local path where persistent working copies are stored.
+    """
 
     repo_types = ('hg', 'mercurial')
     tool_name = 'Mercurial'
+    config_keys = BaseRepository.config_keys + ('checkout_pool_size',)
+
+    def __init__(self, name, clone_path, checkout_pool_size=None, **kwargs):
+        """Initialize the repository.
+
+        Version Changed:
+            5.0:
+            Added the ``checkout_pool_size`` argument.
+
+        Args:
+            name (str):
+                The name of the repository.
+
+            clone_path (str):
+                The clone path of the repository.
+
+            checkout_pool_size (int, optional):
+                The number of persistent working copies to keep for
+                checkouts. Each is shared with the local clone using
+                :command:`hg share`, and updated to the requested commit for
+                each checkout. Ignored files, such as build output, are kept
+                between checkouts.
+
+                If ``None``, each checkout will be archived separately.
+
+            **kwargs (dict):
+                Additional keyword arguments for the parent class.
+        """
+        super(HgRepository, self).__init__(name=name,
+                                           clone_path=clone_path,
+                                           **kwargs)
+
+        if checkout_pool_size and fcntl is None:
+            logger.warning('Pooled checkouts are not supported on this '
+                           'platform. Each checkout of repository %s will '
+                           'be archived separately.',
+                           name)
+            checkout_pool_size = None
+
+        self.checkout_pool_size = checkout_pool_size
+        self.pool_path = os.path.join(appdirs.site_data_dir('reviewbot'),
+                                      'checkout-pools', name)
 
     def sync(self):
         """Sync the latest state of the repository."""
+        self.lock_storage()
+
         if not os.path.exists(self.repo_path):
             os.makedirs(self.repo_path)
 
@@ -193,26 +891,236 @@ class HgRepository(BaseRepository):
                         self.repo_path)
             execute(['hg', '-R', self.repo_path, 'pull'])
 
-    def checkout(self, commit_id):
+        self._mark_used()
+
+    @property
+    def storage_paths(self):
+        """The local paths used to store data for this repository.
+
+        Version Added:
+            5.0
+
+        Type:
+            list of str
+        """
+        return super(HgRepository, self).storage_paths + [self.pool_path]
+
+    def maintain(self):
+        """Optimize the local clone of the repository.
+
+        This will roll back any transaction left behind by an interrupted
+        pull, and warm the branch, tag, and revision caches used when
+        pulling and updating working copies.
+
+        Version Added:
+            5.0
+        """
+        hg_args = ['hg', '-R', self.repo_path]
+
+        # hg recover exits with 1 when there's no transaction to roll back.
+        execute(hg_args + ['recover'],
+                extra_ignore_errors=(1,))
+        execute(hg_args + ['debugupdatecaches'])
+
+    def verify(self):
+        """Return whether the local clone of the repository is healthy.
+
+        Version Added:
+            5.0
+
+        Returns:
+            bool:
+            ``False`` if the clone is definitely corrupt and should be cloned
+            again. ``True`` otherwise, including if it couldn't be checked.
+        """
+        # hg verify exits with 1 when it finds integrity errors, and 255 if
+        # it couldn't run at all.
+        try:
+            output = execute(['hg', '-R', self.repo_path, 'verify', '--quiet'],
+                             extra_ignore_errors=(1,),
+                             none_on_ignored_error=True)
+        except Exception as e:
+            logger.warning('Unable to verify repository %s: %s',
+                           self.name, e)
+            return True
+
+        if output is None:
+            logger.error('Repository %s failed verification', self.name)
+            return False
+
+        return True
+
+    def checkout(self, commit_id, paths=None):
         """Check out the given commit.
 
+        Version Changed:
+            5.0:
+            * Added the ``paths`` argument.
+            * The checkout may now be a pooled working copy. See
+              :py:attr:`checkout_pool_size`.
+
         Args:
             commit_id (str):
                 The ID of the commit to check out.
 
+            paths (set of str, optional):
+                A set of directories, relative to the root of the repository,
+                to limit the checkout to. Files directly within the root of
+                the repository will always be checked out. This is ignored
+                for pooled working copies.
+
+                If ``None``, the full tree will be checked out.
+
         Returns:
             str:
             The name of a directory with the given checkout.
         """
+        self.lock_storage()
+
+        if self.checkout_pool_size:
+            # Pooled working copies always contain the full tree.
+            workdir = self._checkout_pooled(commit_id)
+
+            if workdir is not None:
+                return workdir
+
+        if self.checkout_snapshots and paths is None:
+            return self._checkout_snapshot(commit_id)
+
         workdir = make_tempdir()
+        archive_args = []
+
+        if paths is not None:
+            # Match the behavior of git's cone-mode sparse checkouts, which
+            # always include files at the root of the tree.
+            archive_args += ['-I', 'rootfilesin:.']
+
+            for path in sorted(paths):
+                archive_args += ['-I', 'path:%s' % path]
 
         logger.info('Creating working tree for commit ID %s in %s', commit_id,
                     workdir)
         execute(['hg', '-R', self.repo_path, 'archive', '-r', commit_id,
-                 '-t', 'files', workdir])
+                 '-t', 'files'] + archive_args + [workdir])
 
         return workdir
 
+    def export(self, commit_id, target_dir):
+        """Write the files of the given commit to a directory.
+
+        Version Added:
+            5.0
+
+        Args:
+            commit_id (str):
+                The ID of the commit to export.
+
+            target_dir (str):
+                The existing, empty directory to write to.
+        """
+        execute(['hg', '-R', self.repo_path, 'archive', '-r', commit_id,
+                 '-t', 'files', target_dir])
+
+    def get_file_paths(self, commit_id):
+        """Return the paths of all files in the given commit.
+
+        Version Added:
+            5.0
+
+        Args:
+            commit_id (str):
+                The ID of the commit to list.
+
+        Returns:
+            list of str:
+            The paths of the files, relative to the root of the repository.
+        """
+        output = execute(['hg', '-R', self.repo_path, 'manifest', '-r',
+                          commit_id])
+
+        return output.splitlines()
+
+    def _checkout_pooled(self, commit_id):
+        """Check out the given commit in a pooled working copy.
+
+        The first working copy not in use by another task will be locked
+        until :py:func:`~reviewbot.utils.filesystem.cleanup_tempfiles` is
+        called, and updated to the commit.
+
+        Version Added:
+            5.0
+
+        Args:
+            commit_id (str):
+                The ID of the commit to check out.
+
+        Returns:
+            str:
+            The path to the working copy, or ``None`` if all working copies
+            are in use.
+        """
+        os.makedirs(self.pool_path, exist_ok=True)
+
+        for i in range(self.checkout_pool_size):
+            workdir = os.path.join(self.pool_path, str(i))
+            lock_fd = os.open('%s.lock' % workdir, os.O_RDWR | os.O_CREAT)
+
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Another task is using this working copy.
+                os.close(lock_fd)
+                continue
+
+            try:
+                self._update_pooled_working_copy(workdir, commit_id)
+            except Exception:
+                # Start over with a new working copy next time.
+                shutil.rmtree(workdir, ignore_errors=True)
+                os.close(lock_fd)
+                raise
+
+            add_cleanup_callback(partial(os.close, lock_fd))
+
+            return workdir
+
+        logger.info('All %d pooled working copies for repository %s are in '
+                    'use. Archiving commit ID %s instead.',
+                    self.checkout_pool_size, self.name, commit_id)
+
+        return None
+
+    def _update_pooled_working_copy(self, workdir, commit_id):
+        """Update a pooled working copy to the given commit.
+
+        Version Added:
+            5.0
+
+        Args:
+            workdir (str):
+                The path to the working copy.
+
+            commit_id (str):
+                The ID of the commit to check out.
+        """
+        if os.path.exists(os.path.join(workdir, '.hg')):
+            # Remove any files added by the last task, but keep ignored
+            # files, so that builds can be incremental.
+            logger.info('Cleaning pooled working copy %s', workdir)
+            execute(['hg', '-R', workdir, '--config', 'extensions.purge=',
+                     'purge'])
+        else:
+            if os.path.exists(workdir):
+                shutil.rmtree(workdir)
+
+            logger.info('Creating pooled working copy %s', workdir)
+            execute(['hg', '--config', 'extensions.share=', 'share', '-U',
+                     self.repo_path, workdir])
+
+        logger.info('Updating pooled working copy %s to commit ID %s',
+                    workdir, commit_id)
+        execute(['hg', '-R', workdir, 'update', '-C', '-r', commit_id])
+
 
 def fetch_repositories(url, user=None, token=None):
     """Fetch repositories from Review Board.
@@ -227,33 +1135,258 @@ def fetch_repositories(url, user=None, token=None):
         token (str):
             The configured API token for the user.
     """
-    logger.info('Fetching repositories from Review Board: %s', url)
+    for repository_cls in repository_backends:
+        _add_discovered_repositories(fetch_repository_configs(
+            url=url,
+            user=user,
+            token=token,
+            repository_cls=repository_cls))
+
+
+def fetch_repository_configs(url, repository_cls, user=None, token=None):
+    """Fetch configuration for repositories of a given type from Review Board.
+
+    Version Added:
+        5.0
+
+    Args:
+        url (str):
+            The configured url for the connection.
+
+        repository_cls (type):
+            The repository backend to fetch repositories for.
+
+        user (str, optional):
+            The configured user for the connection.
+
+        token (str, optional):
+            The configured API token for the user.
+
+    Returns:
+        list of dict:
+        The configuration for each usable repository. Each contains
+        ``server``, ``type``, ``name``, and ``clone_path`` keys.
+    """
+    logger.info('Fetching %s repositories from Review Board: %s',
+                repository_cls.tool_name, url)
 
     root = get_api_root(url=url,
                         username=user,
                         api_token=token)
+    repos = root.get_repositories(tool=repository_cls.tool_name,
+                                  only_links='',
+                                  only_fields='path,mirror_path,name')
+    repo_configs = []
+
+    for repo in repos.all_items:
+        clone_path = None
+
+        for path in (repo.path, repo.mirror_path):
+            if (os.path.exists(path) or path.startswith('http') or
+                path.startswith('git')):
+                clone_path = path
+                break
 
-    for repository_cls in repository_backends:
-        repos = root.get_repositories(tool=repository_cls.tool_name,
-                                      only_links='',
-                                      only_fields='path,mirror_path,name')
-
-        for repo in repos.all_items:
-            clone_path = None
-
-            for path in (repo.path, repo.mirror_path):
-                if (os.path.exists(path) or path.startswith('http') or
-                    path.startswith('git')):
-                    clone_path = path
-                    break
-
-            if clone_path:
-                repositories[repo.name] = repository_cls(
-                    name=repo.name,
-                    clone_path=clone_path)
-            else:
-                logger.warning('Cannot find usable path for repository: %s',
-                               repo.name)
+        if clone_path:
+            repo_configs.append({
+                'server': url,
+                'type': repository_cls.repo_types[0],
+                'name': repo.name,
+                'clone_path': clone_path,
+            })
+        else:
+            logger.warning('Cannot find usable path for repository: %s',
+                           repo.name)
+
+    return repo_configs
+
+
+def discover_repositories(servers, cached_repo_configs=None):
+    """Fetch configuration for repositories from Review Board servers.
+
+    Each combination of server and repository backend is fetched
+    concurrently. If any fail, the previously discovered repositories for
+    that combination will be used instead.
+
+    Version Added:
+        5.0
+
+    Args:
+        servers (list of dict):
+            The configuration for each Review Board server.
+
+        cached_repo_configs (list of dict, optional):
+            Previously discovered repository configuration, from
+            :py:func:`load_repositories_cache`.
+
+    Returns:
+        list of dict:
+        The configuration for each discovered repository, as returned by
+        :py:func:`fetch_repository_configs`.
+    """
+    if cached_repo_configs is None:
+        cached_repo_configs = []
+
+    jobs = [
+        (server, repository_cls)
+        for server in servers
+        for repository_cls in repository_backends
+    ]
+
+    if not jobs:
+        return []
+
+    repo_configs = []
+
+    with ThreadPoolExecutor(max_workers=min(len(jobs),
+                                            MAX_DISCOVERY_THREADS)) as pool:
+        futures = [
+            pool.submit(fetch_repository_configs,
+                        url=server['url'],
+                        user=server.get('user'),
+                        token=server.get('token'),
+                        repository_cls=repository_cls)
+            for server, repository_cls in jobs
+        ]
+
+        # Results are collected in order, so that later servers take
+        # precedence over earlier ones, regardless of timing.
+        for (server, repository_cls), future in zip(jobs, futures):
+            try:
+                repo_configs += future.result()
+            except Exception as e:
+                logger.error('Unexpected error fetching %s repositories for '
+                             'Review Board server configuration %r: %s',
+                             repository_cls.tool_name, server, e)
+
+                repo_configs += [
+                    _repo_config
+                    for _repo_config in cached_repo_configs
+                    if (_repo_config['server'] == server['url'] and
+                        _repo_config['type'] in repository_cls.repo_types)
+                ]
+
+    return repo_configs
+
+
+def load_repositories_cache():
+    """Load the cache of repositories discovered from Review Board servers.
+
+    Version Added:
+        5.0
+
+    Returns:
+        list of dict:
+        The configuration for each cached repository, or ``None`` if there's
+        no usable cache.
+    """
+    cache_path = config['repositories_cache_path']
+
+    if not cache_path or not os.path.exists(cache_path):
+        return None
+
+    try:
+        with open(cache_path, 'r') as fp:
+            repo_configs = json.load(fp)
+
+        assert isinstance(repo_configs, list)
+    except Exception as e:
+        logger.warning('Unable to read the repositories cache "%s": %s',
+                       cache_path, e)
+        return None
+
+    return repo_configs
+
+
+def save_repositories_cache(repo_configs):
+    """Save the cache of repositories discovered from Review Board servers.
+
+    Version Added:
+        5.0
+
+    Args:
+        repo_configs (list of dict):
+            The configuration for each discovered repository.
+    """
+    cache_path = config['repositories_cache_path']
+
+    if not cache_path:
+        return
+
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+        # Write the new cache atomically, since other worker processes may
+        # be reading it.
+        tmp_path = '%s.%s' % (cache_path, uuid4())
+
+        with open(tmp_path, 'w') as fp:
+            json.dump(repo_configs, fp)
+
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        logger.warning('Unable to write the repositories cache "%s": %s',
+                       cache_path, e)
+
+
+def refresh_repositories(on_repositories_added=None):
+    """Refresh the list of repositories discovered from Review Board servers.
+
+    This will fetch repositories from all configured servers, and add any
+    new repositories to the active list and the cache. Manually configured
+    repositories still take precedence.
+
+    This is intended to be called in the background, after
+    :py:func:`init_repositories` loads repositories from the cache.
+
+    Version Added:
+        5.0
+
+    Args:
+        on_repositories_added (callable, optional):
+            A function to call with a list of names of any newly-added
+            repositories.
+    """
+    servers = _get_server_configs()
+
+    if not servers:
+        return
+
+    repo_configs = discover_repositories(
+        servers,
+        cached_repo_configs=load_repositories_cache() or [])
+    save_repositories_cache(repo_configs)
+
+    added = _add_discovered_repositories(repo_configs)
+
+    if added:
+        logger.info('Found new repositories: %s', ', '.join(added))
+
+        if on_repositories_added is not None:
+            on_repositories_added(added)
+
+
+def get_repository(name):
+    """Return the repository with the given name.
+
+    If the repository isn't known to this process, the repositories cache
+    will be checked, in case it was discovered after the process started.
+
+    Version Added:
+        5.0
+
+    Args:
+        name (str):
+            The name of the repository.
+
+    Returns:
+        BaseRepository:
+        The repository, or ``None`` if it's not configured.
+    """
+    if name not in repositories:
+        _add_discovered_repositories(load_repositories_cache() or [])
+
+    return repositories.get(name)
 
 
 def init_repositories():
@@ -263,6 +1396,17 @@ def init_repositories():
     repositories specified in the configuration. As part of this, it will
     validate the configuration and skip any entries that are misconfigured
     or result in any unexpected errors.
+
+    Version Changed:
+        5.0:
+        Repositories from Review Board servers are now fetched concurrently
+        and cached. If a cache exists, it will be used instead of contacting
+        the servers, and this will return ``True``.
+
+    Returns:
+        bool:
+        ``True`` if repositories were loaded from the cache, and should be
+        refreshed by calling :py:func:`refresh_repositories`.
     """
     global repository_backends
 
@@ -271,25 +1415,24 @@ def init_repositories():
         HgRepository,
     ]
 
-    for server in config['reviewboard_servers']:
-        if 'url' not in server:
-            logger.error('The following server configuration is missing the '
-                         '"url" key: %r',
-                         server)
-            continue
+    _configured_repository_names.clear()
 
-        server_kwargs = {
-            'url': server['url'],
-            'user': server.get('user'),
-            'token': server.get('token'),
-        }
+    servers = _get_server_configs()
+    needs_refresh = False
 
-        try:
-            fetch_repositories(**server_kwargs)
-        except Exception as e:
-            logger.error('Unexpected error fetching repositories for '
-                         'Review Board server configuration %r: %s',
-                         server, e)
+    if servers:
+        repo_configs = load_repositories_cache()
+
+        if repo_configs is None:
+            repo_configs = discover_repositories(servers)
+            save_repositories_cache(repo_configs)
+        else:
+            logger.info('Loaded %d repositories from the cache. They will '
+                        'be refreshed once the worker has started.',
+                        len(repo_configs))
+            needs_refresh = True
+
+        _add_discovered_repositories(repo_configs)
 
     for repository in config['repositories']:
         missing_keys = ({'name', 'type', 'clone_path'} -
@@ -315,8 +1458,13 @@ def init_repositories():
 
         for repository_cls in repository_backends:
             if repo_type in repository_cls.repo_types:
+                for key in repository_cls.config_keys:
+                    if key in repository:
+                        repo_kwargs[key] = repository[key]
+
                 try:
                     repositories[repo_name] = repository_cls(**repo_kwargs)
+                    _configured_repository_names.add(repo_name)
                 except Exception as e:
                     logger.error('Unexpected error initializing repository '
                                  'for configuration %r: %s',
@@ -327,6 +1475,246 @@ def init_repositories():
             logger.error('Unknown type "%s" for configured repository %s',
                          repo_type, repo_name)
 
+    return needs_refresh
+
+
+def _get_server_configs():
+    """Return the valid Review Board server configurations.
+
+    Version Added:
+        5.0
+
+    Returns:
+        list of dict:
+        The configuration for each server with a URL.
+    """
+    servers = []
+
+    for server in config['reviewboard_servers']:
+        if 'url' in server:
+            servers.append(server)
+        else:
+            logger.error('The following server configuration is missing the '
+                         '"url" key: %r',
+                         server)
+
+    return servers
+
+
+def _add_discovered_repositories(repo_configs):
+    """Add repositories discovered from Review Board servers.
+
+    Manually configured repositories will not be replaced.
+
+    Version Added:
+        5.0
+
+    Args:
+        repo_configs (list of dict):
+            The configuration for each discovered repository.
+
+    Returns:
+        list of str:
+        The names of any newly-added repositories.
+    """
+    added = []
+
+    for repo_config in repo_configs:
+        name = repo_config['name']
+
+        if name in _configured_repository_names:
+            continue
+
+        for repository_cls in repository_backends:
+            if repo_config['type'] in repository_cls.repo_types:
+                repository = repository_cls(
+                    name=name,
+                    clone_path=repo_config['clone_path'])
+
+                if name not in repositories:
+                    added.append(name)
+
+                if repositories.get(name) != repository:
+                    repositories[name] = repository
+
+                break
+
+    return added
+
+
+def maintain_repositories(force=False):
+    """Perform maintenance on the local storage of configured repositories.
+
+    When due, based on the ``repository_maintenance_interval`` setting, this
+    will:
+
+    1. Verify each cloned repository, marking any that are corrupt to be
+       cloned again when next used.
+    2. Optimize each cloned repository (see
+       :py:meth:`BaseRepository.maintain`).
+    3. Enforce the ``repository_storage_quota`` setting, removing the least
+       recently used snapshots and repositories until storage fits within
+       the quota.
+
+    Only one worker process will perform maintenance at a time. Repositories
+    in use by tasks are skipped, and won't be removed to enforce the quota.
+    This never raises exceptions.
+
+    Version Added:
+        5.0
+
+    Args:
+        force (bool, optional):
+            Whether to perform maintenance even if it isn't due.
+    """
+    interval = config['repository_maintenance_interval']
+
+    if not repositories or (interval is None and not force):
+        return
+
+    data_dir = appdirs.site_data_dir('reviewbot')
+    stamp_path = os.path.join(data_dir, 'last-maintenance')
+
+    try:
+        if (not force and
+            time.time() - os.stat(stamp_path).st_mtime < interval):
+            return
+    except OSError:
+        # Maintenance has never been performed.
+        pass
+
+    lock_fd = None
+
+    try:
+        os.makedirs(data_dir, exist_ok=True)
+
+        if fcntl is not None:
+            lock_fd = os.open(os.path.join(data_dir, 'maintenance.lock'),
+                              os.O_RDWR | os.O_CREAT)
+
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Another worker process is already performing maintenance.
+                return
+
+        with open(stamp_path, 'w'):
+            pass
+
+        logger.info('Performing repository maintenance')
+
+        for repository in list(repositories.values()):
+            if not os.path.exists(repository.repo_path):
+                continue
+
+            try:
+                with repository.lock_storage_exclusive() as locked:
+                    if not locked:
+                        logger.info('Repository %s is in use. Skipping '
+                                    'maintenance.',
+                                    repository.name)
+                    elif repository.verify():
+                        repository.maintain()
+                    else:
+                        repository.mark_for_reclone()
+            except Exception as e:
+                logger.exception('Unexpected error performing maintenance '
+                                 'on repository %s: %s',
+                                 repository.name, e)
+
+        quota = config['repository_storage_quota']
+
+        if quota is not None:
+            _enforce_storage_quota(quota)
+    except Exception as e:
+        logger.exception('Unexpected error performing repository '
+                         'maintenance: %s',
+                         e)
+    finally:
+        if lock_fd is not None:
+            os.close(lock_fd)
+
+
+def _enforce_storage_quota(quota):
+    """Remove least recently used storage until it fits within a quota.
+
+    Individual snapshots are removed along with entire repositories, based
+    on when each was last used. Anything used within the
+    :py:data:`EVICTION_GRACE_PERIOD`, or belonging to a repository in use by
+    a task, is kept.
+
+    Version Added:
+        5.0
+
+    Args:
+        quota (int):
+            The maximum number of bytes to use for all repositories.
+    """
+    # Each entry is a tuple of (last_used, repository, snapshot_path), where
+    # snapshot_path is None for the repository as a whole.
+    entries = []
+    repository_sizes = {}
+
+    for repository in repositories.values():
+        last_used = repository.get_last_used()
+
+        if last_used is None:
+            continue
+
+        repository_sizes[repository.name] = sum(
+            get_disk_usage(_path)
+            for _path in repository.storage_paths
+        )
+        entries.append((last_used, repository, None))
+
+        if os.path.isdir(repository.snapshots_path):
+            for name in os.listdir(repository.snapshots_path):
+                if not name.startswith('.'):
+                    path = os.path.join(repository.snapshots_path, name)
+                    entries.append((os.stat(path).st_mtime, repository,
+                                    path))
+
+    total = sum(repository_sizes.values())
+
+    if total <= quota:
+        return
+
+    logger.info('Repository storage is using %d bytes, exceeding the quota '
+                'of %d bytes. Removing least recently used storage.',
+                total, quota)
+
+    cutoff = time.time() - EVICTION_GRACE_PERIOD
+
+    for last_used, repository, snapshot_path in sorted(entries,
+                                                       key=lambda e: e[0]):
+        if total <= quota or last_used >= cutoff:
+            break
+
+        if repository.name not in repository_sizes:
+            # The repository has already been removed.
+            continue
+
+        with repository.lock_storage_exclusive() as locked:
+            if not locked:
+                continue
+
+            if snapshot_path is None:
+                repository.remove_storage()
+                total -= repository_sizes.pop(repository.name)
+            else:
+                size = get_disk_usage(snapshot_path)
+
+                logger.info('Removing snapshot %s', snapshot_path)
+                shutil.rmtree(snapshot_path, ignore_errors=True)
+                repository_sizes[repository.name] -= size
+                total -= size
+
+    if total > quota:
+        logger.warning('Repository storage is using %d bytes, exceeding the '
+                       'quota of %d bytes. The remaining storage is in '
+                       'active use.',
+                       total, quota)
+
 
 def reset_repositories():
     """Reset the repository state.
@@ -337,3 +1725,4 @@ def reset_repositories():
         3.0
     """
     repositories.clear()
+    _configured_repository_names.clear()
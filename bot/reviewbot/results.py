@@ -0,0 +1,214 @@
+"""Exchange of results between tasks.
+
+Review Bot doesn't use a Celery result backend. When a task needs results
+from other tasks, such as when a large diff is split across workers, the
+results are sent back through a temporary queue on the broker. All results
+queues are bound to a single shared exchange, using the queue's name as the
+routing key, so no exchanges are left behind on the broker.
+
+Version Added:
+    5.0
+"""
+
+from __future__ import annotations
+
+from uuid import uuid4
+
+from kombu import Exchange, Queue
+
+from reviewbot.utils.log import get_logger
+
+
+logger = get_logger(__name__)
+
+
+#: The exchange that all results are sent through.
+#:
+#: Version Added:
+#:     5.0
+RESULTS_EXCHANGE = Exchange('reviewbot.results', type='direct')
+
+
+def _get_results_queue(name, expires=None):
+    """Return the queue definition for results.
+
+    Args:
+        name (str):
+            The name of the queue. This is also its routing key on
+            :py:data:`RESULTS_EXCHANGE`.
+
+        expires (float, optional):
+            The number of seconds after which the unused queue will be
+            removed by the broker.
+
+    Returns:
+        kombu.Queue:
+        The queue.
+    """
+    return Queue(name,
+                 RESULTS_EXCHANGE,
+                 routing_key=name,
+                 expires=expires)
+
+
+def create_results_queue(app, expires):
+    """Create a new queue to receive results on.
+
+    Args:
+        app (celery.Celery):
+            The Celery application.
+
+        expires (float):
+            The number of seconds after which the unused queue will be
+            removed by the broker. This ensures the queue doesn't outlive a
+            worker that stops while waiting for results.
+
+    Returns:
+        str:
+        The name of the new queue.
+    """
+    name = 'reviewbot.results.%s' % uuid4().hex
+
+    with app.connection_for_write() as conn:
+        _get_results_queue(name, expires)(conn.default_channel).declare()
+
+    return name
+
+
+def results_queue_exists(app, name):
+    """Return whether a results queue still exists.
+
+    The queue is deleted once the task waiting for results has finished or
+    given up, after which any results sent to it are discarded.
+
+    Args:
+        app (celery.Celery):
+            The Celery application.
+
+        name (str):
+            The name of the results queue.
+
+    Returns:
+        bool:
+        ``True`` if the queue exists.
+    """
+    with app.connection_for_write() as conn:
+        return _results_queue_exists(name, conn)
+
+
+def send_result(app, name, result):
+    """Send a result to a results queue.
+
+    If the queue no longer exists, the result is dropped and logged.
+
+    Args:
+        app (celery.Celery):
+            The Celery application.
+
+        name (str):
+            The name of the results queue.
+
+        result (dict):
+            The result to send. This must be serializable to JSON.
+
+    Returns:
+        bool:
+        ``True`` if the result was sent. ``False`` if the queue no longer
+        exists.
+    """
+    with app.connection_for_write() as conn:
+        if not _results_queue_exists(name, conn):
+            logger.warning('Results queue %s no longer exists. Dropping '
+                           'result: %r',
+                           name, result)
+            return False
+
+        conn.Producer().publish(result,
+                                exchange=RESULTS_EXCHANGE,
+                                routing_key=name,
+                                serializer='json')
+
+    return True
+
+
+def fetch_results(app, name, channel=None):
+    """Return all results waiting in a results queue.
+
+    Args:
+        app (celery.Celery):
+            The Celery application.
+
+        name (str):
+            The name of the results queue.
+
+        channel (kombu.transport.virtual.Channel, optional):
+            An open channel to read the results from. If not provided, a
+            connection will be opened for this call. Callers checking for
+            results repeatedly should pass a channel, to avoid opening a
+            new connection each time.
+
+    Returns:
+        list of dict:
+        The results.
+    """
+    if channel is None:
+        with app.connection_for_read() as conn:
+            return fetch_results(app, name, channel=conn.default_channel)
+
+    results = []
+    queue = _get_results_queue(name)(channel)
+
+    while True:
+        message = queue.get(no_ack=True)
+
+        if message is None:
+            break
+
+        try:
+            results.append(message.decode())
+        except Exception as e:
+            logger.error('Unable to decode a result from queue %s: %s',
+                         name, e)
+
+    return results
+
+
+def delete_results_queue(app, name):
+    """Delete a results queue.
+
+    Args:
+        app (celery.Celery):
+            The Celery application.
+
+        name (str):
+            The name of the results queue.
+    """
+    try:
+        with app.connection_for_write() as conn:
+            _get_results_queue(name)(conn.default_channel).delete()
+    except Exception as e:
+        logger.warning('Unable to delete results queue %s: %s', name, e)
+
+
+def _results_queue_exists(name, conn):
+    """Return whether a results queue exists, using an open connection.
+
+    Args:
+        name (str):
+            The name of the results queue.
+
+        conn (kombu.Connection):
+            The connection to check with. On AMQP brokers, the default
+            channel is closed if the queue doesn't exist, so the connection
+            shouldn't be used further in that case.
+
+    Returns:
+        bool:
+        ``True`` if the queue exists.
+    """
+    try:
+        conn.default_channel.queue_declare(queue=name, passive=True)
+    except conn.channel_errors:
+        return False
+
+    return True
@@ -0,0 +1,142 @@
+"""Repository sharding across workers.
+
+When ``repository_shard_replicas`` is configured, each repository is assigned
+to a limited number of the workers that have it configured, using rendezvous
+(highest random weight) hashing. Only those workers consume the queues for
+that repository, so clones and build output stay warm on a few hosts rather
+than being duplicated on every worker.
+
+Workers that join or leave only change the assignment of the repositories
+they own or would own. Every other repository stays where it is.
+
+Version Added:
+    5.0
+"""
+
+from __future__ import annotations
+
+import hashlib
+
+from reviewbot.config import config
+from reviewbot.utils.log import get_logger
+
+
+logger = get_logger(__name__)
+
+
+def is_sharding_enabled():
+    """Return whether repository sharding is enabled.
+
+    Returns:
+        bool:
+        ``True`` if repositories are sharded across workers.
+    """
+    return bool(config['repository_shard_replicas'])
+
+
+def get_shard_owners(repository_name, hostnames, replicas):
+    """Return the workers responsible for a repository.
+
+    Args:
+        repository_name (str):
+            The name of the repository.
+
+        hostnames (list of str):
+            The hostnames of all workers that have the repository configured.
+
+        replicas (int):
+            The number of workers that should be responsible for the
+            repository.
+
+    Returns:
+        list of str:
+        The hostnames of the responsible workers.
+    """
+    def _get_weight(hostname):
+        key = ('%s\0%s' % (repository_name, hostname)).encode('utf-8')
+
+        return hashlib.sha256(key).digest()
+
+    return sorted(hostnames, key=_get_weight, reverse=True)[:replicas]
+
+
+def get_owned_repositories(hostname, worker_repositories):
+    """Return the repositories a worker is responsible for.
+
+    Args:
+        hostname (str):
+            The hostname of the worker.
+
+        worker_repositories (dict):
+            A mapping of each live worker's hostname to the set of
+            repository names configured on that worker. This must include
+            ``hostname``.
+
+    Returns:
+        set of str:
+        The names of the repositories that the worker should consume queues
+        for.
+    """
+    replicas = config['repository_shard_replicas']
+    repository_hosts = {}
+
+    for worker_hostname, repository_names in worker_repositories.items():
+        for repository_name in repository_names:
+            repository_hosts.setdefault(repository_name, []).append(
+                worker_hostname)
+
+    return {
+        repository_name
+        for repository_name in worker_repositories[hostname]
+        if hostname in get_shard_owners(repository_name,
+                                        repository_hosts[repository_name],
+                                        replicas)
+    }
+
+
+def fetch_worker_repositories(app, hostname, repository_names, timeout=1.0):
+    """Return the repositories configured on each live worker.
+
+    This asks all workers connected to the broker for their list of
+    repositories.
+
+    Args:
+        app (celery.Celery):
+            The Celery application.
+
+        hostname (str):
+            The hostname of this worker.
+
+        repository_names (set of str):
+            The names of the repositories configured on this worker. This is
+            used in place of a reply from this worker, which may not be
+            consuming broadcasts yet.
+
+        timeout (float, optional):
+            The number of seconds to wait for replies.
+
+    Returns:
+        dict:
+        A mapping of worker hostnames to sets of repository names.
+    """
+    worker_repositories = {}
+
+    try:
+        replies = app.control.broadcast('get_worker_repositories',
+                                        reply=True,
+                                        timeout=timeout)
+    except Exception as e:
+        logger.error('Unable to fetch repositories from other workers. '
+                     'Repositories will not be sharded: %s',
+                     e)
+        replies = []
+
+    for reply in replies:
+        for worker_hostname, result in reply.items():
+            if isinstance(result, dict) and 'repositories' in result:
+                worker_repositories[worker_hostname] = \
+                    set(result['repositories'])
+
+    worker_repositories[hostname] = set(repository_names)
+
+    return worker_repositories
@@ -3,12 +3,26 @@
 from __future__ import annotations
 
 import json
+import time
+from contextlib import nullcontext
 
 from celery.worker.control import Panel
 
-from reviewbot.celery import get_celery
+from reviewbot.autoscale import record_task_duration
+from reviewbot.batching import get_batch_size, take_queued_tasks
+from reviewbot.celery import (acquire_task_slot,
+                              get_celery,
+                              get_task_retry_delay,
+                              release_task_slot)
+from reviewbot.config import config
 from reviewbot.processing.review import Review
-from reviewbot.repositories import repositories
+from reviewbot.repositories import get_repository, repositories
+from reviewbot.results import (create_results_queue,
+                               delete_results_queue,
+                               fetch_results,
+                               results_queue_exists,
+                               send_result)
+from reviewbot.tools.base.mixins import FullRepositoryToolMixin
 from reviewbot.tools.base.registry import get_tool_class, get_tool_classes
 from reviewbot.utils.api import get_api_root
 from reviewbot.utils.filesystem import cleanup_tempfiles
@@ -22,11 +36,33 @@ DONE_FAILURE = 'done-failure'
 ERROR = 'error'
 
 
+#: The number of seconds to wait for other tasks to review part of a diff.
+#:
+#: Version Added:
+#:     5.0
+SHARD_TIMEOUT = 10 * 60
+
+#: The initial number of seconds between checks on other tasks' progress.
+#:
+#: This doubles each time there's no progress, up to
+#: :py:data:`SHARD_MAX_POLL_INTERVAL`.
+#:
+#: Version Added:
+#:     5.0
+SHARD_POLL_INTERVAL = 0.5
+
+#: The maximum number of seconds between checks on other tasks' progress.
+#:
+#: Version Added:
+#:     5.0
+SHARD_MAX_POLL_INTERVAL = 5
+
+
 celery = get_celery()
 logger = get_logger(__name__)
 
 
-@celery.task(ignore_result=True)
+@celery.task(ignore_result=True, max_retries=None)
 def RunTool(server_url='',
             session='',
             username='',
@@ -40,6 +76,13 @@ def RunTool(server_url='',
             *args, **kwargs):
     """Execute an automated review on a review request.
 
+    Version Changed:
+        5.0:
+        If ``run_tool_batch_size`` is configured, other pending tasks in the
+        same queue will be run as part of this task. Tasks for large changes,
+        or for tools limited by ``tool_concurrency``, are deferred when all
+        slots available for them are in use.
+
     Args:
         server_url (str):
             The URL of the Review Board server.
@@ -85,15 +128,154 @@ def RunTool(server_url='',
         bool:
         Whether the task completed successfully.
     """
+    routing_key = RunTool.request.delivery_info['routing_key']
+
+    if not acquire_task_slot(routing_key):
+        _defer_task(RunTool, routing_key)
+        return False
+
+    started = time.monotonic()
+
+    try:
+        batch_size = get_batch_size()
+
+        if batch_size > 1:
+            batch = take_queued_tasks(
+                app=celery,
+                queue_name=routing_key,
+                task_name=RunTool.name,
+                max_count=batch_size - 1,
+                window=config['run_tool_batch_window'])
+        else:
+            batch = nullcontext([])
+
+        with batch as batched_tasks:
+            if batched_tasks:
+                logger.debug('Running %d additional queued tasks from %s in '
+                             'a batch',
+                             len(batched_tasks), routing_key)
+
+            # These are shared by all tasks in a batch.
+            api_roots = {}
+            tool_instances = {}
+
+            result = _run_tool(routing_key=routing_key,
+                               server_url=server_url,
+                               session=session,
+                               username=username,
+                               review_request_id=review_request_id,
+                               diff_revision=diff_revision,
+                               status_update_id=status_update_id,
+                               review_settings=review_settings,
+                               tool_options=tool_options,
+                               repository_name=repository_name,
+                               base_commit_id=base_commit_id,
+                               api_roots=api_roots,
+                               tool_instances=tool_instances)
+
+            for queued_task in batched_tasks:
+                cleanup_tempfiles()
+
+                # A failure in one task must not prevent the rest from
+                # running. Failed tasks aren't returned to the queue, just
+                # as Celery wouldn't retry them.
+                try:
+                    _run_tool(routing_key=routing_key,
+                              api_roots=api_roots,
+                              tool_instances=tool_instances,
+                              **queued_task.kwargs)
+                except Exception as e:
+                    logger.exception('Error running queued task from %s: %s',
+                                     routing_key, e)
+
+                queued_task.ack()
+
+        return result
+    finally:
+        record_task_duration(routing_key, time.monotonic() - started)
+        release_task_slot(routing_key)
+        cleanup_tempfiles()
+
+
+@celery.task(ignore_result=True, max_retries=None)
+def RunTools(server_url='',
+             session='',
+             username='',
+             review_request_id=-1,
+             diff_revision=-1,
+             tools=[],
+             repository_name='',
+             base_commit_id='',
+             *args, **kwargs):
+    """Execute several configurations of a tool on a review request.
+
+    This is used when more than one integration configuration for the same
+    tool matches a review request. The diff is fetched once and, for tools
+    requiring full repository access, a single patched working directory is
+    prepared and shared. Each configuration is then run in turn, with its
+    own review and status update.
+
+    Version Added:
+        5.0
+
+    Args:
+        server_url (str):
+            The URL of the Review Board server.
+
+        session (str):
+            The encoded session identifier.
+
+        username (str):
+            The name of the user who owns the ``session``.
+
+        review_request_id (int):
+            The ID of the review request being reviewed (ID for use in the
+            API, which is the "display_id" field).
+
+        diff_revision (int):
+            The ID of the diff revision being reviewed.
+
+        tools (list of dict):
+            The configurations to run. Each is a dictionary containing
+            ``status_update_id``, ``review_settings``, and ``tool_options``
+            keys, as passed to :py:func:`RunTool`.
+
+        repository_name (str):
+            The name of the repository to clone to run the tool, if the tool
+            requires full working directory access.
+
+        base_commit_id (str):
+            The ID of the commit that the patch should be applied to.
+
+        *args (tuple):
+            Any additional positional arguments (perhaps used by a newer
+            version of the Review Bot extension).
+
+        **kwargs (dict):
+            Any additional keyword arguments (perhaps used by a newer version
+            of the Review Bot extension).
+
+    Returns:
+        bool:
+        Whether all configurations completed successfully.
+    """
+    routing_key = RunTools.request.delivery_info['routing_key']
+
+    if not acquire_task_slot(routing_key):
+        _defer_task(RunTools, routing_key)
+        return False
+
+    started = time.monotonic()
+
     try:
-        routing_key = RunTool.request.delivery_info['routing_key']
         route_parts = routing_key.partition('.')
         tool_name = route_parts[0]
 
         log_detail = ('(server=%s, review_request_id=%s, diff_revision=%s)'
                       % (server_url, review_request_id, diff_revision))
 
-        logger.debug('Running tool "%s" %s', tool_name, log_detail)
+        logger.debug('Running %d configurations of tool "%s" %s',
+                     len(tools), tool_name, log_detail)
 
         try:
             logger.debug('Initializing RB API %s', log_detail)
@@ -111,31 +293,51 @@ def RunTool(server_url='',
             logger.error('Tool "%s" not found %s', tool_name, log_detail)
             return False
 
-        repository = None
+        runs = []
 
-        try:
-            logger.debug('Creating status update %s', log_detail)
-            status_update = api_root.get_status_update(
-                review_request_id=review_request_id,
-                status_update_id=status_update_id)
-        except Exception as e:
-            logger.exception('Unable to create status update: %s %s',
-                             e, log_detail)
+        for tool_info in tools:
+            try:
+                logger.debug('Creating status update %s', log_detail)
+                status_update = api_root.get_status_update(
+                    review_request_id=review_request_id,
+                    status_update_id=tool_info['status_update_id'])
+            except Exception as e:
+                logger.exception('Unable to create status update: %s %s',
+                                 e, log_detail)
+                continue
+
+            if _is_superseded(api_root=api_root,
+                              review_request_id=review_request_id,
+                              status_update_id=tool_info['status_update_id'],
+                              status_update=status_update,
+                              log_detail=log_detail,
+                              refresh=False):
+                continue
+
+            runs.append((tool_info, status_update))
+
+        if not runs:
             return False
 
+        success = len(runs) == len(tools)
+        repository = None
+
         if tool_cls.working_directory_required:
             if not base_commit_id:
                 logger.error('Working directory is required but the diffset '
                              'has no base_commit_id %s', log_detail)
-                status_update.update(
-                    state=ERROR,
-                    description='Diff does not include parent commit '
-                                'information.')
+
+                for tool_info, status_update in runs:
+                    status_update.update(
+                        state=ERROR,
+                        description='Diff does not include parent commit '
+                                    'information.')
+
                 return False
 
-            try:
-                repository = repositories[repository_name]
-            except KeyError:
+            repository = get_repository(repository_name)
+
+            if repository is None:
                 logger.error('Unable to find configured repository "%s" %s',
                              repository_name, log_detail)
                 return False
@@ -145,68 +347,232 @@ def RunTool(server_url='',
             review = Review(api_root=api_root,
                             review_request_id=review_request_id,
                             diff_revision=diff_revision,
-                            settings=review_settings)
-            status_update.update(description='running...')
+                            settings=runs[0][0]['review_settings'])
         except Exception as e:
-            logger.exception('Failed to initialize review: %s %s', e, log_detail)
-            status_update.update(state=ERROR, description='internal error.')
+            logger.exception('Failed to initialize review: %s %s',
+                             e, log_detail)
+
+            for tool_info, status_update in runs:
+                status_update.update(state=ERROR,
+                                     description='internal error.')
+
             return False
 
-        try:
-            logger.debug('Initializing tool "%s %s" %s',
-                         tool_cls.name, tool_cls.version, log_detail)
-            tool = tool_cls(settings=tool_options,
-                            in_task=True)
-        except Exception as e:
-            logger.exception('Error initializing tool "%s": %s %s',
-                             tool_cls.name, e, log_detail)
-            status_update.update(state=ERROR, description='internal error.')
+        tool_runs = []
+
+        for tool_info, status_update in runs:
+            try:
+                logger.debug('Initializing tool "%s %s" %s',
+                             tool_cls.name, tool_cls.version, log_detail)
+                tool = tool_cls(settings=tool_info['tool_options'],
+                                in_task=True)
+            except Exception as e:
+                logger.exception('Error initializing tool "%s": %s %s',
+                                 tool_cls.name, e, log_detail)
+                status_update.update(state=ERROR,
+                                     description='internal error.')
+                success = False
+                continue
+
+            tool_runs.append((tool, tool_info, status_update))
+
+        # Fetching the diff may have taken a while. Make sure there's still
+        # something to do before preparing files.
+        tool_runs = [
+            (tool, tool_info, status_update)
+            for tool, tool_info, status_update in tool_runs
+            if not _is_superseded(
+                api_root=api_root,
+                review_request_id=review_request_id,
+                status_update_id=tool_info['status_update_id'],
+                status_update=status_update,
+                log_detail=log_detail)
+        ]
+
+        if not tool_runs:
             return False
 
+        execute_kwargs = {}
+
         try:
-            # TODO: In Review Bot 4.0, remove the settings argument.
-            logger.debug('Executing tool "%s" %s', tool.name, log_detail)
-            tool.execute(review,
-                         settings=tool_options,
-                         repository=repository,
-                         base_commit_id=base_commit_id)
-            logger.debug('Tool "%s" completed successfully %s',
-                         tool.name, log_detail)
-        except Exception as e:
-            logger.exception('Error executing tool "%s": %s %s',
-                             tool.name, e, log_detail)
-            status_update.update(state=ERROR, description='internal error.')
-            return False
+            if isinstance(tool_runs[0][0], FullRepositoryToolMixin):
+                # Check out a tree that satisfies every configuration, and
+                # patch it once.
+                repository.sync()
+                checkout_paths = set()
 
-        if tool.output:
-            file_attachments = \
-                api_root.get_user_file_attachments(username=username)
-            attachment = \
-                file_attachments.upload_attachment(filename='tool-output',
-                                                   content=tool.output)
+                for tool, tool_info, status_update in tool_runs:
+                    tool_paths = tool.get_checkout_paths(
+                        review=review,
+                        repository=repository,
+                        base_commit_id=base_commit_id)
 
-            status_update.update(url=attachment.absolute_url,
-                                 url_text='Tool console output')
+                    if tool_paths is None:
+                        checkout_paths = None
+                        break
 
-        try:
-            if not review.has_comments:
-                status_update.update(state=DONE_SUCCESS,
-                                     description='passed.')
-            else:
-                logger.debug('Publishing review %s', log_detail)
-                review_id = review.publish().id
-
-                status_update.update(state=DONE_FAILURE,
-                                     description='failed.',
-                                     review_id=review_id)
+                    checkout_paths.update(tool_paths)
+
+                execute_kwargs['working_dir'] = \
+                    tool_runs[0][0].prepare_working_dir(
+                        review=review,
+                        repository=repository,
+                        base_commit_id=base_commit_id,
+                        checkout_paths=checkout_paths)
+            elif repository is None:
+                # Fetch each patched file that will be reviewed just once.
+                for f in review.files:
+                    if any(tool.get_can_handle_file(review_file=f)
+                           for tool, tool_info, status_update in tool_runs):
+                        f.patched_file_path = f.get_patched_file_path()
         except Exception as e:
-            logger.exception('Error when publishing review: %s %s', e, log_detail)
-            status_update.update(state=ERROR, description='internal error.')
+            logger.exception('Failed to prepare files for review: %s %s',
+                             e, log_detail)
+
+            for tool, tool_info, status_update in tool_runs:
+                status_update.update(state=ERROR,
+                                     description='internal error.')
+
             return False
 
-        logger.debug('Review completed successfully %s', log_detail)
-        return True
+        for tool, tool_info, status_update in tool_runs:
+            if _is_superseded(api_root=api_root,
+                              review_request_id=review_request_id,
+                              status_update_id=tool_info['status_update_id'],
+                              status_update=status_update,
+                              log_detail=log_detail):
+                success = False
+                continue
+
+            tool_review = review.copy(settings=tool_info['review_settings'])
+            tool_options = tool_info['tool_options']
+            status_update.update(description='running...')
+
+            try:
+                # TODO: In Review Bot 4.0, remove the settings argument.
+                logger.debug('Executing tool "%s" %s', tool.name, log_detail)
+                tool.execute(tool_review,
+                             settings=tool_options,
+                             repository=repository,
+                             base_commit_id=base_commit_id,
+                             **execute_kwargs)
+                logger.debug('Tool "%s" completed successfully %s',
+                             tool.name, log_detail)
+            except Exception as e:
+                logger.exception('Error executing tool "%s": %s %s',
+                                 tool.name, e, log_detail)
+                status_update.update(state=ERROR,
+                                     description='internal error.')
+                success = False
+                continue
+
+            if _is_superseded(api_root=api_root,
+                              review_request_id=review_request_id,
+                              status_update_id=tool_info['status_update_id'],
+                              status_update=status_update,
+                              log_detail=log_detail):
+                success = False
+                continue
+
+            if not _publish_results(api_root=api_root,
+                                    username=username,
+                                    tool=tool,
+                                    review=tool_review,
+                                    status_update=status_update,
+                                    log_detail=log_detail):
+                success = False
+
+        logger.debug('Reviews completed %s', log_detail)
+        return success
     finally:
+        record_task_duration(routing_key, time.monotonic() - started)
+        release_task_slot(routing_key)
+        cleanup_tempfiles()
+
+
+@celery.task(ignore_result=True, max_retries=None)
+def RunToolShard(server_url='',
+                 session='',
+                 review_request_id=-1,
+                 diff_revision=-1,
+                 status_update_id=-1,
+                 review_settings={},
+                 tool_options={},
+                 filediff_ids=[],
+                 shard_index=0,
+                 results_queue='',
+                 *args, **kwargs):
+    """Review a subset of the files in a diff.
+
+    This is used by :py:func:`RunTool` to split a large diff across several
+    tasks. The comments and output from the tool are sent back to the
+    original task, which publishes a combined review.
+
+    Version Added:
+        5.0
+
+    Args:
+        server_url (str):
+            The URL of the Review Board server.
+
+        session (str):
+            The encoded session identifier.
+
+        review_request_id (int):
+            The ID of the review request being reviewed (ID for use in the
+            API, which is the "display_id" field).
+
+        diff_revision (int):
+            The ID of the diff revision being reviewed.
+
+        status_update_id (int):
+            The ID of the status update for the tool run.
+
+        review_settings (dict):
+            Settings for how the review should be created.
+
+        tool_options (dict):
+            The tool-specific settings.
+
+        filediff_ids (list of int):
+            The IDs of the FileDiffs to review.
+
+        shard_index (int):
+            The index of this subset of files.
+
+        results_queue (str):
+            The name of the queue to send the results to.
+
+        *args (tuple):
+            Any additional positional arguments.
+
+        **kwargs (dict):
+            Any additional keyword arguments.
+
+    Returns:
+        bool:
+        Whether the files were reviewed successfully.
+    """
+    routing_key = RunToolShard.request.delivery_info['routing_key']
+
+    if not acquire_task_slot(routing_key):
+        _defer_task(RunToolShard, routing_key)
+        return False
+
+    try:
+        return _run_tool_shard(routing_key=routing_key,
+                               server_url=server_url,
+                               session=session,
+                               review_request_id=review_request_id,
+                               diff_revision=diff_revision,
+                               status_update_id=status_update_id,
+                               review_settings=review_settings,
+                               tool_options=tool_options,
+                               filediff_ids=filediff_ids,
+                               shard_index=shard_index,
+                               results_queue=results_queue)
+    finally:
+        release_task_slot(routing_key)
         cleanup_tempfiles()
 
 
@@ -290,6 +656,776 @@ def update_tools_list(panel, payload):
     }
 
 
+@Panel.register
+def get_worker_repositories(panel, **kwargs):
+    """Return the repositories configured on this worker.
+
+    This is used to shard repositories across workers.
+
+    Version Added:
+        5.0
+
+    Args:
+        panel (celery.worker.control.Panel):
+            The worker control panel.
+
+        **kwargs (dict, unused):
+            Additional arguments sent with the command.
+
+    Returns:
+        dict:
+        A dictionary containing a ``repositories`` key with the list of
+        repository names.
+    """
+    return {
+        'repositories': sorted(repositories),
+    }
+
+
+def _run_tool(routing_key,
+              server_url='',
+              session='',
+              username='',
+              review_request_id=-1,
+              diff_revision=-1,
+              status_update_id=-1,
+              review_settings={},
+              tool_options={},
+              repository_name='',
+              base_commit_id='',
+              api_roots=None,
+              tool_instances=None,
+              **kwargs):
+    """Execute an automated review on a review request.
+
+    This performs the work for a single :py:func:`RunTool` task.
+
+    Version Added:
+        5.0
+
+    Args:
+        routing_key (str):
+            The routing key that the task was received on.
+
+        server_url (str):
+            The URL of the Review Board server.
+
+        session (str):
+            The encoded session identifier.
+
+        username (str):
+            The name of the user who owns the ``session``.
+
+        review_request_id (int):
+            The ID of the review request being reviewed.
+
+        diff_revision (int):
+            The ID of the diff revision being reviewed.
+
+        status_update_id (int):
+            The ID of the status update for this invocation of the tool.
+
+        review_settings (dict):
+            Settings for how the review should be created.
+
+        tool_options (dict):
+            The tool-specific settings.
+
+        repository_name (str):
+            The name of the repository to clone to run the tool, if the tool
+            requires full working directory access.
+
+        base_commit_id (str):
+            The ID of the commit that the patch should be applied to.
+
+        api_roots (dict, optional):
+            A cache of API roots, keyed by server URL and session, shared
+            between the tasks in a batch.
+
+        tool_instances (dict, optional):
+            A cache of tool instances, keyed by the serialized tool options,
+            shared between the tasks in a batch.
+
+        **kwargs (dict):
+            Any additional keyword arguments (perhaps used by a newer version
+            of the Review Bot extension).
+
+    Returns:
+        bool:
+        Whether the task completed successfully.
+    """
+    if api_roots is None:
+        api_roots = {}
+
+    if tool_instances is None:
+        tool_instances = {}
+
+    route_parts = routing_key.partition('.')
+    tool_name = route_parts[0]
+
+    log_detail = ('(server=%s, review_request_id=%s, diff_revision=%s)'
+                  % (server_url, review_request_id, diff_revision))
+
+    logger.debug('Running tool "%s" %s', tool_name, log_detail)
+
+    api_root_key = (server_url, session)
+    api_root = api_roots.get(api_root_key)
+
+    if api_root is None:
+        try:
+            logger.debug('Initializing RB API %s', log_detail)
+            api_root = get_api_root(url=server_url,
+                                    session=session)
+        except Exception as e:
+            logger.error('Could not contact Review Board server: %s %s',
+                         e, log_detail)
+            return False
+
+        api_roots[api_root_key] = api_root
+
+    logger.debug('Loading requested tool "%s" %s', tool_name, log_detail)
+    tool_cls = get_tool_class(tool_name)
+
+    if tool_cls is None:
+        logger.error('Tool "%s" not found %s', tool_name, log_detail)
+        return False
+
+    repository = None
+
+    try:
+        logger.debug('Creating status update %s', log_detail)
+        status_update = api_root.get_status_update(
+            review_request_id=review_request_id,
+            status_update_id=status_update_id)
+    except Exception as e:
+        logger.exception('Unable to create status update: %s %s',
+                         e, log_detail)
+        return False
+
+    if _is_superseded(api_root=api_root,
+                      review_request_id=review_request_id,
+                      status_update_id=status_update_id,
+                      status_update=status_update,
+                      log_detail=log_detail,
+                      refresh=False):
+        return False
+
+    if tool_cls.working_directory_required:
+        if not base_commit_id:
+            logger.error('Working directory is required but the diffset '
+                         'has no base_commit_id %s', log_detail)
+            status_update.update(
+                state=ERROR,
+                description='Diff does not include parent commit '
+                            'information.')
+            return False
+
+        repository = get_repository(repository_name)
+
+        if repository is None:
+            logger.error('Unable to find configured repository "%s" %s',
+                         repository_name, log_detail)
+            return False
+
+    try:
+        logger.debug('Initializing review %s', log_detail)
+        review = Review(api_root=api_root,
+                        review_request_id=review_request_id,
+                        diff_revision=diff_revision,
+                        settings=review_settings)
+        status_update.update(description='running...')
+    except Exception as e:
+        logger.exception('Failed to initialize review: %s %s',
+                         e, log_detail)
+        status_update.update(state=ERROR, description='internal error.')
+        return False
+
+    tool_key = json.dumps(tool_options, sort_keys=True)
+    tool = tool_instances.get(tool_key)
+
+    if tool is None:
+        try:
+            logger.debug('Initializing tool "%s %s" %s',
+                         tool_cls.name, tool_cls.version, log_detail)
+            tool = tool_cls(settings=tool_options,
+                            in_task=True)
+        except Exception as e:
+            logger.exception('Error initializing tool "%s": %s %s',
+                             tool_cls.name, e, log_detail)
+            status_update.update(state=ERROR, description='internal error.')
+            return False
+
+        tool_instances[tool_key] = tool
+    else:
+        # The tool is being reused from an earlier task in the batch.
+        tool.output = None
+
+    if _is_superseded(api_root=api_root,
+                      review_request_id=review_request_id,
+                      status_update_id=status_update_id,
+                      status_update=status_update,
+                      log_detail=log_detail):
+        return False
+
+    try:
+        shards = _get_shards(tool, review)
+
+        if shards:
+            logger.debug('Splitting review of %d files across %d tasks %s',
+                         sum(len(shard) for shard in shards), len(shards),
+                         log_detail)
+            _execute_shards(
+                tool=tool,
+                review=review,
+                shards=shards,
+                routing_key=routing_key,
+                task_kwargs={
+                    'server_url': server_url,
+                    'session': session,
+                    'review_request_id': review_request_id,
+                    'diff_revision': diff_revision,
+                    'status_update_id': status_update_id,
+                    'review_settings': review_settings,
+                    'tool_options': tool_options,
+                })
+        else:
+            # TODO: In Review Bot 4.0, remove the settings argument.
+            logger.debug('Executing tool "%s" %s', tool.name, log_detail)
+            tool.execute(review,
+                         settings=tool_options,
+                         repository=repository,
+                         base_commit_id=base_commit_id)
+
+        logger.debug('Tool "%s" completed successfully %s',
+                     tool.name, log_detail)
+    except Exception as e:
+        logger.exception('Error executing tool "%s": %s %s',
+                         tool.name, e, log_detail)
+        status_update.update(state=ERROR, description='internal error.')
+        return False
+
+    if _is_superseded(api_root=api_root,
+                      review_request_id=review_request_id,
+                      status_update_id=status_update_id,
+                      status_update=status_update,
+                      log_detail=log_detail):
+        return False
+
+    if not _publish_results(api_root=api_root,
+                            username=username,
+                            tool=tool,
+                            review=review,
+                            status_update=status_update,
+                            log_detail=log_detail):
+        return False
+
+    logger.debug('Review completed successfully %s', log_detail)
+    return True
+
+
+def _get_shards(tool, review):
+    """Return how the files in a review should be split across tasks.
+
+    Version Added:
+        5.0
+
+    Args:
+        tool (reviewbot.tools.base.tool.BaseTool):
+            The tool being run.
+
+        review (reviewbot.processing.review.Review):
+            The review.
+
+    Returns:
+        list of list of int:
+        The lists of FileDiff IDs to review in each task, or ``None`` if the
+        review should be performed in a single task.
+    """
+    if tool.working_directory_required:
+        return None
+
+    max_files = config['max_files_per_task'].get(tool.tool_id,
+                                                 tool.max_files_per_task)
+
+    if not max_files:
+        return None
+
+    filediff_ids = [
+        f.id
+        for f in review.files
+        if tool.get_can_handle_file(review_file=f)
+    ]
+
+    if len(filediff_ids) <= max_files:
+        return None
+
+    return [
+        filediff_ids[i:i + max_files]
+        for i in range(0, len(filediff_ids), max_files)
+    ]
+
+
+def _execute_shards(tool, review, shards, routing_key, task_kwargs):
+    """Execute a tool with the files in a review split across tasks.
+
+    The first set of files is reviewed in this task, and the rest are sent
+    to the tool's queue as :py:func:`RunToolShard` tasks. While waiting on
+    them, this task will help review any that are still in the queue. Any
+    not reviewed within :py:data:`SHARD_TIMEOUT` seconds are reviewed here.
+
+    The comments and output from each task are added to ``review`` and the
+    tool. If another task finds that the status update was superseded by a
+    newer diff, this stops without reviewing the remaining files.
+
+    Version Added:
+        5.0
+
+    Args:
+        tool (reviewbot.tools.base.tool.BaseTool):
+            The tool being run.
+
+        review (reviewbot.processing.review.Review):
+            The review.
+
+        shards (list of list of int):
+            The lists of FileDiff IDs to review in each task.
+
+        routing_key (str):
+            The routing key for the tool's queue.
+
+        task_kwargs (dict):
+            Keyword arguments to pass to each :py:func:`RunToolShard` task.
+
+    Raises:
+        Exception:
+            One or more sets of files could not be reviewed.
+    """
+    results_queue = create_results_queue(app=celery,
+                                         expires=SHARD_TIMEOUT * 2)
+    superseded = False
+
+    try:
+        for shard_index, filediff_ids in enumerate(shards[1:], start=1):
+            celery.send_task(RunToolShard.name,
+                             kwargs=dict(task_kwargs,
+                                         filediff_ids=filediff_ids,
+                                         shard_index=shard_index,
+                                         results_queue=results_queue),
+                             queue=routing_key)
+
+        results = {
+            0: _execute_shard(tool, review, shards[0]),
+        }
+        deadline = time.monotonic() + SHARD_TIMEOUT
+        poll_interval = SHARD_POLL_INTERVAL
+
+        with celery.connection_for_read() as conn:
+            channel = conn.default_channel
+
+            while len(results) < len(shards):
+                new_results = fetch_results(app=celery,
+                                            name=results_queue,
+                                            channel=channel)
+
+                for result in new_results:
+                    results[result['shard_index']] = result
+
+                    if result.get('superseded'):
+                        superseded = True
+
+                if superseded or len(results) == len(shards):
+                    break
+
+                # Rather than sit idle, review any files still in the
+                # queue, whether they're for this task or another. This
+                # task's slot covers them.
+                with take_queued_tasks(app=celery,
+                                       queue_name=routing_key,
+                                       task_name=RunToolShard.name,
+                                       max_count=1,
+                                       window=0,
+                                       channel=channel) as queued_tasks:
+                    for queued_task in queued_tasks:
+                        _run_tool_shard(routing_key=routing_key,
+                                        **queued_task.kwargs)
+                        queued_task.ack()
+
+                if queued_tasks:
+                    poll_interval = SHARD_POLL_INTERVAL
+                    continue
+
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    break
+
+                if new_results:
+                    poll_interval = SHARD_POLL_INTERVAL
+
+                time.sleep(min(poll_interval, remaining))
+                poll_interval = min(poll_interval * 2,
+                                    SHARD_MAX_POLL_INTERVAL)
+
+        if superseded:
+            return
+
+        for shard_index, filediff_ids in enumerate(shards):
+            if shard_index not in results:
+                logger.warning('Timed out waiting for files to be reviewed '
+                               'by another task. Reviewing them here.')
+                results[shard_index] = _execute_shard(tool, review,
+                                                      filediff_ids)
+    finally:
+        delete_results_queue(app=celery, name=results_queue)
+
+    outputs = []
+
+    for shard_index in range(len(shards)):
+        result = results[shard_index]
+
+        if result.get('error'):
+            raise Exception('Error reviewing files %s: %s'
+                            % (shards[shard_index], result['error']))
+
+        review.comments += result['comments']
+        review.general_comments += result['general_comments']
+
+        if result['output']:
+            outputs.append(result['output'])
+
+    tool.output = '\n'.join(outputs) or None
+
+
+def _execute_shard(tool, review, filediff_ids):
+    """Execute a tool on a subset of the files in a review.
+
+    Version Added:
+        5.0
+
+    Args:
+        tool (reviewbot.tools.base.tool.BaseTool):
+            The tool to run.
+
+        review (reviewbot.processing.review.Review):
+            The review. This won't be modified.
+
+        filediff_ids (list of int):
+            The IDs of the FileDiffs to review.
+
+    Returns:
+        dict:
+        The results, to be sent back to the task that split the review.
+    """
+    filediff_ids = set(filediff_ids)
+
+    shard_review = review.copy(settings=review.settings)
+    shard_review.files = [
+        f
+        for f in shard_review.files
+        if f.id in filediff_ids
+    ]
+
+    tool.output = None
+
+    try:
+        # TODO: In Review Bot 4.0, remove the settings argument.
+        tool.execute(shard_review,
+                     settings=tool.settings)
+    except Exception as e:
+        logger.exception('Error executing tool "%s" on FileDiffs %s: %s',
+                         tool.name, sorted(filediff_ids), e)
+
+        return {
+            'error': str(e),
+        }
+
+    return {
+        'comments': shard_review.comments,
+        'general_comments': shard_review.general_comments,
+        'output': tool.output,
+    }
+
+
+def _run_tool_shard(routing_key,
+                    server_url='',
+                    session='',
+                    review_request_id=-1,
+                    diff_revision=-1,
+                    status_update_id=-1,
+                    review_settings={},
+                    tool_options={},
+                    filediff_ids=[],
+                    shard_index=0,
+                    results_queue='',
+                    **kwargs):
+    """Review a subset of the files in a diff and send back the results.
+
+    This performs the work for a single :py:func:`RunToolShard` task.
+
+    Version Added:
+        5.0
+
+    Args:
+        routing_key (str):
+            The routing key that the task was received on.
+
+        server_url (str):
+            The URL of the Review Board server.
+
+        session (str):
+            The encoded session identifier.
+
+        review_request_id (int):
+            The ID of the review request being reviewed.
+
+        diff_revision (int):
+            The ID of the diff revision being reviewed.
+
+        status_update_id (int):
+            The ID of the status update for the tool run.
+
+        review_settings (dict):
+            Settings for how the review should be created.
+
+        tool_options (dict):
+            The tool-specific settings.
+
+        filediff_ids (list of int):
+            The IDs of the FileDiffs to review.
+
+        shard_index (int):
+            The index of this subset of files.
+
+        results_queue (str):
+            The name of the queue to send the results to.
+
+        **kwargs (dict):
+            Any additional keyword arguments.
+
+    Returns:
+        bool:
+        Whether the files were reviewed successfully.
+    """
+    tool_name = routing_key.partition('.')[0]
+    log_detail = ('(server=%s, review_request_id=%s, diff_revision=%s, '
+                  'shard=%s)'
+                  % (server_url, review_request_id, diff_revision,
+                     shard_index))
+
+    # The task waiting for results deletes the queue once it's finished or
+    # has given up, so there's no point in reviewing the files.
+    try:
+        if not results_queue_exists(app=celery, name=results_queue):
+            logger.warning('Results queue %s no longer exists. Skipping '
+                           'review of files %s',
+                           results_queue, log_detail)
+            return False
+    except Exception as e:
+        logger.warning('Unable to check results queue %s: %s %s',
+                       results_queue, e, log_detail)
+
+    try:
+        tool_cls = get_tool_class(tool_name)
+
+        if tool_cls is None:
+            raise Exception('Tool "%s" not found' % tool_name)
+
+        api_root = get_api_root(url=server_url,
+                                session=session)
+
+        if _is_superseded(api_root=api_root,
+                          review_request_id=review_request_id,
+                          status_update_id=status_update_id,
+                          status_update=None,
+                          log_detail=log_detail):
+            result = {
+                'superseded': True,
+            }
+        else:
+            # Only fetch the files being reviewed here.
+            review = Review(api_root=api_root,
+                            review_request_id=review_request_id,
+                            diff_revision=diff_revision,
+                            settings=review_settings,
+                            filediff_ids=set(filediff_ids))
+            tool = tool_cls(settings=tool_options,
+                            in_task=True)
+            result = None
+    except Exception as e:
+        logger.exception('Failed to prepare review of files: %s %s',
+                         e, log_detail)
+        result = {
+            'error': str(e),
+        }
+
+    if result is None:
+        result = _execute_shard(tool, review, filediff_ids)
+
+    result['shard_index'] = shard_index
+
+    try:
+        if not send_result(app=celery,
+                           name=results_queue,
+                           result=result):
+            return False
+    except Exception as e:
+        logger.exception('Unable to send results: %s %s', e, log_detail)
+        return False
+
+    return not result.get('error') and not result.get('superseded')
+
+
+def _defer_task(task, routing_key):
+    """Send a task back to its queue to be run later.
+
+    This is used when all slots available for a task are in use. The task
+    is retried with the same ID, so it can still be revoked.
+
+    Version Added:
+        5.0
+
+    Args:
+        task (celery.app.task.Task):
+            The task being run.
+
+        routing_key (str):
+            The routing key (queue name) the task was received on.
+
+    Raises:
+        celery.exceptions.Retry:
+            Raised to tell the worker that the task will be retried.
+    """
+    delay = get_task_retry_delay(routing_key)
+
+    logger.debug('No slots are available for the task. Retrying task '
+                 'from %s in %d seconds.',
+                 routing_key, delay)
+
+    task.retry(countdown=delay,
+               queue=routing_key)
+
+
+def _is_superseded(api_root, review_request_id, status_update_id,
+                   status_update, log_detail, refresh=True):
+    """Return whether a status update was superseded by a newer diff.
+
+    When a new diff is published while a tool is still queued or running
+    for an older one, the extension flags the older status update with
+    ``reviewbot_superseded`` in its extra data. The task should then stop
+    without publishing anything.
+
+    Version Added:
+        5.0
+
+    Args:
+        api_root (rbtools.api.resource.RootResource):
+            The root of the Review Board API.
+
+        review_request_id (int):
+            The ID of the review request being reviewed.
+
+        status_update_id (int):
+            The ID of the status update for the tool run.
+
+        status_update (rbtools.api.resource.ItemResource):
+            The status update for the tool run.
+
+        log_detail (str):
+            Details about the task, for logging.
+
+        refresh (bool, optional):
+            Whether to fetch the latest state of the status update from
+            the server.
+
+    Returns:
+        bool:
+        ``True`` if the status update was superseded.
+    """
+    if refresh:
+        try:
+            status_update = api_root.get_status_update(
+                review_request_id=review_request_id,
+                status_update_id=status_update_id)
+        except Exception as e:
+            logger.warning('Unable to check the state of status update '
+                           '%s: %s %s',
+                           status_update_id, e, log_detail)
+            return False
+
+    extra_data = getattr(status_update, 'extra_data', None) or {}
+
+    if not extra_data.get('reviewbot_superseded'):
+        return False
+
+    logger.info('Status update %s was superseded by a newer diff. Stopping '
+                'the review %s',
+                status_update_id, log_detail)
+
+    return True
+
+
+def _publish_results(api_root, username, tool, review, status_update,
+                     log_detail):
+    """Publish the results of a tool and update its status.
+
+    This will upload any console output from the tool, publish the review
+    if there are comments, and mark the status update as done.
+
+    Version Added:
+        5.0
+
+    Args:
+        api_root (rbtools.api.resource.Resource):
+            The server API root.
+
+        username (str):
+            The name of the Review Bot user.
+
+        tool (reviewbot.tools.base.tool.BaseTool):
+            The tool that was run.
+
+        review (reviewbot.processing.review.Review):
+            The review produced by the tool.
+
+        status_update (rbtools.api.resource.Resource):
+            The status update for the tool.
+
+        log_detail (str):
+            Details on the review request to include in log messages.
+
+    Returns:
+        bool:
+        Whether the results were published successfully.
+    """
+    if tool.output:
+        file_attachments = \
+            api_root.get_user_file_attachments(username=username)
+        attachment = \
+            file_attachments.upload_attachment(filename='tool-output',
+                                               content=tool.output)
+
+        status_update.update(url=attachment.absolute_url,
+                             url_text='Tool console output')
+
+    try:
+        if not review.has_comments:
+            status_update.update(state=DONE_SUCCESS,
+                                 description='passed.')
+        else:
+            logger.debug('Publishing review %s', log_detail)
+            review_id = review.publish().id
+
+            status_update.update(state=DONE_FAILURE,
+                                 description='failed.',
+                                 review_id=review_id)
+    except Exception as e:
+        logger.exception('Error when publishing review: %s %s', e, log_detail)
+        status_update.update(state=ERROR, description='internal error.')
+        return False
+
+    return True
+
+
 def _get_extension_resource(api_root):
     """Return the Review Bot extension resource.
 
@@ -405,10 +405,12 @@ class DummyRootResource(RootResource):
             payload={
                 'status_update': {
                     'id': status_update_id,
+                    'state': 'pending',
                 },
             },
             url=('%sreview-requests/%s/status-updates/%s/'
-                 % (self._url, review_request_id, status_update_id)))
+                 % (self._url, review_request_id, status_update_id)),
+            token='status_update')
 
     def get_user_file_attachments(self, username, **kwargs):
         """Return a user file attachment list resource.
@@ -0,0 +1,161 @@
+"""Unit tests for reviewbot.autoscale."""
+
+from __future__ import annotations
+
+import kgb
+from celery import Celery
+from kombu import Queue
+
+from reviewbot.autoscale import (ReviewBotAutoscaler,
+                                 get_task_duration,
+                                 record_task_duration,
+                                 setup_task_durations)
+from reviewbot.testing import TestCase
+
+
+class DummyPool(object):
+    """A pool for autoscaling tests."""
+
+    def __init__(self, num_processes):
+        self.num_processes = num_processes
+
+    def grow(self, n):
+        self.num_processes += n
+
+    def shrink(self, n):
+        self.num_processes -= n
+
+    def maintain_pool(self):
+        pass
+
+
+class DummyWorker(object):
+    """A worker for autoscaling tests."""
+
+    def __init__(self, app):
+        self.app = app
+
+
+class ReviewBotAutoscalerTests(kgb.SpyAgency, TestCase):
+    """Unit tests for reviewbot.autoscale.ReviewBotAutoscaler."""
+
+    def setUp(self):
+        super(ReviewBotAutoscalerTests, self).setUp()
+
+        self.app = Celery('reviewbot.tasks', broker='memory://')
+        self.app.conf.task_serializer = 'json'
+
+        self.queue_names = ['test-autoscale-heavy.1',
+                            'test-autoscale-light.1']
+        self.app.amqp.queues = [
+            Queue(queue_name, routing_key=queue_name)
+            for queue_name in self.queue_names
+        ]
+
+        setup_task_durations(['test-autoscale-heavy',
+                              'test-autoscale-light'])
+
+        self.pool = DummyPool(1)
+        self.autoscaler = ReviewBotAutoscaler(self.pool,
+                                              max_concurrency=10,
+                                              min_concurrency=1,
+                                              worker=DummyWorker(self.app))
+
+    def tearDown(self):
+        super(ReviewBotAutoscalerTests, self).tearDown()
+
+        with self.app.connection_for_write() as conn:
+            for queue_name in self.queue_names:
+                self.app.amqp.queues[queue_name](conn.default_channel).purge()
+
+        setup_task_durations([])
+
+    def test_record_task_duration(self):
+        """Testing record_task_duration"""
+        self.assertIsNone(get_task_duration('test-autoscale-heavy'))
+
+        record_task_duration('test-autoscale-heavy.1', 10)
+        self.assertEqual(get_task_duration('test-autoscale-heavy'), 10)
+
+        record_task_duration('test-autoscale-heavy.1.large', 20)
+        self.assertEqual(get_task_duration('test-autoscale-heavy'), 12)
+
+        # Unknown tools are ignored.
+        record_task_duration('test-autoscale-other.1', 10)
+        self.assertIsNone(get_task_duration('test-autoscale-other'))
+
+    def test_get_desired_processes(self):
+        """Testing ReviewBotAutoscaler.get_desired_processes"""
+        self._queue_tasks('test-autoscale-heavy.1', 3)
+        self._queue_tasks('test-autoscale-light.1', 30)
+
+        record_task_duration('test-autoscale-heavy.1', 120)
+        record_task_duration('test-autoscale-light.1', 1)
+
+        # The heavy tool gets a process for each waiting task, and the light
+        # tool only needs one to keep up.
+        self.assertEqual(self.autoscaler.get_desired_processes(), 4)
+
+    def test_get_desired_processes_with_memory_budget(self):
+        """Testing ReviewBotAutoscaler.get_desired_processes with
+        autoscale_memory_budget
+        """
+        self._queue_tasks('test-autoscale-heavy.1', 3)
+        self._queue_tasks('test-autoscale-light.1', 3)
+
+        new_config = {
+            'autoscale_memory_budget': 1100,
+            'autoscale_process_memory': 100,
+            'autoscale_tool_weights': {
+                'test-autoscale-heavy': 4,
+            },
+        }
+
+        with self.override_config(new_config):
+            # One process for each tool is added in turn: 400 + 100, then
+            # 400 + 100. After that, only one more light process fits.
+            self.assertEqual(self.autoscaler.get_desired_processes(), 5)
+
+    def test_get_desired_processes_with_no_tasks(self):
+        """Testing ReviewBotAutoscaler.get_desired_processes with no tasks
+        uses the minimum concurrency
+        """
+        self.assertEqual(self.autoscaler.get_desired_processes(), 1)
+
+    def test_maybe_scale(self):
+        """Testing ReviewBotAutoscaler.maybe_scale with
+        autoscale_by_queue_depth
+        """
+        self._queue_tasks('test-autoscale-heavy.1', 3)
+
+        with self.override_config({'autoscale_by_queue_depth': True}):
+            self.autoscaler.maybe_scale()
+
+        self.assertEqual(self.pool.num_processes, 3)
+
+    def test_maybe_scale_disabled(self):
+        """Testing ReviewBotAutoscaler.maybe_scale without
+        autoscale_by_queue_depth
+        """
+        self.spy_on(self.autoscaler.get_desired_processes)
+        self._queue_tasks('test-autoscale-heavy.1', 3)
+
+        self.autoscaler.maybe_scale()
+
+        self.assertSpyNotCalled(self.autoscaler.get_desired_processes)
+        self.assertEqual(self.pool.num_processes, 1)
+
+    def _queue_tasks(self, queue_name, count):
+        """Queue tasks for testing.
+
+        Args:
+            queue_name (str):
+                The name of the queue.
+
+            count (int):
+                The number of tasks to queue.
+        """
+        for i in range(count):
+            self.app.send_task('reviewbot.tasks.RunTool',
+                               kwargs={},
+                               queue=queue_name)
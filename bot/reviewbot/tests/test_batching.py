@@ -0,0 +1,190 @@
+"""Unit tests for reviewbot.batching."""
+
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+
+from celery import Celery
+from celery.worker import state as worker_state
+
+from reviewbot.batching import get_batch_size, take_queued_tasks
+from reviewbot.testing import TestCase
+
+
+class BatchingTests(TestCase):
+    """Unit tests for reviewbot.batching."""
+
+    def setUp(self):
+        super(BatchingTests, self).setUp()
+
+        self.app = Celery('reviewbot.tasks', broker='memory://')
+        self.app.conf.task_serializer = 'json'
+
+    def test_get_batch_size(self):
+        """Testing get_batch_size"""
+        self.assertEqual(get_batch_size(), 1)
+
+        with self.override_config({'run_tool_batch_size': 10}):
+            self.assertEqual(get_batch_size(), 10)
+
+        with self.override_config({'run_tool_batch_size': None}):
+            self.assertEqual(get_batch_size(), 1)
+
+    def test_take_queued_tasks(self):
+        """Testing take_queued_tasks"""
+        for i in range(3):
+            self._send_task('reviewbot.tasks.RunTool', status_update_id=i)
+
+        with self._take_queued_tasks('reviewbot.tasks.RunTool',
+                                     max_count=2) as queued_tasks:
+            self.assertEqual(
+                [
+                    queued_task.kwargs
+                    for queued_task in queued_tasks
+                ],
+                [
+                    {'status_update_id': 0},
+                    {'status_update_id': 1},
+                ])
+
+            for queued_task in queued_tasks:
+                queued_task.ack()
+
+        self.assertEqual(self._take_all_kwargs('reviewbot.tasks.RunTool'),
+                         [{'status_update_id': 2}])
+
+    def test_take_queued_tasks_without_ack(self):
+        """Testing take_queued_tasks returns tasks that weren't acknowledged
+        to the queue
+        """
+        for i in range(3):
+            self._send_task('reviewbot.tasks.RunTool', status_update_id=i)
+
+        with self._take_queued_tasks('reviewbot.tasks.RunTool',
+                                     max_count=2) as queued_tasks:
+            self.assertEqual(len(queued_tasks), 2)
+            queued_tasks[0].ack()
+
+        self.assertEqual(
+            sorted(
+                task_kwargs['status_update_id']
+                for task_kwargs in self._take_all_kwargs(
+                    'reviewbot.tasks.RunTool')
+            ),
+            [1, 2])
+
+    def test_take_queued_tasks_with_other_task(self):
+        """Testing take_queued_tasks leaves other tasks in the queue"""
+        self._send_task('reviewbot.tasks.RunTool', status_update_id=1)
+        self._send_task('reviewbot.tasks.RunTools', tools=[])
+
+        self.assertEqual(self._take_all_kwargs('reviewbot.tasks.RunTool'),
+                         [{'status_update_id': 1}])
+
+        # The other task should have been returned to the queue.
+        self.assertEqual(self._take_all_kwargs('reviewbot.tasks.RunTools'),
+                         [{'tools': []}])
+
+    def test_take_queued_tasks_with_revoked(self):
+        """Testing take_queued_tasks discards revoked tasks"""
+        self._send_task('reviewbot.tasks.RunTool',
+                        task_id='revoked-task',
+                        status_update_id=1)
+        self._send_task('reviewbot.tasks.RunTool', status_update_id=2)
+
+        worker_state.revoked.add('revoked-task')
+
+        try:
+            self.assertEqual(
+                self._take_all_kwargs('reviewbot.tasks.RunTool'),
+                [{'status_update_id': 2}])
+        finally:
+            worker_state.revoked.discard('revoked-task')
+
+        self.assertEqual(self._take_all_kwargs('reviewbot.tasks.RunTool'),
+                         [])
+
+    def test_take_queued_tasks_with_expired(self):
+        """Testing take_queued_tasks discards expired tasks"""
+        now = datetime.now(timezone.utc)
+
+        self._send_task('reviewbot.tasks.RunTool',
+                        expires=now - timedelta(minutes=1),
+                        status_update_id=1)
+        self._send_task('reviewbot.tasks.RunTool',
+                        expires=now + timedelta(minutes=1),
+                        status_update_id=2)
+
+        self.assertEqual(self._take_all_kwargs('reviewbot.tasks.RunTool'),
+                         [{'status_update_id': 2}])
+
+    def test_take_queued_tasks_with_empty_queue(self):
+        """Testing take_queued_tasks with an empty queue"""
+        with take_queued_tasks(app=self.app,
+                               queue_name='test-batching.2',
+                               task_name='reviewbot.tasks.RunTool',
+                               max_count=5,
+                               window=0) as queued_tasks:
+            self.assertEqual(queued_tasks, [])
+
+    def _take_queued_tasks(self, task_name, max_count):
+        """Take tasks from the test queue.
+
+        Args:
+            task_name (str):
+                The name of the task to take.
+
+            max_count (int):
+                The maximum number of tasks to take.
+
+        Returns:
+            contextlib.AbstractContextManager:
+            The context manager for the tasks.
+        """
+        return take_queued_tasks(app=self.app,
+                                 queue_name='test-batching.1',
+                                 task_name=task_name,
+                                 max_count=max_count,
+                                 window=0)
+
+    def _take_all_kwargs(self, task_name):
+        """Take and acknowledge all tasks of a type from the test queue.
+
+        Args:
+            task_name (str):
+                The name of the task to take.
+
+        Returns:
+            list of dict:
+            The keyword arguments for each task.
+        """
+        with self._take_queued_tasks(task_name, max_count=100) as queued_tasks:
+            for queued_task in queued_tasks:
+                queued_task.ack()
+
+            return [
+                queued_task.kwargs
+                for queued_task in queued_tasks
+            ]
+
+    def _send_task(self, task_name, task_id=None, expires=None, **kwargs):
+        """Send a task to the test queue.
+
+        Args:
+            task_name (str):
+                The name of the task.
+
+            task_id (str, optional):
+                The ID of the task.
+
+            expires (datetime.datetime, optional):
+                The time the task expires.
+
+            **kwargs (dict):
+                The keyword arguments for the task.
+        """
+        self.app.send_task(task_name,
+                           kwargs=kwargs,
+                           task_id=task_id,
+                           expires=expires,
+                           queue='test-batching.1')
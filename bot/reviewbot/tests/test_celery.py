@@ -5,12 +5,39 @@ from __future__ import annotations
 import os
 import re
 import shutil
+import subprocess
+import sys
 import tempfile
 
 import kgb
-
-from reviewbot.celery import setup_cookies
+from celery import Celery
+from kombu import Queue
+
+from reviewbot import celery as celery_module, sharding as reviewbot_sharding
+from reviewbot.autoscale import record_task_duration, setup_task_durations
+from reviewbot.celery import (HEARTBEAT_QUEUE,
+                              LARGE_TASK_RETRY_DELAY,
+                              TOOL_TASK_RETRY_DELAY,
+                              acquire_task_slot,
+                              add_repository_queues,
+                              available_tools,
+                              consumed_repository_names,
+                              get_celery,
+                              get_queue_names,
+                              get_task_retry_delay,
+                              rebalance_repository_queues,
+                              release_process_task_slots,
+                              release_task_slot,
+                              repository_queue_prefixes,
+                              send_heartbeat,
+                              setup_cookies,
+                              setup_large_task_slots,
+                              setup_tool_slots,
+                              update_tool_queue_consumption)
 from reviewbot.config import config
+from reviewbot.repositories import (BaseRepository,
+                                    repositories,
+                                    reset_repositories)
 from reviewbot.testing import TestCase
 from reviewbot.utils.log import get_root_logger
 
@@ -145,3 +172,409 @@ class SetupCookiesTests(kgb.SpyAgency, TestCase):
             root_logger.debug,
             'Cookies can be stored at %s',
             cookie_path)
+
+
+class LargeTaskSlotsTests(TestCase):
+    """Unit tests for reviewbot.celery.setup_large_task_slots."""
+
+    def tearDown(self):
+        super(LargeTaskSlotsTests, self).tearDown()
+
+        setup_large_task_slots(4)
+
+    def test_without_reserved_slots(self):
+        """Testing setup_large_task_slots without reserved_small_task_slots"""
+        self.assertIsNone(setup_large_task_slots(4))
+        self.assertEqual(get_queue_names('tool1.1'),
+                         ['tool1.1', 'tool1.1.large'])
+
+        for i in range(5):
+            self.assertTrue(acquire_task_slot('tool1.1.large'))
+
+    def test_with_reserved_slots(self):
+        """Testing setup_large_task_slots with reserved_small_task_slots"""
+        with self.override_config({'reserved_small_task_slots': 3}):
+            self.assertEqual(setup_large_task_slots(4), 1)
+
+        self.assertEqual(get_queue_names('tool1.1'),
+                         ['tool1.1', 'tool1.1.large'])
+
+        # Only one task for a large change can run at a time.
+        self.assertTrue(acquire_task_slot('tool1.1.large'))
+        self.assertFalse(acquire_task_slot('tool1.1.large'))
+
+        # Tasks for small changes are unaffected.
+        self.assertTrue(acquire_task_slot('tool1.1'))
+        release_task_slot('tool1.1')
+
+        release_task_slot('tool1.1.large')
+        self.assertTrue(acquire_task_slot('tool1.1.large'))
+        release_task_slot('tool1.1.large')
+
+    def test_with_all_slots_reserved(self):
+        """Testing setup_large_task_slots with all slots reserved for small
+        changes
+        """
+        with self.override_config({'reserved_small_task_slots': 4}):
+            self.assertEqual(setup_large_task_slots(4), 0)
+
+        self.assertEqual(get_queue_names('tool1.1'), ['tool1.1'])
+
+
+class DummyConsumer(object):
+    """A worker consumer for tool slot tests."""
+
+    def __init__(self, queue_names):
+        self.task_consumer = self
+        self.queues = [
+            Queue(queue_name)
+            for queue_name in queue_names
+        ]
+
+    @property
+    def queue_names(self):
+        return [queue.name for queue in self.queues]
+
+    def call_soon(self, func, *args, **kwargs):
+        func(*args, **kwargs)
+
+    def add_task_queue(self, queue_name, **kwargs):
+        self.queues.append(Queue(queue_name))
+
+    def cancel_task_queue(self, queue_name):
+        self.queues = [
+            queue
+            for queue in self.queues
+            if queue.name != queue_name
+        ]
+
+
+class ToolSlotsTests(kgb.SpyAgency, TestCase):
+    """Unit tests for per-tool slots in reviewbot.celery."""
+
+    def setUp(self):
+        super(ToolSlotsTests, self).setUp()
+
+        with self.override_config({'tool_concurrency': {'tool1': 2}}):
+            self.assertEqual(setup_tool_slots(), {'tool1': 2})
+
+    def tearDown(self):
+        super(ToolSlotsTests, self).tearDown()
+
+        repository_queue_prefixes[:] = []
+        consumed_repository_names.clear()
+        setup_tool_slots()
+
+    def test_acquire_and_release(self):
+        """Testing acquire_task_slot and release_task_slot with
+        tool_concurrency
+        """
+        self.assertTrue(acquire_task_slot('tool1.1'))
+        self.assertTrue(acquire_task_slot('tool1.1.large'))
+        self.assertFalse(acquire_task_slot('tool1.1'))
+
+        # Other tools are unaffected.
+        self.assertTrue(acquire_task_slot('tool2.1'))
+        release_task_slot('tool2.1')
+
+        release_task_slot('tool1.1')
+        self.assertTrue(acquire_task_slot('tool1.1'))
+
+        release_task_slot('tool1.1')
+        release_task_slot('tool1.1.large')
+
+    def test_acquire_with_slot_held_by_exited_process(self):
+        """Testing acquire_task_slot with tool_concurrency reclaims slots
+        held by processes that exited without releasing them
+        """
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+
+        self.assertTrue(acquire_task_slot('tool1.1'))
+        self.assertTrue(acquire_task_slot('tool1.1'))
+        self.assertFalse(acquire_task_slot('tool1.1'))
+
+        # Simulate a slot held by a worker process that was killed while
+        # running a task.
+        tool_slots = celery_module._tool_slots['tool1']
+        tool_slots._pids[0] = process.pid
+
+        self.assertEqual(tool_slots.get_in_use(), 1)
+        self.assertTrue(acquire_task_slot('tool1.1'))
+
+        release_task_slot('tool1.1')
+        release_task_slot('tool1.1')
+        self.assertEqual(tool_slots.get_in_use(), 0)
+
+    def test_release_process_task_slots(self):
+        """Testing release_process_task_slots"""
+        self.assertTrue(acquire_task_slot('tool1.1'))
+        self.assertTrue(acquire_task_slot('tool1.1'))
+
+        release_process_task_slots(pid=os.getpid(), exitcode=0)
+
+        self.assertEqual(celery_module._tool_slots['tool1'].get_in_use(), 0)
+
+    def test_get_task_retry_delay(self):
+        """Testing get_task_retry_delay"""
+        self.assertEqual(get_task_retry_delay('tool1.1.large'),
+                         LARGE_TASK_RETRY_DELAY)
+        self.assertEqual(get_task_retry_delay('tool2.1.large'),
+                         LARGE_TASK_RETRY_DELAY)
+
+        self.assertTrue(acquire_task_slot('tool1.1'))
+        self.assertTrue(acquire_task_slot('tool1.1'))
+
+        try:
+            self.assertEqual(get_task_retry_delay('tool1.1.large'),
+                             TOOL_TASK_RETRY_DELAY)
+        finally:
+            release_task_slot('tool1.1')
+            release_task_slot('tool1.1')
+
+    def test_update_tool_queue_consumption(self):
+        """Testing update_tool_queue_consumption"""
+        repository_queue_prefixes[:] = ['tool1.1']
+        consumed_repository_names.update({'repo1', 'repo2'})
+
+        consumer = DummyConsumer(['tool1.1.repo1',
+                                  'tool1.1.repo1.large',
+                                  'tool2.1'])
+
+        self.assertTrue(acquire_task_slot('tool1.1.repo1'))
+        update_tool_queue_consumption(consumer)
+        self.assertEqual(consumer.queue_names,
+                         ['tool1.1.repo1', 'tool1.1.repo1.large', 'tool2.1'])
+
+        # Taking the last slot should stop consuming from the tool's queues.
+        self.assertTrue(acquire_task_slot('tool1.1.repo1'))
+        update_tool_queue_consumption(consumer)
+        self.assertEqual(consumer.queue_names, ['tool2.1'])
+
+        # Queues added while paused should be paused as well.
+        consumer.add_task_queue('tool1.1.repo2')
+        update_tool_queue_consumption(consumer)
+        self.assertEqual(consumer.queue_names, ['tool2.1'])
+
+        # Releasing a slot should resume consuming from the tool's queues,
+        # except for repositories this worker no longer handles.
+        consumed_repository_names.discard('repo1')
+        release_task_slot('tool1.1.repo1')
+        update_tool_queue_consumption(consumer)
+        self.assertEqual(consumer.queue_names, ['tool2.1', 'tool1.1.repo2'])
+
+        release_task_slot('tool1.1.repo1')
+        update_tool_queue_consumption(consumer)
+        self.assertEqual(consumer.queue_names, ['tool2.1', 'tool1.1.repo2'])
+
+    def test_acquire_with_large_task(self):
+        """Testing acquire_task_slot with tool_concurrency releases the slot
+        for large changes when no tool slots are available
+        """
+        with self.override_config({'reserved_small_task_slots': 1}):
+            setup_large_task_slots(3)
+
+        try:
+            self.assertTrue(acquire_task_slot('tool1.1'))
+            self.assertTrue(acquire_task_slot('tool1.1'))
+            self.assertFalse(acquire_task_slot('tool1.1.large'))
+
+            # Both slots for large changes should still be available.
+            self.assertTrue(acquire_task_slot('tool2.1.large'))
+            self.assertTrue(acquire_task_slot('tool2.1.large'))
+            self.assertFalse(acquire_task_slot('tool2.1.large'))
+        finally:
+            setup_large_task_slots(3)
+
+
+class AddRepositoryQueuesTests(kgb.SpyAgency, TestCase):
+    """Unit tests for reviewbot.celery.add_repository_queues."""
+
+    def tearDown(self):
+        super(AddRepositoryQueuesTests, self).tearDown()
+
+        repository_queue_prefixes[:] = []
+        consumed_repository_names.clear()
+
+    def test_add_repository_queues(self):
+        """Testing add_repository_queues"""
+        celery = get_celery()
+        self.assertIs(celery_module.celery, celery)
+
+        self.spy_on(celery.control.add_consumer, call_original=False)
+
+        repository_queue_prefixes[:] = ['tool1.1', 'tool2.1']
+        add_repository_queues('worker1', ['repo1'])
+
+        self.assertSpyCallCount(celery.control.add_consumer, 4)
+
+        for call, queue_name in zip(celery.control.add_consumer.calls,
+                                    ('tool1.1.repo1',
+                                     'tool1.1.repo1.large',
+                                     'tool2.1.repo1',
+                                     'tool2.1.repo1.large')):
+            self.assertSpyCalledWith(
+                call,
+                queue_name,
+                exchange=queue_name,
+                exchange_type='direct',
+                routing_key=queue_name,
+                destination=['worker1'])
+
+        self.assertEqual(consumed_repository_names, {'repo1'})
+
+    def test_add_repository_queues_without_large_queues(self):
+        """Testing add_repository_queues with all slots reserved for small
+        changes
+        """
+        celery = get_celery()
+
+        self.spy_on(celery.control.add_consumer, call_original=False)
+
+        repository_queue_prefixes[:] = ['tool1.1']
+
+        with self.override_config({'reserved_small_task_slots': 2}):
+            setup_large_task_slots(2)
+
+        try:
+            add_repository_queues('worker1', ['repo1'])
+        finally:
+            setup_large_task_slots(2)
+
+        self.assertSpyCallCount(celery.control.add_consumer, 1)
+        self.assertSpyCalledWith(celery.control.add_consumer,
+                                 'tool1.1.repo1',
+                                 destination=['worker1'])
+
+    def test_add_repository_queues_with_sharding(self):
+        """Testing add_repository_queues with repository_shard_replicas"""
+        celery = get_celery()
+
+        self.spy_on(rebalance_repository_queues, call_original=False)
+        self.spy_on(celery.control.add_consumer, call_original=False)
+
+        with self.override_config({'repository_shard_replicas': 1}):
+            add_repository_queues('worker1', ['repo1'])
+
+        self.assertSpyCalledWith(rebalance_repository_queues, 'worker1')
+        self.assertSpyNotCalled(celery.control.add_consumer)
+
+
+class RebalanceRepositoryQueuesTests(kgb.SpyAgency, TestCase):
+    """Unit tests for reviewbot.celery.rebalance_repository_queues."""
+
+    def setUp(self):
+        super(RebalanceRepositoryQueuesTests, self).setUp()
+
+        config['repository_shard_replicas'] = 1
+
+        for repo_name in ('repo1', 'repo2', 'repo3'):
+            repositories[repo_name] = BaseRepository(
+                name=repo_name,
+                clone_path='https://example.com/')
+
+        repository_queue_prefixes[:] = ['tool1.1']
+
+    def tearDown(self):
+        super(RebalanceRepositoryQueuesTests, self).tearDown()
+
+        reset_repositories()
+        repository_queue_prefixes[:] = []
+        consumed_repository_names.clear()
+
+    def test_rebalance(self):
+        """Testing rebalance_repository_queues"""
+        celery = get_celery()
+
+        # This worker will own repo2 and repo3 (which no other worker has),
+        # but no longer repo1.
+        self.spy_on(
+            celery.control.broadcast,
+            op=kgb.SpyOpReturn([
+                {'worker2': {'repositories': ['repo1']}},
+            ]))
+        self.spy_on(celery.control.add_consumer, call_original=False)
+        self.spy_on(celery.control.cancel_consumer, call_original=False)
+        self.spy_on(
+            reviewbot_sharding.get_shard_owners,
+            op=kgb.SpyOpMatchAny([
+                {
+                    'args': ('repo1', ['worker2', 'worker1'], 1),
+                    'op': kgb.SpyOpReturn(['worker2']),
+                },
+                {
+                    'op': kgb.SpyOpReturn(['worker1']),
+                },
+            ]))
+
+        consumed_repository_names.update({'repo1', 'repo2'})
+        rebalance_repository_queues('worker1')
+
+        self.assertEqual(consumed_repository_names, {'repo2', 'repo3'})
+        self.assertSpyCallCount(celery.control.add_consumer, 2)
+        self.assertSpyCalledWith(celery.control.add_consumer.calls[0],
+                                 'tool1.1.repo3',
+                                 destination=['worker1'])
+        self.assertSpyCalledWith(celery.control.add_consumer.calls[1],
+                                 'tool1.1.repo3.large',
+                                 destination=['worker1'])
+        self.assertSpyCallCount(celery.control.cancel_consumer, 2)
+        self.assertSpyCalledWith(celery.control.cancel_consumer.calls[0],
+                                 'tool1.1.repo1',
+                                 destination=['worker1'])
+        self.assertSpyCalledWith(celery.control.cancel_consumer.calls[1],
+                                 'tool1.1.repo1.large',
+                                 destination=['worker1'])
+
+
+class SendHeartbeatTests(TestCase):
+    """Unit tests for reviewbot.celery.send_heartbeat."""
+
+    def setUp(self):
+        super(SendHeartbeatTests, self).setUp()
+
+        self.app = Celery('reviewbot.tasks', broker='memory://')
+
+    def tearDown(self):
+        super(SendHeartbeatTests, self).tearDown()
+
+        available_tools.clear()
+        consumed_repository_names.clear()
+        setup_task_durations([])
+
+    def test_send_heartbeat(self):
+        """Testing send_heartbeat"""
+        available_tools.update({
+            'tool1': '1.0',
+            'tool2': '2.0',
+        })
+        consumed_repository_names.update({'repo2', 'repo1'})
+        setup_task_durations(['tool1', 'tool2'])
+        record_task_duration('tool1.1.0', 12.5)
+
+        send_heartbeat(self.app, 'celery@worker1', 4)
+
+        with self.app.connection_for_read() as connection:
+            queue = Queue(HEARTBEAT_QUEUE)(connection.default_channel)
+            message = queue.get(no_ack=True)
+
+            self.assertIsNone(queue.get(no_ack=True))
+
+        heartbeat = message.decode()
+        self.assertIsInstance(heartbeat.pop('timestamp'), float)
+        self.assertEqual(
+            heartbeat,
+            {
+                'hostname': 'celery@worker1',
+                'interval': 30,
+                'tools': {
+                    'tool1': '1.0',
+                    'tool2': '2.0',
+                },
+                'repositories': ['repo1', 'repo2'],
+                'in_flight': 0,
+                'pool_size': 4,
+                'task_durations': {
+                    'tool1': 12.5,
+                },
+            })
@@ -2,19 +2,35 @@
 
 from __future__ import annotations
 
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import appdirs
 import kgb
 
 from reviewbot.config import config
-from reviewbot.repositories import (GitRepository,
+from reviewbot.repositories import (BaseRepository,
+                                    GitRepository,
                                     HgRepository,
+                                    fetch_repository_configs,
+                                    get_repository,
                                     init_repositories,
                                     logger,
+                                    maintain_repositories,
+                                    refresh_repositories,
                                     repositories,
                                     reset_repositories)
 from reviewbot.testing.testcases import (DummyRootResource,
                                          RepositoryListResource,
                                          TestCase)
 from reviewbot.utils.api import get_api_root
+from reviewbot.utils.filesystem import (cleanup_tempfiles,
+                                        make_tempdir_snapshot)
+from reviewbot.utils.process import execute
 
 
 class RepositoriesTests(kgb.SpyAgency, TestCase):
@@ -291,6 +307,99 @@ class RepositoriesTests(kgb.SpyAgency, TestCase):
                     clone_path='https://hg.example.com/'),
             })
 
+    def test_init_repositories_with_repositories_config_keys(self):
+        """Testing init_repositories with repositories containing
+        backend-specific configuration keys
+        """
+        config['repositories'] = [
+            {
+                'name': 'repo1',
+                'clone_path': 'git@example.com:/repo1.git',
+                'type': 'git',
+                'clone_filter': 'blob:none',
+                'shallow_since': '2024-01-01',
+            },
+            {
+                'name': 'repo2',
+                'clone_path': 'https://hg.example.com/',
+                'type': 'hg',
+                'clone_filter': 'blob:none',
+                'patch_strategy': 'diff',
+                'checkout_pool_size': 4,
+            },
+        ]
+
+        init_repositories()
+
+        self.assertEqual(
+            repositories,
+            {
+                'repo1': GitRepository(
+                    name='repo1',
+                    clone_path='git@example.com:/repo1.git'),
+                'repo2': HgRepository(
+                    name='repo2',
+                    clone_path='https://hg.example.com/'),
+            })
+
+        repo1 = repositories['repo1']
+        self.assertEqual(repo1.clone_filter, 'blob:none')
+        self.assertEqual(repo1.shallow_since, '2024-01-01')
+        self.assertEqual(repo1.patch_strategy, 'files')
+
+        repo2 = repositories['repo2']
+        self.assertFalse(hasattr(repo2, 'clone_filter'))
+        self.assertEqual(repo2.patch_strategy, 'diff')
+        self.assertEqual(repo2.checkout_pool_size, 4)
+
+    def test_init_repositories_with_repositories_bad_patch_strategy(self):
+        """Testing init_repositories with repositories containing an unknown
+        patch_strategy
+        """
+        self.spy_on(logger.error)
+
+        repo_config = {
+            'name': 'repo1',
+            'clone_path': 'git@example.com:/repo1.git',
+            'type': 'git',
+            'patch_strategy': 'xxx',
+        }
+        config['repositories'] = [repo_config]
+
+        init_repositories()
+
+        self.assertEqual(repositories, {})
+        self.assertSpyCalledWith(
+            logger.error,
+            'Unexpected error initializing repository for configuration '
+            '%r: %s',
+            repo_config)
+
+    def test_init_repositories_with_repositories_bad_checkout_snapshots(
+        self,
+    ):
+        """Testing init_repositories with repositories containing an unknown
+        checkout_snapshots
+        """
+        self.spy_on(logger.error)
+
+        repo_config = {
+            'name': 'repo1',
+            'clone_path': 'git@example.com:/repo1.git',
+            'type': 'git',
+            'checkout_snapshots': 'xxx',
+        }
+        config['repositories'] = [repo_config]
+
+        init_repositories()
+
+        self.assertEqual(repositories, {})
+        self.assertSpyCalledWith(
+            logger.error,
+            'Unexpected error initializing repository for configuration '
+            '%r: %s',
+            repo_config)
+
     def test_init_repositories_with_repositories_missing_keys(self):
         """Testing init_repositories with repositories containing missing keys
         """
@@ -337,3 +446,933 @@ class RepositoriesTests(kgb.SpyAgency, TestCase):
             'key(s): %r',
             '"clone_path", "type"',
             repo_config2)
+
+
+class RepositoryDiscoveryTests(kgb.SpyAgency, TestCase):
+    """Unit tests for discovering repositories from Review Board servers."""
+
+    def setUp(self):
+        super(RepositoryDiscoveryTests, self).setUp()
+
+        self.tempdir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.tempdir, 'cache',
+                                       'repositories.json')
+
+        config['repositories_cache_path'] = self.cache_path
+        config['reviewboard_servers'] = [
+            {
+                'url': 'https://rb1.example.com/',
+            },
+        ]
+
+        self.server_repos = {
+            'Git': [
+                {
+                    'name': 'Git Repo 1',
+                    'path': 'git@example.com:/repo1.git',
+                    'mirror_path': '',
+                },
+            ],
+            'Mercurial': [
+                {
+                    'name': 'Mercurial Repo 1',
+                    'path': 'https://hg1.example.com/',
+                    'mirror_path': '',
+                },
+            ],
+        }
+
+        api_root = DummyRootResource(
+            transport=self.api_transport,
+            payload={
+                'uri_templates': {},
+            },
+            url='https://rb1.example.com/')
+
+        @self.spy_for(api_root.get_repositories)
+        def _get_repositories(_self, tool, **kwargs):
+            return RepositoryListResource(
+                transport=self.api_transport,
+                payload={
+                    'repositories': self.server_repos[tool],
+                    'total_results': len(self.server_repos[tool]),
+                },
+                url='https://rb1.example.com/repositories/?tool=%s' % tool)
+
+        self.spy_on(get_api_root, op=kgb.SpyOpReturn(api_root))
+
+    def tearDown(self):
+        super(RepositoryDiscoveryTests, self).tearDown()
+
+        reset_repositories()
+        shutil.rmtree(self.tempdir)
+
+    def test_init_repositories_without_cache(self):
+        """Testing init_repositories without a repositories cache"""
+        self.assertFalse(init_repositories())
+
+        self.assertEqual(sorted(repositories),
+                         ['Git Repo 1', 'Mercurial Repo 1'])
+
+        with open(self.cache_path, 'r') as fp:
+            self.assertEqual(
+                json.load(fp),
+                [
+                    {
+                        'server': 'https://rb1.example.com/',
+                        'type': 'git',
+                        'name': 'Git Repo 1',
+                        'clone_path': 'git@example.com:/repo1.git',
+                    },
+                    {
+                        'server': 'https://rb1.example.com/',
+                        'type': 'hg',
+                        'name': 'Mercurial Repo 1',
+                        'clone_path': 'https://hg1.example.com/',
+                    },
+                ])
+
+    def test_init_repositories_with_cache(self):
+        """Testing init_repositories with a repositories cache"""
+        self._write_cache()
+
+        self.assertTrue(init_repositories())
+        self.assertSpyNotCalled(get_api_root)
+        self.assertEqual(
+            repositories,
+            {
+                'Cached Repo': GitRepository(
+                    name='Cached Repo',
+                    clone_path='git://example.com/cached.git'),
+            })
+
+    def test_init_repositories_with_bad_cache(self):
+        """Testing init_repositories with an unreadable repositories cache"""
+        os.mkdir(os.path.dirname(self.cache_path))
+
+        with open(self.cache_path, 'w') as fp:
+            fp.write('{')
+
+        self.assertFalse(init_repositories())
+        self.assertEqual(sorted(repositories),
+                         ['Git Repo 1', 'Mercurial Repo 1'])
+
+    def test_refresh_repositories(self):
+        """Testing refresh_repositories"""
+        self._write_cache()
+        init_repositories()
+
+        config['repositories'] = []
+
+        added = []
+        refresh_repositories(on_repositories_added=added.extend)
+
+        self.assertEqual(added, ['Git Repo 1', 'Mercurial Repo 1'])
+        self.assertEqual(sorted(repositories),
+                         ['Cached Repo', 'Git Repo 1', 'Mercurial Repo 1'])
+
+        with open(self.cache_path, 'r') as fp:
+            self.assertEqual(len(json.load(fp)), 2)
+
+    def test_refresh_repositories_with_configured(self):
+        """Testing refresh_repositories with manually configured
+        repositories of the same name
+        """
+        config['repositories'] = [{
+            'name': 'Git Repo 1',
+            'type': 'git',
+            'clone_path': 'git://example.com/override.git',
+        }]
+        self._write_cache()
+        init_repositories()
+
+        added = []
+        refresh_repositories(on_repositories_added=added.extend)
+
+        self.assertEqual(added, ['Mercurial Repo 1'])
+        self.assertEqual(repositories['Git Repo 1'].clone_path,
+                         'git://example.com/override.git')
+
+    def test_refresh_repositories_with_error(self):
+        """Testing refresh_repositories with an error fetching from a
+        server
+        """
+        self._write_cache()
+        init_repositories()
+
+        self.spy_on(
+            fetch_repository_configs,
+            op=kgb.SpyOpMatchInOrder([
+                {
+                    'kwargs': {
+                        'repository_cls': GitRepository,
+                    },
+                    'op': kgb.SpyOpRaise(Exception('Oh no.')),
+                },
+                {
+                    'kwargs': {
+                        'repository_cls': HgRepository,
+                    },
+                    'call_original': True,
+                },
+            ]))
+
+        refresh_repositories()
+
+        # The cached Git repositories from that server should be kept.
+        self.assertEqual(sorted(repositories),
+                         ['Cached Repo', 'Mercurial Repo 1'])
+
+        with open(self.cache_path, 'r') as fp:
+            self.assertEqual(
+                [
+                    _repo_config['name']
+                    for _repo_config in json.load(fp)
+                ],
+                ['Cached Repo', 'Mercurial Repo 1'])
+
+    def test_get_repository_with_cache(self):
+        """Testing get_repository with a repository added to the cache
+        after startup
+        """
+        init_repositories()
+
+        self.assertIsNone(get_repository('Cached Repo'))
+
+        self._write_cache()
+        repository = get_repository('Cached Repo')
+
+        self.assertIsNotNone(repository)
+        self.assertEqual(repository.clone_path,
+                         'git://example.com/cached.git')
+
+    def _write_cache(self):
+        """Write a repositories cache containing a single repository."""
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+
+        with open(self.cache_path, 'w') as fp:
+            json.dump(
+                [{
+                    'server': 'https://rb1.example.com/',
+                    'type': 'git',
+                    'name': 'Cached Repo',
+                    'clone_path': 'git://example.com/cached.git',
+                }],
+                fp)
+
+
+class MaintainRepositoriesTests(kgb.SpyAgency, TestCase):
+    """Unit tests for reviewbot.repositories.maintain_repositories."""
+
+    def setUp(self):
+        super(MaintainRepositoriesTests, self).setUp()
+
+        self.tempdir = tempfile.mkdtemp()
+        self.spy_on(appdirs.site_data_dir,
+                    op=kgb.SpyOpReturn(self.tempdir))
+        self.maintained = []
+
+        # Maintenance is disabled by default.
+        config_override = self.override_config({
+            'repository_maintenance_interval': 24 * 60 * 60,
+        })
+        config_override.__enter__()
+        self.addCleanup(config_override.__exit__, None, None, None)
+
+        @self.spy_for(BaseRepository.maintain, owner=BaseRepository)
+        def _maintain(_self):
+            self.maintained.append(_self.name)
+
+        self.spy_on(BaseRepository.verify,
+                    owner=BaseRepository,
+                    op=kgb.SpyOpReturn(True))
+
+        self.repo1 = self._add_repository('repo1', last_used=100)
+        self.repo2 = self._add_repository('repo2', last_used=200)
+        self.repo3 = BaseRepository(name='repo3',
+                                    clone_path='https://example.com/')
+        repositories['repo3'] = self.repo3
+
+    def tearDown(self):
+        super(MaintainRepositoriesTests, self).tearDown()
+
+        reset_repositories()
+        shutil.rmtree(self.tempdir)
+
+    def test_maintain(self):
+        """Testing maintain_repositories"""
+        maintain_repositories()
+
+        self.assertSpyCallCount(BaseRepository.verify, 2)
+        self.assertEqual(self.maintained, ['repo1', 'repo2'])
+        self.assertTrue(os.path.exists(
+            os.path.join(self.tempdir, 'last-maintenance')))
+
+        # Maintenance shouldn't be performed again until it's due.
+        maintain_repositories()
+
+        self.assertEqual(self.maintained, ['repo1', 'repo2'])
+
+    def test_maintain_with_due(self):
+        """Testing maintain_repositories with maintenance due"""
+        stamp_path = os.path.join(self.tempdir, 'last-maintenance')
+
+        with open(stamp_path, 'w'):
+            pass
+
+        os.utime(stamp_path, (1, time.time() - 24 * 60 * 60))
+        maintain_repositories()
+
+        self.assertSpyCallCount(BaseRepository.maintain, 2)
+
+    def test_maintain_with_disabled(self):
+        """Testing maintain_repositories with
+        repository_maintenance_interval=None
+        """
+        with self.override_config({'repository_maintenance_interval': None}):
+            maintain_repositories()
+
+        self.assertSpyNotCalled(BaseRepository.verify)
+        self.assertSpyNotCalled(BaseRepository.maintain)
+
+    def test_maintain_with_locked(self):
+        """Testing maintain_repositories with maintenance in progress in
+        another process
+        """
+        lock_fd = os.open(os.path.join(self.tempdir, 'maintenance.lock'),
+                          os.O_RDWR | os.O_CREAT)
+
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            maintain_repositories()
+        finally:
+            os.close(lock_fd)
+
+        self.assertSpyNotCalled(BaseRepository.verify)
+
+    def test_maintain_with_verify_failed(self):
+        """Testing maintain_repositories with a repository failing
+        verification
+        """
+        BaseRepository.verify.unspy()
+
+        @self.spy_for(BaseRepository.verify, owner=BaseRepository)
+        def _verify(_self):
+            return _self is not self.repo1
+
+        maintain_repositories()
+
+        # The corrupt repository is only marked, so that it isn't removed
+        # while tasks in other processes are using it.
+        self.assertTrue(os.path.exists(self.repo1.repo_path))
+        self.assertTrue(os.path.exists('%s.reclone' % self.repo1.repo_path))
+        self.assertFalse(os.path.exists('%s.reclone'
+                                        % self.repo2.repo_path))
+        self.assertEqual(self.maintained, ['repo2'])
+
+        self.spy_on(BaseRepository.remove_storage, owner=BaseRepository)
+
+        try:
+            self.repo1.lock_storage()
+        finally:
+            cleanup_tempfiles()
+
+        self.assertSpyCalledOnce(BaseRepository.remove_storage)
+        self.assertFalse(os.path.exists(self.repo1.repo_path))
+        self.assertFalse(os.path.exists('%s.reclone' % self.repo1.repo_path))
+
+    def test_maintain_with_repository_in_use(self):
+        """Testing maintain_repositories with a repository in use by a task"""
+        try:
+            self.repo1.lock_storage()
+
+            with self.override_config({
+                'repository_maintenance_interval': 24 * 60 * 60,
+                'repository_storage_quota': 1,
+            }):
+                maintain_repositories()
+        finally:
+            cleanup_tempfiles()
+
+        self.assertEqual(self.maintained, ['repo2'])
+        self.assertTrue(os.path.exists(self.repo1.repo_path))
+        self.assertFalse(os.path.exists(self.repo2.repo_path))
+
+    def test_lock_storage_with_reclone_and_in_use(self):
+        """Testing BaseRepository.lock_storage with a repository marked to be
+        cloned again and in use by another task
+        """
+        self.repo1.mark_for_reclone()
+
+        lock_fd = os.open('%s.lock' % self.repo1.repo_path,
+                          os.O_RDWR | os.O_CREAT)
+
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_SH)
+            self.repo1.lock_storage()
+        finally:
+            cleanup_tempfiles()
+            os.close(lock_fd)
+
+        self.assertTrue(os.path.exists(self.repo1.repo_path))
+        self.assertTrue(os.path.exists('%s.reclone' % self.repo1.repo_path))
+
+    def test_maintain_with_quota(self):
+        """Testing maintain_repositories with repository_storage_quota
+        exceeded
+        """
+        snapshot1 = self._add_snapshot(self.repo1, 'abc123', last_used=300)
+        snapshot2 = self._add_snapshot(self.repo2, 'def456', last_used=50)
+
+        # Two of the three snapshots or repositories will need to be
+        # removed.
+        with self.override_config({
+            'repository_maintenance_interval': 24 * 60 * 60,
+            'repository_storage_quota': 300 * 1024,
+        }):
+            maintain_repositories()
+
+        self.assertFalse(os.path.exists(snapshot2))
+        self.assertFalse(os.path.exists(self.repo1.repo_path))
+        self.assertFalse(os.path.exists(snapshot1))
+        self.assertTrue(os.path.exists(self.repo2.repo_path))
+
+    def test_maintain_with_quota_and_recent(self):
+        """Testing maintain_repositories with repository_storage_quota
+        exceeded and recently used repositories
+        """
+        os.utime(self.repo1.repo_path)
+
+        with self.override_config({
+            'repository_maintenance_interval': 24 * 60 * 60,
+            'repository_storage_quota': 1,
+        }):
+            maintain_repositories()
+
+        self.assertTrue(os.path.exists(self.repo1.repo_path))
+        self.assertFalse(os.path.exists(self.repo2.repo_path))
+
+    def _add_repository(self, name, last_used):
+        """Add a cloned repository containing 100KB of data.
+
+        Args:
+            name (str):
+                The name of the repository.
+
+            last_used (int):
+                The timestamp of the last use of the repository.
+
+        Returns:
+            reviewbot.repositories.BaseRepository:
+            The new repository.
+        """
+        repository = BaseRepository(name=name,
+                                    clone_path='https://example.com/')
+        os.makedirs(repository.repo_path)
+
+        with open(os.path.join(repository.repo_path, 'data'), 'wb') as fp:
+            fp.write(b'x' * 100 * 1024)
+
+        os.utime(repository.repo_path, (last_used, last_used))
+        repositories[name] = repository
+
+        return repository
+
+    def _add_snapshot(self, repository, commit_id, last_used):
+        """Add a snapshot containing 100KB of data to a repository.
+
+        Args:
+            repository (reviewbot.repositories.BaseRepository):
+                The repository.
+
+            commit_id (str):
+                The commit ID of the snapshot.
+
+            last_used (int):
+                The timestamp of the last use of the snapshot.
+
+        Returns:
+            str:
+            The path to the snapshot.
+        """
+        path = os.path.join(repository.snapshots_path, commit_id)
+        os.makedirs(path)
+
+        with open(os.path.join(path, 'data'), 'wb') as fp:
+            fp.write(b'x' * 100 * 1024)
+
+        os.utime(path, (last_used, last_used))
+
+        return path
+
+
+class GitRepositoryTests(kgb.SpyAgency, TestCase):
+    """Unit tests for reviewbot.repositories.GitRepository."""
+
+    def setUp(self):
+        super(GitRepositoryTests, self).setUp()
+
+        self.tempdir = tempfile.mkdtemp()
+        self.spy_on(execute, op=kgb.SpyOpReturn(''))
+
+    def tearDown(self):
+        super(GitRepositoryTests, self).tearDown()
+
+        cleanup_tempfiles()
+        shutil.rmtree(self.tempdir)
+
+    def test_sync_with_new_clone(self):
+        """Testing GitRepository.sync with a new clone"""
+        repository = self._create_repository()
+        repository.sync()
+
+        self.assertSpyCallCount(execute, 1)
+        self.assertSpyCalledWith(
+            execute,
+            ['git', 'clone', '--bare', 'https://git.example.com/repo.git',
+             repository.repo_path])
+
+    def test_sync_with_new_clone_and_clone_options(self):
+        """Testing GitRepository.sync with a new clone and clone_filter and
+        shallow_since
+        """
+        repository = self._create_repository(clone_filter='blob:none',
+                                              shallow_since='2024-01-01')
+        repository.sync()
+
+        self.assertSpyCallCount(execute, 1)
+        self.assertSpyCalledWith(
+            execute,
+            ['git', 'clone', '--bare', '--filter=blob:none',
+             '--shallow-since=2024-01-01',
+             'https://git.example.com/repo.git', repository.repo_path])
+
+    def test_sync_with_existing_clone(self):
+        """Testing GitRepository.sync with an existing clone"""
+        repository = self._create_repository()
+        os.mkdir(repository.repo_path)
+        repository.sync()
+
+        self.assertSpyCallCount(execute, 1)
+        self.assertSpyCalledWith(
+            execute,
+            ['git', '--git-dir=%s' % repository.repo_path, 'fetch',
+             'origin', '+refs/heads/*:refs/heads/*'])
+
+    def test_sync_with_existing_partial_clone(self):
+        """Testing GitRepository.sync with an existing partial clone"""
+        repository = self._create_repository(clone_filter='blob:none')
+        os.mkdir(repository.repo_path)
+        repository.sync()
+
+        self.assertSpyCallCount(execute, 2)
+        self.assertSpyCalledWith(
+            execute.calls[0],
+            ['git', '--git-dir=%s' % repository.repo_path, 'fetch',
+             'origin', '+refs/heads/*:refs/heads/*'])
+        self.assertSpyCalledWith(
+            execute.calls[1],
+            ['git', '--git-dir=%s' % repository.repo_path, 'worktree',
+             'prune'])
+
+    def test_get_file_paths(self):
+        """Testing GitRepository.get_file_paths"""
+        execute.unspy()
+        self.spy_on(execute, op=kgb.SpyOpReturn('README\0src/main.go\0'))
+
+        repository = self._create_repository()
+
+        self.assertEqual(repository.get_file_paths('abc123'),
+                         ['README', 'src/main.go'])
+        self.assertSpyCalledWith(
+            execute,
+            ['git', '--git-dir=%s' % repository.repo_path, 'ls-tree', '-r',
+             '-z', '--name-only', 'abc123'])
+
+    def test_maintain(self):
+        """Testing GitRepository.maintain"""
+        repository = self._create_repository()
+        repository.maintain()
+
+        git_args = ['git', '--git-dir=%s' % repository.repo_path]
+
+        self.assertSpyCallCount(execute, 3)
+        self.assertSpyCalledWith(execute.calls[0],
+                                 git_args + ['gc', '--auto'])
+        self.assertSpyCalledWith(
+            execute.calls[1],
+            git_args + ['commit-graph', 'write', '--reachable'])
+        self.assertSpyCalledWith(execute.calls[2],
+                                 git_args + ['multi-pack-index', 'write'])
+
+    def test_verify(self):
+        """Testing GitRepository.verify"""
+        repository = self._create_repository()
+
+        self.assertTrue(repository.verify())
+        self.assertSpyCalledWith(
+            execute,
+            ['git', '--git-dir=%s' % repository.repo_path, 'fsck',
+             '--connectivity-only', '--no-dangling', '--no-progress'])
+
+    def test_verify_with_corrupt(self):
+        """Testing GitRepository.verify with a corrupt repository"""
+        execute.unspy()
+        self.spy_on(execute, op=kgb.SpyOpReturn(None))
+
+        repository = self._create_repository()
+
+        self.assertFalse(repository.verify())
+        self.assertSpyCalledWith(
+            execute,
+            extra_ignore_errors=tuple(range(1, 128)),
+            none_on_ignored_error=True)
+
+    def test_verify_with_error(self):
+        """Testing GitRepository.verify with an error running git fsck"""
+        execute.unspy()
+        self.spy_on(execute, op=kgb.SpyOpRaise(Exception('Oh no.')))
+
+        repository = self._create_repository()
+
+        self.assertTrue(repository.verify())
+
+    def test_checkout_with_partial_clone(self):
+        """Testing GitRepository.checkout with a partial clone"""
+        repository = self._create_repository(clone_filter='blob:none')
+        workdir = repository.checkout('abc123')
+
+        self.assertTrue(os.path.isdir(workdir))
+        self.assertSpyCallCount(execute, 1)
+        self.assertSpyCalledWith(
+            execute,
+            ['git', '--git-dir=%s' % repository.repo_path, 'worktree',
+             'add', '--detach', workdir, 'abc123'])
+
+    def test_checkout_with_paths(self):
+        """Testing GitRepository.checkout with paths"""
+        repository = self._create_repository()
+        workdir = repository.checkout('abc123',
+                                      paths={'src/pkg', 'docs'})
+
+        self.assertSpyCallCount(execute, 4)
+
+        branchname = execute.calls[0].args[0][3]
+        self.assertTrue(branchname.startswith('br-abc123-'))
+
+        self.assertSpyCalledWith(
+            execute.calls[1],
+            ['git', 'clone', '--local', '--no-hardlinks', '--depth', '1',
+             '--branch', branchname, '--sparse', repository.repo_path,
+             workdir])
+        self.assertSpyCalledWith(
+            execute.calls[3],
+            ['git', '-C', workdir, 'sparse-checkout', 'set', '--cone',
+             'docs', 'src/pkg'])
+
+    def test_checkout_with_partial_clone_and_paths(self):
+        """Testing GitRepository.checkout with a partial clone and paths"""
+        repository = self._create_repository(clone_filter='blob:none')
+        workdir = repository.checkout('abc123',
+                                      paths={'src/pkg'})
+
+        self.assertSpyCallCount(execute, 3)
+        self.assertSpyCalledWith(
+            execute.calls[0],
+            ['git', '--git-dir=%s' % repository.repo_path, 'worktree',
+             'add', '--detach', '--no-checkout', workdir, 'abc123'])
+        self.assertSpyCalledWith(
+            execute.calls[1],
+            ['git', '-C', workdir, 'sparse-checkout', 'set', '--cone',
+             'src/pkg'])
+        self.assertSpyCalledWith(
+            execute.calls[2],
+            ['git', '-C', workdir, 'reset', '--hard'])
+
+    def test_checkout_with_snapshots(self):
+        """Testing GitRepository.checkout with checkout_snapshots"""
+        self.spy_on(make_tempdir_snapshot, call_original=False,
+                    op=kgb.SpyOpReturn('/tmp/view'))
+
+        repository = self._create_repository(checkout_snapshots='copy')
+        workdir = repository.checkout('abc123')
+
+        snapshot_path = os.path.join(repository.snapshots_path, 'abc123')
+
+        self.assertEqual(workdir, '/tmp/view')
+        self.assertTrue(os.path.isdir(snapshot_path))
+        self.assertEqual(os.listdir(repository.snapshots_path), ['abc123'])
+        self.assertSpyCalledWith(make_tempdir_snapshot, snapshot_path,
+                                 method='copy')
+
+        self.assertSpyCallCount(execute, 2)
+
+        git_args = [
+            'git',
+            '--git-dir=%s' % repository.repo_path,
+            '--work-tree=%s' % execute.calls[0].args[0][2].split('=', 1)[1],
+        ]
+        env = execute.calls[0].kwargs['env']
+
+        self.assertIn('GIT_INDEX_FILE', env)
+        self.assertSpyCalledWith(execute.calls[0],
+                                 git_args + ['read-tree', 'abc123'],
+                                 env=env)
+        self.assertSpyCalledWith(execute.calls[1],
+                                 git_args + ['checkout-index', '--all'],
+                                 env=env)
+
+    def test_checkout_with_snapshots_and_existing(self):
+        """Testing GitRepository.checkout with checkout_snapshots and an
+        existing snapshot
+        """
+        self.spy_on(make_tempdir_snapshot, call_original=False,
+                    op=kgb.SpyOpReturn('/tmp/view'))
+
+        repository = self._create_repository(checkout_snapshots='auto')
+        snapshot_path = os.path.join(repository.snapshots_path, 'abc123')
+        os.makedirs(snapshot_path)
+
+        self.assertEqual(repository.checkout('abc123'), '/tmp/view')
+        self.assertSpyNotCalled(execute)
+        self.assertSpyCalledWith(make_tempdir_snapshot, snapshot_path,
+                                 method='auto')
+
+    def test_checkout_with_snapshots_and_export_error(self):
+        """Testing GitRepository.checkout with checkout_snapshots and an
+        error exporting the snapshot
+        """
+        self.spy_on(make_tempdir_snapshot, call_original=False)
+        execute.unspy()
+        self.spy_on(execute, op=kgb.SpyOpRaise(Exception('Oh no.')))
+
+        repository = self._create_repository(checkout_snapshots='copy')
+
+        with self.assertRaisesRegex(Exception, 'Oh no.'):
+            repository.checkout('abc123')
+
+        self.assertEqual(os.listdir(repository.snapshots_path), [])
+        self.assertSpyNotCalled(make_tempdir_snapshot)
+
+    def test_checkout_with_snapshots_and_paths(self):
+        """Testing GitRepository.checkout with checkout_snapshots and paths"""
+        self.spy_on(make_tempdir_snapshot, call_original=False)
+
+        repository = self._create_repository(checkout_snapshots='copy')
+        repository.checkout('abc123', paths={'src/pkg'})
+
+        self.assertSpyNotCalled(make_tempdir_snapshot)
+        self.assertFalse(os.path.exists(repository.snapshots_path))
+
+    def _create_repository(self, **kwargs):
+        """Return a new repository stored in the test's temp directory.
+
+        Args:
+            **kwargs (dict):
+                Additional keyword arguments for the repository.
+
+        Returns:
+            reviewbot.repositories.GitRepository:
+            The new repository.
+        """
+        repository = GitRepository(name='repo',
+                                   clone_path='https://git.example.com/'
+                                              'repo.git',
+                                   **kwargs)
+        repository.repo_path = os.path.join(self.tempdir, 'repo')
+        repository.snapshots_path = os.path.join(self.tempdir, 'snapshots')
+
+        return repository
+
+
+class HgRepositoryTests(kgb.SpyAgency, TestCase):
+    """Unit tests for reviewbot.repositories.HgRepository."""
+
+    def setUp(self):
+        super(HgRepositoryTests, self).setUp()
+
+        self.tempdir = tempfile.mkdtemp()
+        self.spy_on(execute, op=kgb.SpyOpReturn(''))
+
+    def tearDown(self):
+        super(HgRepositoryTests, self).tearDown()
+
+        cleanup_tempfiles()
+        shutil.rmtree(self.tempdir)
+
+    def test_checkout(self):
+        """Testing HgRepository.checkout"""
+        repository = HgRepository(name='repo',
+                                  clone_path='https://hg.example.com/')
+        workdir = repository.checkout('abc123')
+
+        self.assertSpyCalledWith(
+            execute,
+            ['hg', '-R', repository.repo_path, 'archive', '-r', 'abc123',
+             '-t', 'files', workdir])
+
+    def test_checkout_with_paths(self):
+        """Testing HgRepository.checkout with paths"""
+        repository = HgRepository(name='repo',
+                                  clone_path='https://hg.example.com/')
+        workdir = repository.checkout('abc123',
+                                      paths={'src/pkg', 'docs'})
+
+        self.assertSpyCalledWith(
+            execute,
+            ['hg', '-R', repository.repo_path, 'archive', '-r', 'abc123',
+             '-t', 'files', '-I', 'rootfilesin:.', '-I', 'path:docs',
+             '-I', 'path:src/pkg', workdir])
+
+    def test_export(self):
+        """Testing HgRepository.export"""
+        repository = HgRepository(name='repo',
+                                  clone_path='https://hg.example.com/')
+        repository.export('abc123', '/tmp/snapshot')
+
+        self.assertSpyCalledWith(
+            execute,
+            ['hg', '-R', repository.repo_path, 'archive', '-r', 'abc123',
+             '-t', 'files', '/tmp/snapshot'])
+
+    def test_get_file_paths(self):
+        """Testing HgRepository.get_file_paths"""
+        execute.unspy()
+        self.spy_on(execute, op=kgb.SpyOpReturn('README\nsrc/main.go\n'))
+
+        repository = HgRepository(name='repo',
+                                  clone_path='https://hg.example.com/')
+
+        self.assertEqual(repository.get_file_paths('abc123'),
+                         ['README', 'src/main.go'])
+        self.assertSpyCalledWith(
+            execute,
+            ['hg', '-R', repository.repo_path, 'manifest', '-r', 'abc123'])
+
+    def test_maintain(self):
+        """Testing HgRepository.maintain"""
+        repository = HgRepository(name='repo',
+                                  clone_path='https://hg.example.com/')
+        repository.maintain()
+
+        hg_args = ['hg', '-R', repository.repo_path]
+
+        self.assertSpyCallCount(execute, 2)
+        self.assertSpyCalledWith(execute.calls[0],
+                                 hg_args + ['recover'],
+                                 extra_ignore_errors=(1,))
+        self.assertSpyCalledWith(execute.calls[1],
+                                 hg_args + ['debugupdatecaches'])
+
+    def test_verify_with_corrupt(self):
+        """Testing HgRepository.verify with a corrupt clone"""
+        execute.unspy()
+        self.spy_on(execute, op=kgb.SpyOpReturn(None))
+
+        repository = HgRepository(name='repo',
+                                  clone_path='https://hg.example.com/')
+
+        self.assertFalse(repository.verify())
+        self.assertSpyCalledWith(
+            execute,
+            ['hg', '-R', repository.repo_path, 'verify', '--quiet'],
+            extra_ignore_errors=(1,),
+            none_on_ignored_error=True)
+
+    def test_checkout_with_pool(self):
+        """Testing HgRepository.checkout with checkout_pool_size and a new
+        working copy
+        """
+        repository = self._create_pooled_repository()
+        workdir = repository.checkout('abc123')
+
+        self.assertEqual(workdir, os.path.join(repository.pool_path, '0'))
+        self.assertSpyCallCount(execute, 2)
+        self.assertSpyCalledWith(
+            execute.calls[0],
+            ['hg', '--config', 'extensions.share=', 'share', '-U',
+             repository.repo_path, workdir])
+        self.assertSpyCalledWith(
+            execute.calls[1],
+            ['hg', '-R', workdir, 'update', '-C', '-r', 'abc123'])
+
+    def test_checkout_with_pool_and_existing(self):
+        """Testing HgRepository.checkout with checkout_pool_size and an
+        existing working copy
+        """
+        repository = self._create_pooled_repository()
+        os.makedirs(os.path.join(repository.pool_path, '0', '.hg'))
+
+        workdir = repository.checkout('abc123', paths={'src'})
+
+        self.assertEqual(workdir, os.path.join(repository.pool_path, '0'))
+        self.assertSpyCallCount(execute, 2)
+        self.assertSpyCalledWith(
+            execute.calls[0],
+            ['hg', '-R', workdir, '--config', 'extensions.purge=', 'purge'])
+        self.assertSpyCalledWith(
+            execute.calls[1],
+            ['hg', '-R', workdir, 'update', '-C', '-r', 'abc123'])
+
+    def test_checkout_with_pool_in_use(self):
+        """Testing HgRepository.checkout with checkout_pool_size and all
+        working copies in use
+        """
+        repository = self._create_pooled_repository(checkout_pool_size=2)
+
+        workdir1 = repository.checkout('abc123')
+        workdir2 = repository.checkout('abc123')
+        workdir3 = repository.checkout('abc123')
+
+        self.assertEqual(workdir1, os.path.join(repository.pool_path, '0'))
+        self.assertEqual(workdir2, os.path.join(repository.pool_path, '1'))
+        self.assertFalse(workdir3.startswith(repository.pool_path))
+        self.assertSpyLastCalledWith(
+            execute,
+            ['hg', '-R', repository.repo_path, 'archive', '-r', 'abc123',
+             '-t', 'files', workdir3])
+
+        # Cleaning up should release the working copies.
+        cleanup_tempfiles()
+
+        self.assertEqual(repository.checkout('abc123'), workdir1)
+
+    def test_checkout_with_pool_and_error(self):
+        """Testing HgRepository.checkout with checkout_pool_size and an error
+        updating the working copy
+        """
+        repository = self._create_pooled_repository()
+        workdir = os.path.join(repository.pool_path, '0')
+        os.makedirs(os.path.join(workdir, '.hg'))
+
+        execute.unspy()
+        self.spy_on(execute, op=kgb.SpyOpRaise(Exception('Oh no.')))
+
+        with self.assertRaisesRegex(Exception, 'Oh no.'):
+            repository.checkout('abc123')
+
+        self.assertFalse(os.path.exists(workdir))
+
+        # The working copy should have been released.
+        execute.unspy()
+        self.spy_on(execute, op=kgb.SpyOpReturn(''))
+
+        self.assertEqual(repository.checkout('abc123'), workdir)
+
+    def _create_pooled_repository(self, checkout_pool_size=1):
+        """Return a new repository using pooled checkouts.
+
+        Args:
+            checkout_pool_size (int, optional):
+                The number of pooled working copies.
+
+        Returns:
+            reviewbot.repositories.HgRepository:
+            The new repository.
+        """
+        repository = HgRepository(name='repo',
+                                  clone_path='https://hg.example.com/',
+                                  checkout_pool_size=checkout_pool_size)
+        repository.pool_path = os.path.join(self.tempdir, 'pool')
+
+        return repository
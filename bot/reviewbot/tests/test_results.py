@@ -0,0 +1,120 @@
+"""Unit tests for reviewbot.results."""
+
+from __future__ import annotations
+
+from celery import Celery
+
+from reviewbot.results import (RESULTS_EXCHANGE,
+                               create_results_queue,
+                               delete_results_queue,
+                               fetch_results,
+                               results_queue_exists,
+                               send_result)
+from reviewbot.testing import TestCase
+
+
+class ResultsTests(TestCase):
+    """Unit tests for reviewbot.results."""
+
+    def setUp(self):
+        super(ResultsTests, self).setUp()
+
+        self.app = Celery('reviewbot.tasks', broker='memory://')
+
+    def test_send_and_fetch_results(self):
+        """Testing send_result and fetch_results"""
+        name = create_results_queue(app=self.app, expires=60)
+
+        try:
+            self.assertTrue(name.startswith('reviewbot.results.'))
+            self.assertEqual(fetch_results(app=self.app, name=name), [])
+
+            send_result(app=self.app,
+                        name=name,
+                        result={'shard_index': 1})
+            send_result(app=self.app,
+                        name=name,
+                        result={'shard_index': 2})
+
+            self.assertEqual(
+                fetch_results(app=self.app, name=name),
+                [
+                    {'shard_index': 1},
+                    {'shard_index': 2},
+                ])
+            self.assertEqual(fetch_results(app=self.app, name=name), [])
+        finally:
+            delete_results_queue(app=self.app, name=name)
+
+    def test_fetch_results_with_channel(self):
+        """Testing fetch_results with an open channel"""
+        name = create_results_queue(app=self.app, expires=60)
+
+        try:
+            with self.app.connection_for_read() as conn:
+                channel = conn.default_channel
+
+                self.assertEqual(
+                    fetch_results(app=self.app, name=name, channel=channel),
+                    [])
+
+                send_result(app=self.app,
+                            name=name,
+                            result={'shard_index': 1})
+
+                self.assertEqual(
+                    fetch_results(app=self.app, name=name, channel=channel),
+                    [{'shard_index': 1}])
+        finally:
+            delete_results_queue(app=self.app, name=name)
+
+    def test_send_result_with_deleted_queue(self):
+        """Testing send_result with a deleted results queue drops the
+        result
+        """
+        name = create_results_queue(app=self.app, expires=60)
+        self.assertTrue(results_queue_exists(app=self.app, name=name))
+
+        delete_results_queue(app=self.app, name=name)
+        self.assertFalse(results_queue_exists(app=self.app, name=name))
+
+        with self.assertLogs('reviewbot.results', level='WARNING') as logs:
+            self.assertFalse(send_result(app=self.app,
+                                         name=name,
+                                         result={'shard_index': 1}))
+
+        self.assertIn('no longer exists', logs.output[0])
+
+    def test_create_results_queue_shared_exchange(self):
+        """Testing create_results_queue binds queues to the shared results
+        exchange
+        """
+        name1 = create_results_queue(app=self.app, expires=60)
+        name2 = create_results_queue(app=self.app, expires=60)
+
+        try:
+            self.assertTrue(send_result(app=self.app,
+                                        name=name1,
+                                        result={'shard_index': 1}))
+
+            self.assertEqual(fetch_results(app=self.app, name=name1),
+                             [{'shard_index': 1}])
+            self.assertEqual(fetch_results(app=self.app, name=name2), [])
+
+            with self.app.connection_for_read() as conn:
+                exchange = RESULTS_EXCHANGE(conn.default_channel)
+                exchange.declare(passive=True)
+        finally:
+            delete_results_queue(app=self.app, name=name1)
+            delete_results_queue(app=self.app, name=name2)
+
+    def test_create_results_queue_unique(self):
+        """Testing create_results_queue returns a new queue each time"""
+        name1 = create_results_queue(app=self.app, expires=60)
+        name2 = create_results_queue(app=self.app, expires=60)
+
+        try:
+            self.assertNotEqual(name1, name2)
+        finally:
+            delete_results_queue(app=self.app, name=name1)
+            delete_results_queue(app=self.app, name=name2)
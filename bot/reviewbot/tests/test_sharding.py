@@ -0,0 +1,122 @@
+"""Unit tests for reviewbot.sharding."""
+
+from __future__ import annotations
+
+import kgb
+
+from reviewbot.celery import get_celery
+from reviewbot.sharding import (fetch_worker_repositories,
+                                get_owned_repositories,
+                                get_shard_owners,
+                                is_sharding_enabled)
+from reviewbot.testing import TestCase
+
+
+class ShardingTests(kgb.SpyAgency, TestCase):
+    """Unit tests for reviewbot.sharding."""
+
+    def test_is_sharding_enabled(self):
+        """Testing is_sharding_enabled"""
+        self.assertFalse(is_sharding_enabled())
+
+        with self.override_config({'repository_shard_replicas': 2}):
+            self.assertTrue(is_sharding_enabled())
+
+    def test_get_shard_owners(self):
+        """Testing get_shard_owners"""
+        hostnames = ['worker%d' % _i for _i in range(10)]
+        owners = get_shard_owners('repo1', hostnames, 3)
+
+        self.assertEqual(len(owners), 3)
+        self.assertEqual(len(set(owners)), 3)
+
+        # The result must not depend on the order of the workers.
+        self.assertEqual(get_shard_owners('repo1', hostnames[::-1], 3),
+                         owners)
+
+    def test_get_shard_owners_with_fewer_workers(self):
+        """Testing get_shard_owners with fewer workers than replicas"""
+        self.assertEqual(
+            sorted(get_shard_owners('repo1', ['worker1', 'worker2'], 3)),
+            ['worker1', 'worker2'])
+
+    def test_get_shard_owners_with_worker_added(self):
+        """Testing get_shard_owners with a worker joining only moves
+        repositories to that worker
+        """
+        hostnames = ['worker%d' % _i for _i in range(10)]
+
+        for i in range(100):
+            repo_name = 'repo%d' % i
+            old_owners = set(get_shard_owners(repo_name, hostnames, 2))
+            new_owners = set(get_shard_owners(repo_name,
+                                              hostnames + ['new-worker'],
+                                              2))
+
+            self.assertTrue(new_owners - old_owners <= {'new-worker'})
+
+    def test_get_owned_repositories(self):
+        """Testing get_owned_repositories"""
+        worker_repositories = {
+            'worker1': {'repo1', 'repo2', 'repo3'},
+            'worker2': {'repo1', 'repo2'},
+            'worker3': {'repo1'},
+        }
+
+        with self.override_config({'repository_shard_replicas': 1}):
+            owned = {
+                _hostname: get_owned_repositories(_hostname,
+                                                  worker_repositories)
+                for _hostname in worker_repositories
+            }
+
+        # Each repository should be owned by exactly one worker that has it
+        # configured.
+        for repo_name in ('repo1', 'repo2', 'repo3'):
+            self.assertEqual(
+                len([
+                    _hostname
+                    for _hostname, _repo_names in owned.items()
+                    if repo_name in _repo_names
+                ]),
+                1)
+
+        self.assertIn('repo3', owned['worker1'])
+
+    def test_fetch_worker_repositories(self):
+        """Testing fetch_worker_repositories"""
+        celery = get_celery()
+
+        self.spy_on(
+            celery.control.broadcast,
+            op=kgb.SpyOpReturn([
+                {'worker2': {'repositories': ['repo1', 'repo2']}},
+                {'worker3': {'error': 'No such command'}},
+                {'worker1': {'repositories': ['old']}},
+            ]))
+
+        self.assertEqual(
+            fetch_worker_repositories(celery, 'worker1', {'repo1'}),
+            {
+                'worker1': {'repo1'},
+                'worker2': {'repo1', 'repo2'},
+            })
+        self.assertSpyCalledWith(celery.control.broadcast,
+                                 'get_worker_repositories',
+                                 reply=True,
+                                 timeout=1.0)
+
+    def test_fetch_worker_repositories_with_error(self):
+        """Testing fetch_worker_repositories with an error contacting the
+        broker
+        """
+        celery = get_celery()
+
+        self.spy_on(celery.control.broadcast,
+                    op=kgb.SpyOpRaise(IOError('Oh no.')))
+
+        self.assertEqual(
+            fetch_worker_repositories(celery, 'worker1', {'repo1'}),
+            {
+                'worker1': {'repo1'},
+            })
@@ -2,21 +2,43 @@
 
 from __future__ import annotations
 
+from contextlib import nullcontext
+
 import kgb
 from celery.worker.control import Panel
+from kombu import Connection
 from rbtools.api.errors import APIError, AuthorizationError
 
+from reviewbot.batching import QueuedTask, take_queued_tasks
+from reviewbot.celery import (LARGE_TASK_RETRY_DELAY,
+                              TOOL_TASK_RETRY_DELAY,
+                              acquire_task_slot,
+                              release_task_slot,
+                              setup_large_task_slots,
+                              setup_tool_slots)
 from reviewbot.processing.review import Review
 from reviewbot.repositories import GitRepository, repositories
-from reviewbot.tasks import RunTool, update_tools_list
+from reviewbot.results import (create_results_queue,
+                               delete_results_queue,
+                               fetch_results,
+                               results_queue_exists,
+                               send_result)
+from reviewbot.tasks import (RunTool,
+                             RunToolShard,
+                             RunTools,
+                             celery,
+                             get_worker_repositories,
+                             update_tools_list)
 from reviewbot.testing import TestCase
-from reviewbot.testing.testcases import (ReviewBotToolsResource,
+from reviewbot.testing.testcases import (DummyFileDiffResource,
+                                         ReviewBotToolsResource,
                                          StatusUpdateResource)
-from reviewbot.tools.base import BaseTool
+from reviewbot.tools.base import BaseTool, FullRepositoryToolMixin
 from reviewbot.tools.base.registry import (_registered_tools,
                                            register_tool_class,
                                            unregister_tool_class)
 from reviewbot.utils.api import get_api_root
+from reviewbot.utils.filesystem import make_tempdir
 
 
 class DummyTool(BaseTool):
@@ -41,6 +63,12 @@ class FullRepoTool(BaseTool):
     version = '2'
 
 
+class FullRepoMixinTool(FullRepositoryToolMixin, BaseTool):
+    name = 'FullRepoMixin'
+    tool_id = 'full-repo-mixin'
+    description = 'This is the full repository mixin tool.'
+
+
 class FailedDepCheckTool(BaseTool):
     name = 'FailedDepCheck'
     tool_id = 'failed-dep-check'
@@ -48,6 +76,21 @@ class FailedDepCheckTool(BaseTool):
     exe_dependencies = ['xxx-bad-dep']
 
 
+class DummyMessage(object):
+    """A broker message for batching tests."""
+
+    def __init__(self):
+        self.acknowledged = False
+        self.requeued = False
+
+    def ack(self):
+        self.acknowledged = True
+
+    def requeue(self):
+        self.acknowledged = True
+        self.requeued = True
+
+
 class BaseTaskTestCase(kgb.SpyAgency, TestCase):
     @classmethod
     def setUpClass(cls):
@@ -97,6 +140,25 @@ class BaseTaskTestCase(kgb.SpyAgency, TestCase):
         kwargs['throw'] = True
         return task.apply(kwargs=kwargs).get()
 
+    def _set_status_update_state(self, status_update, state):
+        """Set the state of a fetched status update.
+
+        Args:
+            status_update (rbtools.api.resource.StatusUpdateResource):
+                The status update to modify.
+
+            state (str):
+                The state to set. ``superseded`` marks the status update
+                the way the extension does when a newer diff is published.
+        """
+        if state == 'superseded':
+            status_update._fields['state'] = 'error'
+            status_update._fields['extra_data'] = {
+                'reviewbot_superseded': True,
+            }
+        else:
+            status_update._fields['state'] = state
+
 
 class RunToolTests(BaseTaskTestCase):
     """Unit tests for reviewbot.tasks.RunTool."""
@@ -264,6 +326,172 @@ class RunToolTests(BaseTaskTestCase):
                                  description='passed.')
         self.assertSpyCallCount(StatusUpdateResource.update, 2)
 
+    def test_with_batch(self):
+        """Testing RunTool task with run_tool_batch_size running queued tasks
+        """
+        self.spy_on(DummyTool.__init__, owner=DummyTool)
+
+        queued_tasks = [
+            QueuedTask(message=DummyMessage(),
+                       task_id='task2',
+                       kwargs={
+                           'diff_revision': 2,
+                           'review_request_id': 124,
+                           'review_settings': {},
+                           'server_url': 'https://reviews.example.com/',
+                           'status_update_id': 2,
+                       }),
+            QueuedTask(message=DummyMessage(),
+                       task_id='task3',
+                       kwargs={
+                           'diff_revision': 3,
+                           'review_request_id': 125,
+                           'review_settings': {},
+                           'server_url': 'https://reviews.example.com/',
+                           'status_update_id': 3,
+                       }),
+        ]
+
+        self.spy_on(take_queued_tasks,
+                    op=kgb.SpyOpReturn(nullcontext(queued_tasks)))
+
+        with self.override_config({'run_tool_batch_size': 3}):
+            result = self.run_tools_task(routing_key=DummyTool.tool_id)
+
+        self.assertTrue(result)
+        self.assertSpyCalledWith(take_queued_tasks,
+                                 queue_name=DummyTool.tool_id,
+                                 task_name='reviewbot.tasks.RunTool',
+                                 max_count=2)
+
+        # The queued tasks should only be acknowledged once they've run.
+        for queued_task in queued_tasks:
+            self.assertTrue(queued_task.message.acknowledged)
+            self.assertFalse(queued_task.message.requeued)
+
+        # The API root and tool should be shared across the batch.
+        self.assertSpyCallCount(get_api_root, 1)
+        self.assertSpyCallCount(DummyTool.__init__, 1)
+        self.assertSpyCallCount(DummyTool.execute, 3)
+
+        self.assertSpyCallCount(StatusUpdateResource.update, 6)
+
+    def test_with_batch_disabled(self):
+        """Testing RunTool task without run_tool_batch_size doesn't check
+        for queued tasks
+        """
+        self.spy_on(take_queued_tasks)
+
+        result = self.run_tools_task(routing_key=DummyTool.tool_id)
+
+        self.assertTrue(result)
+        self.assertSpyNotCalled(take_queued_tasks)
+
+    def test_with_large_change(self):
+        """Testing RunTool task for a large change with a free slot"""
+        routing_key = '%s.large' % DummyTool.tool_id
+
+        with self.override_config({'reserved_small_task_slots': 1}):
+            setup_large_task_slots(2)
+
+        try:
+            self.spy_on(RunTool.retry, call_original=False)
+
+            result = self.run_tools_task(routing_key=routing_key)
+
+            self.assertTrue(result)
+            self.assertSpyCalled(DummyTool.execute)
+            self.assertSpyNotCalled(RunTool.retry)
+
+            # The slot should have been released.
+            self.assertTrue(acquire_task_slot(routing_key))
+            release_task_slot(routing_key)
+        finally:
+            setup_large_task_slots(2)
+
+    def test_with_large_change_no_free_slots(self):
+        """Testing RunTool task for a large change with no free slots
+        defers the task
+        """
+        routing_key = '%s.large' % DummyTool.tool_id
+
+        with self.override_config({'reserved_small_task_slots': 1}):
+            setup_large_task_slots(2)
+
+        try:
+            self.assertTrue(acquire_task_slot(routing_key))
+            self.spy_on(RunTool.retry, call_original=False)
+
+            result = self.run_tools_task(routing_key=routing_key,
+                                         status_update_id=1)
+
+            self.assertFalse(result)
+            self.assertSpyNotCalled(DummyTool.execute)
+            self.assertSpyNotCalled(StatusUpdateResource.update)
+            self.assertSpyCalledOnceWith(RunTool.retry,
+                                         countdown=LARGE_TASK_RETRY_DELAY,
+                                         queue=routing_key)
+
+            release_task_slot(routing_key)
+        finally:
+            setup_large_task_slots(2)
+
+    def test_with_tool_concurrency_no_free_slots(self):
+        """Testing RunTool task with no free tool_concurrency slots defers
+        the task
+        """
+        routing_key = DummyTool.tool_id
+
+        with self.override_config({'tool_concurrency': {routing_key: 1}}):
+            setup_tool_slots()
+
+        try:
+            self.assertTrue(acquire_task_slot(routing_key))
+            self.spy_on(RunTool.retry, call_original=False)
+
+            result = self.run_tools_task(routing_key=routing_key)
+
+            self.assertFalse(result)
+            self.assertSpyNotCalled(DummyTool.execute)
+            self.assertSpyCalledOnceWith(RunTool.retry,
+                                         countdown=TOOL_TASK_RETRY_DELAY,
+                                         queue=routing_key)
+        finally:
+            setup_tool_slots()
+
+    def test_with_superseded(self):
+        """Testing RunTool task with a status update superseded by a newer
+        diff before starting
+        """
+        self._spy_on_status_update_states(['superseded'])
+
+        result = self.run_tools_task(routing_key=DummyTool.tool_id)
+
+        self.assertFalse(result)
+        self.assertSpyCallCount(self.api_root.get_status_update, 1)
+        self.assertSpyNotCalled(DummyTool.execute)
+        self.assertSpyNotCalled(StatusUpdateResource.update)
+
+    def test_with_superseded_during_run(self):
+        """Testing RunTool task with a status update superseded by a newer
+        diff while running the tool
+        """
+        self._spy_on_status_update_states(['pending', 'pending',
+                                           'superseded'])
+
+        result = self.run_tools_task(routing_key=DummyTool.tool_id)
+
+        self.assertFalse(result)
+        self.assertSpyCallCount(self.api_root.get_status_update, 3)
+        self.assertSpyCalled(DummyTool.execute)
+        self.assertSpyNotCalled(Review.publish)
+
+        # Only the initial update should have been made. The status update
+        # belongs to the newer diff now.
+        self.assertSpyCallCount(StatusUpdateResource.update, 1)
+        self.assertSpyCalledWith(StatusUpdateResource.update,
+                                 description='running...')
+
     def test_with_error_contacting_rb_api(self):
         """Testing RunTool task with error contacting Review Board API"""
         get_api_root.unspy()
@@ -373,6 +601,25 @@ class RunToolTests(BaseTaskTestCase):
                                  description='Diff does not include parent '
                                              'commit information.')
 
+    def _spy_on_status_update_states(self, states):
+        """Spy on fetching status updates, returning the given states.
+
+        Args:
+            states (list of str):
+                The state to return for each fetch of a status update.
+        """
+        api_root = self.api_root
+
+        @self.spy_for(api_root.get_status_update)
+        def _get_status_update(_self, review_request_id, status_update_id,
+                               **kwargs):
+            status_update = api_root.get_status_update.call_original(
+                review_request_id=review_request_id,
+                status_update_id=status_update_id)
+            self._set_status_update_state(status_update, states.pop(0))
+
+            return status_update
+
     def run_tools_task(self, routing_key, **kwargs):
         """Call the RunTools.
 
@@ -409,6 +656,560 @@ class RunToolTests(BaseTaskTestCase):
         return self.call_task(RunTool, **task_kwargs)
 
 
+class RunToolsTests(BaseTaskTestCase):
+    """Unit tests for reviewbot.tasks.RunTools."""
+
+    @classmethod
+    def setUpClass(cls):
+        super(RunToolsTests, cls).setUpClass()
+
+        register_tool_class(FullRepoMixinTool)
+
+    @classmethod
+    def tearDownClass(cls):
+        super(RunToolsTests, cls).tearDownClass()
+
+        unregister_tool_class(FullRepoMixinTool.tool_id)
+
+    def setUp(self):
+        super(RunToolsTests, self).setUp()
+
+        self.spy_on(get_api_root,
+                    op=kgb.SpyOpReturn(self.api_root))
+        self.spy_on(StatusUpdateResource.update,
+                    owner=StatusUpdateResource)
+        self.spy_on(Review.__init__,
+                    owner=Review)
+        self.spy_on(Review.publish,
+                    owner=Review)
+
+    def test_with_multiple_configurations(self):
+        """Testing RunTools task with multiple configurations"""
+        @self.spy_for(DummyTool.handle_file, owner=DummyTool)
+        def _handle_file(_self, f, *args, **kwargs):
+            if _self.settings.get('complain'):
+                f.comment('Bad line!', first_line=1)
+
+        filediff = self.create_filediff_resource()
+        self.spy_on(filediff.get_patched_file)
+        self.spy_on(self.api_root.get_files,
+                    op=kgb.SpyOpReturn([filediff]))
+
+        result = self.run_tools_task(
+            routing_key=DummyTool.tool_id,
+            tools=[
+                self._make_tool_info(status_update_id=1,
+                                     tool_options={'complain': True}),
+                self._make_tool_info(status_update_id=2),
+            ])
+
+        self.assertTrue(result)
+        self.assertSpyCallCount(Review.__init__, 1)
+        self.assertSpyCallCount(filediff.get_patched_file, 1)
+        self.assertSpyCallCount(DummyTool.handle_file, 2)
+        self.assertSpyCallCount(Review.publish, 1)
+
+        self.assertSpyCalledWith(StatusUpdateResource.update,
+                                 state='done-failure',
+                                 description='failed.',
+                                 review_id=123)
+        self.assertSpyCalledWith(StatusUpdateResource.update,
+                                 state='done-success',
+                                 description='passed.')
+        self.assertSpyCallCount(StatusUpdateResource.update, 4)
+
+    def test_with_full_repo_tool(self):
+        """Testing RunTools task with full-repository tool shares one
+        working directory
+        """
+        self.spy_on(FullRepoMixinTool.execute,
+                    owner=FullRepoMixinTool)
+
+        repository = GitRepository(name='MyRepo',
+                                   clone_path='git://example.com/repo')
+        repositories['MyRepo'] = repository
+        self.spy_on(repository.sync, call_original=False)
+
+        working_dir = make_tempdir()
+
+        self.spy_on(FullRepoMixinTool.prepare_working_dir,
+                    owner=FullRepoMixinTool,
+                    op=kgb.SpyOpReturn(working_dir))
+
+        try:
+            result = self.run_tools_task(
+                base_commit_id='abc123',
+                routing_key=FullRepoMixinTool.tool_id,
+                repository_name='MyRepo',
+                tools=[
+                    self._make_tool_info(status_update_id=1),
+                    self._make_tool_info(status_update_id=2),
+                ])
+        finally:
+            repositories.clear()
+
+        self.assertTrue(result)
+        self.assertSpyCallCount(repository.sync, 1)
+        self.assertSpyCallCount(FullRepoMixinTool.prepare_working_dir, 1)
+        self.assertSpyCalledWith(FullRepoMixinTool.prepare_working_dir,
+                                 repository=repository,
+                                 base_commit_id='abc123',
+                                 checkout_paths=None)
+        self.assertSpyCallCount(FullRepoMixinTool.execute, 2)
+        self.assertSpyCalledWith(FullRepoMixinTool.execute,
+                                 base_commit_id='abc123',
+                                 repository=repository,
+                                 working_dir=working_dir)
+
+        self.assertSpyCallCount(StatusUpdateResource.update, 4)
+
+    def test_with_error_execute_tool(self):
+        """Testing RunTools task with error executing one configuration"""
+        @self.spy_for(DummyTool.execute, owner=DummyTool)
+        def _execute(_self, review, **kwargs):
+            if _self.settings.get('fail'):
+                raise Exception('oh no')
+
+        result = self.run_tools_task(
+            routing_key=DummyTool.tool_id,
+            tools=[
+                self._make_tool_info(status_update_id=1,
+                                     tool_options={'fail': True}),
+                self._make_tool_info(status_update_id=2),
+            ])
+
+        self.assertFalse(result)
+        self.assertSpyCallCount(DummyTool.execute, 2)
+
+        self.assertSpyCalledWith(StatusUpdateResource.update,
+                                 state='error',
+                                 description='internal error.')
+        self.assertSpyCalledWith(StatusUpdateResource.update,
+                                 state='done-success',
+                                 description='passed.')
+        self.assertSpyCallCount(StatusUpdateResource.update, 4)
+
+    def test_with_error_creating_review(self):
+        """Testing RunTools task with error creating Review object"""
+        Review.__init__.unspy()
+        self.spy_on(Review.__init__,
+                    owner=Review,
+                    op=kgb.SpyOpRaise(Exception('oh no')))
+
+        result = self.run_tools_task(
+            routing_key=DummyTool.tool_id,
+            tools=[
+                self._make_tool_info(status_update_id=1),
+                self._make_tool_info(status_update_id=2),
+            ])
+
+        self.assertFalse(result)
+        self.assertSpyCalledWith(StatusUpdateResource.update,
+                                 state='error',
+                                 description='internal error.')
+        self.assertSpyCallCount(StatusUpdateResource.update, 2)
+
+    def run_tools_task(self, routing_key, **kwargs):
+        """Call the RunTools task.
+
+        Args:
+            routing_key (str):
+                The routing key to pass for the task.
+
+            **kwargs (dict):
+                Additional keyword arguments to provide for the task.
+
+        Returns:
+            object:
+            The result of the task.
+        """
+        task_kwargs = {
+            'delivery_info': {
+                'routing_key': routing_key,
+            },
+            'diff_revision': 1,
+            'review_request_id': 123,
+            'server_url': 'https://reviews.example.com/',
+        }
+        task_kwargs.update(kwargs)
+
+        return self.call_task(RunTools, **task_kwargs)
+
+    def _make_tool_info(self, status_update_id, tool_options={}):
+        """Return information on a configuration to run.
+
+        Args:
+            status_update_id (int):
+                The ID of the status update.
+
+            tool_options (dict, optional):
+                The tool options.
+
+        Returns:
+            dict:
+            The configuration information for the task.
+        """
+        return {
+            'status_update_id': status_update_id,
+            'review_settings': {
+                'comment_unmodified': False,
+                'max_comments': 100,
+                'open_issues': True,
+            },
+            'tool_options': tool_options,
+        }
+
+
+class RunToolShardsTests(BaseTaskTestCase):
+    """Unit tests for splitting reviews across RunToolShard tasks."""
+
+    def setUp(self):
+        super(RunToolShardsTests, self).setUp()
+
+        self.sent_tasks = []
+        self.sent_results = []
+
+        self.spy_on(get_api_root,
+                    op=kgb.SpyOpReturn(self.api_root))
+        self.spy_on(StatusUpdateResource.update,
+                    owner=StatusUpdateResource)
+
+        @self.spy_for(DummyTool.handle_file, owner=DummyTool)
+        def _handle_file(_self, f, *args, **kwargs):
+            f.comment('Bad file %s!' % f.id, first_line=1)
+
+        self.spy_on(
+            self.api_root.get_files,
+            op=kgb.SpyOpReturn([
+                self.create_filediff_resource(filediff_id=_i,
+                                              source_file='test%s.py' % _i,
+                                              dest_file='test%s.py' % _i)
+                for _i in range(1, 6)
+            ]))
+
+        self.published_reviews = []
+
+        @self.spy_for(Review.publish, owner=Review)
+        def _publish(_self):
+            self.published_reviews.append(_self)
+
+            return Review.publish.call_original(_self)
+
+        # Simulate the broker.
+        self.spy_on(celery.connection_for_read,
+                    call_fake=lambda _self, url=None, **kwargs:
+                        Connection('memory://'))
+        self.spy_on(create_results_queue,
+                    op=kgb.SpyOpReturn('reviewbot.results.test'))
+        self.spy_on(delete_results_queue,
+                    call_original=False)
+
+        @self.spy_for(celery.send_task)
+        def _send_task(_self, name, kwargs=None, **options):
+            self.sent_tasks.append(kwargs)
+
+        @self.spy_for(take_queued_tasks)
+        def _take_queued_tasks(*args, **kwargs):
+            max_count = kwargs['max_count']
+            results = [
+                QueuedTask(message=DummyMessage(),
+                           task_id=None,
+                           kwargs=task_kwargs)
+                for task_kwargs in self.sent_tasks[:max_count]
+            ]
+            del self.sent_tasks[:max_count]
+
+            return nullcontext(results)
+
+        self.spy_on(results_queue_exists,
+                    op=kgb.SpyOpReturn(True))
+
+        @self.spy_for(send_result)
+        def _send_result(app, name, result):
+            self.sent_results.append(result)
+
+            return True
+
+        @self.spy_for(fetch_results)
+        def _fetch_results(app, name, channel=None):
+            results = self.sent_results[:]
+            del self.sent_results[:]
+
+            return results
+
+    def test_without_max_files_per_task(self):
+        """Testing RunTool task without max_files_per_task doesn't split
+        the review
+        """
+        result = self.run_tools_task(routing_key=DummyTool.tool_id)
+
+        self.assertTrue(result)
+        self.assertSpyNotCalled(create_results_queue)
+        self.assertSpyCallCount(DummyTool.handle_file, 5)
+        self.assertEqual(len(self.published_reviews), 1)
+        self.assertEqual(len(self.published_reviews[0].comments), 5)
+
+    def test_with_max_files_per_task(self):
+        """Testing RunTool task with max_files_per_task splitting the review
+        across tasks
+        """
+        with self.override_config({'max_files_per_task': {'dummy': 2}}):
+            result = self.run_tools_task(routing_key=DummyTool.tool_id)
+
+        self.assertTrue(result)
+        self.assertSpyCallCount(celery.send_task, 2)
+        self.assertEqual(
+            [
+                call.kwargs['kwargs']['filediff_ids']
+                for call in celery.send_task.calls
+            ],
+            [[3, 4], [5]])
+        self.assertSpyCalledWith(delete_results_queue,
+                                 name='reviewbot.results.test')
+
+        self.assertSpyCallCount(DummyTool.handle_file, 5)
+        self.assertEqual(len(self.published_reviews), 1)
+
+        review = self.published_reviews[0]
+        self.assertEqual(
+            [comment['filediff_id'] for comment in review.comments],
+            [1, 2, 3, 4, 5])
+
+        self.assertSpyCalledWith(StatusUpdateResource.update,
+                                 state='done-failure',
+                                 description='failed.',
+                                 review_id=123)
+
+    def test_with_max_files_per_task_and_error(self):
+        """Testing RunTool task with max_files_per_task and an error
+        reviewing some files
+        """
+        DummyTool.handle_file.unspy()
+
+        @self.spy_for(DummyTool.handle_file, owner=DummyTool)
+        def _handle_file(_self, f, *args, **kwargs):
+            if f.id == 4:
+                raise Exception('oh no')
+
+        with self.override_config({'max_files_per_task': {'dummy': 2}}):
+            result = self.run_tools_task(routing_key=DummyTool.tool_id)
+
+        self.assertFalse(result)
+        self.assertSpyNotCalled(Review.publish)
+        self.assertSpyCalledWith(StatusUpdateResource.update,
+                                 state='error',
+                                 description='internal error.')
+
+    def test_with_max_files_per_task_and_superseded(self):
+        """Testing RunTool task with max_files_per_task and a status update
+        superseded while other tasks review files
+        """
+        self._spy_on_status_update_states(['pending', 'pending'])
+
+        with self.override_config({'max_files_per_task': {'dummy': 2}}):
+            result = self.run_tools_task(routing_key=DummyTool.tool_id,
+                                         status_update_id=1)
+
+        self.assertFalse(result)
+        self.assertEqual(
+            [
+                call.kwargs['kwargs']['status_update_id']
+                for call in celery.send_task.calls
+            ],
+            [1, 1])
+
+        # The first task to find the status update superseded stops the
+        # review. The remaining files aren't reviewed.
+        self.assertSpyCallCount(DummyTool.handle_file, 2)
+        self.assertSpyNotCalled(Review.publish)
+        self.assertSpyCalledWith(delete_results_queue,
+                                 name='reviewbot.results.test')
+
+    def test_run_tool_shard(self):
+        """Testing RunToolShard task"""
+        self.spy_on(DummyFileDiffResource.get_diff_data,
+                    owner=DummyFileDiffResource)
+
+        result = self.call_task(
+            RunToolShard,
+            delivery_info={
+                'routing_key': DummyTool.tool_id,
+            },
+            server_url='https://reviews.example.com/',
+            review_request_id=123,
+            diff_revision=1,
+            review_settings={
+                'comment_unmodified': False,
+                'max_comments': 100,
+                'open_issues': True,
+            },
+            filediff_ids=[2, 5],
+            shard_index=3,
+            results_queue='reviewbot.results.test')
+
+        self.assertTrue(result)
+        self.assertSpyCallCount(send_result, 1)
+        self.assertSpyCalledWith(send_result,
+                                 name='reviewbot.results.test')
+
+        # Only the files being reviewed should have been fetched.
+        self.assertSpyCallCount(DummyFileDiffResource.get_diff_data, 2)
+
+        self.assertEqual(len(self.sent_results), 1)
+
+        sent_result = self.sent_results[0]
+        self.assertEqual(sent_result['shard_index'], 3)
+        self.assertEqual(
+            [comment['filediff_id'] for comment in sent_result['comments']],
+            [2, 5])
+        self.assertEqual(sent_result['general_comments'], [])
+        self.assertIsNone(sent_result['output'])
+
+    def test_run_tool_shard_with_results_queue_deleted(self):
+        """Testing RunToolShard task with the results queue deleted skips
+        the review
+        """
+        results_queue_exists.unspy()
+        self.spy_on(results_queue_exists,
+                    op=kgb.SpyOpReturn(False))
+
+        result = self.call_task(
+            RunToolShard,
+            delivery_info={
+                'routing_key': DummyTool.tool_id,
+            },
+            server_url='https://reviews.example.com/',
+            review_request_id=123,
+            diff_revision=1,
+            filediff_ids=[2, 5],
+            shard_index=3,
+            results_queue='reviewbot.results.test')
+
+        self.assertFalse(result)
+        self.assertSpyCalledWith(results_queue_exists,
+                                 name='reviewbot.results.test')
+        self.assertSpyNotCalled(self.api_root.get_files)
+        self.assertSpyNotCalled(DummyTool.handle_file)
+        self.assertSpyNotCalled(send_result)
+
+    def test_run_tool_shard_with_superseded(self):
+        """Testing RunToolShard task with a status update superseded by a
+        newer diff
+        """
+        self._spy_on_status_update_states([])
+
+        result = self.call_task(
+            RunToolShard,
+            delivery_info={
+                'routing_key': DummyTool.tool_id,
+            },
+            server_url='https://reviews.example.com/',
+            review_request_id=123,
+            diff_revision=1,
+            status_update_id=1,
+            filediff_ids=[2, 5],
+            shard_index=3,
+            results_queue='reviewbot.results.test')
+
+        self.assertFalse(result)
+        self.assertSpyNotCalled(self.api_root.get_files)
+        self.assertSpyNotCalled(DummyTool.handle_file)
+        self.assertEqual(self.sent_results,
+                         [{'superseded': True, 'shard_index': 3}])
+
+    def test_run_tool_shard_with_large_change_no_free_slots(self):
+        """Testing RunToolShard task for a large change with no free slots
+        defers the task
+        """
+        routing_key = '%s.large' % DummyTool.tool_id
+
+        with self.override_config({'reserved_small_task_slots': 1}):
+            setup_large_task_slots(2)
+
+        try:
+            self.assertTrue(acquire_task_slot(routing_key))
+            self.spy_on(RunToolShard.retry, call_original=False)
+
+            result = self.call_task(
+                RunToolShard,
+                delivery_info={
+                    'routing_key': routing_key,
+                },
+                server_url='https://reviews.example.com/',
+                review_request_id=123,
+                diff_revision=1,
+                filediff_ids=[2, 5],
+                shard_index=3,
+                results_queue='reviewbot.results.test')
+
+            self.assertFalse(result)
+            self.assertSpyNotCalled(DummyTool.handle_file)
+            self.assertSpyNotCalled(send_result)
+            self.assertSpyCalledOnceWith(RunToolShard.retry,
+                                         countdown=LARGE_TASK_RETRY_DELAY,
+                                         queue=routing_key)
+
+            release_task_slot(routing_key)
+        finally:
+            setup_large_task_slots(2)
+
+    def _spy_on_status_update_states(self, states):
+        """Spy on fetching status updates, returning the given states.
+
+        Once the states run out, status updates are returned as superseded.
+
+        Args:
+            states (list of str):
+                The state to return for each fetch of a status update.
+        """
+        api_root = self.api_root
+
+        @self.spy_for(api_root.get_status_update)
+        def _get_status_update(_self, review_request_id, status_update_id,
+                               **kwargs):
+            status_update = api_root.get_status_update.call_original(
+                review_request_id=review_request_id,
+                status_update_id=status_update_id)
+
+            if states:
+                self._set_status_update_state(status_update, states.pop(0))
+            else:
+                self._set_status_update_state(status_update, 'superseded')
+
+            return status_update
+
+    def run_tools_task(self, routing_key, **kwargs):
+        """Call the RunTool task.
+
+        Args:
+            routing_key (str):
+                The routing key to pass for the task.
+
+            **kwargs (dict):
+                Additional keyword arguments to provide for the task.
+
+        Returns:
+            object:
+            The result of the task.
+        """
+        task_kwargs = {
+            'delivery_info': {
+                'routing_key': routing_key,
+            },
+            'diff_revision': 1,
+            'review_request_id': 123,
+            'review_settings': {
+                'comment_unmodified': True,
+                'max_comments': 100,
+                'open_issues': True,
+            },
+            'server_url': 'https://reviews.example.com/',
+        }
+        task_kwargs.update(kwargs)
+
+        return self.call_task(RunTool, **task_kwargs)
+
+
 class UpdateToolsListTests(BaseTaskTestCase):
     """Unit tests for reviewbot.tasks.update_tools_list."""
 
@@ -513,3 +1314,25 @@ class UpdateToolsListTests(BaseTaskTestCase):
             ),
             'status': 'error',
         })
+
+
+class GetWorkerRepositoriesTests(BaseTaskTestCase):
+    """Unit tests for reviewbot.tasks.get_worker_repositories."""
+
+    def test_get_worker_repositories(self):
+        """Testing get_worker_repositories"""
+        repositories['MyRepo2'] = GitRepository(
+            name='MyRepo2',
+            clone_path='git://example.com/repo2')
+        repositories['MyRepo1'] = GitRepository(
+            name='MyRepo1',
+            clone_path='git://example.com/repo1')
+
+        try:
+            result = get_worker_repositories(Panel())
+        finally:
+            repositories.clear()
+
+        self.assertEqual(result, {
+            'repositories': ['MyRepo1', 'MyRepo2'],
+        })
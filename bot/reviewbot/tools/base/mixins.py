@@ -10,6 +10,7 @@ import os
 import re
 
 from reviewbot.config import config
+from reviewbot.repositories import PATCH_STRATEGY_DIFF
 from reviewbot.utils.filesystem import chdir
 from reviewbot.utils.process import execute
 from reviewbot.utils.text import split_comma_separated
@@ -111,9 +112,168 @@ class FullRepositoryToolMixin(object):
 
     working_directory_required = True
 
-    def execute(self, review, repository=None, base_commit_id=None, **kwargs):
+    #: Whether the tool can run against a sparse checkout of the repository.
+    #:
+    #: If set, only the directories containing files in the diff, along with
+    #: any returned by :py:meth:`get_extra_checkout_paths`, will be checked
+    #: out, rather than the full tree. Files at the root of the repository
+    #: are always checked out.
+    #:
+    #: This should only be enabled for tools that don't need access to the
+    #: rest of the tree (such as other packages being imported).
+    #:
+    #: Version Added:
+    #:     5.0
+    #:
+    #: Type:
+    #:     bool
+    sparse_checkout = False
+
+    def get_extra_checkout_paths(self, review, repository=None,
+                                 base_commit_id=None, **kwargs):
+        """Return additional directories needed in a sparse checkout.
+
+        Subclasses can override this to include directories containing
+        files that the tool needs in order to run, such as workspace roots
+        or module definitions. This is only used if
+        :py:attr:`sparse_checkout` is set.
+
+        Version Added:
+            5.0
+
+        Args:
+            review (reviewbot.processing.review.Review):
+                The review object.
+
+            repository (reviewbot.repositories.BaseRepository, optional):
+                The repository, which has already been synced.
+
+            base_commit_id (str, optional):
+                The ID of the commit that will be checked out.
+
+            **kwargs (dict, unused):
+                Additional keyword arguments, for future expansion.
+
+        Returns:
+            list of str:
+            A list of directories, relative to the root of the repository,
+            or ``None`` to check out the full tree.
+        """
+        return []
+
+    def get_manifest_dirs(self, repository, base_commit_id, manifest_names):
+        """Return the directories containing manifest files in a commit.
+
+        Tools can use this from :py:meth:`get_extra_checkout_paths` to find
+        the projects (such as Go modules or Cargo crates) in the repository,
+        without checking anything out.
+
+        Version Added:
+            5.0
+
+        Args:
+            repository (reviewbot.repositories.BaseRepository):
+                The repository, which has already been synced.
+
+            base_commit_id (str):
+                The ID of the commit that will be checked out.
+
+            manifest_names (list of str):
+                The filenames of the manifest files to look for, such as
+                :file:`go.mod`.
+
+        Returns:
+            set of str:
+            The directories, relative to the root of the repository, that
+            contain a manifest file. The root of the repository is included
+            as an empty string.
+
+            This will be ``None`` if the files in the commit couldn't be
+            listed.
+        """
+        if repository is None or not base_commit_id:
+            return None
+
+        try:
+            file_paths = repository.get_file_paths(base_commit_id)
+        except Exception as e:
+            self.logger.warning('Unable to list files in commit %s: %s',
+                                base_commit_id, e)
+            return None
+
+        return {
+            os.path.dirname(path)
+            for path in file_paths
+            if os.path.basename(path) in manifest_names
+        }
+
+    def get_checkout_paths(self, review, repository=None,
+                           base_commit_id=None, **kwargs):
+        """Return the directories to check out of the repository.
+
+        By default, this will return ``None`` (checking out the full tree)
+        unless :py:attr:`sparse_checkout` is set, in which case it will
+        return the directories containing the files in the diff along with
+        the results of :py:meth:`get_extra_checkout_paths`.
+
+        Version Added:
+            5.0
+
+        Args:
+            review (reviewbot.processing.review.Review):
+                The review object.
+
+            repository (reviewbot.repositories.BaseRepository, optional):
+                The repository, which has already been synced.
+
+            base_commit_id (str, optional):
+                The ID of the commit that will be checked out.
+
+            **kwargs (dict, unused):
+                Additional keyword arguments, for future expansion.
+
+        Returns:
+            set of str:
+            The set of directories to check out, relative to the root of the
+            repository, or ``None`` to check out the full tree.
+        """
+        if not self.sparse_checkout:
+            return None
+
+        extra_paths = self.get_extra_checkout_paths(
+            review=review,
+            repository=repository,
+            base_commit_id=base_commit_id,
+            **kwargs)
+
+        if extra_paths is None:
+            return None
+
+        paths = set(extra_paths)
+
+        for f in review.files:
+            paths.add(os.path.dirname(f.source_file))
+            paths.add(os.path.dirname(f.dest_file))
+
+        # The root of the tree is always checked out.
+        paths.discard('')
+
+        return paths
+
+    def execute(self, review, repository=None, base_commit_id=None,
+                working_dir=None, **kwargs):
         """Perform a review using the tool.
 
+        Version Changed:
+            5.0:
+            The checkout may now be limited to a subset of the tree. See
+            :py:attr:`sparse_checkout`.
+
+            The diff may now be applied as a single patch, depending on the
+            repository's ``patch_strategy``.
+
+            Added the ``working_dir`` argument.
+
         Args:
             review (reviewbot.processing.review.Review):
                 The review object.
@@ -126,19 +286,75 @@ class FullRepositoryToolMixin(object):
 
             base_commit_id (str, optional):
                 The ID of the commit that the patch should be applied to.
+
+            working_dir (str, optional):
+                An already-patched working directory to run the tool in,
+                shared with other tools reviewing the same diff. If not
+                provided, the repository will be checked out and patched.
         """
-        repository.sync()
-        working_dir = repository.checkout(base_commit_id)
+        if working_dir is None:
+            repository.sync()
+
+            working_dir = self.prepare_working_dir(
+                review=review,
+                repository=repository,
+                base_commit_id=base_commit_id,
+                checkout_paths=self.get_checkout_paths(
+                    review=review,
+                    repository=repository,
+                    base_commit_id=base_commit_id,
+                    **kwargs))
 
-        # Patch all the files first.
         with chdir(working_dir):
-            for f in review.files:
-                self.logger.debug('Patching %s', f.dest_file)
-                f.apply_patch(working_dir)
-
             # Now run the tool for everything.
             super(FullRepositoryToolMixin, self).execute(review, **kwargs)
 
+    def prepare_working_dir(self, review, repository, base_commit_id,
+                            checkout_paths=None, **kwargs):
+        """Check out the repository and apply the diff to it.
+
+        Version Added:
+            5.0
+
+        Args:
+            review (reviewbot.processing.review.Review):
+                The review object.
+
+            repository (reviewbot.repositories.Repository):
+                The repository, which has already been synced.
+
+            base_commit_id (str):
+                The ID of the commit that the patch should be applied to.
+
+            checkout_paths (set of str, optional):
+                The directories to check out, or ``None`` to check out the
+                full tree.
+
+            **kwargs (dict, unused):
+                Additional keyword arguments, for future expansion.
+
+        Returns:
+            str:
+            The path to the patched working directory.
+        """
+        if checkout_paths is None:
+            working_dir = repository.checkout(base_commit_id)
+        else:
+            working_dir = repository.checkout(base_commit_id,
+                                              paths=checkout_paths)
+
+        # Patch all the files.
+        with chdir(working_dir):
+            if (repository.patch_strategy == PATCH_STRATEGY_DIFF and
+                review.apply_patch(working_dir)):
+                self.logger.debug('Applied patch to %s', working_dir)
+            else:
+                for f in review.files:
+                    self.logger.debug('Patching %s', f.dest_file)
+                    f.apply_patch(working_dir)
+
+        return working_dir
+
 
 class JavaToolMixin(object):
     """Mixin for Java-based tools.
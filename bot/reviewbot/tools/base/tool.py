@@ -127,6 +127,23 @@ class BaseTool(object):
     #:     bool
     working_directory_required = False
 
+    #: The maximum number of files to review in a single task.
+    #:
+    #: If a diff has more files that the tool can handle than this, they'll
+    #: be split across several tasks, which may run on other workers, and
+    #: the results will be combined into a single review. This is only used
+    #: for tools that don't require a working directory.
+    #:
+    #: This can be overridden for each tool through the
+    #: ``max_files_per_task`` setting in the worker configuration.
+    #:
+    #: Version Added:
+    #:     5.0
+    #:
+    #: Type:
+    #:     int
+    max_files_per_task = None
+
     #: Timeout for tool execution, in seconds.
     #:
     #: Type:
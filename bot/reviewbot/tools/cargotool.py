@@ -60,6 +60,65 @@ class CargoTool(FullRepositoryToolMixin, BaseTool):
 
     TEST_LINES_LIMIT = 100
 
+    sparse_checkout = True
+
+    #: Directories of a package at the root of the repository.
+    #:
+    #: These are checked out in addition to the directories of every crate
+    #: in the repository.
+    #:
+    #: Version Added:
+    #:     5.0
+    #:
+    #: Type:
+    #:     list of str
+    ROOT_PACKAGE_DIRS = ['.cargo', 'benches', 'examples', 'src', 'tests']
+
+    def get_extra_checkout_paths(self, review, repository=None,
+                                 base_commit_id=None, **kwargs):
+        """Return additional directories needed in a sparse checkout.
+
+        Cargo needs every member of a workspace, and any crates they depend
+        on by path, so every crate in the repository is checked out, along
+        with its :file:`Cargo.toml` and :file:`Cargo.lock`. Other
+        directories, such as documentation or code in other languages, are
+        left out.
+
+        Version Added:
+            5.0
+
+        Args:
+            review (reviewbot.processing.review.Review):
+                The review object.
+
+            repository (reviewbot.repositories.BaseRepository, optional):
+                The repository, which has already been synced.
+
+            base_commit_id (str, optional):
+                The ID of the commit that will be checked out.
+
+            **kwargs (dict, unused):
+                Additional keyword arguments.
+
+        Returns:
+            list of str:
+            The crate directories, or ``None`` to check out the full tree.
+        """
+        crate_dirs = self.get_manifest_dirs(repository=repository,
+                                            base_commit_id=base_commit_id,
+                                            manifest_names=['Cargo.toml'])
+
+        if crate_dirs is None:
+            return None
+
+        if '' in crate_dirs:
+            # The manifest at the root of the repository is always checked
+            # out, but the package's sources need to be included.
+            crate_dirs.remove('')
+            crate_dirs.update(self.ROOT_PACKAGE_DIRS)
+
+        return sorted(crate_dirs)
+
     def build_base_command(self, **kwargs):
         """Build the base command line used to review files.
 
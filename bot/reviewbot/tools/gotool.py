@@ -56,6 +56,48 @@ class GoTool(FullRepositoryToolMixin, BaseTool):
         r'(?P<text>.*)$',
         re.M)
 
+    sparse_checkout = True
+
+    def get_extra_checkout_paths(self, review, repository=None,
+                                 base_commit_id=None, **kwargs):
+        """Return additional directories needed in a sparse checkout.
+
+        Packages being reviewed may import any other package in their
+        module, so every module in the repository is checked out, along with
+        its :file:`go.mod` and :file:`go.sum`. This limits the checkout
+        when the repository uses a :file:`go.work` workspace alongside
+        code in other languages. If there's a module at the root of the
+        repository, the full tree is checked out.
+
+        Version Added:
+            5.0
+
+        Args:
+            review (reviewbot.processing.review.Review):
+                The review object.
+
+            repository (reviewbot.repositories.BaseRepository, optional):
+                The repository, which has already been synced.
+
+            base_commit_id (str, optional):
+                The ID of the commit that will be checked out.
+
+            **kwargs (dict, unused):
+                Additional keyword arguments.
+
+        Returns:
+            list of str:
+            The module directories, or ``None`` to check out the full tree.
+        """
+        module_dirs = self.get_manifest_dirs(repository=repository,
+                                             base_commit_id=base_commit_id,
+                                             manifest_names=['go.mod'])
+
+        if module_dirs is None or '' in module_dirs:
+            return None
+
+        return sorted(module_dirs)
+
     def get_can_handle_file(self, review_file, **kwargs):
         """Return whether this tool can handle a given file.
 
@@ -11,13 +11,14 @@ from copy import deepcopy
 from functools import wraps
 from unittest import SkipTest
 
+import appdirs
 import kgb
 
 from reviewbot.config import config
 from reviewbot.repositories import GitRepository
 from reviewbot.testing import TestCase
-from reviewbot.utils.filesystem import make_tempdir
-from reviewbot.utils.process import execute
+from reviewbot.utils.filesystem import cleanup_tempfiles, make_tempdir
+from reviewbot.utils.process import execute, is_exe_in_path
 
 
 class ToolTestCaseMetaclass(type):
@@ -410,6 +411,96 @@ class BaseToolTestCase(kgb.SpyAgency, TestCase):
 
         return review, review_file
 
+    def run_checkout(self, files, diff_files):
+        """Check out a Git repository for the files in a diff.
+
+        This will create a real Git repository containing the given files,
+        and check it out using the paths returned by the tool's
+        :py:meth:`~reviewbot.tools.base.mixins.FullRepositoryToolMixin.
+        get_checkout_paths`.
+
+        Version Added:
+            5.0
+
+        Args:
+            files (dict):
+                A mapping of file paths to contents (as byte strings) to
+                commit to the repository.
+
+            diff_files (list of str):
+                The paths of the files modified in the diff.
+
+        Returns:
+            list of str:
+            The sorted paths of the files in the checkout, relative to its
+            root.
+        """
+        old_path = os.environ['PATH']
+        os.environ['PATH'] = self._old_path
+        self.addCleanup(os.environ.__setitem__, 'PATH', old_path)
+
+        if not is_exe_in_path('git', cache={}):
+            raise SkipTest('git is not available')
+
+        self.addCleanup(cleanup_tempfiles)
+
+        source_dir = make_tempdir()
+
+        for path, contents in files.items():
+            full_path = os.path.join(source_dir, path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+            with open(full_path, 'wb') as fp:
+                fp.write(contents)
+
+        git_args = [
+            'git', '-C', source_dir,
+            '-c', 'user.name=Review Bot',
+            '-c', 'user.email=reviewbot@example.com',
+        ]
+        execute(['git', 'init', '-q', source_dir])
+        execute(git_args + ['add', '.'])
+        execute(git_args + ['commit', '-q', '-m', 'Initial commit.'])
+        commit_id = execute(git_args + ['rev-parse', 'HEAD']).strip()
+
+        self.spy_on(appdirs.site_data_dir,
+                    op=kgb.SpyOpReturn(make_tempdir()))
+        repository = GitRepository(name='MyRepo',
+                                   clone_path=source_dir)
+
+        review = self.create_review()
+
+        for filename in diff_files:
+            self.create_review_file(review,
+                                    source_file=filename,
+                                    dest_file=filename)
+
+        repository.sync()
+        working_dir = repository.checkout(
+            commit_id,
+            paths=self.tool_class().get_checkout_paths(
+                review=review,
+                repository=repository,
+                base_commit_id=commit_id))
+
+        checkout_files = []
+
+        for dirpath, dirnames, filenames in os.walk(working_dir):
+            if '.git' in dirnames:
+                dirnames.remove('.git')
+
+            checkout_files += [
+                os.path.relpath(os.path.join(dirpath, filename),
+                                working_dir)
+                for filename in filenames
+            ]
+
+        # A clone has a .git directory, but a worktree has a .git file.
+        if '.git' in checkout_files:
+            checkout_files.remove('.git')
+
+        return sorted(checkout_files)
+
     def setup_integration_test(self, **kwargs):
         """Set up an integration test.
 
@@ -1004,6 +1004,34 @@ class CargoToolTests(BaseToolTestCase, metaclass=ToolTestCaseMetaclass):
             with_errors=False,
             ignore_errors=True)
 
+    def test_checkout_with_workspace(self):
+        """Testing CargoTool checks out only crates in a workspace"""
+        checkout_files = self.run_checkout(
+            files={
+                'Cargo.lock': b'',
+                'Cargo.toml': b'[workspace]\nmembers = ["crates/*"]\n',
+                'crates/cli/Cargo.toml': b'[package]\nname = "cli"\n',
+                'crates/cli/src/main.rs': b'fn main() {}\n',
+                'crates/core/Cargo.toml': b'[package]\nname = "core"\n',
+                'crates/core/src/lib.rs': b'',
+                'crates/core/src/parse/mod.rs': b'',
+                'docs/index.md': b'',
+                'web/app.js': b'',
+            },
+            diff_files=['crates/core/src/parse/mod.rs'])
+
+        self.assertEqual(
+            checkout_files,
+            [
+                'Cargo.lock',
+                'Cargo.toml',
+                'crates/cli/Cargo.toml',
+                'crates/cli/src/main.rs',
+                'crates/core/Cargo.toml',
+                'crates/core/src/lib.rs',
+                'crates/core/src/parse/mod.rs',
+            ])
+
     def setup_simulation_test(self, output):
         """Set up the simulation test for cargotool.
 
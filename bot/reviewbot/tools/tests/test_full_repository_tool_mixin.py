@@ -0,0 +1,241 @@
+"""Unit tests for reviewbot.tools.base.mixins.FullRepositoryToolMixin."""
+
+from __future__ import annotations
+
+import kgb
+
+from reviewbot.processing.review import File, Review
+from reviewbot.repositories import GitRepository, PATCH_STRATEGY_DIFF
+from reviewbot.testing import TestCase
+from reviewbot.tools.base.mixins import FullRepositoryToolMixin
+from reviewbot.tools.base.tool import BaseTool
+from reviewbot.utils.filesystem import cleanup_tempfiles, make_tempdir
+
+
+class MyFullRepositoryTool(FullRepositoryToolMixin, BaseTool):
+    pass
+
+
+class MySparseTool(FullRepositoryToolMixin, BaseTool):
+    sparse_checkout = True
+
+    def get_extra_checkout_paths(self, review, **kwargs):
+        return ['workspace']
+
+
+class MyFullTreeSparseTool(FullRepositoryToolMixin, BaseTool):
+    sparse_checkout = True
+
+    def get_extra_checkout_paths(self, review, **kwargs):
+        return None
+
+
+class FullRepositoryToolMixinTests(kgb.SpyAgency, TestCase):
+    """Unit tests for reviewbot.tools.base.mixins.FullRepositoryToolMixin."""
+
+    def tearDown(self):
+        super(FullRepositoryToolMixinTests, self).tearDown()
+
+        cleanup_tempfiles()
+
+    def test_get_checkout_paths(self):
+        """Testing FullRepositoryToolMixin.get_checkout_paths"""
+        review = self._create_review()
+
+        self.assertIsNone(
+            MyFullRepositoryTool().get_checkout_paths(review=review))
+
+    def test_get_checkout_paths_with_sparse_checkout(self):
+        """Testing FullRepositoryToolMixin.get_checkout_paths with
+        sparse_checkout=True
+        """
+        review = self._create_review()
+
+        self.assertEqual(
+            MySparseTool().get_checkout_paths(review=review),
+            {'lib/old', 'src/pkg', 'workspace'})
+
+    def test_get_checkout_paths_with_full_tree_needed(self):
+        """Testing FullRepositoryToolMixin.get_checkout_paths with
+        sparse_checkout=True and get_extra_checkout_paths returning None
+        """
+        review = self._create_review()
+
+        self.assertIsNone(
+            MyFullTreeSparseTool().get_checkout_paths(review=review))
+
+    def test_get_manifest_dirs(self):
+        """Testing FullRepositoryToolMixin.get_manifest_dirs"""
+        repository = self._create_repository()
+        self.spy_on(repository.get_file_paths,
+                    op=kgb.SpyOpReturn([
+                        'README',
+                        'go.work',
+                        'svc/api/go.mod',
+                        'svc/api/main.go',
+                        'svc/worker/go.mod',
+                    ]))
+
+        self.assertEqual(
+            MySparseTool().get_manifest_dirs(repository=repository,
+                                             base_commit_id='abc123',
+                                             manifest_names=['go.mod']),
+            {'svc/api', 'svc/worker'})
+        self.assertSpyCalledWith(repository.get_file_paths, 'abc123')
+
+    def test_get_manifest_dirs_with_error(self):
+        """Testing FullRepositoryToolMixin.get_manifest_dirs with an error
+        listing files
+        """
+        repository = self._create_repository()
+        self.spy_on(repository.get_file_paths,
+                    op=kgb.SpyOpRaise(Exception('oh no')))
+
+        self.assertIsNone(
+            MySparseTool().get_manifest_dirs(repository=repository,
+                                             base_commit_id='abc123',
+                                             manifest_names=['go.mod']))
+
+    def test_execute(self):
+        """Testing FullRepositoryToolMixin.execute"""
+        repository = self._create_repository()
+        review = self._create_review()
+
+        MyFullRepositoryTool().execute(review,
+                                       repository=repository,
+                                       base_commit_id='abc123')
+
+        self.assertSpyCalledWith(repository.checkout, 'abc123', paths=None)
+
+    def test_execute_with_sparse_checkout(self):
+        """Testing FullRepositoryToolMixin.execute with sparse_checkout=True
+        """
+        repository = self._create_repository()
+        review = self._create_review()
+
+        MySparseTool().execute(review,
+                               repository=repository,
+                               base_commit_id='abc123')
+
+        self.assertSpyCalledWith(
+            repository.checkout,
+            'abc123',
+            paths={'lib/old', 'src/pkg', 'workspace'})
+
+    def test_execute_with_patch_strategy_files(self):
+        """Testing FullRepositoryToolMixin.execute with
+        patch_strategy="files"
+        """
+        self.spy_on(Review.apply_patch, owner=Review)
+        self.spy_on(File.apply_patch, owner=File, call_original=False)
+
+        repository = self._create_repository()
+        review = self._create_review()
+
+        MyFullRepositoryTool().execute(review,
+                                       repository=repository,
+                                       base_commit_id='abc123')
+
+        self.assertSpyNotCalled(Review.apply_patch)
+        self.assertSpyCallCount(File.apply_patch, 3)
+
+    def test_execute_with_patch_strategy_diff(self):
+        """Testing FullRepositoryToolMixin.execute with patch_strategy="diff"
+        """
+        self.spy_on(Review.apply_patch, owner=Review,
+                    op=kgb.SpyOpReturn(True))
+        self.spy_on(File.apply_patch, owner=File, call_original=False)
+
+        repository = self._create_repository(
+            patch_strategy=PATCH_STRATEGY_DIFF)
+        review = self._create_review()
+
+        MyFullRepositoryTool().execute(review,
+                                       repository=repository,
+                                       base_commit_id='abc123')
+
+        self.assertSpyCallCount(Review.apply_patch, 1)
+        self.assertSpyNotCalled(File.apply_patch)
+
+    def test_execute_with_patch_strategy_diff_and_failure(self):
+        """Testing FullRepositoryToolMixin.execute with patch_strategy="diff"
+        and the patch failing to apply
+        """
+        self.spy_on(Review.apply_patch, owner=Review,
+                    op=kgb.SpyOpReturn(False))
+        self.spy_on(File.apply_patch, owner=File, call_original=False)
+
+        repository = self._create_repository(
+            patch_strategy=PATCH_STRATEGY_DIFF)
+        review = self._create_review()
+
+        MyFullRepositoryTool().execute(review,
+                                       repository=repository,
+                                       base_commit_id='abc123')
+
+        self.assertSpyCallCount(Review.apply_patch, 1)
+        self.assertSpyCallCount(File.apply_patch, 3)
+
+    def test_execute_with_working_dir(self):
+        """Testing FullRepositoryToolMixin.execute with working_dir"""
+        self.spy_on(File.apply_patch, owner=File, call_original=False)
+        self.spy_on(MyFullRepositoryTool.handle_files,
+                    owner=MyFullRepositoryTool,
+                    call_original=False)
+
+        repository = self._create_repository()
+        review = self._create_review()
+
+        MyFullRepositoryTool().execute(review,
+                                       repository=repository,
+                                       base_commit_id='abc123',
+                                       working_dir=make_tempdir())
+
+        self.assertSpyNotCalled(repository.sync)
+        self.assertSpyNotCalled(repository.checkout)
+        self.assertSpyNotCalled(File.apply_patch)
+        self.assertSpyCalled(MyFullRepositoryTool.handle_files)
+
+    def _create_repository(self, **kwargs):
+        """Return a repository with sync and checkout stubbed out.
+
+        Args:
+            **kwargs (dict):
+                Additional keyword arguments for the repository.
+
+        Returns:
+            reviewbot.repositories.GitRepository:
+            The new repository.
+        """
+        repository = GitRepository(name='MyRepo',
+                                   clone_path='git://example.com/repo',
+                                   **kwargs)
+        self.spy_on(repository.sync, call_original=False)
+        self.spy_on(repository.checkout,
+                    op=kgb.SpyOpReturn(make_tempdir()))
+
+        return repository
+
+    def _create_review(self):
+        """Return a review with files in several directories.
+
+        Returns:
+            reviewbot.processing.review.Review:
+            The new review.
+        """
+        review = self.create_review()
+        self.create_review_file(review,
+                                filediff_id=1,
+                                source_file='README',
+                                dest_file='README')
+        self.create_review_file(review,
+                                filediff_id=2,
+                                source_file='src/pkg/main.go',
+                                dest_file='src/pkg/main.go')
+        self.create_review_file(review,
+                                filediff_id=3,
+                                source_file='lib/old/util.go',
+                                dest_file='src/pkg/util.go',
+                                status='moved')
+
+        return review
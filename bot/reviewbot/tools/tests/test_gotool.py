@@ -558,6 +558,63 @@ class GoToolTests(BaseToolTestCase, metaclass=ToolTestCaseMetaclass):
             ignore_errors=True)
         self.assertSpyCallCount(execute, 2)
 
+    def test_checkout_with_workspace(self):
+        """Testing GoTool checks out only modules in a workspace"""
+        checkout_files = self.run_checkout(
+            files={
+                'README': b'',
+                'go.work': (
+                    b'go 1.21\n'
+                    b'\n'
+                    b'use (\n'
+                    b'\t./svc/api\n'
+                    b'\t./svc/worker\n'
+                    b')\n'
+                ),
+                'docs/index.md': b'',
+                'svc/api/go.mod': b'module example.com/api\n',
+                'svc/api/go.sum': b'',
+                'svc/api/handler/handler.go': b'package handler\n',
+                'svc/worker/go.mod': b'module example.com/worker\n',
+                'svc/worker/main.go': b'package main\n',
+                'web/app.js': b'',
+            },
+            diff_files=['svc/api/handler/handler.go'])
+
+        self.assertEqual(
+            checkout_files,
+            [
+                'README',
+                'go.work',
+                'svc/api/go.mod',
+                'svc/api/go.sum',
+                'svc/api/handler/handler.go',
+                'svc/worker/go.mod',
+                'svc/worker/main.go',
+            ])
+
+    def test_checkout_with_root_module(self):
+        """Testing GoTool checks out the full tree with a module at the root
+        of the repository
+        """
+        checkout_files = self.run_checkout(
+            files={
+                'go.mod': b'module example.com/app\n',
+                'go.sum': b'',
+                'cmd/app/main.go': b'package main\n',
+                'internal/util/util.go': b'package util\n',
+            },
+            diff_files=['cmd/app/main.go'])
+
+        self.assertEqual(
+            checkout_files,
+            [
+                'cmd/app/main.go',
+                'go.mod',
+                'go.sum',
+                'internal/util/util.go',
+            ])
+
     def setup_simulation_test(self, test_output=[], vet_output=''):
         """Set up the simulation test for GoTool.
 
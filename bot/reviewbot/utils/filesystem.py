@@ -9,10 +9,11 @@ import shutil
 import tempfile
 from contextlib import contextmanager
 from enum import Enum
-from typing import Optional, TYPE_CHECKING
+from typing import Callable, Optional, TYPE_CHECKING
 
 from reviewbot.errors import SuspiciousFilePath
 from reviewbot.utils.log import get_logger
+from reviewbot.utils.process import execute
 
 if TYPE_CHECKING:
     from collections.abc import Generator
@@ -22,8 +23,65 @@ if TYPE_CHECKING:
 logger = get_logger(__name__)
 
 
+tmpcallbacks = []
 tmpdirs = []
 tmpfiles = []
+tmpmounts = []
+
+
+#: Create snapshot views using the best supported method.
+#:
+#: This will try :py:data:`SNAPSHOT_METHOD_OVERLAY`, then
+#: :py:data:`SNAPSHOT_METHOD_REFLINK`, and then
+#: :py:data:`SNAPSHOT_METHOD_COPY`.
+#:
+#: Version Added:
+#:     5.0
+SNAPSHOT_METHOD_AUTO = 'auto'
+
+#: Create snapshot views by mounting an overlay filesystem.
+#:
+#: This requires permission to mount filesystems.
+#:
+#: Version Added:
+#:     5.0
+SNAPSHOT_METHOD_OVERLAY = 'overlay'
+
+#: Create snapshot views by making copy-on-write clones of each file.
+#:
+#: This requires a filesystem supporting reflinks, such as Btrfs or XFS.
+#:
+#: Version Added:
+#:     5.0
+SNAPSHOT_METHOD_REFLINK = 'reflink'
+
+#: Create snapshot views by hard-linking each file.
+#:
+#: This is only safe for tools that never modify files in place.
+#:
+#: Version Added:
+#:     5.0
+SNAPSHOT_METHOD_HARDLINK = 'hardlink'
+
+#: Create snapshot views by copying each file.
+#:
+#: Version Added:
+#:     5.0
+SNAPSHOT_METHOD_COPY = 'copy'
+
+#: All supported snapshot methods.
+#:
+#: Version Added:
+#:     5.0
+SNAPSHOT_METHODS = (
+    SNAPSHOT_METHOD_AUTO,
+    SNAPSHOT_METHOD_OVERLAY,
+    SNAPSHOT_METHOD_REFLINK,
+    SNAPSHOT_METHOD_HARDLINK,
+    SNAPSHOT_METHOD_COPY,
+)
+
+_unsupported_snapshot_methods = set()
 
 
 class PathPlatform(Enum):
@@ -81,8 +139,29 @@ def chdir(
 def cleanup_tempfiles() -> None:
     """Clean up all temporary files.
 
-    This will delete all the files created by :py:func:`make_tempfile`.
+    This will delete all the files created by :py:func:`make_tempfile`,
+    :py:func:`make_tempdir`, and :py:func:`make_tempdir_snapshot`.
+
+    Version Changed:
+        5.0:
+        Overlay filesystems mounted for snapshots are now unmounted, and
+        callbacks registered with :py:func:`add_cleanup_callback` are called.
     """
+    for callback in tmpcallbacks:
+        try:
+            callback()
+        except Exception as e:
+            logger.warning('Unexpected error in cleanup callback %r: %s',
+                           callback, e)
+
+    for mount_path in tmpmounts:
+        try:
+            logger.debug('Unmounting temporary snapshot %s', mount_path)
+            execute(['umount', mount_path])
+        except Exception as e:
+            logger.warning('Unable to unmount temporary snapshot %s: %s',
+                           mount_path, e)
+
     for tmpdir in tmpdirs:
         try:
             logger.debug('Removing temporary directory %s', tmpdir)
@@ -97,8 +176,28 @@ def cleanup_tempfiles() -> None:
         except Exception:
             pass
 
+    tmpcallbacks[:] = []
     tmpdirs[:] = []
     tmpfiles[:] = []
+    tmpmounts[:] = []
+
+
+def add_cleanup_callback(
+    callback: Callable[[], None],
+) -> None:
+    """Register a function to call when cleaning up temporary files.
+
+    This can be used to release any resources held for the duration of a
+    task. The callback will be called once, by :py:func:`cleanup_tempfiles`.
+
+    Version Added:
+        5.0
+
+    Args:
+        callback (callable):
+            The function to call. This takes no arguments.
+    """
+    tmpcallbacks.append(callback)
 
 
 def make_tempfile(
@@ -140,6 +239,110 @@ def make_tempdir() -> str:
     return tmpdir
 
 
+def make_tempdir_snapshot(
+    source_dir: str,
+    method: str = SNAPSHOT_METHOD_AUTO,
+) -> str:
+    """Create a temporary copy-on-write view of a directory.
+
+    Changes made within the returned directory will not affect
+    ``source_dir``, so long as the chosen method supports it (see
+    :py:data:`SNAPSHOT_METHOD_HARDLINK`). Like :py:func:`make_tempdir`, the
+    view will be removed by :py:func:`cleanup_tempfiles`.
+
+    Version Added:
+        5.0
+
+    Args:
+        source_dir (str):
+            The directory to create a view of. This must not be modified
+            while the view exists.
+
+        method (str, optional):
+            The method used to create the view. This must be one of
+            :py:data:`SNAPSHOT_METHODS`.
+
+    Returns:
+        str:
+        The path to the new view.
+
+    Raises:
+        Exception:
+            The view could not be created using the given method.
+    """
+    assert method in SNAPSHOT_METHODS, method
+
+    if method != SNAPSHOT_METHOD_AUTO:
+        return _make_tempdir_snapshot(source_dir, method)
+
+    for method in (SNAPSHOT_METHOD_OVERLAY,
+                   SNAPSHOT_METHOD_REFLINK):
+        if method not in _unsupported_snapshot_methods:
+            try:
+                return _make_tempdir_snapshot(source_dir, method)
+            except Exception as e:
+                logger.debug('Unable to create a snapshot using "%s". '
+                             'This method will not be tried again: %s',
+                             method, e)
+                _unsupported_snapshot_methods.add(method)
+
+    return _make_tempdir_snapshot(source_dir, SNAPSHOT_METHOD_COPY)
+
+
+def _make_tempdir_snapshot(
+    source_dir: str,
+    method: str,
+) -> str:
+    """Create a temporary view of a directory using a specific method.
+
+    Version Added:
+        5.0
+
+    Args:
+        source_dir (str):
+            The directory to create a view of.
+
+        method (str):
+            The method used to create the view.
+
+    Returns:
+        str:
+        The path to the new view.
+    """
+    tmpdir = make_tempdir()
+
+    if method == SNAPSHOT_METHOD_OVERLAY:
+        # Only the upper layer is written to, so discarding the view only
+        # needs to remove the files the tool actually changed.
+        upper_dir = os.path.join(tmpdir, 'upper')
+        work_dir = os.path.join(tmpdir, 'work')
+        view_dir = os.path.join(tmpdir, 'tree')
+
+        for path in (upper_dir, work_dir, view_dir):
+            os.mkdir(path)
+
+        execute(['mount', '-t', 'overlay', 'overlay', '-o',
+                 'lowerdir=%s,upperdir=%s,workdir=%s'
+                 % (source_dir, upper_dir, work_dir),
+                 view_dir])
+        tmpmounts.append(view_dir)
+
+        return view_dir
+    elif method == SNAPSHOT_METHOD_REFLINK:
+        execute(['cp', '-a', '--reflink=always',
+                 os.path.join(source_dir, '.'), tmpdir])
+    elif method == SNAPSHOT_METHOD_HARDLINK:
+        execute(['cp', '-al', os.path.join(source_dir, '.'), tmpdir])
+    else:
+        assert method == SNAPSHOT_METHOD_COPY, method
+
+        shutil.copytree(source_dir, tmpdir,
+                        symlinks=True,
+                        dirs_exist_ok=True)
+
+    return tmpdir
+
+
 def ensure_dirs_exist(
     path: str,
 ) -> None:
@@ -166,6 +369,49 @@ def ensure_dirs_exist(
         os.makedirs(folder_path)
 
 
+def get_disk_usage(
+    path: str,
+) -> int:
+    """Return the disk space used by a file or directory tree.
+
+    Files hard-linked more than once within the tree are only counted once.
+
+    Version Added:
+        5.0
+
+    Args:
+        path (str):
+            The path to the file or directory.
+
+    Returns:
+        int:
+        The number of bytes used, or 0 if the path does not exist.
+    """
+    seen = set()
+    total = 0
+
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in [dirpath] + [
+            os.path.join(dirpath, _name)
+            for _name in dirnames + filenames
+        ]:
+            try:
+                st = os.lstat(name)
+            except OSError:
+                continue
+
+            key = (st.st_dev, st.st_ino)
+
+            if key not in seen:
+                seen.add(key)
+                total += st.st_blocks * 512
+
+    if not seen and os.path.isfile(path):
+        total = os.lstat(path).st_blocks * 512
+
+    return total
+
+
 def get_path_platform(
     path: str,
 ) -> PathPlatform:
@@ -6,13 +6,24 @@ Version Added:
 
 from __future__ import annotations
 
+import os
 from typing import Optional
 
+import kgb
+
 from reviewbot.errors import SuspiciousFilePath
 from reviewbot.testing import TestCase
+from reviewbot.utils import filesystem
 from reviewbot.utils.filesystem import (PathPlatform,
+                                        add_cleanup_callback,
+                                        cleanup_tempfiles,
+                                        get_disk_usage,
                                         get_path_platform,
-                                        normalize_platform_path)
+                                        make_tempdir,
+                                        make_tempdir_snapshot,
+                                        normalize_platform_path,
+                                        tmpmounts)
+from reviewbot.utils.process import execute
 
 
 class GetPathPlatformTests(TestCase):
@@ -279,3 +290,156 @@ class NormalizePlatformPath(TestCase):
                                     relative_to=relative_to_windows,
                                     target_platform=PathPlatform.WINDOWS),
             expected_windows_path)
+
+
+class CleanupTempfilesTests(TestCase):
+    """Unit tests for reviewbot.utils.filesystem.cleanup_tempfiles.
+
+    Version Added:
+        5.0
+    """
+
+    def test_with_callbacks(self) -> None:
+        """Testing cleanup_tempfiles with callbacks"""
+        calls = []
+
+        def _bad_callback():
+            raise Exception('Oh no.')
+
+        add_cleanup_callback(lambda: calls.append(1))
+        add_cleanup_callback(_bad_callback)
+        add_cleanup_callback(lambda: calls.append(2))
+
+        cleanup_tempfiles()
+        self.assertEqual(calls, [1, 2])
+
+        # Callbacks should only be called once.
+        cleanup_tempfiles()
+        self.assertEqual(calls, [1, 2])
+
+
+class GetDiskUsageTests(TestCase):
+    """Unit tests for reviewbot.utils.filesystem.get_disk_usage.
+
+    Version Added:
+        5.0
+    """
+
+    def tearDown(self) -> None:
+        super().tearDown()
+
+        cleanup_tempfiles()
+
+    def test_with_tree(self) -> None:
+        """Testing get_disk_usage with a directory tree"""
+        tmpdir = make_tempdir()
+        os.mkdir(os.path.join(tmpdir, 'src'))
+        path1 = os.path.join(tmpdir, 'src', 'file1')
+        path2 = os.path.join(tmpdir, 'file2')
+
+        with open(path1, 'wb') as fp:
+            fp.write(b'x' * 64 * 1024)
+
+        # Hard links should only be counted once.
+        os.link(path1, path2)
+
+        usage = get_disk_usage(tmpdir)
+
+        self.assertGreaterEqual(usage, 64 * 1024)
+        self.assertLess(usage, 128 * 1024)
+        self.assertEqual(get_disk_usage(path1), os.stat(path1).st_blocks * 512)
+
+    def test_with_missing(self) -> None:
+        """Testing get_disk_usage with a missing path"""
+        self.assertEqual(get_disk_usage('/xxx-missing'), 0)
+
+
+class MakeTempdirSnapshotTests(kgb.SpyAgency, TestCase):
+    """Unit tests for reviewbot.utils.filesystem.make_tempdir_snapshot.
+
+    Version Added:
+        5.0
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+
+        self.source_dir = make_tempdir()
+        os.mkdir(os.path.join(self.source_dir, 'src'))
+
+        with open(os.path.join(self.source_dir, 'src', 'main.c'), 'w') as fp:
+            fp.write('int main() {}\n')
+
+        filesystem._unsupported_snapshot_methods.clear()
+
+    def tearDown(self) -> None:
+        super().tearDown()
+
+        cleanup_tempfiles()
+        filesystem._unsupported_snapshot_methods.clear()
+
+    def test_with_copy(self) -> None:
+        """Testing make_tempdir_snapshot with method=copy"""
+        view_dir = make_tempdir_snapshot(self.source_dir, method='copy')
+        view_path = os.path.join(view_dir, 'src', 'main.c')
+
+        with open(view_path, 'w') as fp:
+            fp.write('changed\n')
+
+        with open(os.path.join(self.source_dir, 'src', 'main.c')) as fp:
+            self.assertEqual(fp.read(), 'int main() {}\n')
+
+        cleanup_tempfiles()
+
+        self.assertFalse(os.path.exists(view_dir))
+        self.assertFalse(os.path.exists(self.source_dir))
+
+    def test_with_hardlink(self) -> None:
+        """Testing make_tempdir_snapshot with method=hardlink"""
+        self.spy_on(execute, op=kgb.SpyOpReturn(''))
+
+        view_dir = make_tempdir_snapshot(self.source_dir, method='hardlink')
+
+        self.assertSpyCalledWith(
+            execute,
+            ['cp', '-al', os.path.join(self.source_dir, '.'), view_dir])
+
+    def test_with_overlay(self) -> None:
+        """Testing make_tempdir_snapshot with method=overlay"""
+        self.spy_on(execute, op=kgb.SpyOpReturn(''))
+
+        view_dir = make_tempdir_snapshot(self.source_dir, method='overlay')
+        tmpdir = os.path.dirname(view_dir)
+
+        self.assertEqual(tmpmounts, [view_dir])
+        self.assertSpyCalledWith(
+            execute,
+            ['mount', '-t', 'overlay', 'overlay', '-o',
+             'lowerdir=%s,upperdir=%s/upper,workdir=%s/work'
+             % (self.source_dir, tmpdir, tmpdir),
+             view_dir])
+
+        cleanup_tempfiles()
+
+        self.assertSpyLastCalledWith(execute, ['umount', view_dir])
+        self.assertEqual(tmpmounts, [])
+        self.assertFalse(os.path.exists(tmpdir))
+
+    def test_with_auto_fallback(self) -> None:
+        """Testing make_tempdir_snapshot with method=auto falling back to
+        copying
+        """
+        self.spy_on(execute, op=kgb.SpyOpRaise(Exception('Not permitted')))
+
+        view_dir = make_tempdir_snapshot(self.source_dir)
+
+        self.assertTrue(os.path.exists(os.path.join(view_dir, 'src',
+                                                    'main.c')))
+        self.assertSpyCallCount(execute, 2)
+        self.assertEqual(execute.calls[0].args[0][0], 'mount')
+        self.assertEqual(execute.calls[1].args[0][0], 'cp')
+
+        # Unsupported methods shouldn't be tried again.
+        make_tempdir_snapshot(self.source_dir)
+
+        self.assertSpyCallCount(execute, 2)
@@ -8,6 +8,7 @@ from reviewboard.extensions.base import get_extension_manager
 
 from reviewbotext.extension import ReviewBotExtension
 from reviewbotext.forms import ToolForm
+from reviewbotext.integration import mark_tools_updated
 from reviewbotext.models import Tool
 
 
@@ -69,6 +70,7 @@ class ToolAdmin(admin.ModelAdmin):
             The result of the API call.
         """
         Tool.objects.all().update(in_last_update=False)
+        mark_tools_updated()
         ReviewBotExtension.instance.send_refresh_tools()
 
         # The caller is not sensitive to the contents. It's just looking for
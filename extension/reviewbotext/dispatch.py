@@ -0,0 +1,400 @@
+"""Asynchronous delivery of tasks to Review Bot workers.
+
+Version Added:
+    5.0
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from datetime import timedelta
+from typing import TYPE_CHECKING
+
+from django.core.cache import cache
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+from djblets.cache.backend import make_cache_key
+
+from reviewbotext.compat.logs import log_timed
+from reviewbotext.models import QueuedTask
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Mapping, Sequence
+    from typing import Any
+
+    from reviewbotext.extension import ReviewBotExtension
+
+
+logger = logging.getLogger(__name__)
+
+
+class TaskDispatcher:
+    """Sends queued tasks to Review Bot workers in the background.
+
+    Tasks are recorded as :py:class:`~reviewbotext.models.QueuedTask` entries
+    in the same transaction as the status updates they run for. Once that
+    transaction is committed, a background thread sends them to the broker,
+    retrying with a backoff if the broker can't be reached. This keeps
+    publishing a review request from waiting on the broker.
+
+    The thread is started when the extension is initialized, and restarted
+    at the next request or queued task if it's not running (such as in a
+    process forked after initialization). Each pass sends every task that's
+    due, including any left behind by other processes, so tasks queued by a
+    process that exits before sending them are still sent.
+
+    When running under uWSGI, the ``enable-threads`` option must be set for
+    the thread to run. Tasks can also be sent by running the
+    ``reviewbot_dispatch_tasks`` management command periodically.
+
+    Version Added:
+        5.0
+    """
+
+    #: The maximum number of seconds between checks for tasks to send.
+    POLL_INTERVAL = 30
+
+    #: The maximum number of seconds to wait before retrying a task.
+    MAX_RETRY_DELAY = 300
+
+    #: The number of seconds a task is reserved for the process sending it.
+    #:
+    #: If the process doesn't send the task or record a failure within this
+    #: time, another process may send it.
+    CLAIM_TIMEOUT = 60
+
+    #: The cache key for the lag of the most recently sent task.
+    LAG_CACHE_KEY = 'reviewbot-dispatch-lag'
+
+    ######################
+    # Instance variables #
+    ######################
+
+    #: The extension the tasks are sent for.
+    extension: ReviewBotExtension
+
+    def __init__(
+        self,
+        extension: ReviewBotExtension,
+    ) -> None:
+        """Initialize the dispatcher.
+
+        Args:
+            extension (reviewbotext.extension.ReviewBotExtension):
+                The extension the tasks are sent for.
+        """
+        self.extension = extension
+
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: (threading.Thread | None) = None
+        self._stopped = False
+        self._pending_revokes: list[str] = []
+
+    def queue_task(
+        self,
+        task_name: str,
+        task_kwargs: Mapping[str, Any],
+        queue: str,
+        task_id: str,
+    ) -> None:
+        """Queue a task to send once the current transaction is committed.
+
+        Args:
+            task_name (str):
+                The name of the task.
+
+            task_kwargs (dict):
+                The keyword arguments for the task. The session is added when
+                the task is sent.
+
+            queue (str):
+                The name of the queue to send the task to.
+
+            task_id (str):
+                The ID of the task.
+        """
+        self.queue_tasks([{
+            'task_name': task_name,
+            'task_kwargs': task_kwargs,
+            'queue': queue,
+            'task_id': task_id,
+        }])
+
+    def queue_tasks(
+        self,
+        tasks: Sequence[Mapping[str, Any]],
+    ) -> None:
+        """Queue several tasks to send once the transaction is committed.
+
+        The tasks are recorded using a single query.
+
+        Args:
+            tasks (list of dict):
+                The tasks to queue. Each contains the keyword arguments for
+                :py:meth:`queue_task`.
+        """
+        if not tasks:
+            return
+
+        QueuedTask.objects.bulk_create([
+            QueuedTask(task_id=task['task_id'],
+                       task_name=task['task_name'],
+                       queue=task['queue'],
+                       task_kwargs=task['task_kwargs'])
+            for task in tasks
+        ])
+        transaction.on_commit(self.wake)
+
+    def revoke_tasks(
+        self,
+        task_ids: Iterable[str],
+    ) -> None:
+        """Revoke tasks once the current transaction is committed.
+
+        Revoking is a best-effort optimization, so these are not retried.
+
+        Args:
+            task_ids (list of str):
+                The IDs of the tasks to revoke.
+        """
+        task_ids = sorted(task_ids)
+
+        def _revoke() -> None:
+            with self._lock:
+                self._pending_revokes += task_ids
+
+            self.wake()
+
+        transaction.on_commit(_revoke)
+
+    def start(self) -> None:
+        """Start the background thread, if it's not already running."""
+        with self._lock:
+            if self._stopped:
+                return
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,
+                                                name='reviewbot-dispatch',
+                                                daemon=True)
+                self._thread.start()
+
+    def wake(self) -> None:
+        """Wake the background thread, starting it if needed."""
+        self.start()
+        self._event.set()
+
+    def stop(self) -> None:
+        """Stop the background thread.
+
+        Any tasks that haven't been sent remain queued, and will be sent by
+        another process.
+        """
+        with self._lock:
+            self._stopped = True
+            thread = self._thread
+            self._thread = None
+
+        self._event.set()
+
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def dispatch_pending(self) -> int:
+        """Send all tasks that are due.
+
+        Returns:
+            int:
+            The number of tasks that were sent.
+        """
+        extension = self.extension
+
+        with self._lock:
+            revoke_task_ids = self._pending_revokes
+            self._pending_revokes = []
+
+        # Claim every task that's due in one query, so that other processes
+        # don't send them too. The claimed tasks are the ones left with this
+        # pass's claim expiration.
+        now = timezone.now()
+        claim_expiration = now + timedelta(seconds=self.CLAIM_TIMEOUT)
+        queued_tasks: list[QueuedTask] = []
+
+        claimed = (
+            QueuedTask.objects
+            .filter(next_attempt__lte=now)
+            .update(next_attempt=claim_expiration)
+        )
+
+        if claimed:
+            queued_tasks = list(
+                QueuedTask.objects
+                .filter(next_attempt=claim_expiration)
+                .order_by('pk'))
+
+        if not queued_tasks and not revoke_task_ids:
+            return 0
+
+        celery = extension.celery
+        sent = 0
+
+        try:
+            # Everything in this pass is published over a single connection
+            # from the app's pool, which is kept open between passes.
+            with celery.producer_or_acquire() as producer:
+                if revoke_task_ids:
+                    try:
+                        celery.control.revoke(revoke_task_ids,
+                                              connection=producer.connection)
+                    except Exception as e:
+                        logger.error('Unable to revoke superseded Review Bot '
+                                     'tasks %s: %s',
+                                     ', '.join(revoke_task_ids), e)
+
+                if queued_tasks:
+                    session = extension.login_user()
+
+                for queued_task in queued_tasks:
+                    task_kwargs = dict(queued_task.task_kwargs,
+                                       session=session)
+
+                    with log_timed(f'Sending task {queued_task.task_id} to '
+                                   f'Review Bot queue {queued_task.queue}',
+                                   logger=logger):
+                        celery.send_task(queued_task.task_name,
+                                         kwargs=task_kwargs,
+                                         queue=queued_task.queue,
+                                         task_id=queued_task.task_id,
+                                         producer=producer)
+
+                    queued_task.delete()
+                    sent += 1
+
+                    lag = timezone.now() - queued_task.created
+                    cache.set(make_cache_key(self.LAG_CACHE_KEY),
+                              lag.total_seconds())
+        except Exception as e:
+            if sent < len(queued_tasks):
+                self._defer_tasks(queued_tasks[sent:], e)
+            else:
+                logger.error('Unable to connect to the Review Bot broker: '
+                             '%s',
+                             e)
+
+        return sent
+
+    def _defer_tasks(
+        self,
+        queued_tasks: Sequence[QueuedTask],
+        error: Exception,
+    ) -> None:
+        """Defer tasks that couldn't be sent.
+
+        The first task's attempt count determines how long to wait. The
+        broker is most likely unavailable, so the remaining tasks wait for
+        the same retry.
+
+        Args:
+            queued_tasks (list of reviewbotext.models.QueuedTask):
+                The tasks that weren't sent.
+
+            error (Exception):
+                The error sending the first task.
+        """
+        queued_task = queued_tasks[0]
+        attempts = queued_task.attempts + 1
+        delay = min(2 ** attempts, self.MAX_RETRY_DELAY)
+        retry_at = timezone.now() + timedelta(seconds=delay)
+
+        logger.error('Unable to send task %s to Review Bot queue %s '
+                     '(attempt %d). Retrying %d tasks in %d seconds: %s',
+                     queued_task.task_id, queued_task.queue, attempts,
+                     len(queued_tasks), delay, error)
+
+        QueuedTask.objects.filter(pk=queued_task.pk).update(
+            attempts=attempts,
+            next_attempt=retry_at,
+            last_error=str(error))
+        QueuedTask.objects.filter(pk__in=[
+            queued_task.pk
+            for queued_task in queued_tasks[1:]
+        ]).update(next_attempt=retry_at)
+
+    def get_stats(self) -> dict[str, Any]:
+        """Return statistics on the tasks waiting to be sent.
+
+        Returns:
+            dict:
+            A dictionary with the following keys:
+
+            ``pending`` (:py:class:`int`):
+                The number of tasks waiting to be sent.
+
+            ``oldest_pending_age`` (:py:class:`float`):
+                The number of seconds the oldest waiting task has been
+                queued, or ``None`` if no tasks are waiting.
+
+            ``last_lag`` (:py:class:`float`):
+                The number of seconds between queuing and sending the most
+                recently sent task, or ``None`` if not known.
+        """
+        stats = QueuedTask.objects.aggregate(pending=Count('pk'),
+                                             oldest=Min('created'))
+        oldest = stats['oldest']
+
+        if oldest is None:
+            oldest_pending_age = None
+        else:
+            oldest_pending_age = (timezone.now() - oldest).total_seconds()
+
+        return {
+            'pending': stats['pending'],
+            'oldest_pending_age': oldest_pending_age,
+            'last_lag': cache.get(make_cache_key(self.LAG_CACHE_KEY)),
+        }
+
+    def _run(self) -> None:
+        """Send tasks until the dispatcher is stopped."""
+        try:
+            while not self._stopped:
+                self._event.clear()
+                wait_time = self.POLL_INTERVAL
+
+                try:
+                    # Discard any connection that was dropped by the
+                    # database or has outlived CONN_MAX_AGE while waiting.
+                    close_old_connections()
+
+                    self.dispatch_pending()
+                    wait_time = self._get_wait_time()
+                except Exception as e:
+                    logger.exception('Unexpected error sending Review Bot '
+                                     'tasks: %s',
+                                     e)
+
+                self._event.wait(wait_time)
+        finally:
+            connection.close()
+
+    def _get_wait_time(self) -> float:
+        """Return the number of seconds to wait before the next pass.
+
+        Returns:
+            float:
+            The number of seconds to wait.
+        """
+        next_attempt = (
+            QueuedTask.objects
+            .aggregate(next_attempt=Min('next_attempt'))
+            ['next_attempt']
+        )
+
+        if next_attempt is None:
+            return self.POLL_INTERVAL
+
+        wait = (next_attempt - timezone.now()).total_seconds()
+
+        return min(max(wait, 0.1), self.POLL_INTERVAL)
@@ -7,25 +7,37 @@ from importlib import import_module
 
 from celery import Celery, VERSION as CELERY_VERSION
 from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth import login
 from django.contrib.auth.models import User
+from django.core.signals import request_started
 from django.http import HttpRequest
 from django.utils.translation import gettext_lazy as _
+from djblets.cache.backend import make_cache_key
 from djblets.db.query import get_object_or_none
 from reviewboard.accounts.backends import auth_backends
 from reviewboard.admin.server import get_server_url
 from reviewboard.extensions.base import Extension
-from reviewboard.extensions.hooks import IntegrationHook
+from reviewboard.extensions.hooks import IntegrationHook, SignalHook
 
 from reviewbotext.compat.logs import log_timed
+from reviewbotext.dispatch import TaskDispatcher
 from reviewbotext.integration import ReviewBotIntegration
 from reviewbotext.resources import (review_bot_review_resource,
                                     tool_resource)
+from reviewbotext.worker_status import WorkerStatusMonitor
 
 
 logger = logging.getLogger(__name__)
 
 
+#: The number of seconds before expiration that a worker session is replaced.
+#:
+#: Version Added:
+#:     5.0
+SESSION_REFRESH_MARGIN = 24 * 60 * 60
+
+
 class ReviewBotExtension(Extension):
     """An extension for communicating with Review Bot."""
 
@@ -86,7 +98,11 @@ class ReviewBotExtension(Extension):
             return self._celery
 
         # Either we're creating the instance for the first, or the broker
-        # URL has changed. Either way, we need a new instance.
+        # URL has changed. Either way, we need a new instance. Any pooled
+        # connections to the old broker are no longer needed.
+        if self._celery is not None:
+            self._celery.close()
+
         celery = Celery('reviewbot.tasks')
 
         if CELERY_VERSION >= (4, 0):
@@ -113,6 +129,36 @@ class ReviewBotExtension(Extension):
         self._celery = None
         self._broker_url = None
 
+        #: The dispatcher sending tasks to workers.
+        #:
+        #: Version Added:
+        #:     5.0
+        self.dispatcher = TaskDispatcher(self)
+        self.dispatcher.start()
+
+        # Processes forked after initialization don't inherit the
+        # dispatcher's thread, so it's restarted on their first request.
+        SignalHook(self, request_started, self._on_request_started)
+
+        #: The monitor for the status of workers.
+        #:
+        #: Version Added:
+        #:     5.0
+        self.worker_status = WorkerStatusMonitor(self)
+
+    def shutdown(self):
+        """Shut down the extension.
+
+        Version Added:
+            5.0
+        """
+        self.dispatcher.stop()
+
+        if self._celery is not None:
+            self._celery.close()
+
+        super().shutdown()
+
     def login_user(self):
         """Log in as the configured user.
 
@@ -120,11 +166,34 @@ class ReviewBotExtension(Extension):
         Client.login() with a small hack that does not require the call to
         authenticate().
 
+        The session is shared between dispatches until it nears expiration,
+        so that sending tasks to workers doesn't create a new session each
+        time.
+
+        Version Changed:
+            5.0:
+            Sessions are now reused until they near expiration, until the
+            user's credentials change, or until they're removed.
+
         Returns:
             unicode:
-            The session key of the new user session.
+            The session key of the user session.
         """
         user = self.user
+        cache_key = make_cache_key('reviewbot-session:%s' % user.pk)
+        auth_hash = user.get_session_auth_hash()
+        engine = import_module(settings.SESSION_ENGINE)
+
+        try:
+            session_key, session_auth_hash = cache.get(cache_key)
+        except (TypeError, ValueError):
+            pass
+        else:
+            # The session may have been removed (such as by clearsessions or
+            # a logout) before the cached key expired.
+            if (session_auth_hash == auth_hash and
+                engine.SessionStore().exists(session_key)):
+                return session_key
 
         # Review Board 3.0.8 moved all the auth backends into their own
         # modules. While the old path works for importing, it won't work
@@ -134,13 +203,19 @@ class ReviewBotExtension(Extension):
         backend_cls = auth_backends.get('backend_id', 'builtin')
         user.backend = '%s.%s' % (backend_cls.__module__, backend_cls.__name__)
 
-        engine = import_module(settings.SESSION_ENGINE)
-
         # Create a fake request to store login details.
         request = HttpRequest()
         request.session = engine.SessionStore()
         login(request, user)
         request.session.save()
+
+        # Tasks may wait in a queue for a while before they use the session,
+        # so it's replaced well before it expires.
+        expiry_age = request.session.get_expiry_age()
+        cache.set(cache_key,
+                  (request.session.session_key, auth_hash),
+                  expiry_age - min(SESSION_REFRESH_MARGIN, expiry_age // 2))
+
         return request.session.session_key
 
     def send_refresh_tools(self):
@@ -154,3 +229,17 @@ class ReviewBotExtension(Extension):
                        logger=logger):
             self.celery.control.broadcast('update_tools_list',
                                           payload=payload)
+
+    def _on_request_started(self, **kwargs):
+        """Handle the start of a request.
+
+        This ensures the dispatcher's thread is running in this process.
+
+        Version Added:
+            5.0
+
+        Args:
+            **kwargs (dict):
+                Keyword arguments passed by the signal.
+        """
+        self.dispatcher.start()
@@ -99,6 +99,33 @@ class ReviewBotConfigForm(IntegrationConfigForm):
         ),
         initial=NOTIFY_OWNER_ONLY_DEFAULT)
 
+    #: The number of files at which a diff is considered large.
+    #:
+    #: Version Added:
+    #:     5.0
+    large_diff_files = forms.IntegerField(
+        label=_('Large diff file count'),
+        required=False,
+        min_value=1,
+        help_text=_(
+            'Diffs with at least this many files are sent to the queue for '
+            'large changes, so that they don\'t hold up smaller changes. '
+            'Workers can reserve slots for smaller changes.'
+        ))
+
+    #: The number of changed lines at which a diff is considered large.
+    #:
+    #: Version Added:
+    #:     5.0
+    large_diff_lines = forms.IntegerField(
+        label=_('Large diff line count'),
+        required=False,
+        min_value=1,
+        help_text=_(
+            'Diffs with at least this many inserted and deleted lines are '
+            'sent to the queue for large changes.'
+        ))
+
     def __init__(
         self,
         *args,
@@ -206,6 +233,8 @@ class ReviewBotConfigForm(IntegrationConfigForm):
                            'max_comments',
                            'notify_owner_only',
                            'run_manually',
+                           'large_diff_files',
+                           'large_diff_lines',
                            'tool_options',),
             }),
         )
@@ -5,35 +5,256 @@ from __future__ import annotations
 import json
 import logging
 from datetime import datetime
+from uuid import uuid4
 from typing import TYPE_CHECKING
 
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
+from djblets.cache.synchronizer import GenerationSynchronizer
+from djblets.conditions import ConditionSet
 from djblets.extensions.hooks import SignalHook
 from reviewboard.admin.server import get_server_url
 from reviewboard.diffviewer.models import DiffSet
 from reviewboard.integrations.base import Integration
-from reviewboard.reviews.models import StatusUpdate
+from reviewboard.reviews.models import (BaseComment,
+                                        Comment,
+                                        FileAttachmentComment,
+                                        GeneralComment,
+                                        ScreenshotComment,
+                                        StatusUpdate)
 from reviewboard.reviews.signals import (review_request_published,
                                          status_update_request_run)
 
-from reviewbotext.compat.logs import log_timed
 from reviewbotext.forms import ReviewBotConfigForm
 from reviewbotext.models import Tool
 
 if TYPE_CHECKING:
-    from collections.abc import Iterator, Mapping
+    from collections.abc import Iterable, Iterator, Mapping, Sequence
     from typing import Any
 
     from django.contrib.auth.models import User
     from djblets.integrations.models import BaseIntegrationConfig
     from reviewboard.changedescs.models import ChangeDescription
     from reviewboard.reviews.models import ReviewRequest
+    from reviewboard.scmtools.models import Repository
+    from reviewboard.site.models import LocalSite
 
 
 logger = logging.getLogger(__name__)
 
 
+#: The suffix for queues receiving tasks for large diffs.
+#:
+#: Version Added:
+#:     5.0
+LARGE_QUEUE_SUFFIX = '.large'
+
+
+#: The key for synchronizing changes to tools between processes.
+#:
+#: Version Added:
+#:     5.0
+TOOLS_SYNC_KEY = 'reviewbot-tools:gen'
+
+
+def mark_tools_updated() -> None:
+    """Invalidate the cached configurations after tools are changed.
+
+    Saving or deleting a :py:class:`~reviewbotext.models.Tool` does this
+    automatically. This must be called after changing tools using bulk
+    operations, which don't emit signals.
+
+    Version Added:
+        5.0
+    """
+    GenerationSynchronizer(TOOLS_SYNC_KEY).mark_updated()
+
+
+class ConfigIndex:
+    """An index of integration configurations.
+
+    Configurations whose conditions require certain repositories or review
+    groups are indexed by them. This allows configurations that can't match
+    a review request to be skipped without evaluating their conditions.
+
+    Version Added:
+        5.0
+    """
+
+    #: The key type for repositories in the index.
+    KEY_REPOSITORY = 'repository'
+
+    #: The key type for review groups in the index.
+    KEY_REVIEW_GROUP = 'review-group'
+
+    ######################
+    # Instance variables #
+    ######################
+
+    #: The resolved configurations, in their original order.
+    config_infos: Sequence[tuple[BaseIntegrationConfig,
+                                 Tool,
+                                 Mapping[str, Any],
+                                 Mapping[str, Any]]]
+
+    def __init__(
+        self,
+        config_infos: Sequence[tuple[BaseIntegrationConfig,
+                                     Tool,
+                                     Mapping[str, Any],
+                                     Mapping[str, Any]]],
+    ) -> None:
+        """Initialize the index.
+
+        Args:
+            config_infos (list of tuple):
+                The resolved configurations, in the form returned by
+                :py:meth:`ReviewBotIntegration._get_matching_configs`.
+        """
+        self.config_infos = config_infos
+        self._unindexed: list[int] = []
+        self._index: dict[tuple[str, int], list[int]] = {}
+        self._has_review_groups = False
+
+        for i, config_info in enumerate(config_infos):
+            keys = self._get_index_keys(config_info[0])
+
+            if keys is None:
+                self._unindexed.append(i)
+            else:
+                for key in keys:
+                    self._index.setdefault(key, []).append(i)
+
+                    if key[0] == self.KEY_REVIEW_GROUP:
+                        self._has_review_groups = True
+
+    def get_candidates(
+        self,
+        review_request: ReviewRequest,
+    ) -> list[tuple[BaseIntegrationConfig,
+                    Tool,
+                    Mapping[str, Any],
+                    Mapping[str, Any]]]:
+        """Return the configurations that may match a review request.
+
+        The conditions for these configurations still need to be evaluated.
+
+        Args:
+            review_request (reviewboard.reviews.models.ReviewRequest):
+                The review request to return candidates for.
+
+        Returns:
+            list of tuple:
+            The candidate configurations, in their original order.
+        """
+        index = self._index
+        positions = set(self._unindexed)
+
+        if review_request.repository_id:
+            positions.update(index.get(
+                (self.KEY_REPOSITORY, review_request.repository_id), []))
+
+        if self._has_review_groups:
+            for group_id in review_request.target_groups.values_list(
+                'pk', flat=True):
+                positions.update(index.get(
+                    (self.KEY_REVIEW_GROUP, group_id), []))
+
+        return [
+            self.config_infos[i]
+            for i in sorted(positions)
+        ]
+
+    def _get_index_keys(
+        self,
+        config: BaseIntegrationConfig,
+    ) -> (set[tuple[str, int]] | None):
+        """Return the index keys for a configuration.
+
+        Args:
+            config (djblets.integrations.models.BaseIntegrationConfig):
+                The configuration.
+
+        Returns:
+            set of tuple:
+            The keys that a review request must have at least one of for the
+            configuration to match, or ``None`` if the configuration can't be
+            indexed.
+        """
+        conditions_data = config.settings.get('conditions') or {}
+        conditions = conditions_data.get('conditions') or []
+        mode = conditions_data.get('mode', ConditionSet.DEFAULT_MODE)
+
+        if not conditions:
+            return None
+
+        condition_keys = [
+            self._get_condition_keys(condition)
+            for condition in conditions
+        ]
+
+        if mode == ConditionSet.MODE_ALL:
+            # Any one of the conditions is enough to narrow down candidates.
+            # Repositories are preferred, as they don't require a query.
+            best_keys = None
+
+            for keys in condition_keys:
+                if keys:
+                    if next(iter(keys))[0] == self.KEY_REPOSITORY:
+                        return keys
+                    elif best_keys is None:
+                        best_keys = keys
+
+            return best_keys
+        elif mode == ConditionSet.MODE_ANY:
+            # Every condition must be indexed, since any of them could match.
+            if all(condition_keys):
+                return set().union(*condition_keys)
+
+        return None
+
+    def _get_condition_keys(
+        self,
+        condition: Mapping[str, Any],
+    ) -> (set[tuple[str, int]] | None):
+        """Return the index keys for a single condition.
+
+        Args:
+            condition (dict):
+                The serialized condition.
+
+        Returns:
+            set of tuple:
+            The keys that a review request must have at least one of for the
+            condition to match, or ``None`` if the condition can't be
+            indexed.
+        """
+        choice_id = condition.get('choice')
+        operator_id = condition.get('op')
+        value = condition.get('value')
+
+        if choice_id == 'repository' and operator_id == 'one-of':
+            key_type = self.KEY_REPOSITORY
+        elif choice_id == 'review-groups' and operator_id == 'contains-any':
+            key_type = self.KEY_REVIEW_GROUP
+        else:
+            return None
+
+        if not isinstance(value, list) or not value:
+            return None
+
+        try:
+            return {
+                (key_type, int(pk))
+                for pk in value
+            }
+        except (TypeError, ValueError):
+            return None
+
+
 class ReviewBotIntegration(Integration):
     """The integration for Review Bot.
 
@@ -47,10 +268,15 @@ class ReviewBotIntegration(Integration):
 
     def initialize(self) -> None:
         """Initialize the integration hooks."""
+        self._config_indexes = {}
+        self._tools_gen_sync = GenerationSynchronizer(TOOLS_SYNC_KEY)
+
         SignalHook(self, review_request_published,
                    self._on_review_request_published)
         SignalHook(self, status_update_request_run,
                    self._on_status_update_request_run)
+        SignalHook(self, post_save, self._on_tool_changed, sender=Tool)
+        SignalHook(self, post_delete, self._on_tool_changed, sender=Tool)
 
     @cached_property
     def icon_static_urls(self) -> Mapping[str, str]:
@@ -79,6 +305,13 @@ class ReviewBotIntegration(Integration):
                         Mapping[str, Any]]]:
         """Return the matching configurations for a review request.
 
+        Version Changed:
+            5.0:
+            The tools, tool options, and review settings for the
+            configurations are now cached, and configurations scoped to
+            other repositories or review groups are skipped without
+            evaluating their conditions.
+
         Args:
             review_request (reviewboard.reviews.models.ReviewRequest):
                 The review request to get Review Bot configurations for.
@@ -100,26 +333,74 @@ class ReviewBotIntegration(Integration):
             The tool options dictionary contains the matching configuration's
             settings specific to the tool.
         """
-        matching_configs = [
-            config
-            for config in self.get_configs(review_request.local_site)
-            if config.match_conditions(form_cls=self.config_form_cls,
-                                       review_request=review_request)
-        ]
+        config_index = self._get_config_index(review_request.local_site)
+
+        for config_info in config_index.get_candidates(review_request):
+            config = config_info[0]
 
-        for config in matching_configs:
             if (service_id is not None and
-                'reviewbot.%s' % config.id != service_id):
+                'reviewbot.%s' % config.pk != service_id):
                 continue
 
+            if config.match_conditions(form_cls=self.config_form_cls,
+                                       review_request=review_request):
+                yield config_info
+
+    def _get_config_index(
+        self,
+        local_site: (LocalSite | None),
+    ) -> ConfigIndex:
+        """Return the index of resolved configurations for a Local Site.
+
+        The tools for all configurations are fetched in a single query, and
+        the tool options and review settings are parsed once. The result is
+        cached until a configuration or tool is changed.
+
+        Version Added:
+            5.0
+
+        Args:
+            local_site (reviewboard.site.models.LocalSite):
+                The Local Site to return configurations for.
+
+        Returns:
+            ConfigIndex:
+            The index of configurations.
+        """
+        # The integration manager returns a new list whenever configurations
+        # change, in this or any other process.
+        configs = self.get_configs(local_site)
+
+        if self._tools_gen_sync.is_expired():
+            self._tools_gen_sync.refresh()
+            self._config_indexes.clear()
+
+        cache_key = local_site.pk if local_site else None
+
+        try:
+            cached_configs, config_index = self._config_indexes[cache_key]
+
+            if cached_configs is configs:
+                return config_index
+        except KeyError:
+            pass
+
+        tools = Tool.objects.in_bulk({
+            config.settings.get('tool')
+            for config in configs
+        })
+        config_infos = []
+
+        for config in configs:
             tool_id = config.settings.get('tool')
 
             try:
-                tool = Tool.objects.get(pk=tool_id)
-            except Tool.DoesNotExist:
+                tool = tools[tool_id]
+            except KeyError:
                 logger.error('Skipping Review Bot integration config %s (%d) '
-                             'because Tool with pk=%d does not exist.',
+                             'because Tool with pk=%s does not exist.',
                              config.name, config.pk, tool_id)
+                continue
 
             review_settings = {
                 'comment_unmodified': config.settings.get(
@@ -148,8 +429,29 @@ class ReviewBotIntegration(Integration):
                                  config.name, config.pk, e)
                 tool_options = {}
 
-            yield config, tool, tool_options, review_settings
+            config_infos.append((config, tool, tool_options, review_settings))
+
+        config_index = ConfigIndex(config_infos)
+        self._config_indexes[cache_key] = (configs, config_index)
+
+        return config_index
+
+    def _on_tool_changed(self, **kwargs) -> None:
+        """Handle changes to a tool.
+
+        This will invalidate the cached configurations in all processes.
+
+        Version Added:
+            5.0
 
+        Args:
+            **kwargs (dict):
+                Keyword arguments from the signal.
+        """
+        self._tools_gen_sync.mark_updated()
+        self._config_indexes.clear()
+
+    @transaction.atomic
     def _on_review_request_published(
         self,
         user: User,
@@ -159,6 +461,12 @@ class ReviewBotIntegration(Integration):
     ) -> None:
         """Handle when a review request is published.
 
+        Version Changed:
+            5.0:
+            Tasks are now queued in the same transaction as the status
+            updates, and sent to the broker after the transaction is
+            committed.
+
         Args:
             user (django.contrib.auth.models.User):
                 The user who published the review request.
@@ -200,19 +508,44 @@ class ReviewBotIntegration(Integration):
 
         server_url = get_server_url(local_site=review_request.local_site)
 
-        # TODO: This creates a new session entry. We should figure out a better
-        # way for Review Bot workers to authenticate to the server.
-        session = extension.login_user()
         user = extension.user
 
+        repository = review_request.repository
+
+        if changedesc is not None:
+            # Runs that are still pending for older diffs will be superseded
+            # by the runs for this diff.
+            pending_status_updates = [
+                status_update
+                for status_update in StatusUpdate.objects.filter(
+                    review_request=review_request,
+                    service_id__startswith='reviewbot.',
+                    state=StatusUpdate.PENDING)
+                if status_update.effective_state == StatusUpdate.PENDING
+            ]
+        else:
+            pending_status_updates = []
+
+        # Configurations sent to the same queue are run by the same tool on
+        # the same set of workers, so they're grouped into a single task that
+        # can share the diff and working directory.
+        queued_tools = {}
+        task_ids = {}
+        diff_sizes = {}
+        service_ids = set()
+        drop_issues_service_ids = set()
+        status_updates = []
+        tool_infos = []
+
         for config, tool, tool_options, review_settings in matching_configs:
             # Use the config ID rather than the tool name because it is unique
             # and unchanging. This allows us to find other status updates from
             # the same tool config.
             service_id = 'reviewbot.%s' % config.id
+            service_ids.add(service_id)
 
             if config.settings.get('drop_old_issues'):
-                self._drop_old_issues(user, service_id, review_request)
+                drop_issues_service_ids.add(service_id)
 
             status_update = StatusUpdate(
                 service_id=service_id,
@@ -223,72 +556,324 @@ class ReviewBotIntegration(Integration):
                 timeout=tool.timeout,
                 user=user)
             status_update.extra_data['can_retry'] = True
+            status_updates.append(status_update)
 
             if review_settings['run_manually']:
                 status_update.description = 'waiting to run.'
                 status_update.state = StatusUpdate.NOT_YET_RUN
-                status_update.save()
             else:
-                status_update.save()
+                queue = self._get_queue(config=config,
+                                        tool=tool,
+                                        repository=repository,
+                                        diffset=diffset,
+                                        diff_sizes=diff_sizes)
+
+                if queue not in task_ids:
+                    task_ids[queue] = str(uuid4())
+
+                # This allows the task to be revoked if it's superseded.
+                status_update.extra_data['reviewbot_task_id'] = \
+                    task_ids[queue]
+
+                tool_infos.append((queue, status_update, {
+                    'review_settings': review_settings,
+                    'tool_options': tool_options,
+                }))
+
+        # Issues are dropped before the new status updates are created, so
+        # they can't be affected.
+        if drop_issues_service_ids:
+            self._drop_old_issues(user, drop_issues_service_ids,
+                                  review_request)
+
+        self._create_status_updates(status_updates)
+
+        for queue, status_update, tool_info in tool_infos:
+            tool_info['status_update_id'] = status_update.pk
+            queued_tools.setdefault(queue, []).append(tool_info)
+
+        self._supersede_status_updates(
+            review_request=review_request,
+            status_updates=[
+                status_update
+                for status_update in pending_status_updates
+                if status_update.service_id in service_ids
+            ])
+
+        tasks = []
+
+        for queue, tools in queued_tools.items():
+            task_kwargs = {
+                'server_url': server_url,
+                'username': user.username,
+                'review_request_id': review_request_id,
+                'diff_revision': diffset.revision,
+                'repository_name': repository.name,
+                'base_commit_id': diffset.base_commit_id,
+            }
+
+            if len(tools) == 1:
+                task_name = 'reviewbot.tasks.RunTool'
+                task_kwargs.update(tools[0])
+            else:
+                task_name = 'reviewbot.tasks.RunTools'
+                task_kwargs['tools'] = tools
+
+            status_update_ids = ', '.join(
+                str(tool_info['status_update_id'])
+                for tool_info in tools
+            )
+
+            logger.info('Queuing automatic run task for Review Bot queue %s '
+                        'for review request %s, diff revision %s, status '
+                        'update IDs %s',
+                        queue, review_request.pk, diffset.revision,
+                        status_update_ids)
+
+            tasks.append({
+                'task_name': task_name,
+                'task_kwargs': task_kwargs,
+                'queue': queue,
+                'task_id': task_ids[queue],
+            })
+
+        extension.dispatcher.queue_tasks(tasks)
+
+    def _get_queue(
+        self,
+        config: BaseIntegrationConfig,
+        tool: Tool,
+        repository: Repository,
+        diffset: DiffSet,
+        diff_sizes: (dict[int, tuple[int, int]] | None) = None,
+    ) -> str:
+        """Return the queue to send a task for a configuration to.
+
+        If the configuration sets thresholds for large diffs and the diff
+        reaches one of them, the task will be sent to the queue for large
+        diffs, so that it doesn't hold up smaller changes on the workers.
+
+        Version Added:
+            5.0
+
+        Args:
+            config (djblets.integrations.models.BaseIntegrationConfig):
+                The matching configuration.
 
-                repository = review_request.repository
-                queue = '%s.%s' % (tool.entry_point, tool.version)
-
-                if tool.working_directory_required:
-                    queue = '%s.%s' % (queue, repository.name)
-
-                with log_timed(f'Sending automatic run task to Review Bot '
-                               f'queue {queue} for review request '
-                               f'{review_request.pk}, diff revision '
-                               f'{diffset.revision}, status update ID '
-                               f'{status_update.pk}',
-                               logger=logger):
-                    extension.celery.send_task(
-                        'reviewbot.tasks.RunTool',
-                        kwargs={
-                            'server_url': server_url,
-                            'session': session,
-                            'username': user.username,
-                            'review_request_id': review_request_id,
-                            'diff_revision': diffset.revision,
-                            'status_update_id': status_update.pk,
-                            'review_settings': review_settings,
-                            'tool_options': tool_options,
-                            'repository_name': repository.name,
-                            'base_commit_id': diffset.base_commit_id,
-                        },
-                        queue=queue)
+            tool (reviewbotext.models.Tool):
+                The tool being run.
+
+            repository (reviewboard.scmtools.models.Repository):
+                The repository for the review request.
+
+            diffset (reviewboard.diffviewer.models.DiffSet):
+                The diffset being reviewed.
+
+            diff_sizes (dict, optional):
+                A cache of diff sizes, used when computing queues for several
+                configurations.
+
+        Returns:
+            str:
+            The name of the queue.
+        """
+        queue = '%s.%s' % (tool.entry_point, tool.version)
+
+        if tool.working_directory_required:
+            queue = '%s.%s' % (queue, repository.name)
+
+        large_diff_files = config.settings.get('large_diff_files')
+        large_diff_lines = config.settings.get('large_diff_lines')
+
+        if large_diff_files or large_diff_lines:
+            if diff_sizes is None:
+                diff_sizes = {}
+
+            try:
+                file_count, line_count = diff_sizes[diffset.pk]
+            except KeyError:
+                file_count, line_count = self._get_diff_size(diffset)
+                diff_sizes[diffset.pk] = (file_count, line_count)
+
+            if ((large_diff_files and file_count >= large_diff_files) or
+                (large_diff_lines and line_count >= large_diff_lines)):
+                queue += LARGE_QUEUE_SUFFIX
+
+        return queue
+
+    def _get_diff_size(
+        self,
+        diffset: DiffSet,
+    ) -> tuple[int, int]:
+        """Return a cheap estimate of the size of a diff.
+
+        This uses the line counts stored for each file, and doesn't need to
+        load or parse the diff content.
+
+        Version Added:
+            5.0
+
+        Args:
+            diffset (reviewboard.diffviewer.models.DiffSet):
+                The diffset to estimate the size of.
+
+        Returns:
+            tuple:
+            A 2-tuple containing the number of files and the total number of
+            inserted and deleted lines.
+        """
+        file_count = 0
+        line_count = 0
+
+        for filediff in diffset.files.all():
+            counts = filediff.get_line_counts()
+            file_count += 1
+            line_count += ((counts.get('raw_insert_count') or 0) +
+                           (counts.get('raw_delete_count') or 0))
+
+        return file_count, line_count
+
+    def _supersede_status_updates(
+        self,
+        review_request: ReviewRequest,
+        status_updates: list[StatusUpdate],
+    ) -> None:
+        """Supersede pending runs for older diffs.
+
+        The status updates are marked as errors and flagged with
+        ``reviewbot_superseded`` in their extra data, which tells any worker
+        still running them to stop without publishing a review. They can't
+        be retried, since the newer diff has its own run. Tasks that are
+        still queued are revoked, unless they're also running other
+        configurations that haven't been superseded.
+
+        Version Added:
+            5.0
+
+        Args:
+            review_request (reviewboard.reviews.models.ReviewRequest):
+                The review request that a new diff was published for.
+
+            status_updates (list of
+                            reviewboard.reviews.models.StatusUpdate):
+                The pending status updates for older diffs.
+        """
+        if not status_updates:
+            return
+
+        task_ids = set()
+
+        for status_update in status_updates:
+            task_id = status_update.extra_data.get('reviewbot_task_id')
+
+            if task_id:
+                task_ids.add(task_id)
+
+        for status_update in status_updates:
+            status_update.state = StatusUpdate.ERROR
+            status_update.description = 'superseded by a newer diff.'
+            status_update.extra_data['reviewbot_superseded'] = True
+            status_update.extra_data.pop('can_retry', None)
+            status_update.save(update_fields=('state', 'description',
+                                              'extra_data'))
+
+        still_pending = (
+            StatusUpdate.objects
+            .filter(review_request=review_request,
+                    state=StatusUpdate.PENDING)
+            .only('extra_data')
+        )
+
+        for status_update in still_pending:
+            task_ids.discard(status_update.extra_data.get('reviewbot_task_id'))
+
+        if task_ids:
+            from reviewbotext.extension import ReviewBotExtension
+            extension = ReviewBotExtension.instance
+
+            extension.dispatcher.revoke_tasks(task_ids)
 
     def _drop_old_issues(
         self,
         user: User,
-        service_id: str,
+        service_ids: Iterable[str],
         review_request: ReviewRequest,
     ) -> None:
-        """Drop old issues associated with the given tool config.
+        """Drop old issues associated with the given tool configs.
+
+        Version Changed:
+            5.0:
+            This now takes a list of service IDs, and drops the issues for
+            all of them using a constant number of queries.
 
         Args:
             user (django.contrib.auth.models.User):
                 The Review Bot user.
 
-            service_id (str):
-                The service ID set on the status update objects.
+            service_ids (list of str):
+                The service IDs set on the status update objects.
 
             review_request (reviewboard.reviews.models.ReviewRequest):
                 The review request that Review Bot is currently checking.
         """
-        status_updates = (
-            StatusUpdate.objects.all()
+        review_ids = list(
+            StatusUpdate.objects
             .filter(user=user,
-                    service_id=service_id,
+                    service_id__in=service_ids,
                     review_request=review_request)
             .exclude(review__isnull=True)
-            .select_related('review')
+            .values_list('review_id', flat=True)
         )
 
-        for update in status_updates:
-            update.drop_open_issues()
+        if not review_ids:
+            return
+
+        now = timezone.now()
+        review_updated = False
+
+        for comment_cls in (Comment, ScreenshotComment,
+                            FileAttachmentComment, GeneralComment):
+            count = (
+                comment_cls.objects
+                .filter(review__in=review_ids,
+                        issue_status=BaseComment.OPEN)
+                .update(issue_status=BaseComment.DROPPED,
+                        timestamp=now)
+            )
+
+            if count > 0:
+                review_updated = True
+
+        if review_updated:
+            review_request.last_review_activity_timestamp = now
+            review_request.save(
+                update_fields=['last_review_activity_timestamp'])
+            review_request.reinit_issue_open_count()
+
+    def _create_status_updates(
+        self,
+        status_updates: list[StatusUpdate],
+    ) -> None:
+        """Create status updates.
+
+        The status updates are created in a single query if the database can
+        return the new IDs from a bulk insert.
 
+        Version Added:
+            5.0
+
+        Args:
+            status_updates (list of
+                            reviewboard.reviews.models.StatusUpdate):
+                The status updates to create.
+        """
+        if connection.features.can_return_rows_from_bulk_insert:
+            StatusUpdate.objects.bulk_create(status_updates)
+        else:
+            for status_update in status_updates:
+                status_update.save()
+
+    @transaction.atomic
     def _on_status_update_request_run(
         self,
         status_update: StatusUpdate,
@@ -296,6 +881,12 @@ class ReviewBotIntegration(Integration):
     ) -> None:
         """Handle a request to run or rerun a tool.
 
+        Version Changed:
+            5.0:
+            The task is now queued in the same transaction as the status
+            update, and sent to the broker after the transaction is
+            committed.
+
         Args:
             status_update (reviewboard.reviews.models.StatusUpdate):
                 The status update for the tool that should be run.
@@ -324,25 +915,21 @@ class ReviewBotIntegration(Integration):
         from reviewbotext.extension import ReviewBotExtension
         extension = ReviewBotExtension.instance
 
-        # TODO: This creates a new session entry. We should figure out a better
-        # way for Review Bot workers to authenticate to the server.
-        session = extension.login_user()
         user = extension.user
 
         assert len(matching_configs) == 1
         config, tool, tool_options, review_settings = matching_configs[0]
 
+        task_id = str(uuid4())
+
         status_update.description = 'starting...'
         status_update.state = StatusUpdate.PENDING
         status_update.timestamp = datetime.now()
-        status_update.save(update_fields=('description', 'state', 'timestamp'))
+        status_update.extra_data['reviewbot_task_id'] = task_id
+        status_update.save(update_fields=('description', 'state', 'timestamp',
+                                          'extra_data'))
 
         repository = review_request.repository
-        queue = '%s.%s' % (tool.entry_point, tool.version)
-
-        if tool.working_directory_required:
-            queue = '%s.%s' % (queue, repository.name)
-
         changedesc = status_update.change_description
 
         # If there's a change description associated with the status
@@ -361,23 +948,29 @@ class ReviewBotIntegration(Integration):
                          status_update.pk)
             return
 
-        with log_timed(f'Sending manual run task to Review Bot queue {queue} '
-                       f'for review request {review_request.pk}, '
-                       f'diff revision {diffset.revision}, '
-                       f'status update ID {status_update.pk}',
-                       logger=logger):
-            extension.celery.send_task(
-                'reviewbot.tasks.RunTool',
-                kwargs={
-                    'server_url': server_url,
-                    'session': session,
-                    'username': user.username,
-                    'review_request_id': review_request.get_display_id(),
-                    'diff_revision': diffset.revision,
-                    'status_update_id': status_update.pk,
-                    'review_settings': review_settings,
-                    'tool_options': tool_options,
-                    'repository_name': repository.name,
-                    'base_commit_id': diffset.base_commit_id,
-                },
-                queue=queue)
+        queue = self._get_queue(config=config,
+                                tool=tool,
+                                repository=repository,
+                                diffset=diffset)
+
+        logger.info('Queuing manual run task for Review Bot queue %s for '
+                    'review request %s, diff revision %s, status update '
+                    'ID %s',
+                    queue, review_request.pk, diffset.revision,
+                    status_update.pk)
+
+        extension.dispatcher.queue_task(
+            task_name='reviewbot.tasks.RunTool',
+            task_kwargs={
+                'server_url': server_url,
+                'username': user.username,
+                'review_request_id': review_request.get_display_id(),
+                'diff_revision': diffset.revision,
+                'status_update_id': status_update.pk,
+                'review_settings': review_settings,
+                'tool_options': tool_options,
+                'repository_name': repository.name,
+                'base_commit_id': diffset.base_commit_id,
+            },
+            queue=queue,
+            task_id=task_id)
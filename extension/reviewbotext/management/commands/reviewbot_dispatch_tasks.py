@@ -0,0 +1,44 @@
+"""Management command to send queued tasks to Review Bot workers.
+
+Version Added:
+    5.0
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from reviewboard.extensions.base import get_extension_manager
+
+from reviewbotext.extension import ReviewBotExtension
+
+
+class Command(BaseCommand):
+    """Sends queued tasks to Review Bot workers.
+
+    This can be run periodically (such as from cron) to send tasks on
+    servers where the extension's background thread can't run.
+
+    Version Added:
+        5.0
+    """
+
+    help = 'Sends any queued Review Bot tasks that are due to the broker.'
+
+    def handle(self, **options):
+        """Handle the command.
+
+        Args:
+            **options (dict):
+                Options parsed on the command line.
+
+        Raises:
+            django.core.management.CommandError:
+                The Review Bot extension is not enabled.
+        """
+        extension_manager = get_extension_manager()
+        extension = extension_manager.get_enabled_extension(
+            ReviewBotExtension.id)
+
+        if extension is None:
+            raise CommandError('The Review Bot extension is not enabled.')
+
+        sent = extension.dispatcher.dispatch_pending()
+        self.stdout.write('Sent %d Review Bot task(s).' % sent)
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from djblets.db.fields import JSONField
 
 
@@ -49,3 +50,42 @@ class Tool(models.Model):
     class Meta:
         app_label = 'reviewbotext'
         unique_together = ('entry_point', 'version')
+
+
+class QueuedTask(models.Model):
+    """A task waiting to be sent to Review Bot workers.
+
+    Tasks are recorded in the same transaction as the status updates they
+    run for, and are sent to the broker by
+    :py:class:`~reviewbotext.dispatch.TaskDispatcher` once that transaction
+    is committed.
+
+    Version Added:
+        5.0
+    """
+
+    task_id = models.CharField(max_length=64, unique=True)
+    task_name = models.CharField(max_length=128)
+    queue = models.CharField(max_length=255)
+
+    #: The keyword arguments for the task.
+    #:
+    #: These don't include the session, which is added when the task is sent.
+    task_kwargs = JSONField()
+
+    created = models.DateTimeField(default=timezone.now)
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        """Return a string representation of the queued task.
+
+        Returns:
+            unicode:
+            The text representation for this model.
+        """
+        return '%s (%s)' % (self.task_name, self.task_id)
+
+    class Meta:
+        app_label = 'reviewbotext'
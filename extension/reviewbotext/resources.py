@@ -7,6 +7,9 @@ import logging
 from typing import TYPE_CHECKING, overload
 
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils import timezone
 from djblets.webapi.decorators import (webapi_login_required,
                                        webapi_request_fields,
                                        webapi_response_errors)
@@ -15,11 +18,12 @@ from djblets.webapi.errors import (DOES_NOT_EXIST,
                                    NOT_LOGGED_IN,
                                    PERMISSION_DENIED)
 from reviewboard.diffviewer.models import FileDiff
-from reviewboard.reviews.models import BaseComment, Review
+from reviewboard.reviews.models import BaseComment, Comment, Review
 from reviewboard.webapi.decorators import webapi_check_local_site
 from reviewboard.webapi.resources import resources, WebAPIResource
 from typing_extensions import NotRequired, TypedDict
 
+from reviewbotext.integration import mark_tools_updated
 from reviewbotext.models import Tool
 
 if TYPE_CHECKING:
@@ -168,6 +172,14 @@ class ToolResource(WebAPIResource):
           },
         ]
 
+        Existing tools are loaded in a single query. New tools are created,
+        and tools that weren't in the last update are marked, in bulk. If
+        nothing has changed, nothing is written.
+
+        Version Changed:
+            5.0:
+            Tools are now created and updated in bulk.
+
         TODO: Use the hostname.
         """
         from reviewbotext.extension import ReviewBotExtension
@@ -186,23 +198,56 @@ class ToolResource(WebAPIResource):
                 },
             }
 
-        for tool in tools:
-            obj, created = Tool.objects.get_or_create(
-                entry_point=tool['entry_point'],
-                version=tool['version'],
-                defaults={
-                    'name': tool['name'],
-                    'description': tool['description'],
-                    'tool_options': tool['tool_options'],
-                    'in_last_update': True,
-                    'timeout': tool['timeout'],
-                    'working_directory_required':
-                        tool['working_directory_required'],
+        tools_by_key = {
+            (tool['entry_point'], tool['version']): tool
+            for tool in tools
+        }
+
+        # Load all the existing tools in one query, and only write the ones
+        # that are new or weren't in the last update.
+        existing_tools = {
+            (obj.entry_point, obj.version): obj
+            for obj in (
+                Tool.objects
+                .filter(entry_point__in={
+                    entry_point
+                    for entry_point, version in tools_by_key
                 })
+                .only('pk', 'entry_point', 'version', 'in_last_update')
+            )
+        }
 
-            if not created and not obj.in_last_update:
-                obj.in_last_update = True
-                obj.save()
+        new_tools = [
+            Tool(entry_point=tool['entry_point'],
+                 version=tool['version'],
+                 name=tool['name'],
+                 description=tool['description'],
+                 tool_options=tool['tool_options'],
+                 in_last_update=True,
+                 timeout=tool['timeout'],
+                 working_directory_required=tool['working_directory_required'])
+            for key, tool in tools_by_key.items()
+            if key not in existing_tools
+        ]
+
+        stale_tool_pks = [
+            obj.pk
+            for key, obj in existing_tools.items()
+            if key in tools_by_key and not obj.in_last_update
+        ]
+
+        if new_tools:
+            # Another worker may be adding the same tools at the same time.
+            Tool.objects.bulk_create(new_tools, ignore_conflicts=True)
+
+        if stale_tool_pks:
+            Tool.objects.filter(pk__in=stale_tool_pks).update(
+                in_last_update=True)
+
+        if new_tools or stale_tool_pks:
+            # Bulk operations don't emit the signals that invalidate the
+            # cached tools.
+            mark_tools_updated()
 
         # TODO: Fix the result key here.
         return 201, {}
@@ -295,6 +340,9 @@ class ReviewBotReviewResource(WebAPIResource):
         """Create a new review and publishes it.
 
         Version Changed:
+            5.0:
+            Comments are now created in bulk.
+
             4.1:
             Added the ``to_owner_only`` argument.
 
@@ -406,11 +454,39 @@ class ReviewBotReviewResource(WebAPIResource):
             body_bottom_rich_text=body_bottom_rich_text,
             ship_it=ship_it)
 
+        now = timezone.now()
+
         for comment_type, comments in (
             (new_review.comments, diff_comments_norm),
             (new_review.general_comments, general_comments_norm)):
-            for comment in comments:
-                comment_type.create(**comment)
+            if not comments:
+                continue
+
+            comment_objs = [
+                comment_type.model(timestamp=now, **comment)
+                for comment in comments
+            ]
+
+            # The comments are created in bulk, along with their relations to
+            # the review, if the database can return the new IDs from a bulk
+            # insert. They don't need the side effects of
+            # BaseComment.save(), since the review is published below.
+            if connection.features.can_return_rows_from_bulk_insert:
+                comment_type.model.objects.bulk_create(comment_objs)
+            else:
+                for comment_obj in comment_objs:
+                    comment_obj.save()
+
+            comment_type.add(*comment_objs)
+
+        if diff_comments_norm:
+            # Publishing checks that each diff comment's diff is public. Load
+            # the diffs along with the comments, rather than once per comment.
+            prefetch_related_objects(
+                [new_review],
+                Prefetch('comments',
+                         queryset=Comment.objects.select_related(
+                             'filediff__diffset__history')))
 
         new_review.publish(
             user=request.user,
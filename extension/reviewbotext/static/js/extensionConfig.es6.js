@@ -277,6 +277,9 @@ const BrokerStatusView = Backbone.View.extend({
             <li>
              <span class="fa fa-desktop"></span>
              <%- worker.hostname %>
+             <% if (worker.heartbeatText) { %>
+              (<%- worker.heartbeatText %>)
+             <% } %>
             </li>
            <% }); %>
           </ul>
@@ -312,7 +315,7 @@ const BrokerStatusView = Backbone.View.extend({
         this._errorText = '';
         this._workers = [];
 
-        this.listenTo(this.model, 'change', this._update);
+        this.listenTo(this.model, 'change', () => this._update(true));
         this._update();
     },
 
@@ -363,7 +366,9 @@ const BrokerStatusView = Backbone.View.extend({
                 connectedText: gettext('Connected to broker.'),
                 workersText: workersText,
                 refreshText: gettext('Refresh'),
-                workers: this._workers,
+                workers: this._workers.map(worker => _.extend({
+                    heartbeatText: this._getHeartbeatText(worker.heartbeat),
+                }, worker)),
                 readyText: gettext('Review Bot is ready!'),
                 configureIntegrationsHTML: interpolate(
                     gettext('To configure when Review Bot tools are run, set up <a href="%s">integration configurations</a>.'),
@@ -377,6 +382,30 @@ const BrokerStatusView = Backbone.View.extend({
         }
     },
 
+    /**
+     * Return text describing a worker's latest heartbeat.
+     *
+     * Args:
+     *     heartbeat (object):
+     *         The latest heartbeat from the worker, if any.
+     *
+     * Returns:
+     *     string:
+     *     The text describing the heartbeat, or an empty string if there
+     *     is no heartbeat.
+     */
+    _getHeartbeatText(heartbeat) {
+        if (!heartbeat) {
+            return '';
+        } else if (heartbeat.stale) {
+            return gettext('not responding');
+        } else {
+            return interpolate(
+                gettext('%s of %s processes busy'),
+                [heartbeat.in_flight, heartbeat.pool_size]);
+        }
+    },
+
     /**
      * Handler for when the "Refresh" link is clicked.
      *
@@ -388,13 +417,18 @@ const BrokerStatusView = Backbone.View.extend({
         e.preventDefault();
         e.stopPropagation();
 
-        this._update();
+        this._update(true);
     },
 
     /**
      * Request status from the server and update the UI.
+     *
+     * Args:
+     *     refresh (boolean, optional):
+     *         Whether to ask the server to query the workers again, rather
+     *         than returning the last known status.
      */
-    _update() {
+    _update(refresh=false) {
         if (this._updating) {
             return;
         }
@@ -402,10 +436,30 @@ const BrokerStatusView = Backbone.View.extend({
         this._updating = true;
         this._updateDisplay();
 
+        this._fetchStatus(refresh);
+    },
+
+    /**
+     * Fetch the status from the server.
+     *
+     * If the server is still querying the workers, this will check again
+     * shortly.
+     *
+     * Args:
+     *     refresh (boolean):
+     *         Whether to ask the server to query the workers again.
+     */
+    _fetchStatus(refresh) {
         $.ajax({
             type: 'GET',
             url: this.model.options.workerStatusURL,
+            data: refresh ? {refresh: 1} : {},
             success: result => {
+                if (result.refreshing) {
+                    setTimeout(() => this._fetchStatus(false), 1000);
+                    return;
+                }
+
                 this._workers = result.hosts || [];
                 this._connected = (result.state === 'success');
                 this._errorText = result.error || '';
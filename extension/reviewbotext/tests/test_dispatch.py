@@ -0,0 +1,201 @@
+"""Unit tests for reviewbotext.dispatch.TaskDispatcher."""
+
+import io
+from datetime import timedelta
+
+import kgb
+from django.core.cache import cache
+from django.core.management import call_command, get_commands
+from django.db import DatabaseError, close_old_connections, connections
+from django.utils import timezone
+
+from reviewbotext.dispatch import TaskDispatcher
+from reviewbotext.models import QueuedTask
+from reviewbotext.tests.testcase import TestCase
+
+
+class TaskDispatcherTests(kgb.SpyAgency, TestCase):
+    """Unit tests for reviewbotext.dispatch.TaskDispatcher."""
+
+    def setUp(self):
+        super(TaskDispatcherTests, self).setUp()
+
+        cache.clear()
+
+        extension = self.extension
+        extension.settings['broker_url'] = 'memory://'
+
+        self.spy_on(extension.login_user,
+                    op=kgb.SpyOpReturn('session-key'))
+
+        self.dispatcher = TaskDispatcher(extension)
+
+    def test_queue_task(self):
+        """Testing TaskDispatcher.queue_task sends the task after commit"""
+        self.spy_on(self.extension.celery.send_task,
+                    call_original=False)
+        self.spy_on(self.dispatcher.wake,
+                    call_fake=lambda _self: _self.dispatch_pending())
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.dispatcher.queue_task(task_name='reviewbot.tasks.RunTool',
+                                       task_kwargs={'status_update_id': 1},
+                                       queue='tool1.1',
+                                       task_id='task1')
+
+        send_task = self.extension.celery.send_task
+        self.assertSpyNotCalled(send_task)
+        self.assertEqual(QueuedTask.objects.count(), 1)
+
+        for callback in callbacks:
+            callback()
+
+        self.assertSpyCalledWith(
+            send_task,
+            'reviewbot.tasks.RunTool',
+            kwargs={
+                'session': 'session-key',
+                'status_update_id': 1,
+            },
+            queue='tool1.1',
+            task_id='task1')
+        self.assertFalse(QueuedTask.objects.exists())
+
+        stats = self.dispatcher.get_stats()
+        self.assertEqual(stats['pending'], 0)
+        self.assertIsNone(stats['oldest_pending_age'])
+        self.assertIsNotNone(stats['last_lag'])
+
+    def test_dispatch_pending_with_broker_error(self):
+        """Testing TaskDispatcher.dispatch_pending with an error sending to
+        the broker
+        """
+        self.spy_on(self.extension.celery.send_task,
+                    op=kgb.SpyOpRaise(IOError('Oh no.')))
+
+        for i in range(2):
+            QueuedTask.objects.create(task_id='task%s' % i,
+                                      task_name='reviewbot.tasks.RunTool',
+                                      queue='tool1.1',
+                                      task_kwargs={})
+
+        self.assertEqual(self.dispatcher.dispatch_pending(), 0)
+
+        send_task = self.extension.celery.send_task
+        self.assertSpyCallCount(send_task, 1)
+
+        queued_task1, queued_task2 = QueuedTask.objects.order_by('pk')
+        self.assertEqual(queued_task1.attempts, 1)
+        self.assertEqual(queued_task1.last_error, 'Oh no.')
+        self.assertGreater(queued_task1.next_attempt, timezone.now())
+
+        # Both tasks wait for the retry.
+        self.assertEqual(queued_task2.attempts, 0)
+        self.assertEqual(queued_task2.next_attempt,
+                         queued_task1.next_attempt)
+
+        self.assertEqual(self.dispatcher.dispatch_pending(), 0)
+        self.assertSpyCallCount(send_task, 1)
+
+        stats = self.dispatcher.get_stats()
+        self.assertEqual(stats['pending'], 2)
+        self.assertIsNotNone(stats['oldest_pending_age'])
+
+    def test_dispatch_pending_with_claimed(self):
+        """Testing TaskDispatcher.dispatch_pending with tasks claimed or
+        deferred by another process
+        """
+        self.spy_on(self.extension.celery.send_task,
+                    call_original=False)
+
+        now = timezone.now()
+        QueuedTask.objects.create(task_id='task1',
+                                  task_name='reviewbot.tasks.RunTool',
+                                  queue='tool1.1',
+                                  task_kwargs={},
+                                  next_attempt=now + timedelta(seconds=30))
+        QueuedTask.objects.create(task_id='task2',
+                                  task_name='reviewbot.tasks.RunTool',
+                                  queue='tool1.1',
+                                  task_kwargs={},
+                                  next_attempt=now - timedelta(seconds=30))
+
+        self.assertEqual(self.dispatcher.dispatch_pending(), 1)
+
+        send_task = self.extension.celery.send_task
+        self.assertSpyCalledOnceWith(send_task,
+                                     'reviewbot.tasks.RunTool',
+                                     task_id='task2')
+        self.assertEqual(
+            list(QueuedTask.objects.values_list('task_id', flat=True)),
+            ['task1'])
+
+    def test_start(self):
+        """Testing TaskDispatcher.start"""
+        self._dispatcher_spy_agency.unspy_all()
+        self.spy_on(TaskDispatcher._run,
+                    owner=TaskDispatcher,
+                    call_original=False)
+
+        dispatcher = self.dispatcher
+        dispatcher.start()
+        thread = dispatcher._thread
+
+        try:
+            self.assertIsNotNone(thread)
+            thread.join(timeout=5)
+
+            # A thread that's no longer running is replaced.
+            dispatcher.start()
+            self.assertIsNot(dispatcher._thread, thread)
+        finally:
+            dispatcher.stop()
+
+        self.assertSpyCallCount(TaskDispatcher._run, 2)
+
+    def test_run_with_database_error(self):
+        """Testing TaskDispatcher._run keeps running after a database error"""
+        dispatcher = self.dispatcher
+        wait_times = []
+
+        self.spy_on(close_old_connections, call_original=False)
+        self.spy_on(connections['default'].close, call_original=False)
+        self.spy_on(dispatcher.dispatch_pending, call_original=False)
+        self.spy_on(dispatcher._get_wait_time,
+                    op=kgb.SpyOpRaise(DatabaseError('Connection lost.')))
+
+        @self.spy_for(dispatcher._event.wait)
+        def _wait(_self, timeout=None):
+            wait_times.append(timeout)
+
+            if len(wait_times) == 2:
+                dispatcher._stopped = True
+
+            return True
+
+        dispatcher._run()
+
+        self.assertEqual(wait_times, [TaskDispatcher.POLL_INTERVAL] * 2)
+        self.assertSpyCallCount(close_old_connections, 2)
+        self.assertSpyCallCount(dispatcher.dispatch_pending, 2)
+
+    def test_management_command(self):
+        """Testing reviewbot_dispatch_tasks management command"""
+        self.spy_on(self.extension.celery.send_task,
+                    call_original=False)
+
+        QueuedTask.objects.create(task_id='task1',
+                                  task_name='reviewbot.tasks.RunTool',
+                                  queue='tool1.1',
+                                  task_kwargs={})
+
+        # The list of commands may have been cached before the extension
+        # was enabled.
+        get_commands.cache_clear()
+
+        stdout = io.StringIO()
+        call_command('reviewbot_dispatch_tasks', stdout=stdout)
+
+        self.assertSpyCalledOnce(self.extension.celery.send_task)
+        self.assertFalse(QueuedTask.objects.exists())
+        self.assertEqual(stdout.getvalue(), 'Sent 1 Review Bot task(s).\n')
@@ -0,0 +1,77 @@
+"""Unit tests for reviewbotext.extension.ReviewBotExtension."""
+
+from importlib import import_module
+
+import kgb
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+
+from reviewbotext.tests.testcase import TestCase
+
+
+class ReviewBotExtensionTests(kgb.SpyAgency, TestCase):
+    """Unit tests for reviewbotext.extension.ReviewBotExtension."""
+
+    fixtures = ['test_users']
+
+    def setUp(self):
+        super(ReviewBotExtensionTests, self).setUp()
+
+        cache.clear()
+
+        self.user = self.create_user(username='reviewbot')
+        self.extension.settings['user'] = self.user.pk
+
+    def test_login_user_reuses_session(self):
+        """Testing ReviewBotExtension.login_user reuses the session"""
+        self.spy_on(SessionStore.save, owner=SessionStore)
+
+        session_key = self.extension.login_user()
+        self.assertIsNotNone(session_key)
+        self.assertSpyCalled(SessionStore.save)
+
+        SessionStore.save.reset_calls()
+
+        self.assertEqual(self.extension.login_user(), session_key)
+        self.assertSpyNotCalled(SessionStore.save)
+
+    def test_login_user_with_changed_password(self):
+        """Testing ReviewBotExtension.login_user creates a new session after
+        the user's password changes
+        """
+        session_key = self.extension.login_user()
+
+        self.user.set_password('new-password')
+        self.user.save(update_fields=('password',))
+
+        self.assertNotEqual(self.extension.login_user(), session_key)
+
+    def test_login_user_with_removed_session(self):
+        """Testing ReviewBotExtension.login_user creates a new session after
+        the cached session is removed
+        """
+        engine = import_module(settings.SESSION_ENGINE)
+
+        session_key = self.extension.login_user()
+        engine.SessionStore(session_key=session_key).delete()
+
+        new_session_key = self.extension.login_user()
+        self.assertNotEqual(new_session_key, session_key)
+        self.assertTrue(engine.SessionStore().exists(new_session_key))
+
+    def test_celery_with_changed_broker_url(self):
+        """Testing ReviewBotExtension.celery with a changed broker URL closes
+        the old app's connections
+        """
+        extension = self.extension
+        extension.settings['broker_url'] = 'memory://'
+
+        celery = extension.celery
+        self.assertIs(extension.celery, celery)
+
+        self.spy_on(celery.close)
+        extension.settings['broker_url'] = 'memory://localhost/'
+
+        self.assertIsNot(extension.celery, celery)
+        self.assertSpyCalled(celery.close)
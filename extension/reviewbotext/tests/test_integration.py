@@ -0,0 +1,486 @@
+"""Unit tests for reviewbotext.integration.ReviewBotIntegration."""
+
+import json
+
+import kgb
+from celery.app.control import Control
+from reviewboard.changedescs.models import ChangeDescription
+from reviewboard.integrations.base import get_integration_manager
+from reviewboard.reviews.models import (GeneralComment,
+                                        ReviewRequest,
+                                        StatusUpdate)
+from reviewboard.reviews.signals import status_update_request_run
+
+from reviewbotext.dispatch import TaskDispatcher
+from reviewbotext.integration import ReviewBotIntegration
+from reviewbotext.models import Tool
+from reviewbotext.tests.testcase import TestCase
+
+
+class ReviewBotIntegrationTests(kgb.SpyAgency, TestCase):
+    """Unit tests for reviewbotext.integration.ReviewBotIntegration."""
+
+    fixtures = ['test_scmtools', 'test_users']
+
+    def setUp(self):
+        super(ReviewBotIntegrationTests, self).setUp()
+
+        self.user = self.create_user(username='reviewbot')
+
+        extension = self.extension
+        extension.settings['user'] = self.user.pk
+        extension.settings['broker_url'] = 'memory://'
+
+        integration_manager = get_integration_manager()
+        integration_manager.clear_all_configs_cache()
+
+        self.integration = integration_manager.get_integration(
+            ReviewBotIntegration.integration_id)
+        self.integration.enable_integration()
+
+        self.spy_on(extension.login_user,
+                    op=kgb.SpyOpReturn('session-key'))
+        self.spy_on(extension.celery.send_task,
+                    call_original=False)
+
+        # Send queued tasks immediately, rather than in a thread.
+        self.spy_on(TaskDispatcher.wake,
+                    owner=TaskDispatcher,
+                    call_fake=lambda dispatcher: dispatcher.dispatch_pending())
+
+    def tearDown(self):
+        self.integration.disable_integration()
+
+        super(ReviewBotIntegrationTests, self).tearDown()
+
+    def test_publish_groups_configs_by_queue(self):
+        """Testing ReviewBotIntegration on review request publish groups
+        configurations sharing a queue into a RunTools task
+        """
+        tool1 = self.create_tool(entry_point='tool1')
+        tool2 = self.create_tool(entry_point='tool2')
+
+        config1 = self.create_integration_config(tool1,
+                                                 tool_options={'a': 1})
+        config2 = self.create_integration_config(tool1,
+                                                 tool_options={'a': 2})
+        config3 = self.create_integration_config(tool2)
+
+        review_request = self.create_review_request(create_repository=True)
+        diffset = self.create_diffset(review_request,
+                                      base_commit_id='abc123')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            review_request.publish(review_request.submitter)
+
+        send_task = self.extension.celery.send_task
+        self.assertSpyCallCount(send_task, 2)
+
+        # Both tasks should be published with the same producer.
+        self.assertIs(send_task.calls[0].kwargs['producer'],
+                      send_task.calls[1].kwargs['producer'])
+
+        status_updates = {
+            status_update.service_id: status_update.pk
+            for status_update in StatusUpdate.objects.filter(
+                review_request=review_request)
+        }
+
+        # The first call should have combined both configurations for the
+        # first tool.
+        call = send_task.calls[0]
+        self.assertEqual(call.args, ('reviewbot.tasks.RunTools',))
+        self.assertEqual(call.kwargs['queue'], 'tool1.1.0')
+
+        task_kwargs = call.kwargs['kwargs']
+        self.assertEqual(task_kwargs['diff_revision'], diffset.revision)
+        self.assertEqual(task_kwargs['base_commit_id'], 'abc123')
+        self.assertEqual(
+            [
+                (tool_info['status_update_id'], tool_info['tool_options'])
+                for tool_info in task_kwargs['tools']
+            ],
+            [
+                (status_updates['reviewbot.%s' % config1.pk], {'a': 1}),
+                (status_updates['reviewbot.%s' % config2.pk], {'a': 2}),
+            ])
+
+        # The second tool should use a standard RunTool task.
+        call = send_task.calls[1]
+        self.assertEqual(call.args, ('reviewbot.tasks.RunTool',))
+        self.assertEqual(call.kwargs['queue'], 'tool2.1.0')
+
+        task_kwargs = call.kwargs['kwargs']
+        self.assertNotIn('tools', task_kwargs)
+        self.assertEqual(task_kwargs['status_update_id'],
+                         status_updates['reviewbot.%s' % config3.pk])
+        self.assertEqual(task_kwargs['tool_options'], {})
+
+    def test_publish_with_large_diff(self):
+        """Testing ReviewBotIntegration on review request publish with a diff
+        over the large diff thresholds uses the large queue
+        """
+        tool = self.create_tool(entry_point='tool1')
+        self.create_integration_config(tool, large_diff_files=2)
+        self.create_integration_config(tool, large_diff_lines=10)
+
+        review_request = self.create_review_request(create_repository=True)
+        diffset = self.create_diffset(review_request)
+        filediff = self.create_filediff(diffset)
+        filediff.set_line_counts(raw_insert_count=8,
+                                 raw_delete_count=2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            review_request.publish(review_request.submitter)
+
+        send_task = self.extension.celery.send_task
+        self.assertSpyCallCount(send_task, 2)
+        self.assertEqual(send_task.calls[0].kwargs['queue'], 'tool1.1.0')
+        self.assertEqual(send_task.calls[1].kwargs['queue'],
+                         'tool1.1.0.large')
+
+    def test_run_with_large_diff(self):
+        """Testing ReviewBotIntegration on status update run request with a
+        diff over the large diff thresholds uses the large queue
+        """
+        tool = self.create_tool(entry_point='tool1')
+        config = self.create_integration_config(tool,
+                                                large_diff_files=1,
+                                                run_manually=True)
+
+        review_request = self.create_review_request(create_repository=True)
+        diffset = self.create_diffset(review_request)
+        self.create_filediff(diffset)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            review_request.publish(review_request.submitter)
+
+        send_task = self.extension.celery.send_task
+        self.assertSpyNotCalled(send_task)
+
+        status_update = StatusUpdate.objects.get(
+            service_id='reviewbot.%s' % config.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            status_update_request_run.send(sender=self.__class__,
+                                           status_update=status_update)
+
+        self.assertSpyCallCount(send_task, 1)
+        self.assertEqual(send_task.last_call.kwargs['queue'],
+                         'tool1.1.0.large')
+
+    def test_publish_supersedes_pending_runs(self):
+        """Testing ReviewBotIntegration on review request publish with a new
+        diff supersedes pending runs for older diffs
+        """
+        tool1 = self.create_tool(entry_point='tool1')
+        tool2 = self.create_tool(entry_point='tool2')
+        config1 = self.create_integration_config(tool1)
+        config2 = self.create_integration_config(tool2)
+
+        review_request = self.create_review_request(create_repository=True)
+        self.create_diffset(review_request)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            review_request.publish(review_request.submitter)
+
+        send_task = self.extension.celery.send_task
+        self.assertSpyCallCount(send_task, 2)
+        old_task_id1 = send_task.calls[0].kwargs['task_id']
+        old_task_id2 = send_task.calls[1].kwargs['task_id']
+
+        status_update1 = StatusUpdate.objects.get(
+            service_id='reviewbot.%s' % config1.pk)
+        status_update2 = StatusUpdate.objects.get(
+            service_id='reviewbot.%s' % config2.pk)
+        self.assertEqual(status_update1.extra_data['reviewbot_task_id'],
+                         old_task_id1)
+
+        # The second tool's run has completed.
+        status_update2.state = StatusUpdate.DONE_SUCCESS
+        status_update2.save(update_fields=('state',))
+
+        self.spy_on(Control.revoke,
+                    owner=Control,
+                    call_original=False)
+
+        diffset = self.create_diffset(review_request, revision=2)
+        changedesc = ChangeDescription.objects.create(
+            public=True,
+            fields_changed={
+                'diff': {
+                    'added': [[diffset.name, None, diffset.pk]],
+                },
+            })
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.integration._on_review_request_published(
+                user=review_request.submitter,
+                review_request=review_request,
+                changedesc=changedesc)
+
+        status_update1.refresh_from_db()
+        self.assertEqual(status_update1.state, StatusUpdate.ERROR)
+        self.assertEqual(status_update1.description,
+                         'superseded by a newer diff.')
+        self.assertTrue(status_update1.extra_data['reviewbot_superseded'])
+        self.assertNotIn('can_retry', status_update1.extra_data)
+
+        status_update2.refresh_from_db()
+        self.assertEqual(status_update2.state, StatusUpdate.DONE_SUCCESS)
+
+        self.assertSpyCalledWith(Control.revoke, [old_task_id1])
+
+        self.assertSpyCallCount(send_task, 4)
+        self.assertEqual(send_task.calls[2].kwargs['kwargs']['diff_revision'],
+                         2)
+        self.assertNotIn(send_task.calls[2].kwargs['task_id'],
+                         (old_task_id1, old_task_id2))
+
+    def test_publish_drops_old_issues(self):
+        """Testing ReviewBotIntegration on review request publish with
+        drop_old_issues drops issues from earlier runs
+        """
+        tool = self.create_tool(entry_point='tool1')
+        config1 = self.create_integration_config(tool, drop_old_issues=True)
+        config2 = self.create_integration_config(tool, drop_old_issues=True)
+        config3 = self.create_integration_config(tool)
+
+        review_request = self.create_review_request(create_repository=True,
+                                                    publish=True)
+        self.create_diffset(review_request)
+
+        comments = []
+
+        for config in (config1, config2, config3):
+            review = self.create_review(review_request,
+                                        user=self.user,
+                                        publish=True)
+            comments.append(self.create_general_comment(review,
+                                                         issue_opened=True))
+            self.create_status_update(review_request,
+                                      user=self.user,
+                                      service_id='reviewbot.%s' % config.pk,
+                                      review=review)
+
+        self.spy_on(StatusUpdate.drop_open_issues,
+                    owner=StatusUpdate)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.integration._on_review_request_published(
+                user=review_request.submitter,
+                review_request=review_request)
+
+        self.assertSpyNotCalled(StatusUpdate.drop_open_issues)
+
+        for comment in comments:
+            comment.refresh_from_db()
+
+        self.assertEqual(
+            [comment.issue_status for comment in comments],
+            [
+                GeneralComment.DROPPED,
+                GeneralComment.DROPPED,
+                GeneralComment.OPEN,
+            ])
+
+        review_request = ReviewRequest.objects.get(pk=review_request.pk)
+        self.assertEqual(review_request.issue_open_count, 1)
+        self.assertEqual(review_request.issue_dropped_count, 2)
+
+        # The new status updates and tasks are created in bulk.
+        self.assertEqual(
+            StatusUpdate.objects.filter(review_request=review_request,
+                                        review__isnull=True).count(),
+            3)
+        self.assertSpyCallCount(self.extension.celery.send_task, 1)
+
+    def test_get_matching_configs_cached(self):
+        """Testing ReviewBotIntegration._get_matching_configs caches resolved
+        configurations
+        """
+        tool = self.create_tool(entry_point='tool1')
+        config = self.create_integration_config(tool,
+                                                tool_options={'a': 1},
+                                                max_comments=10)
+        review_request = self.create_review_request()
+
+        self.spy_on(Tool.objects.in_bulk)
+
+        matching_configs = list(
+            self.integration._get_matching_configs(review_request))
+
+        self.assertEqual(len(matching_configs), 1)
+        self.assertEqual(matching_configs[0][0], config)
+        self.assertEqual(matching_configs[0][1], tool)
+        self.assertEqual(matching_configs[0][2], {'a': 1})
+        self.assertEqual(matching_configs[0][3]['max_comments'], 10)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                list(self.integration._get_matching_configs(review_request)),
+                matching_configs)
+
+        self.assertSpyCallCount(Tool.objects.in_bulk, 1)
+
+        # Saving a tool should invalidate the cache.
+        tool.timeout = 10
+        tool.save()
+
+        matching_configs = list(
+            self.integration._get_matching_configs(review_request))
+        self.assertSpyCallCount(Tool.objects.in_bulk, 2)
+        self.assertEqual(matching_configs[0][1].timeout, 10)
+
+        # So should saving a configuration, once the integration manager
+        # picks up the change at the start of the next request.
+        config.settings['tool_options'] = json.dumps({'a': 2})
+        config.save()
+        get_integration_manager().check_expired()
+
+        matching_configs = list(
+            self.integration._get_matching_configs(review_request))
+        self.assertSpyCallCount(Tool.objects.in_bulk, 3)
+        self.assertEqual(matching_configs[0][2], {'a': 2})
+
+    def test_get_matching_configs_with_repository_conditions(self):
+        """Testing ReviewBotIntegration._get_matching_configs skips
+        configurations for other repositories without evaluating conditions
+        """
+        tool = self.create_tool(entry_point='tool1')
+        repository1 = self.create_repository(name='repo1')
+        repository2 = self.create_repository(name='repo2')
+
+        config1 = self.create_integration_config(
+            tool,
+            conditions={
+                'mode': 'all',
+                'conditions': [{
+                    'choice': 'repository',
+                    'op': 'one-of',
+                    'value': [repository1.pk],
+                }],
+            })
+        config2 = self.create_integration_config(
+            tool,
+            conditions={
+                'mode': 'all',
+                'conditions': [{
+                    'choice': 'repository',
+                    'op': 'one-of',
+                    'value': [repository2.pk],
+                }],
+            })
+        config3 = self.create_integration_config(tool)
+
+        review_request = self.create_review_request(repository=repository1)
+
+        # Spy on the cached instances of the configurations.
+        config_index = self.integration._get_config_index(None)
+        cached_config1, cached_config2 = [
+            info[0]
+            for info in config_index.config_infos[:2]
+        ]
+        self.spy_on(cached_config1.match_conditions)
+        self.spy_on(cached_config2.match_conditions)
+
+        matching_configs = list(
+            self.integration._get_matching_configs(review_request))
+
+        self.assertEqual([info[0] for info in matching_configs],
+                         [config1, config3])
+        self.assertSpyCalled(cached_config1.match_conditions)
+        self.assertSpyNotCalled(cached_config2.match_conditions)
+
+    def test_get_matching_configs_with_review_group_conditions(self):
+        """Testing ReviewBotIntegration._get_matching_configs with
+        configurations indexed by review group
+        """
+        tool = self.create_tool(entry_point='tool1')
+        group1 = self.create_review_group(name='group1')
+        group2 = self.create_review_group(name='group2')
+
+        config1 = self.create_integration_config(
+            tool,
+            conditions={
+                'mode': 'any',
+                'conditions': [{
+                    'choice': 'review-groups',
+                    'op': 'contains-any',
+                    'value': [group1.pk],
+                }],
+            })
+        self.create_integration_config(
+            tool,
+            conditions={
+                'mode': 'any',
+                'conditions': [{
+                    'choice': 'review-groups',
+                    'op': 'contains-any',
+                    'value': [group2.pk],
+                }],
+            })
+
+        review_request = self.create_review_request()
+        review_request.target_groups.add(group1)
+
+        config_index = self.integration._get_config_index(None)
+        self.assertEqual(
+            [info[0] for info in config_index.get_candidates(review_request)],
+            [config1])
+
+        matching_configs = list(
+            self.integration._get_matching_configs(review_request))
+        self.assertEqual([info[0] for info in matching_configs], [config1])
+
+    def create_tool(self, entry_point, **kwargs):
+        """Create a tool for testing.
+
+        Args:
+            entry_point (str):
+                The entry point (tool ID) of the tool.
+
+            **kwargs (dict):
+                Additional fields for the tool.
+
+        Returns:
+            reviewbotext.models.Tool:
+            The new tool.
+        """
+        return Tool.objects.create(name=entry_point,
+                                   entry_point=entry_point,
+                                   version='1.0',
+                                   in_last_update=True,
+                                   **kwargs)
+
+    def create_integration_config(self, tool, tool_options={}, **kwargs):
+        """Create an integration configuration that always matches.
+
+        Args:
+            tool (reviewbotext.models.Tool):
+                The tool to run.
+
+            tool_options (dict, optional):
+                The options for the tool.
+
+            **kwargs (dict):
+                Additional settings for the configuration.
+
+        Returns:
+            reviewboard.integrations.models.IntegrationConfig:
+            The new configuration.
+        """
+        settings = {
+            'conditions': {
+                'mode': 'always',
+                'conditions': [],
+            },
+            'tool': tool.pk,
+            'tool_options': json.dumps(tool_options),
+        }
+        settings.update(kwargs)
+
+        return self.integration.create_config(name=tool.name,
+                                              enabled=True,
+                                              settings=settings,
+                                              save=True)
@@ -0,0 +1,74 @@
+"""Unit tests for reviewbotext.resources.ReviewBotReviewResource."""
+
+import json
+
+from reviewboard.reviews.models import Review
+
+from reviewbotext.tests.testcase import TestCase
+
+
+class ReviewBotReviewResourceTests(TestCase):
+    """Unit tests for reviewbotext.resources.ReviewBotReviewResource."""
+
+    fixtures = ['test_scmtools', 'test_users']
+
+    def test_post(self):
+        """Testing the POST review-bot-reviews/ API"""
+        review_request = self.create_review_request(create_repository=True,
+                                                    publish=True)
+        diffset = self.create_diffset(review_request)
+        filediff = self.create_filediff(diffset)
+
+        self.client.login(username='doc', password='doc')
+
+        response = self.client.post(
+            '/api/extensions/reviewbotext.extension.ReviewBotExtension/'
+            'review-bot-reviews/',
+            {
+                'review_request_id': review_request.display_id,
+                'body_top': 'Header',
+                'diff_comments': json.dumps([
+                    {
+                        'filediff_id': filediff.pk,
+                        'first_line': i + 1,
+                        'num_lines': 1,
+                        'text': 'Diff comment %s' % i,
+                        'issue_opened': i == 0,
+                        'rich_text': False,
+                    }
+                    for i in range(3)
+                ]),
+                'general_comments': json.dumps([
+                    {
+                        'text': 'General comment',
+                        'issue_opened': True,
+                        'rich_text': True,
+                    },
+                ]),
+            })
+
+        self.assertEqual(response.status_code, 201)
+
+        review = Review.objects.get(review_request=review_request)
+        self.assertTrue(review.public)
+        self.assertEqual(review.body_top, 'Header')
+
+        comments = list(review.comments.order_by('first_line'))
+        self.assertEqual(
+            [
+                (comment.filediff_id, comment.first_line, comment.text,
+                 comment.issue_opened)
+                for comment in comments
+            ],
+            [
+                (filediff.pk, 1, 'Diff comment 0', True),
+                (filediff.pk, 2, 'Diff comment 1', False),
+                (filediff.pk, 3, 'Diff comment 2', False),
+            ])
+
+        general_comments = list(review.general_comments.all())
+        self.assertEqual(len(general_comments), 1)
+        self.assertTrue(general_comments[0].rich_text)
+
+        review_request.refresh_from_db()
+        self.assertEqual(review_request.issue_open_count, 2)
@@ -0,0 +1,115 @@
+"""Unit tests for reviewbotext.resources.ToolResource."""
+
+import json
+
+import kgb
+from djblets.cache.synchronizer import GenerationSynchronizer
+
+from reviewbotext.models import Tool
+from reviewbotext.tests.testcase import TestCase
+
+
+class ToolResourceTests(kgb.SpyAgency, TestCase):
+    """Unit tests for reviewbotext.resources.ToolResource."""
+
+    fixtures = ['test_users']
+
+    def setUp(self):
+        super(ToolResourceTests, self).setUp()
+
+        self.user = self.create_user(username='reviewbot',
+                                     password='reviewbot')
+        self.extension.settings['user'] = self.user.pk
+
+        self.client.login(username='reviewbot', password='reviewbot')
+
+    def test_post(self):
+        """Testing the POST tools/ API"""
+        stale_tool = Tool.objects.create(name='Tool 1',
+                                         entry_point='tool1',
+                                         version='1.0',
+                                         in_last_update=False,
+                                         tool_options=[])
+        other_tool = Tool.objects.create(name='Tool 1',
+                                         entry_point='tool1',
+                                         version='0.9',
+                                         in_last_update=False,
+                                         tool_options=[])
+
+        self.spy_on(GenerationSynchronizer.mark_updated,
+                    owner=GenerationSynchronizer)
+
+        response = self._post_tools([
+            self._make_tool_data('tool1', '1.0'),
+            self._make_tool_data('tool2', '2.0'),
+        ])
+        self.assertEqual(response.status_code, 201)
+
+        stale_tool.refresh_from_db()
+        self.assertTrue(stale_tool.in_last_update)
+
+        other_tool.refresh_from_db()
+        self.assertFalse(other_tool.in_last_update)
+
+        new_tool = Tool.objects.get(entry_point='tool2')
+        self.assertEqual(new_tool.version, '2.0')
+        self.assertEqual(new_tool.timeout, 30)
+        self.assertTrue(new_tool.in_last_update)
+
+        self.assertSpyCallCount(GenerationSynchronizer.mark_updated, 1)
+
+        # Posting the same tools again shouldn't write anything.
+        self.spy_on(Tool.objects.bulk_create)
+
+        response = self._post_tools([
+            self._make_tool_data('tool1', '1.0'),
+            self._make_tool_data('tool2', '2.0'),
+        ])
+        self.assertEqual(response.status_code, 201)
+
+        self.assertSpyNotCalled(Tool.objects.bulk_create)
+        self.assertSpyCallCount(GenerationSynchronizer.mark_updated, 1)
+        self.assertEqual(Tool.objects.count(), 3)
+
+    def _make_tool_data(self, entry_point, version):
+        """Return data for a tool.
+
+        Args:
+            entry_point (str):
+                The entry point of the tool.
+
+            version (str):
+                The version of the tool.
+
+        Returns:
+            dict:
+            The tool data.
+        """
+        return {
+            'name': 'Tool %s' % entry_point,
+            'entry_point': entry_point,
+            'version': version,
+            'description': '',
+            'tool_options': [],
+            'timeout': 30,
+            'working_directory_required': False,
+        }
+
+    def _post_tools(self, tools):
+        """Post a list of tools to the API.
+
+        Args:
+            tools (list of dict):
+                The tools to post.
+
+        Returns:
+            django.http.HttpResponse:
+            The response.
+        """
+        return self.client.post(
+            '/api/extensions/reviewbotext.extension.ReviewBotExtension/'
+            'tools/',
+            {
+                'hostname': 'bot1.example.com',
+                'tools': json.dumps(tools),
+            })
@@ -0,0 +1,153 @@
+"""Unit tests for reviewbotext.worker_status.WorkerStatusMonitor."""
+
+import time
+
+import kgb
+from django.core.cache import cache
+from kombu import Exchange, Queue
+
+from reviewbotext.tests.testcase import TestCase
+from reviewbotext.worker_status import WorkerStatusMonitor
+
+
+class WorkerStatusMonitorTests(kgb.SpyAgency, TestCase):
+    """Unit tests for reviewbotext.worker_status.WorkerStatusMonitor."""
+
+    def setUp(self):
+        super(WorkerStatusMonitorTests, self).setUp()
+
+        cache.clear()
+
+        extension = self.extension
+        extension.settings['broker_url'] = 'memory://'
+
+        self.monitor = WorkerStatusMonitor(extension)
+
+    def test_collect_heartbeats(self):
+        """Testing WorkerStatusMonitor.collect_heartbeats"""
+        now = time.time()
+
+        self._send_heartbeat('celery@bot1.example.com', now - 40,
+                             in_flight=1)
+        self._send_heartbeat('celery@bot1.example.com', now - 10,
+                             in_flight=2)
+        self._send_heartbeat('celery@bot2.example.com', now - 100)
+        self._send_heartbeat('celery@bot3.example.com', now - 2 * 60 * 60)
+
+        self.assertEqual(self.monitor.collect_heartbeats(), 4)
+        self.assertEqual(self.monitor.collect_heartbeats(), 0)
+
+        heartbeats = self.monitor.get_heartbeats()
+
+        self.assertEqual(
+            [
+                (heartbeat['name'], heartbeat['hostname'],
+                 heartbeat['in_flight'], heartbeat['stale'])
+                for heartbeat in heartbeats
+            ],
+            [
+                ('celery@bot1.example.com', 'bot1.example.com', 2, False),
+                ('celery@bot2.example.com', 'bot2.example.com', 0, True),
+            ])
+
+        heartbeat = heartbeats[0]
+        self.assertEqual(heartbeat['tools'], {'tool1': '1.0'})
+        self.assertEqual(heartbeat['repositories'], ['repo1'])
+        self.assertEqual(heartbeat['pool_size'], 4)
+        self.assertEqual(heartbeat['task_durations'], {'tool1': 12.5})
+        self.assertGreaterEqual(heartbeat['age'], 10)
+
+    def test_collect_heartbeats_with_invalid(self):
+        """Testing WorkerStatusMonitor.collect_heartbeats with an invalid
+        heartbeat
+        """
+        self._publish({'hostname': 'celery@bot1.example.com'})
+        self._send_heartbeat('celery@bot2.example.com', time.time())
+
+        self.assertEqual(self.monitor.collect_heartbeats(), 2)
+        self.assertEqual(
+            [
+                heartbeat['name']
+                for heartbeat in self.monitor.get_heartbeats()
+            ],
+            ['celery@bot2.example.com'])
+
+    def test_start_collecting_heartbeats(self):
+        """Testing WorkerStatusMonitor.start_collecting_heartbeats is rate
+        limited
+        """
+        self.spy_on(self.monitor._run_in_background,
+                    call_fake=lambda _self, func: func())
+        self.spy_on(self.monitor.collect_heartbeats,
+                    op=kgb.SpyOpReturn(0))
+
+        self.assertTrue(self.monitor.start_collecting_heartbeats())
+        self.assertFalse(self.monitor.start_collecting_heartbeats())
+
+        self.assertSpyCallCount(self.monitor.collect_heartbeats, 1)
+
+    def test_start_refresh_with_error(self):
+        """Testing WorkerStatusMonitor.start_refresh with an unexpected error
+        fetching the status
+        """
+        self.spy_on(self.monitor._run_in_background,
+                    call_fake=lambda _self, func: func())
+        self.spy_on(self.extension.login_user,
+                    op=kgb.SpyOpRaise(Exception('Unable to log in.')))
+
+        self.assertTrue(self.monitor.start_refresh())
+
+        status = self.monitor.get_status()
+
+        self.assertEqual(status['state'], 'error')
+        self.assertEqual(status['error'],
+                         'Unable to fetch worker status: Unable to log in.')
+        self.assertFalse(status['refreshing'])
+        self.assertIn('updated', status)
+
+    def _send_heartbeat(self, hostname, timestamp, in_flight=0):
+        """Send a heartbeat, as a worker would.
+
+        Args:
+            hostname (str):
+                The name of the worker.
+
+            timestamp (float):
+                The time the heartbeat was sent.
+
+            in_flight (int, optional):
+                The number of tasks running on the worker.
+        """
+        self._publish({
+            'hostname': hostname,
+            'timestamp': timestamp,
+            'interval': 30,
+            'tools': {
+                'tool1': '1.0',
+            },
+            'repositories': ['repo1'],
+            'in_flight': in_flight,
+            'pool_size': 4,
+            'task_durations': {
+                'tool1': 12.5,
+            },
+        })
+
+    def _publish(self, heartbeat):
+        """Publish a heartbeat to the heartbeat queue.
+
+        Args:
+            heartbeat (dict):
+                The heartbeat to publish.
+        """
+        queue_name = WorkerStatusMonitor.HEARTBEAT_QUEUE
+        exchange = Exchange(queue_name, type='direct', durable=False)
+
+        with self.extension.celery.producer_or_acquire() as producer:
+            producer.publish(heartbeat,
+                             exchange=exchange,
+                             routing_key=queue_name,
+                             declare=[Queue(queue_name, exchange,
+                                            routing_key=queue_name,
+                                            durable=False)],
+                             serializer='json')
@@ -4,14 +4,31 @@ import json
 from collections import OrderedDict
 
 import kgb
+from django.core.cache import cache
 from django.urls import reverse
 
 from reviewbotext.tests.testcase import TestCase
+from reviewbotext.worker_status import WorkerStatusMonitor
 
 
 class WorkerStatusViewTests(kgb.SpyAgency, TestCase):
     """Unit tests for reviewbotext.views.WorkerStatusView."""
 
+    def setUp(self):
+        super(WorkerStatusViewTests, self).setUp()
+
+        cache.clear()
+
+        # Refresh the status immediately, rather than in a thread.
+        self.spy_on(WorkerStatusMonitor._run_in_background,
+                    owner=WorkerStatusMonitor,
+                    call_fake=lambda monitor, func: func())
+
+        # Heartbeats are covered by the WorkerStatusMonitor tests.
+        self.spy_on(WorkerStatusMonitor.collect_heartbeats,
+                    owner=WorkerStatusMonitor,
+                    op=kgb.SpyOpReturn(0))
+
     def test_get(self):
         """Testing WorkerStatusView.get"""
         user = self.create_user()
@@ -58,7 +75,7 @@ class WorkerStatusViewTests(kgb.SpyAgency, TestCase):
         response = self.client.get(reverse('reviewbot-worker-status'))
 
         self.assertEqual(
-            json.loads(response.content.decode('utf-8')),
+            self._get_status_data(response),
             {
                 'state': 'success',
                 'hosts': [
@@ -87,12 +104,21 @@ class WorkerStatusViewTests(kgb.SpyAgency, TestCase):
                                 'working_directory_required': False,
                             },
                         ],
+                        'heartbeat': None,
                     },
                     {
                         'hostname': 'bot2.example.com',
                         'tools': [],
+                        'heartbeat': None,
                     },
                 ],
+                'heartbeats': [],
+                'dispatch': {
+                    'pending': 0,
+                    'oldest_pending_age': None,
+                    'last_lag': None,
+                },
+                'refreshing': False,
             })
 
     def test_get_with_worker_status_error(self):
@@ -141,10 +167,17 @@ class WorkerStatusViewTests(kgb.SpyAgency, TestCase):
         response = self.client.get(reverse('reviewbot-worker-status'))
 
         self.assertEqual(
-            json.loads(response.content.decode('utf-8')),
+            self._get_status_data(response),
             {
                 'state': 'error',
                 'error': 'Error from user@bot2.example.com: Oh no.',
+                'heartbeats': [],
+                'dispatch': {
+                    'pending': 0,
+                    'oldest_pending_age': None,
+                    'last_lag': None,
+                },
+                'refreshing': False,
             })
 
     def test_get_with_worker_status_unknown(self):
@@ -190,7 +223,7 @@ class WorkerStatusViewTests(kgb.SpyAgency, TestCase):
         response = self.client.get(reverse('reviewbot-worker-status'))
 
         self.assertEqual(
-            json.loads(response.content.decode('utf-8')),
+            self._get_status_data(response),
             {
                 'state': 'error',
                 'error': (
@@ -198,6 +231,13 @@ class WorkerStatusViewTests(kgb.SpyAgency, TestCase):
                     "user@bot2.example.com. Please check the worker's "
                     "logs for information."
                 ),
+                'heartbeats': [],
+                'dispatch': {
+                    'pending': 0,
+                    'oldest_pending_age': None,
+                    'last_lag': None,
+                },
+                'refreshing': False,
             })
 
     def test_get_with_ioerror(self):
@@ -214,10 +254,17 @@ class WorkerStatusViewTests(kgb.SpyAgency, TestCase):
         response = self.client.get(reverse('reviewbot-worker-status'))
 
         self.assertEqual(
-            json.loads(response.content.decode('utf-8')),
+            self._get_status_data(response),
             {
                 'state': 'error',
                 'error': 'Unable to connect to broker: Oh no.',
+                'heartbeats': [],
+                'dispatch': {
+                    'pending': 0,
+                    'oldest_pending_age': None,
+                    'last_lag': None,
+                },
+                'refreshing': False,
             })
 
     def test_get_with_not_configured(self):
@@ -233,3 +280,75 @@ class WorkerStatusViewTests(kgb.SpyAgency, TestCase):
                 'state': 'error',
                 'error': 'Review Bot is not yet configured.',
             })
+
+    def test_get_cached(self):
+        """Testing WorkerStatusView.get returns the cached status"""
+        self._configure()
+
+        broadcast = self.extension.celery.control.broadcast
+        self.spy_on(broadcast, op=kgb.SpyOpReturn([]))
+
+        response = self.client.get(reverse('reviewbot-worker-status'))
+        data = self._get_status_data(response)
+        self.assertEqual(data['state'], 'success')
+
+        response = self.client.get(reverse('reviewbot-worker-status'))
+        self.assertEqual(self._get_status_data(response), data)
+
+        self.assertSpyCallCount(self.extension.celery.control.broadcast, 1)
+
+        # Requesting a refresh should query the workers again.
+        response = self.client.get(reverse('reviewbot-worker-status'),
+                                   {'refresh': '1'})
+        self.assertEqual(self._get_status_data(response)['state'],
+                         'success')
+        self.assertSpyCallCount(self.extension.celery.control.broadcast, 2)
+
+    def test_get_while_refreshing(self):
+        """Testing WorkerStatusView.get while the first refresh is in
+        progress
+        """
+        self._configure()
+
+        WorkerStatusMonitor._run_in_background.unspy()
+        self.spy_on(WorkerStatusMonitor._run_in_background,
+                    owner=WorkerStatusMonitor,
+                    call_original=False)
+
+        response = self.client.get(reverse('reviewbot-worker-status'))
+
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['state'], 'refreshing')
+        self.assertTrue(data['refreshing'])
+
+        # This starts both a refresh and heartbeat collection. A second
+        # request shouldn't start either again.
+        self.assertSpyCallCount(WorkerStatusMonitor._run_in_background, 2)
+
+        self.client.get(reverse('reviewbot-worker-status'))
+        self.assertSpyCallCount(WorkerStatusMonitor._run_in_background, 2)
+
+    def _configure(self):
+        """Configure the extension for testing."""
+        extension = self.extension
+        extension.settings['user'] = self.create_user().pk
+        extension.settings['broker_url'] = 'example.com'
+
+    def _get_status_data(self, response):
+        """Return the status data from a response.
+
+        This checks for and removes the timestamp of the status.
+
+        Args:
+            response (django.http.HttpResponse):
+                The response.
+
+        Returns:
+            dict:
+            The status data.
+        """
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertIn('updated', data)
+        del data['updated']
+
+        return data
@@ -4,8 +4,10 @@ Version Added:
     3.0
 """
 
+import kgb
 from reviewboard.extensions.testing import ExtensionTestCase
 
+from reviewbotext.dispatch import TaskDispatcher
 from reviewbotext.extension import ReviewBotExtension
 
 
@@ -17,3 +19,29 @@ class TestCase(ExtensionTestCase):
     """
 
     extension_class = ReviewBotExtension
+
+    def setUp(self):
+        """Set up the test case.
+
+        The task dispatcher's background thread isn't started, so that it
+        doesn't access the database alongside the test.
+
+        Version Added:
+            5.0
+        """
+        self._dispatcher_spy_agency = kgb.SpyAgency()
+        self._dispatcher_spy_agency.spy_on(TaskDispatcher.start,
+                                           owner=TaskDispatcher,
+                                           call_original=False)
+
+        super(TestCase, self).setUp()
+
+    def tearDown(self):
+        """Tear down the test case.
+
+        Version Added:
+            5.0
+        """
+        super(TestCase, self).tearDown()
+
+        self._dispatcher_spy_agency.unspy_all()
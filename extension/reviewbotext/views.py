@@ -15,11 +15,9 @@ from django.views.generic import TemplateView, View
 from djblets.avatars.services import URLAvatarService
 from djblets.db.query import get_object_or_none
 from djblets.siteconfig.models import SiteConfiguration
-from reviewboard.admin.server import get_server_url
 from reviewboard.avatars import avatar_services
 from reviewboard.site.urlresolvers import local_site_reverse
 
-from reviewbotext.compat.logs import log_timed
 from reviewbotext.extension import ReviewBotExtension
 
 
@@ -260,10 +258,15 @@ class WorkerStatusView(View):
     """An "API" to get worker status.
 
     This view is an internal API to query the workers and return their status.
+
+    Version Changed:
+        5.0:
+        This now returns a cached status immediately, refreshing it in the
+        background. Passing ``?refresh=1`` requests a refresh.
     """
 
     def get(self, request):
-        """Query workers and return their status.
+        """Return the status of the workers.
 
         Args:
             request (django.http.HttpRequest):
@@ -274,66 +277,11 @@ class WorkerStatusView(View):
             The response.
         """
         extension = ReviewBotExtension.instance
-        response = {}
 
         if extension.is_configured:
-            try:
-                payload = {
-                    'session': extension.login_user(),
-                    'url': get_server_url(),
-                }
-
-                with log_timed('Fetching Review Bot worker status',
-                               logger=logger):
-                    reply = extension.celery.control.broadcast(
-                        'update_tools_list',
-                        payload=payload,
-                        reply=True,
-                        timeout=10)
-
-                state = 'success'
-                error = None
-                hosts = []
-
-                for item in reply:
-                    for worker_host, data in item.items():
-                        worker_status = data.get('status')
-
-                        if worker_status == 'ok':
-                            hosts.append({
-                                'hostname': worker_host.split('@', 1)[1],
-                                'tools': data['tools'],
-                            })
-                        elif worker_status == 'error':
-                            state = 'error'
-                            error = (
-                                'Error from %s: %s'
-                                % (worker_host, data['error'])
-                            )
-                            break
-                        else:
-                            state = 'error'
-                            error = (
-                                "Unexpected result when querying worker "
-                                "status for %s. Please check the worker's "
-                                "logs for information."
-                                % worker_host
-                            )
-                            break
-
-                response = {
-                    'state': state,
-                }
-
-                if state == 'success':
-                    response['hosts'] = hosts
-                else:
-                    response['error'] = error
-            except IOError as e:
-                response = {
-                    'state': 'error',
-                    'error': 'Unable to connect to broker: %s' % e,
-                }
+            response = extension.worker_status.get_status(
+                refresh=request.GET.get('refresh') == '1')
+            response['dispatch'] = extension.dispatcher.get_stats()
         else:
             response = {
                 'state': 'error',
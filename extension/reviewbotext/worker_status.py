@@ -0,0 +1,452 @@
+"""Cached status and heartbeats of Review Bot workers.
+
+Version Added:
+    5.0
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+
+from django.core.cache import cache
+from django.db import connection
+from djblets.cache.backend import make_cache_key
+from kombu import Exchange, Queue
+from reviewboard.admin.server import get_server_url
+
+from reviewbotext.compat.logs import log_timed
+
+if TYPE_CHECKING:
+    from typing import Any, Callable
+
+    from reviewbotext.extension import ReviewBotExtension
+
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerStatusMonitor:
+    """Caches the status of workers, refreshing it in the background.
+
+    Querying the workers broadcasts a request to all of them and waits for
+    their replies. Each worker re-checks its tools and uploads the list
+    before replying. Rather than doing this for every request, the result
+    is cached for all processes and refreshed in a background thread once
+    it's older than :py:attr:`STATUS_TTL`, or when a refresh is requested.
+
+    Workers also periodically send heartbeats to :py:attr:`HEARTBEAT_QUEUE`,
+    describing their tools, repositories and current load. These are
+    collected without waiting on the workers, and are used to spot workers
+    that have stopped responding.
+
+    Version Added:
+        5.0
+    """
+
+    #: The number of seconds before the cached status is refreshed.
+    STATUS_TTL = 60
+
+    #: The number of seconds to wait for replies from workers.
+    REPLY_TIMEOUT = 10
+
+    #: The maximum number of seconds a refresh is expected to take.
+    #:
+    #: Only one refresh runs at a time across all processes. If a refresh
+    #: doesn't finish within this time, another one may be started.
+    REFRESH_TIMEOUT = 30
+
+    #: The cache key for the status.
+    STATUS_CACHE_KEY = 'reviewbot-worker-status'
+
+    #: The cache key used to indicate that a refresh is in progress.
+    REFRESHING_CACHE_KEY = 'reviewbot-worker-status-refreshing'
+
+    #: The name of the queue that workers send heartbeats to.
+    HEARTBEAT_QUEUE = 'reviewbot.heartbeats'
+
+    #: The minimum number of seconds between collecting heartbeats.
+    HEARTBEAT_COLLECT_INTERVAL = 10
+
+    #: The number of missed heartbeats before a worker is considered stale.
+    MISSED_HEARTBEATS = 3
+
+    #: The number of seconds before a stale worker is forgotten.
+    HEARTBEAT_EXPIRATION = 60 * 60
+
+    #: The cache key for the latest heartbeats.
+    HEARTBEATS_CACHE_KEY = 'reviewbot-worker-heartbeats'
+
+    #: The cache key used to limit how often heartbeats are collected.
+    COLLECTING_CACHE_KEY = 'reviewbot-worker-heartbeats-collecting'
+
+    ######################
+    # Instance variables #
+    ######################
+
+    #: The extension the workers are monitored for.
+    extension: ReviewBotExtension
+
+    def __init__(
+        self,
+        extension: ReviewBotExtension,
+    ) -> None:
+        """Initialize the monitor.
+
+        Args:
+            extension (reviewbotext.extension.ReviewBotExtension):
+                The extension the workers are monitored for.
+        """
+        self.extension = extension
+
+    def get_status(
+        self,
+        refresh: bool = False,
+    ) -> dict[str, Any]:
+        """Return the cached status of the workers.
+
+        This never waits for the workers. If the status is missing or out of
+        date, or if a refresh is requested, a refresh is started in the
+        background.
+
+        Args:
+            refresh (bool, optional):
+                Whether to refresh the status, even if it's up to date.
+
+        Returns:
+            dict:
+            The status, in the form returned by :py:meth:`fetch_status`, with
+            the following additional keys:
+
+            ``refreshing`` (:py:class:`bool`):
+                Whether the status is being refreshed.
+
+            ``updated`` (:py:class:`str`):
+                The time the status was fetched, in ISO 8601 format. This is
+                not present if the status has not been fetched yet.
+
+            ``heartbeats`` (:py:class:`list`):
+                The latest heartbeats from the workers, as returned by
+                :py:meth:`get_heartbeats`. Each entry in ``hosts`` also
+                has a ``heartbeat`` key with the matching heartbeat, or
+                ``None``.
+        """
+        status_cache_key = make_cache_key(self.STATUS_CACHE_KEY)
+        snapshot = cache.get(status_cache_key)
+        now = datetime.now(timezone.utc)
+
+        if (refresh or
+            snapshot is None or
+            (now - snapshot['updated']).total_seconds() > self.STATUS_TTL):
+            self.start_refresh()
+
+            # The refresh may have already finished.
+            snapshot = cache.get(status_cache_key)
+
+        if snapshot is None:
+            status = {
+                'state': 'refreshing',
+            }
+        else:
+            status = dict(snapshot['status'],
+                          updated=snapshot['updated'].isoformat())
+
+        status['refreshing'] = (
+            cache.get(make_cache_key(self.REFRESHING_CACHE_KEY)) is not None)
+
+        self.start_collecting_heartbeats()
+        heartbeats = self.get_heartbeats()
+        heartbeats_by_hostname = {}
+
+        for heartbeat in heartbeats:
+            heartbeats_by_hostname.setdefault(heartbeat['hostname'],
+                                              heartbeat)
+
+        status['heartbeats'] = heartbeats
+
+        if 'hosts' in status:
+            status['hosts'] = [
+                dict(host,
+                     heartbeat=heartbeats_by_hostname.get(host['hostname']))
+                for host in status['hosts']
+            ]
+
+        return status
+
+    def get_heartbeats(self) -> list[dict[str, Any]]:
+        """Return the latest heartbeat from each worker.
+
+        This only returns heartbeats that have already been collected. See
+        :py:meth:`start_collecting_heartbeats`.
+
+        Returns:
+            list of dict:
+            The heartbeats, sorted by worker name. Each is in the form sent
+            by the worker, with the following changes:
+
+            ``name`` (:py:class:`str`):
+                The full name of the worker, including the node name.
+
+            ``hostname`` (:py:class:`str`):
+                The hostname of the worker.
+
+            ``timestamp`` (:py:class:`str`):
+                The time the heartbeat was sent, in ISO 8601 format.
+
+            ``age`` (:py:class:`float`):
+                The number of seconds since the heartbeat was sent.
+
+            ``stale`` (:py:class:`bool`):
+                Whether the worker has missed :py:attr:`MISSED_HEARTBEATS`
+                heartbeats in a row.
+        """
+        heartbeats = cache.get(make_cache_key(self.HEARTBEATS_CACHE_KEY),
+                               {})
+        now = datetime.now(timezone.utc).timestamp()
+        result = []
+
+        for name, heartbeat in sorted(heartbeats.items()):
+            age = max(now - heartbeat['timestamp'], 0)
+            result.append(dict(
+                heartbeat,
+                name=name,
+                hostname=name.split('@', 1)[-1],
+                timestamp=datetime.fromtimestamp(heartbeat['timestamp'],
+                                                 timezone.utc).isoformat(),
+                age=age,
+                stale=(age > self.MISSED_HEARTBEATS *
+                       max(heartbeat['interval'], 1))))
+
+        return result
+
+    def start_collecting_heartbeats(self) -> bool:
+        """Start collecting heartbeats in the background.
+
+        Heartbeats are collected at most once every
+        :py:attr:`HEARTBEAT_COLLECT_INTERVAL` seconds across all processes.
+
+        Returns:
+            bool:
+            ``True`` if heartbeats are being collected, or ``False`` if they
+            were collected recently.
+        """
+        if not cache.add(make_cache_key(self.COLLECTING_CACHE_KEY), True,
+                         self.HEARTBEAT_COLLECT_INTERVAL):
+            return False
+
+        def _collect() -> None:
+            try:
+                self.collect_heartbeats()
+            except Exception as e:
+                logger.exception('Unexpected error collecting Review Bot '
+                                 'worker heartbeats: %s',
+                                 e)
+
+        self._run_in_background(_collect)
+
+        return True
+
+    def collect_heartbeats(self) -> int:
+        """Collect heartbeats waiting in the broker.
+
+        This reads any heartbeats sent since the last collection without
+        waiting for new ones, and stores the latest one from each worker.
+        Workers that haven't sent a heartbeat in
+        :py:attr:`HEARTBEAT_EXPIRATION` seconds are forgotten.
+
+        Returns:
+            int:
+            The number of heartbeats collected.
+        """
+        queue = Queue(self.HEARTBEAT_QUEUE,
+                      Exchange(self.HEARTBEAT_QUEUE, type='direct',
+                               durable=False),
+                      routing_key=self.HEARTBEAT_QUEUE,
+                      durable=False)
+        received = []
+
+        with self.extension.celery.connection_for_read() as conn:
+            bound_queue = queue(conn.default_channel)
+            bound_queue.declare()
+
+            while True:
+                message = bound_queue.get(no_ack=True, accept=['json'])
+
+                if message is None:
+                    break
+
+                received.append(message.decode())
+
+        heartbeats_cache_key = make_cache_key(self.HEARTBEATS_CACHE_KEY)
+        heartbeats = cache.get(heartbeats_cache_key, {})
+
+        for heartbeat in received:
+            try:
+                name = heartbeat.pop('hostname')
+                timestamp = float(heartbeat['timestamp'])
+                float(heartbeat['interval'])
+            except (AttributeError, KeyError, TypeError, ValueError):
+                logger.warning('Ignoring invalid Review Bot worker '
+                               'heartbeat: %r',
+                               heartbeat)
+                continue
+
+            old_heartbeat = heartbeats.get(name)
+
+            if (old_heartbeat is None or
+                old_heartbeat['timestamp'] < timestamp):
+                heartbeats[name] = heartbeat
+
+        cutoff = (datetime.now(timezone.utc).timestamp() -
+                  self.HEARTBEAT_EXPIRATION)
+        heartbeats = {
+            name: heartbeat
+            for name, heartbeat in heartbeats.items()
+            if heartbeat['timestamp'] >= cutoff
+        }
+
+        cache.set(heartbeats_cache_key, heartbeats, None)
+
+        return len(received)
+
+    def start_refresh(self) -> bool:
+        """Start refreshing the status in the background.
+
+        Returns:
+            bool:
+            ``True`` if a refresh was started, or ``False`` if one was
+            already in progress.
+        """
+        refreshing_cache_key = make_cache_key(self.REFRESHING_CACHE_KEY)
+
+        if not cache.add(refreshing_cache_key, True, self.REFRESH_TIMEOUT):
+            return False
+
+        def _refresh() -> None:
+            try:
+                try:
+                    status = self.fetch_status()
+                except Exception as e:
+                    logger.exception('Unexpected error refreshing Review Bot '
+                                     'worker status: %s',
+                                     e)
+
+                    # Report the error rather than leaving the last known
+                    # status in place, which may be out of date.
+                    status = {
+                        'state': 'error',
+                        'error': 'Unable to fetch worker status: %s' % e,
+                    }
+
+                cache.set(make_cache_key(self.STATUS_CACHE_KEY),
+                          {
+                              'status': status,
+                              'updated': datetime.now(timezone.utc),
+                          },
+                          None)
+            except Exception as e:
+                logger.exception('Unexpected error caching Review Bot '
+                                 'worker status: %s',
+                                 e)
+            finally:
+                cache.delete(refreshing_cache_key)
+
+        self._run_in_background(_refresh)
+
+        return True
+
+    def fetch_status(self) -> dict[str, Any]:
+        """Query the workers and return their status.
+
+        This waits for replies from the workers.
+
+        Returns:
+            dict:
+            A dictionary with the following keys:
+
+            ``state`` (:py:class:`str`):
+                ``success`` or ``error``.
+
+            ``hosts`` (:py:class:`list`):
+                The workers and their tools, if successful.
+
+            ``error`` (:py:class:`str`):
+                The error, if not successful.
+        """
+        extension = self.extension
+
+        try:
+            payload = {
+                'session': extension.login_user(),
+                'url': get_server_url(),
+            }
+
+            with log_timed('Fetching Review Bot worker status',
+                           logger=logger):
+                reply = extension.celery.control.broadcast(
+                    'update_tools_list',
+                    payload=payload,
+                    reply=True,
+                    timeout=self.REPLY_TIMEOUT)
+        except IOError as e:
+            return {
+                'state': 'error',
+                'error': 'Unable to connect to broker: %s' % e,
+            }
+
+        hosts = []
+
+        for item in reply:
+            for worker_host, data in item.items():
+                worker_status = data.get('status')
+
+                if worker_status == 'ok':
+                    hosts.append({
+                        'hostname': worker_host.split('@', 1)[1],
+                        'tools': data['tools'],
+                    })
+                elif worker_status == 'error':
+                    return {
+                        'state': 'error',
+                        'error': (
+                            'Error from %s: %s'
+                            % (worker_host, data['error'])
+                        ),
+                    }
+                else:
+                    return {
+                        'state': 'error',
+                        'error': (
+                            "Unexpected result when querying worker "
+                            "status for %s. Please check the worker's "
+                            "logs for information."
+                            % worker_host
+                        ),
+                    }
+
+        return {
+            'state': 'success',
+            'hosts': hosts,
+        }
+
+    def _run_in_background(
+        self,
+        func: Callable[[], None],
+    ) -> None:
+        """Run a function in a background thread.
+
+        Args:
+            func (callable):
+                The function to run.
+        """
+        def _run() -> None:
+            try:
+                func()
+            finally:
+                connection.close()
+
+        threading.Thread(target=_run,
+                         name='reviewbot-worker-status',
+                         daemon=True).start()